@@ -5,7 +5,7 @@
 # for any function you add to database.
 # Please reuse the functions in sqlitecachedb as much as possible
 
-from Tribler.Core.CacheDB.sqlitecachedb import SQLiteCacheDB, bin2str, str2bin, NULL, SQLiteNoCacheDB
+from Tribler.Core.CacheDB.sqlitecachedb import SQLiteCacheDB, bin2str, str2bin, NULL, SQLiteNoCacheDB, LimitedOrderedDict, register_task
 from copy import deepcopy,copy
 from traceback import print_exc, print_stack
 from time import time
@@ -23,6 +23,9 @@ import math
 import re
 from sets import Set
 from struct import unpack_from
+from array import array
+from operator import itemgetter
+import heapq
 
 from maxflow import Network
 from math import atan, pi
@@ -47,6 +50,12 @@ DEBUG = False
 SHOW_ERROR = False
 
 MAX_KEYWORDS_STORED = 5
+SEARCH_CACHE_SIZE = 100 # number of searchNames results kept
+SEARCH_CACHE_TTL = 30 # seconds a searchNames result is kept at most
+CHANNELCAST_RECENT_SIZE = 64 # number of most recent torrents kept per channel for channelcast messages
+CHANNELCAST_RANDOM_SIZE = 64 # number of randomly sampled torrents kept per channel for channelcast messages
+BUZZ_QUEUE_BATCH_SIZE = 250 # number of queued torrents from which the network buzz terms are extracted per task
+BUZZ_QUEUE_DELAY = 1.0 # seconds between these tasks
 MAX_KEYWORD_LENGTH = 50
 
 #Rahim:
@@ -558,6 +567,10 @@ class TorrentDBHandler(BasicDBHandler):
 
         self.value_name_for_channel = ['C.torrent_id', 'infohash', 'name', 'torrent_file_name', 'length', 'creation_date', 'num_files', 'thumbnail', 'insert_time', 'secret', 'relevance', 'source_id', 'category_id', 'status_id', 'num_seeders', 'num_leechers', 'comment']
 
+        self._search_cache = LimitedOrderedDict(SEARCH_CACHE_SIZE) # {(keywords, local, keys, doSort): (timestamp, results)}
+        self._search_cache_lock = Lock()
+        self._search_cache_generation = 0 # incremented by every invalidation
+
 
     def register(self, category, torrent_dir):
         self.category = category
@@ -568,6 +581,10 @@ class TorrentDBHandler(BasicDBHandler):
         self.channelcast_db = ChannelCastDBHandler.getInstance()
         self._rtorrent_handler = RemoteTorrentHandler.getInstance()
 
+        # new torrents, channels and votes all change the outcome of searchNames
+        self.notifier.add_observer(self._invalidateSearchCache, NTFY_TORRENTS, [NTFY_INSERT, NTFY_UPDATE, NTFY_DELETE])
+        self.notifier.add_observer(self._invalidateSearchCache, NTFY_CHANNELCAST, [NTFY_INSERT, NTFY_UPDATE, NTFY_DELETE, NTFY_CREATE, NTFY_MODIFIED])
+
     def getTorrentID(self, infohash):
         assert isinstance(infohash, str), "INFOHASH has invalid type: %s" % type(infohash)
         assert len(infohash) == INFOHASH_LENGTH, "INFOHASH has invalid length: %d" % len(infohash)
@@ -611,33 +628,11 @@ class TorrentDBHandler(BasicDBHandler):
 
     def addExternalTorrentNoDef(self, infohash, name, files, trackers, timestamp, source, extra_info={}):
         if not self.hasTorrent(infohash):
-            metainfo = {'info':{}, 'encoding':'utf_8'}
-            metainfo['info']['name'] = name.encode('utf_8')
-            metainfo['info']['piece length'] = -1
-            metainfo['info']['pieces'] = ''
-
-            if len(files) > 1:
-                files_as_dict = []
-                for filename, file_lenght in files:
-                    filename = filename.encode('utf_8')
-                    files_as_dict.append({'path':[filename], 'length':file_lenght})
-                metainfo['info']['files'] = files_as_dict
-
-            elif len(files) == 1:
-                metainfo['info']['length'] = files[0][1]
-            else:
+            if len(files) == 0:
                 return
 
-            if len(trackers) > 0:
-                metainfo['announce'] = trackers[0]
-            else:
-                metainfo['nodes'] = []
-
-            metainfo['creation date'] = timestamp
-
             try:
-                torrentdef = TorrentDef.load_from_dict(metainfo)
-                torrentdef.infohash = infohash
+                torrentdef = self._createTorrentDefNoDef(infohash, name, files, trackers, timestamp)
 
                 torrent_id = self._addTorrentToDB(torrentdef, source, extra_info, False)
                 self._rtorrent_handler.notify_possible_torrent_infohash(infohash)
@@ -647,10 +642,7 @@ class TorrentDBHandler(BasicDBHandler):
                     sql_insert_files = "INSERT OR IGNORE INTO TorrentFiles (torrent_id, path, length) VALUES (?,?,?)"
                     self._db.executemany(sql_insert_files, insert_files, commit = False)
 
-                magnetlink = u"magnet:?xt=urn:btih:"+hexlify(infohash)
-                for tracker in trackers:
-                    magnetlink += "&tr="+urllib.quote_plus(tracker)
-                insert_collecting = [(torrent_id, magnetlink)]
+                insert_collecting = [(torrent_id, self._getMagnetLink(infohash, trackers))]
 
                 if len(insert_collecting) > 0:
                     sql_insert_collecting = "INSERT OR IGNORE INTO TorrentCollecting (torrent_id, source) VALUES (?,?)"
@@ -659,6 +651,130 @@ class TorrentDBHandler(BasicDBHandler):
                 print >> sys.stderr, "Could not create a TorrentDef instance", infohash, timestamp, name, files, trackers, source, extra_info
                 print_exc()
 
+    def addExternalTorrentsNoDef(self, torrents, source, extra_info={}):
+        """
+        Bulk version of addExternalTorrentNoDef for torrents which already have a row in the
+        Torrent table, e.g. the rows inserted by addOrGetTorrentIDSReturn.  torrents is a list of
+        (torrent_id, infohash, name, files, trackers, timestamp) tuples.
+
+        The Torrent, FullTextIndex, TorrentTracker, TorrentFiles and TorrentCollecting rows of all
+        torrents are written with one executemany per statement.  Extracting the network buzz
+        terms is queued to a background task.
+
+        Returns the number of torrents added.
+        """
+        torrent_ids = [torrent[0] for torrent in torrents if torrent[0] is not None]
+        collected = set()
+        if torrent_ids:
+            parameters = '?,'*len(torrent_ids)
+            sql = "SELECT torrent_id FROM CollectedTorrent WHERE torrent_id IN ("+parameters[:-1]+")"
+            collected.update(torrent_id for torrent_id, in self._db.fetchall(sql, torrent_ids))
+
+        update_torrents = {}
+        insert_index = []
+        insert_trackers = []
+        insert_files = []
+        insert_collecting = []
+        buzz_torrents = []
+        infohashes = []
+        for torrent_id, infohash, name, files, trackers, timestamp in torrents:
+            if torrent_id is None or torrent_id in collected or len(files) == 0:
+                continue
+            # the same torrent can be received more than once in a batch
+            collected.add(torrent_id)
+
+            try:
+                torrentdef = self._createTorrentDefNoDef(infohash, name, files, trackers, timestamp)
+                database_dict = self._get_database_dict(torrentdef, source, extra_info)
+
+                swarmname = torrentdef.get_name_as_unicode()
+                if not torrentdef.is_multifile_torrent():
+                    swarmname, _ = os.path.splitext(swarmname)
+                index_values = self._getIndexValues(torrent_id, swarmname, torrentdef.get_files_as_unicode())
+            except:
+                print >> sys.stderr, "Could not create a TorrentDef instance", infohash, timestamp, name, files, trackers, source, extra_info
+                print_exc()
+                continue
+
+            keys = tuple(sorted(database_dict.keys()))
+            update_torrents.setdefault(keys, []).append(tuple(database_dict[key] for key in keys) + (torrent_id, ))
+
+            insert_index.append(index_values)
+            buzz_torrents.append((torrent_id, swarmname, source in ['BC', 'SWIFT', 'DISP_SC']))
+
+            announce = torrentdef.get_tracker()
+            if announce != None:
+                insert_trackers.append((torrent_id, announce, 1, 0, 0, self._getLastCheckTime(extra_info)))
+
+            insert_files.extend((torrent_id, unicode(path), length) for path, length in files)
+            insert_collecting.append((torrent_id, self._getMagnetLink(infohash, trackers)))
+            infohashes.append(infohash)
+
+        if not infohashes:
+            return 0
+
+        for keys, values in update_torrents.iteritems():
+            sql_update_torrent = "UPDATE Torrent SET " + ", ".join("%s = ?" % key for key in keys) + " WHERE torrent_id = ?"
+            self._db.executemany(sql_update_torrent, values, commit = False)
+
+        try:
+            #INSERT OR REPLACE not working for fts3 table
+            self._db.executemany(u"DELETE FROM FullTextIndex WHERE rowid = ?", [(values[0], ) for values in insert_index], commit = False)
+            self._db.executemany(u"INSERT INTO FullTextIndex (rowid, swarmname, filenames, fileextensions) VALUES(?,?,?,?)", insert_index, commit = False)
+        except:
+            #this will fail if the fts3 module cannot be found
+            print_exc()
+
+        try:
+            NetworkBuzzDBHandler.getInstance().queueTorrents(buzz_torrents)
+        except:
+            print_exc()
+
+        if insert_trackers:
+            self._db.executemany(self.sql_insert_torrent_tracker, insert_trackers, commit = False)
+
+        sql_insert_files = "INSERT OR IGNORE INTO TorrentFiles (torrent_id, path, length) VALUES (?,?,?)"
+        self._db.executemany(sql_insert_files, insert_files, commit = False)
+
+        sql_insert_collecting = "INSERT OR IGNORE INTO TorrentCollecting (torrent_id, source) VALUES (?,?)"
+        self._db.executemany(sql_insert_collecting, insert_collecting, commit = False)
+
+        for infohash in infohashes:
+            self._rtorrent_handler.notify_possible_torrent_infohash(infohash)
+        return len(infohashes)
+
+    def _createTorrentDefNoDef(self, infohash, name, files, trackers, timestamp):
+        metainfo = {'info':{}, 'encoding':'utf_8'}
+        metainfo['info']['name'] = name.encode('utf_8')
+        metainfo['info']['piece length'] = -1
+        metainfo['info']['pieces'] = ''
+
+        if len(files) > 1:
+            files_as_dict = []
+            for filename, file_lenght in files:
+                filename = filename.encode('utf_8')
+                files_as_dict.append({'path':[filename], 'length':file_lenght})
+            metainfo['info']['files'] = files_as_dict
+        else:
+            metainfo['info']['length'] = files[0][1]
+
+        if len(trackers) > 0:
+            metainfo['announce'] = trackers[0]
+        else:
+            metainfo['nodes'] = []
+
+        metainfo['creation date'] = timestamp
+
+        torrentdef = TorrentDef.load_from_dict(metainfo)
+        torrentdef.infohash = infohash
+        return torrentdef
+
+    def _getMagnetLink(self, infohash, trackers):
+        magnetlink = u"magnet:?xt=urn:btih:"+hexlify(infohash)
+        for tracker in trackers:
+            magnetlink += "&tr="+urllib.quote_plus(tracker)
+        return magnetlink
+
     def addInfohash(self, infohash, commit=True):
         assert isinstance(infohash, str), "INFOHASH has invalid type: %s" % type(infohash)
         assert len(infohash) == INFOHASH_LENGTH, "INFOHASH has invalid length: %d" % len(infohash)
@@ -790,6 +906,20 @@ class TorrentDBHandler(BasicDBHandler):
         if existed and not collected:
             return
 
+        values = self._getIndexValues(torrent_id, swarmname, files)
+        try:
+            #INSERT OR REPLACE not working for fts3 table
+            self._db.execute_write(u"DELETE FROM FullTextIndex WHERE rowid = ?", (torrent_id, ), commit=False)
+            self._db.execute_write(u"INSERT INTO FullTextIndex (rowid, swarmname, filenames, fileextensions) VALUES(?,?,?,?)", values, commit=False)
+        except:
+            #this will fail if the fts3 module cannot be found
+            print_exc()
+
+        # vliegendhart: extract terms and bi-term phrase from Torrent and store it
+        nb = NetworkBuzzDBHandler.getInstance()
+        nb.addTorrent(torrent_id, swarmname, collected = collected, commit=False)
+
+    def _getIndexValues(self, torrent_id, swarmname, files):
         #Niels: new method for indexing, replaces invertedindex
         #Making sure that swarmname does not include extension for single file torrents
         swarm_keywords = " ".join(split_into_keywords(swarmname, filterStopwords = False))
@@ -810,18 +940,7 @@ class TorrentDBHandler(BasicDBHandler):
             filenames.sort(cmp = popSort, reverse = True)
             filenames = filenames[:1000]
 
-        values = (torrent_id, swarm_keywords, " ".join(filenames), " ".join(fileextensions))
-        try:
-            #INSERT OR REPLACE not working for fts3 table
-            self._db.execute_write(u"DELETE FROM FullTextIndex WHERE rowid = ?", (torrent_id, ), commit=False)
-            self._db.execute_write(u"INSERT INTO FullTextIndex (rowid, swarmname, filenames, fileextensions) VALUES(?,?,?,?)", values, commit=False)
-        except:
-            #this will fail if the fts3 module cannot be found
-            print_exc()
-
-        # vliegendhart: extract terms and bi-term phrase from Torrent and store it
-        nb = NetworkBuzzDBHandler.getInstance()
-        nb.addTorrent(torrent_id, swarmname, collected = collected, commit=False)
+        return (torrent_id, swarm_keywords, " ".join(filenames), " ".join(fileextensions))
 
     def getInfohashFromTorrentName(self, name): ##
         sql = "select infohash from Torrent where name='" + str2bin(name) + "'"
@@ -844,19 +963,22 @@ class TorrentDBHandler(BasicDBHandler):
         announce_list = torrentdef.get_tracker_hierarchy()
         self._addTorrentTrackerList(torrent_id, announce, announce_list, extra_info, add_all, commit)
 
+    sql_insert_torrent_tracker = """
+    INSERT OR IGNORE INTO TorrentTracker
+    (torrent_id, tracker, announce_tier,
+    ignored_times, retried_times, last_check)
+    VALUES (?,?,?, ?,?,?)
+    """
+
+    def _getLastCheckTime(self, extra_info):
+        if "last_check_time" in extra_info:
+            return int(time() - extra_info["last_check_time"])
+        return 0
+
     def _addTorrentTrackerList(self, torrent_id, announce, announce_list, extra_info={}, add_all=False, commit=True):
         ignore_number = 0
         retry_number = 0
-        last_check_time = 0
-        if "last_check_time" in extra_info:
-            last_check_time = int(time() - extra_info["last_check_time"])
-
-        sql_insert_torrent_tracker = """
-        INSERT OR IGNORE INTO TorrentTracker
-        (torrent_id, tracker, announce_tier,
-        ignored_times, retried_times, last_check)
-        VALUES (?,?,?, ?,?,?)
-        """
+        last_check_time = self._getLastCheckTime(extra_info)
 
         values = []
         if announce != None:
@@ -876,7 +998,7 @@ class TorrentDBHandler(BasicDBHandler):
                 tier_num += 1
 
         if len(values) > 0:
-            self._db.executemany(sql_insert_torrent_tracker, values, commit=commit)
+            self._db.executemany(self.sql_insert_torrent_tracker, values, commit=commit)
 
     def updateTorrent(self, infohash, commit=True, notify=True, **kw):    # watch the schema of database
         if 'category' in kw:
@@ -1144,6 +1266,14 @@ class TorrentDBHandler(BasicDBHandler):
         infohashes = self._db.fetchall(sql, (tracker, max_last_check, limit))
         return [str2bin(infohash) for infohash, in infohashes]
 
+    def getTrackerInfos(self):
+        sql = "SELECT tracker, last_check, last_success, failures, rtt, min_interval, next_check FROM TrackerInfo"
+        return self._db.fetchall(sql)
+
+    def updateTrackerInfos(self, tracker_infos):
+        sql = "INSERT OR REPLACE INTO TrackerInfo (tracker, last_check, last_success, failures, rtt, min_interval, next_check) VALUES (?,?,?,?,?,?,?)"
+        self._db.executemany(sql, tracker_infos, commit = False)
+
     def getPopularTrackers(self, limit = 10):
         sql = "SELECT DISTINCT tracker FROM torrenttracker WHERE ignored_times = 0 ORDER BY last_check DESC LIMIT ?"
         trackers = self._db.fetchall(sql, (limit, ))
@@ -1577,6 +1707,27 @@ class TorrentDBHandler(BasicDBHandler):
         assert 'infohash' in keys
         assert not doSort or ('num_seeders' in keys or 'T.num_seeders' in keys)
 
+        cache_key = (tuple(keyword.strip() for keyword in filter_keywords(kws)), local, tuple(keys), doSort)
+        with self._search_cache_lock:
+            cached = self._search_cache.get(cache_key)
+            generation = self._search_cache_generation
+        if cached and cached[0] + SEARCH_CACHE_TTL > time():
+            # the caller may modify the results, including the sets of the matches
+            return deepcopy(cached[1])
+
+        # searches from other threads use the read pool, which does not see the uncommitted writes of
+        # the DB thread.  Cache only results which cannot miss a write, nor were invalidated meanwhile
+        uncommitted = self._db.has_uncommitted_writes()
+        results = self._searchNames(kws, local, keys, doSort)
+
+        if not uncommitted:
+            with self._search_cache_lock:
+                if generation == self._search_cache_generation:
+                    self._search_cache[cache_key] = (time(), results)
+                    results = deepcopy(results)
+        return results
+
+    def _searchNames(self, kws, local, keys, doSort):
         infohash_index = keys.index('infohash')
         swift_hash_index = keys.index('swift_hash') if 'swift_hash' in keys else -1
         swift_torrent_hash_index = keys.index('swift_torrent_hash') if 'swift_torrent_hash' in keys else -1
@@ -1662,60 +1813,104 @@ class TorrentDBHandler(BasicDBHandler):
 
         t4 = time()
 
-        #step 2, fix all dict fields
-        dont_sort_list = []
-        results = [list(result) for result in result_dict.values()]
-        for i in xrange(len(results) - 1, -1, -1):
-            result = results[i]
+        #step 2, select the results to return, torrents without seeders are not sorted
+        results = result_dict.values()
+        if doSort:
+            dont_sort_list = [result for result in results if result[num_seeders_index] <= 0]
+            results = [result for result in results if result[num_seeders_index] > 0]
+
+            if local:
+                results.sort(key = itemgetter(num_seeders_index), reverse = True)
+            else:
+                # only the top 25 are returned, no need to sort all of them
+                results = heapq.nlargest(25, results, key = itemgetter(num_seeders_index))
+            results.extend(dont_sort_list)
+
+        if not local:
+            results = results[:25]
 
+        #step 3, fix all dict fields
+        matchinfos = self._decodeMatchinfos([result[-1] for result in results], len(not_negated))
+
+        results = [list(result) for result in results]
+        for result, (swarmnames, filenames, fileextensions) in zip(results, matchinfos):
             result[infohash_index] = str2bin(result[infohash_index])
             if swift_hash_index >= 0 and result[swift_hash_index] :
                 result[swift_hash_index] = str2bin(result[swift_hash_index])
             if swift_torrent_hash_index >= 0 and result[swift_torrent_hash_index]:
                 result[swift_torrent_hash_index] = str2bin(result[swift_torrent_hash_index])
 
-            matches = {'swarmname':set(), 'filenames':set(), 'fileextensions': set()}
+            result[-1] = {'swarmname':set(keyword for keyword, hits in zip(not_negated, swarmnames) if hits),
+                          'filenames':set(keyword for keyword, hits in zip(not_negated, filenames) if hits),
+                          'fileextensions':set(keyword for keyword, hits in zip(not_negated, fileextensions) if hits)}
 
-            #Matchinfo is documented at: http://www.sqlite.org/fts3.html#matchinfo
-            matchinfo = str(result[-1])
-            num_phrases, num_cols = unpack_from('II', matchinfo)
-            unpack_str = 'I'*(3*num_cols*num_phrases)
-            matchinfo = unpack_from('II'+unpack_str, matchinfo)
+            channel = channel_dict.get(result[-2], (result[-2], None, '', '', 0, 0, 0, 0, 0, False))
+            result.extend(channel)
+
+        #print >> sys.stderr, "# hits:%d; search time:%.3f,%.3f,%.3f,%.3f,%.3f" % (len(results),t2-t1, t3-t2, t4-t3, time()-t4, time()-t1)
+        return results
 
-            swarmnames, filenames, fileextensions  = [
-                [matchinfo[3 * (i + p*num_cols) + 2] for p in range(num_phrases)]
-                for i in range(num_cols)
-            ]
+    def searchNamesRemote(self, kws, limit = 25, offset = 0, local = False):
+        """
+        Search path for answering remote search requests.  Merging channels, ordering by the number of
+        seeders and the limit/offset are all performed by SQLite, results are returned as tuples
+        (infohash, name, length, num_files, category, creation_date, num_seeders, num_leechers,
+        swift_hash, swift_torrent_hash, channel_cid) ready to be put into a search-response.
+        """
+        # like searchNames, at most 250 FTS matches are considered.  these are ordered by the number of seeders
+        # after dropping torrents only in spam channels, the best channel is only selected for the returned rows:
+        # my channel, then the channel with the highest vote from me, then the channel with the most favorite votes.
+        sql = """SELECT T.infohash, T.name, T.length, T.num_files, T.category_id, T.creation_date, T.num_seeders, T.num_leechers, T.swift_hash, T.swift_torrent_hash,
+                     (SELECT Ch.dispersy_cid FROM ChannelTorrents C, Channels Ch LEFT OUTER JOIN ChannelVotes V ON V.channel_id = Ch.id AND V.voter_id ISNULL
+                      WHERE C.torrent_id = T.torrent_id AND Ch.id = C.channel_id AND Ch.dispersy_cid != '-1' AND IFNULL(V.vote, 0) >= 0
+                      ORDER BY Ch.id = ? DESC, IFNULL(V.vote, 0) DESC, IFNULL(Ch.nr_favorite, 0) - IFNULL(Ch.nr_spam, 0) DESC LIMIT 1)
+                 FROM (SELECT * FROM (SELECT T.torrent_id, T.infohash, T.name, T.length, T.num_files, T.category_id, T.creation_date, T.num_seeders, T.num_leechers, T.swift_hash, T.swift_torrent_hash
+                                      FROM %s T, FullTextIndex
+                                      WHERE T.torrent_id = FullTextIndex.rowid AND FullTextIndex MATCH ? LIMIT 250) T
+                       WHERE NOT EXISTS (SELECT 1 FROM ChannelTorrents C WHERE C.torrent_id = T.torrent_id)
+                             OR EXISTS (SELECT 1 FROM ChannelTorrents C LEFT OUTER JOIN ChannelVotes V ON V.channel_id = C.channel_id AND V.voter_id ISNULL
+                                        WHERE C.torrent_id = T.torrent_id AND IFNULL(V.vote, 0) >= 0)
+                       ORDER BY T.num_seeders DESC LIMIT ? OFFSET ?) T
+                 ORDER BY T.num_seeders DESC""" % ("Torrent" if local else "CollectedTorrent")
 
-            for i, keyword in enumerate(not_negated):
-                if swarmnames[i]:
-                    matches['swarmname'].add(keyword)
-                if filenames[i]:
-                    matches['filenames'].add(keyword)
-                if fileextensions[i]:
-                    matches['fileextensions'].add(keyword)
-            result[-1] = matches
+        query = " ".join(filter_keywords(kws))
+        myChannelId = self.channelcast_db._channel_id or 0
 
-            channel = channel_dict.get(result[-2], (result[-2], None, '', '', 0, 0, 0, 0, 0, False))
-            result.extend(channel)
+        results = []
+        for infohash, name, length, num_files, category_id, creation_date, num_seeders, num_leechers, swift_hash, swift_torrent_hash, channel_cid in self._db.fetchall(sql, (myChannelId, query, limit, offset)):
+            results.append((str2bin(infohash), name, long(length), int(num_files), [self.id2category[category_id]], long(creation_date), int(num_seeders or 0), int(num_leechers or 0),
+                            str(str2bin(swift_hash)) if swift_hash else swift_hash, str(str2bin(swift_torrent_hash)) if swift_torrent_hash else swift_torrent_hash,
+                            str(channel_cid) if channel_cid else None))
+        return results
 
-            if doSort and result[num_seeders_index] <= 0:
-                dont_sort_list.append(result)
-                results.pop(i)
+    def _decodeMatchinfos(self, matchinfos, nr_keywords):
+        """
+        Decodes the matchinfo blobs of all rows in one pass.  Returns, for every row, a tuple with the
+        number of hits per keyword in the (swarmname, filenames, fileextensions) columns.
+        """
+        #Matchinfo is documented at: http://www.sqlite.org/fts3.html#matchinfo
+        if not matchinfos:
+            return []
 
-        t5 = time()
+        # all rows are the result of the same MATCH and therefore have the same layout: the number of
+        # phrases, the number of columns and then 3 integers per phrase/column combination, the first
+        # being the number of hits in this row
+        num_phrases, num_cols = unpack_from('II', str(matchinfos[0]))
+        stride = 2 + 3 * num_phrases * num_cols
+        matchinfo = array('I', "".join(str(blob) for blob in matchinfos))
 
-        if doSort:
-            def compare(a,b):
-                return cmp(a[num_seeders_index], b[num_seeders_index])
-            results.sort(compare, reverse = True)
-        results.extend(dont_sort_list)
+        nr_keywords = min(nr_keywords, num_phrases)
+        offsets = [[2 + 3 * (col + phrase * num_cols) for phrase in xrange(nr_keywords)] for col in xrange(num_cols)]
 
-        if not local:
-            results = results[:25]
+        decoded = []
+        for row in xrange(0, len(matchinfo), stride):
+            decoded.append(tuple([matchinfo[row + offset] for offset in col_offsets] for col_offsets in offsets))
+        return decoded
 
-        #print >> sys.stderr, "# hits:%d (%d from db, %d not sorted); search time:%.3f,%.3f,%.3f,%.3f,%.3f,%.3f" % (len(results),len(results),len(dont_sort_list),t2-t1, t3-t2, t4-t3, t5-t4, time()-t5, time()-t1)
-        return results
+    def _invalidateSearchCache(self, *args):
+        with self._search_cache_lock:
+            self._search_cache.clear()
+            self._search_cache_generation += 1
 
     def getSearchSuggestion(self, keywords, limit = 1):
         match = [keyword.lower() for keyword in keywords]
@@ -2252,6 +2447,8 @@ class VoteCastDBHandler(BasicDBHandler):
             print >> sys.stderr, "votecast: couldn't make the table"
 
         self.my_votes = None
+        # (channel_id, permids) of the peers subscribed to my channel
+        self.my_channel_subscribers = None
         if DEBUG:
             print >> sys.stderr, "votecast: "
 
@@ -2261,6 +2458,9 @@ class VoteCastDBHandler(BasicDBHandler):
         self.peer_db = PeerDBHandler.getInstance()
         self.channelcast_db = ChannelCastDBHandler.getInstance()
 
+        # the subscribers are looked up by permid, which is gone with the peer
+        self.notifier.add_observer(self._invalidateMyChannelSubscribers, NTFY_PEERS, [NTFY_DELETE])
+
     def on_vote_from_dispersy(self, channel_id, voter_id, dispersy_id, vote, timestamp):
         if not voter_id:
             self.removeVote(channel_id, voter_id) #sqlite constraint does not work for NULL values
@@ -2269,6 +2469,7 @@ class VoteCastDBHandler(BasicDBHandler):
         self._db.execute_write(insert_vote, (channel_id, voter_id, dispersy_id, vote, timestamp))
 
         self._updateChannelVotes(channel_id)
+        self._updateMyChannelSubscribers([(channel_id, voter_id, vote)])
         self.notifier.notify(NTFY_CHANNELCAST, NTFY_UPDATE, channel_id)
 
     def on_votes_from_dispersy(self, votes):
@@ -2288,8 +2489,9 @@ class VoteCastDBHandler(BasicDBHandler):
             # WARNING: pop removes element
             self._updateChannelVotes(just_channel_ids.pop(), commit=False)
         else:
-            self._updateChannelsVotes(just_channel_ids)
-        self._db.commit()
+            self._updateChannelsVotes(just_channel_ids, commit=False)
+
+        self._updateMyChannelSubscribers([(channel_id, voter_id, vote) for channel_id, voter_id, _, vote, _ in votes])
 
         for channel_id,voter_id in channel_voter_ids:
             self.notifier.notify(NTFY_CHANNELCAST, NTFY_UPDATE, channel_id, voter_id==None)
@@ -2303,6 +2505,7 @@ class VoteCastDBHandler(BasicDBHandler):
             deleted_at = long(time())
         self._db.execute_write(remove_vote, (deleted_at, channel_id, dispersy_id))
         self._updateChannelVotes(channel_id)
+        self._invalidateMyChannelSubscribers(NTFY_CHANNELCAST, NTFY_DELETE, channel_id)
 
     def get_latest_vote_dispersy_id(self, channel_id, voter_id):
         if voter_id:
@@ -2340,6 +2543,7 @@ class VoteCastDBHandler(BasicDBHandler):
         sql = "INSERT OR IGNORE INTO _ChannelVotes (channel_id, voter_id, vote, time_stamp) VALUES (?,?,?,?)"
         self._db.execute_write(sql, vote)
         self._updateChannelVotes(vote[0])
+        self._invalidateMyChannelSubscribers(NTFY_CHANNELCAST, NTFY_INSERT, vote[0])
 
         if vote[1] == None:
             self.my_votes = None
@@ -2353,6 +2557,9 @@ class VoteCastDBHandler(BasicDBHandler):
             channels.add(vote[0])
         self._updateChannelsVotes(channels)
 
+        for channel_id in channels:
+            self._invalidateMyChannelSubscribers(NTFY_CHANNELCAST, NTFY_INSERT, channel_id)
+
 
     def removeVote(self, channel_id, voter_id, commit = True):
         if voter_id:
@@ -2362,6 +2569,7 @@ class VoteCastDBHandler(BasicDBHandler):
             sql = "UPDATE _ChannelVotes SET deleted_at = ? WHERE channel_id = ? AND voter_id ISNULL"
             self._db.execute_write(sql, (long(time()), channel_id), commit=commit)
             self.my_votes = None
+        self._invalidateMyChannelSubscribers(NTFY_CHANNELCAST, NTFY_DELETE, channel_id)
 
         if commit:
             self._updateChannelVotes(channel_id)
@@ -2429,6 +2637,46 @@ class VoteCastDBHandler(BasicDBHandler):
     def getVoteForMyChannel(self, voter_id):
         return self.getVote(self.channelcast_db._channel_id, voter_id)
 
+    def getMyChannelSubscribers(self):
+        """ Returns the set of permids of the peers subscribed to my channel, loaded
+        once and kept up to date by the votes received from dispersy """
+        channel_id = self.channelcast_db._channel_id
+        if not channel_id:
+            return set()
+
+        my_channel_subscribers = self.my_channel_subscribers
+        if my_channel_subscribers is None or my_channel_subscribers[0] != channel_id:
+            sql = "SELECT permid FROM ChannelVotes, Peer WHERE ChannelVotes.voter_id = Peer.peer_id AND ChannelVotes.channel_id = ? AND ChannelVotes.vote = 2"
+            my_channel_subscribers = channel_id, set(str2bin(permid) for permid, in self._db.fetchall(sql, (channel_id, )))
+            self.my_channel_subscribers = my_channel_subscribers
+
+            if DEBUG:
+                print >> sys.stderr, "votecast: loaded", len(my_channel_subscribers[1]), "subscribers of my channel"
+        return my_channel_subscribers[1]
+
+    def _updateMyChannelSubscribers(self, votes):
+        my_channel_subscribers = self.my_channel_subscribers
+        if my_channel_subscribers is None:
+            return
+
+        channel_id, subscribers = my_channel_subscribers
+        votes = [(voter_id, vote) for vote_channel_id, voter_id, vote in votes if vote_channel_id == channel_id and voter_id]
+        if votes:
+            permids = self.peer_db.getPermids([voter_id for voter_id, _ in votes])
+            for (voter_id, vote), permid in zip(votes, permids):
+                if permid is None:
+                    continue
+
+                if vote == 2:
+                    subscribers.add(permid)
+                else:
+                    subscribers.discard(permid)
+
+    def _invalidateMyChannelSubscribers(self, subject, changeType, objectID, *args):
+        my_channel_subscribers = self.my_channel_subscribers
+        if my_channel_subscribers is not None and (subject == NTFY_PEERS or objectID == my_channel_subscribers[0]):
+            self.my_channel_subscribers = None
+
     def getDispersyId(self, channel_id, voter_id):
         """ return the dispersy_id for this vote """
         if voter_id:
@@ -2483,6 +2731,38 @@ class VoteCastDBHandler(BasicDBHandler):
 
 #end votes
 
+class ChannelTorrentSample:
+    """
+    The most recent dispersy torrents of a channel and a uniform random sample
+    (reservoir) of all its dispersy torrents, as (time_stamp, infohash) tuples.
+    Used to select the torrents for channelcast messages without sorting all
+    torrents of a channel on time_stamp or random() for every message.
+    """
+    def __init__(self, dispersy_cid, recent, reservoir, nr_torrents):
+        self.dispersy_cid = dispersy_cid
+        self.recent = recent # most recent first
+        self.reservoir = reservoir
+        self.nr_torrents = nr_torrents # number of torrents the reservoir is sampled from
+
+    def add(self, infohash, timestamp):
+        if any(recent_infohash == infohash for _, recent_infohash in self.recent):
+            return
+
+        if len(self.recent) < CHANNELCAST_RECENT_SIZE or timestamp > self.recent[-1][0]:
+            i = len(self.recent)
+            while i > 0 and self.recent[i - 1][0] < timestamp:
+                i -= 1
+            self.recent.insert(i, (timestamp, infohash))
+            del self.recent[CHANNELCAST_RECENT_SIZE:]
+
+        self.nr_torrents += 1
+        if len(self.reservoir) < CHANNELCAST_RANDOM_SIZE:
+            self.reservoir.append((timestamp, infohash))
+        else:
+            i = randint(0, self.nr_torrents - 1)
+            if i < CHANNELCAST_RANDOM_SIZE:
+                self.reservoir[i] = (timestamp, infohash)
+
 class ChannelCastDBHandler(BasicDBHandler):
 
     def __init__(self):
@@ -2504,6 +2784,14 @@ class ChannelCastDBHandler(BasicDBHandler):
         if DEBUG:
             print >> sys.stderr, "Channels: my channel is", self._channel_id
 
+        # channel_id: ChannelTorrentSample, loaded on first use and updated as torrents come in
+        self.torrent_samples = {}
+        self.torrent_samples_lock = Lock()
+
+        # torrents received from dispersy and the seconds spent storing them
+        self.nr_torrents_ingested = 0
+        self.ingest_time = 0.0
+
     def commit(self):
         self._db.commit()
 
@@ -2580,6 +2868,8 @@ class ChannelCastDBHandler(BasicDBHandler):
         sql = "DELETE FROM _ChannelTorrents WHERE dipsersy_id > ?"
         self._db.execute_write(sql, (dispersy_id), commit = self.shouldCommit)
 
+        self._invalidateTorrentSamples()
+
     #dispersy modifying and receiving channels
     def on_channel_from_channelcast(self, publisher_permid, name):
         peer_id = self.peer_db.addOrGetPeerID(publisher_permid)
@@ -2632,10 +2922,13 @@ class ChannelCastDBHandler(BasicDBHandler):
             self.notifier.notify(NTFY_CHANNELCAST, NTFY_MODIFIED, channel_id)
 
     def on_torrents_from_dispersy(self, torrentlist):
+        started = time()
         infohashes = [torrent[3] for torrent in torrentlist]
         torrent_ids, inserted = self.torrent_db.addOrGetTorrentIDSReturn(infohashes)
+        inserted = set(inserted)
 
         insert_data = []
+        new_torrents = []
         updated_channels = {}
         for i, torrent in enumerate(torrentlist):
             channel_id, dispersy_id, peer_id, infohash, timestamp, name, files, trackers = torrent
@@ -2643,22 +2936,46 @@ class ChannelCastDBHandler(BasicDBHandler):
 
             #if new or not yet collected
             if infohash in inserted:
-                self.torrent_db.addExternalTorrentNoDef(infohash, name, files, trackers, timestamp, "DISP", {'dispersy_id':dispersy_id})
+                new_torrents.append((torrent_id, infohash, name, files, trackers, timestamp))
 
             insert_data.append((dispersy_id, torrent_id, channel_id, peer_id, name, timestamp))
             updated_channels[channel_id] = updated_channels.get(channel_id, 0) + 1
 
+        if len(new_torrents) > 0:
+            self.torrent_db.addExternalTorrentsNoDef(new_torrents, "DISP")
+
         if len(insert_data) > 0:
             sql_insert_torrent = "INSERT INTO _ChannelTorrents (dispersy_id, torrent_id, channel_id, peer_id, name, time_stamp) VALUES (?,?,?,?,?,?)"
             self._db.executemany(sql_insert_torrent, insert_data, commit = False)
 
+            self.torrent_samples_lock.acquire()
+            try:
+                for channel_id, _, _, infohash, timestamp, _, _, _ in torrentlist:
+                    torrent_sample = self.torrent_samples.get(channel_id)
+                    if torrent_sample is not None:
+                        torrent_sample.add(infohash, timestamp)
+            finally:
+                self.torrent_samples_lock.release()
+
         sql_update_channel = "UPDATE _Channels SET modified = strftime('%s','now'), nr_torrents = nr_torrents+? WHERE id = ?"
         update_channels = [(new_torrents, channel_id) for channel_id, new_torrents in updated_channels.iteritems()]
-        self._db.executemany(sql_update_channel, update_channels, commit = self.shouldCommit)
+        self._db.executemany(sql_update_channel, update_channels, commit = False)
 
         for channel_id in updated_channels.keys():
             self.notifier.notify(NTFY_CHANNELCAST, NTFY_UPDATE, channel_id)
 
+        took = time() - started
+        self.nr_torrents_ingested += len(torrentlist)
+        self.ingest_time += took
+        if DEBUG:
+            print >> sys.stderr, "Channels: stored %d torrents (%d new) in %.3f seconds, %.0f torrents/s overall" % (len(torrentlist), len(new_torrents), took, self.getIngestStats()['torrents_per_second'])
+
+    def getIngestStats(self):
+        """ Returns the number of torrents received from dispersy, the seconds spent storing them and the resulting rate """
+        return {'torrents': self.nr_torrents_ingested,
+                'time': self.ingest_time,
+                'torrents_per_second': self.nr_torrents_ingested / self.ingest_time if self.ingest_time else 0.0}
+
     def on_remove_torrent_from_dispersy(self, channel_id, dispersy_id, redo):
         sql = "UPDATE _ChannelTorrents SET deleted_at = ? WHERE channel_id = ? and dispersy_id = ?"
 
@@ -2667,6 +2984,7 @@ class ChannelCastDBHandler(BasicDBHandler):
         else:
             deleted_at = long(time())
         self._db.execute_write(sql, (deleted_at, channel_id, dispersy_id), commit = self.shouldCommit)
+        self._invalidateTorrentSamples(channel_id)
 
         self.notifier.notify(NTFY_CHANNELCAST, NTFY_UPDATE, channel_id)
 
@@ -3082,22 +3400,13 @@ class ChannelCastDBHandler(BasicDBHandler):
 
     def getRecentAndRandomTorrents(self,NUM_OWN_RECENT_TORRENTS=15, NUM_OWN_RANDOM_TORRENTS=10, NUM_OTHERS_RECENT_TORRENTS=15, NUM_OTHERS_RANDOM_TORRENTS=10, NUM_OTHERS_DOWNLOADED=5):
         torrent_dict = {}
+        def add_torrents(torrents):
+            for _, infohash, cid in torrents:
+                torrent_dict.setdefault(str(cid), set()).add(infohash)
 
-        least_recent = -1
-        sql = "select dispersy_cid, infohash, time_stamp from ChannelTorrents, Channels, Torrent where ChannelTorrents.torrent_id = Torrent.torrent_id AND Channels.id = ChannelTorrents.channel_id AND ChannelTorrents.channel_id==? and ChannelTorrents.dispersy_id <> -1 order by time_stamp desc limit ?"
-        myrecenttorrents = self._db.fetchall(sql, (self._channel_id, NUM_OWN_RECENT_TORRENTS))
-        for cid, infohash, timestamp in myrecenttorrents:
-            torrent_dict.setdefault(str(cid), set()).add(str2bin(infohash))
-            least_recent = timestamp
-
-        if len(myrecenttorrents) == NUM_OWN_RECENT_TORRENTS and least_recent != -1:
-            sql = "select dispersy_cid, infohash from ChannelTorrents, Channels, Torrent where ChannelTorrents.torrent_id = Torrent.torrent_id AND Channels.id = ChannelTorrents.channel_id AND ChannelTorrents.channel_id==? and time_stamp<? and ChannelTorrents.dispersy_id <> -1 order by random() limit ?"
-            myrandomtorrents = self._db.fetchall(sql,(self._channel_id, least_recent, NUM_OWN_RANDOM_TORRENTS))
-            for cid, infohash, _ in myrecenttorrents:
-                torrent_dict.setdefault(str(cid), set()).add(str2bin(infohash))
-
-            for cid, infohash in myrandomtorrents:
-                torrent_dict.setdefault(str(cid), set()).add(str2bin(infohash))
+        if self._channel_id:
+            mysample = self._getTorrentSamples([self._channel_id])
+            add_torrents(self._selectRecentAndRandomTorrents(mysample, NUM_OWN_RECENT_TORRENTS, NUM_OWN_RANDOM_TORRENTS))
 
         nr_records = sum(len(torrents) for torrents in torrent_dict.values())
         additionalSpace = (NUM_OWN_RECENT_TORRENTS + NUM_OWN_RANDOM_TORRENTS) - nr_records
@@ -3110,31 +3419,76 @@ class ChannelCastDBHandler(BasicDBHandler):
             NUM_OWN_RECENT_TORRENTS -= additionalSpace/2
             NUM_OWN_RANDOM_TORRENTS -= additionalSpace - (additionalSpace/2)
 
-        least_recent = -1
-        sql = "select dispersy_cid, infohash, time_stamp from ChannelTorrents, Channels, Torrent where ChannelTorrents.torrent_id = Torrent.torrent_id AND Channels.id = ChannelTorrents.channel_id AND ChannelTorrents.channel_id in (select channel_id from ChannelVotes where voter_id ISNULL and vote=2) and ChannelTorrents.dispersy_id <> -1 order by time_stamp desc limit ?"
-        othersrecenttorrents = self._db.fetchall(sql, (NUM_OTHERS_RECENT_TORRENTS,))
-        for cid, infohash, timestamp in othersrecenttorrents:
-            torrent_dict.setdefault(str(cid), set()).add(str2bin(infohash))
-            least_recent = timestamp
-
-        if othersrecenttorrents and len(othersrecenttorrents) == NUM_OTHERS_RECENT_TORRENTS and least_recent != -1:
-            sql = "select dispersy_cid, infohash from ChannelTorrents, Channels, Torrent where ChannelTorrents.torrent_id = Torrent.torrent_id AND Channels.id = ChannelTorrents.channel_id AND ChannelTorrents.channel_id in (select channel_id from ChannelVotes where voter_id ISNULL and vote=2) and time_stamp < ? and ChannelTorrents.dispersy_id <> -1 order by random() limit ?"
-            othersrandomtorrents = self._db.fetchall(sql,(least_recent ,NUM_OTHERS_RANDOM_TORRENTS))
-            for cid, infohash in othersrandomtorrents:
-                torrent_dict.setdefault(str(cid), set()).add(str2bin(infohash))
+        sql = "select channel_id from ChannelVotes where voter_id ISNULL and vote=2"
+        subscriptions = self._getTorrentSamples([channel_id for channel_id, in self._db.fetchall(sql)])
+        add_torrents(self._selectRecentAndRandomTorrents(subscriptions, NUM_OTHERS_RECENT_TORRENTS, NUM_OTHERS_RANDOM_TORRENTS))
 
         twomonthsago = long(time() - 5259487)
         nr_records = sum(len(torrents) for torrents in torrent_dict.values())
         additionalSpace = (NUM_OWN_RECENT_TORRENTS + NUM_OWN_RANDOM_TORRENTS + NUM_OTHERS_RECENT_TORRENTS + NUM_OTHERS_RANDOM_TORRENTS) - nr_records
         NUM_OTHERS_DOWNLOADED += additionalSpace
 
-        sql = "select dispersy_cid, infohash from ChannelTorrents, Channels, Torrent where ChannelTorrents.torrent_id = Torrent.torrent_id AND Channels.id = ChannelTorrents.channel_id AND ChannelTorrents.channel_id in (select distinct channel_id from ChannelTorrents where torrent_id in (select torrent_id from MyPreference)) and ChannelTorrents.dispersy_id <> -1 and Channels.modified > ? order by time_stamp desc limit ?"
-        interesting_records = self._db.fetchall(sql,(twomonthsago, NUM_OTHERS_DOWNLOADED))
-        for cid, infohash in interesting_records:
-            torrent_dict.setdefault(str(cid), set()).add(str2bin(infohash))
+        sql = "select id from Channels where modified > ? and id in (select distinct channel_id from ChannelTorrents where torrent_id in (select torrent_id from MyPreference))"
+        interesting = self._getTorrentSamples([channel_id for channel_id, in self._db.fetchall(sql, (twomonthsago, ))])
+        add_torrents(self._selectRecentAndRandomTorrents(interesting, NUM_OTHERS_DOWNLOADED, 0))
 
         return torrent_dict
 
+    def _selectRecentAndRandomTorrents(self, torrent_samples, nr_recent, nr_random):
+        """ Returns the nr_recent most recent torrents of the channels and
+        nr_random random torrents older than those, as (time_stamp, infohash,
+        dispersy_cid) tuples """
+        recent = heapq.nlargest(nr_recent, ((timestamp, infohash, torrent_sample.dispersy_cid) for torrent_sample in torrent_samples for timestamp, infohash in torrent_sample.recent))
+
+        if recent and len(recent) == nr_recent and nr_random > 0:
+            least_recent = recent[-1][0]
+            older = [(timestamp, infohash, torrent_sample.dispersy_cid) for torrent_sample in torrent_samples for timestamp, infohash in torrent_sample.reservoir if timestamp < least_recent]
+            recent.extend(sample(older, min(nr_random, len(older))))
+        return recent
+
+    def _getTorrentSamples(self, channel_ids):
+        """ Returns the ChannelTorrentSamples of the existing channels in channel_ids """
+        self.torrent_samples_lock.acquire()
+        try:
+            torrent_samples = []
+            for channel_id in channel_ids:
+                torrent_sample = self.torrent_samples.get(channel_id)
+                if torrent_sample is None:
+                    torrent_sample = self._loadTorrentSample(channel_id)
+                    if torrent_sample is None:
+                        continue
+                    self.torrent_samples[channel_id] = torrent_sample
+                torrent_samples.append(torrent_sample)
+            return torrent_samples
+        finally:
+            self.torrent_samples_lock.release()
+
+    def _loadTorrentSample(self, channel_id):
+        dispersy_cid = self._db.fetchone("SELECT dispersy_cid FROM Channels WHERE id = ?", (channel_id, ))
+        if dispersy_cid is None:
+            return None
+
+        select = "SELECT time_stamp, infohash FROM ChannelTorrents, Torrent WHERE ChannelTorrents.torrent_id = Torrent.torrent_id AND channel_id = ? AND ChannelTorrents.dispersy_id <> -1"
+        recent = [(timestamp, str2bin(infohash)) for timestamp, infohash in self._db.fetchall(select + " ORDER BY time_stamp DESC LIMIT ?", (channel_id, CHANNELCAST_RECENT_SIZE))]
+        if len(recent) < CHANNELCAST_RECENT_SIZE and len(recent) <= CHANNELCAST_RANDOM_SIZE:
+            # the channel is small enough to hold all its torrents
+            return ChannelTorrentSample(dispersy_cid, recent, list(recent), len(recent))
+
+        nr_torrents = self._db.fetchone("SELECT COUNT(*) FROM ChannelTorrents WHERE channel_id = ? AND dispersy_id <> -1", (channel_id, ))
+        reservoir = [(timestamp, str2bin(infohash)) for timestamp, infohash in self._db.fetchall(select + " ORDER BY random() LIMIT ?", (channel_id, CHANNELCAST_RANDOM_SIZE))]
+        return ChannelTorrentSample(dispersy_cid, recent, reservoir, nr_torrents)
+
+    def _invalidateTorrentSamples(self, channel_id = None):
+        """ Drops the sample of channel_id, or all samples, to be loaded again on next use """
+        self.torrent_samples_lock.acquire()
+        try:
+            if channel_id is None:
+                self.torrent_samples.clear()
+            else:
+                self.torrent_samples.pop(channel_id, None)
+        finally:
+            self.torrent_samples_lock.release()
+
     def getRandomTorrents(self, channel_id, limit = 15, dispersyOnly = True):
         twomonthsago = long(time() - 5259487)
         sql = "select infohash from ChannelTorrents, Torrent where ChannelTorrents.torrent_id = Torrent.torrent_id AND channel_id = ? and ChannelTorrents.time_stamp > ?"
@@ -3701,38 +4055,40 @@ class NetworkBuzzDBHandler(BasicDBHandler):
         self.update_terms = {}
         self.new_phrases = []
 
+        # (torrent_id, torrent_name, collected) tuples waiting for addTorrents
+        self.queued_torrents = []
+        self.queue_scheduled = False
+
         self.termLock = Lock()
-        self.extractor.session.lm.database_thread.register(self.__flush_to_database, delay = 5.0 if self.nr_bi_phrases < 100 else 20.0)
+        self._db.attach_commit_callback(self.__flush_to_database)
 
     def __flush_to_database(self):
-        while True:
-            with self.termLock:
-                try:
-                    add_new_terms_sql = "INSERT INTO TermFrequency (term, freq) VALUES (?, ?);"
-                    update_exist_terms_sql = "UPDATE OR REPLACE TermFrequency SET freq = ? WHERE term_id = ?;"
-                    ins_phrase_sql = u"""INSERT OR REPLACE INTO TorrentBiTermPhrase (torrent_id, term1_id, term2_id)
-                                        SELECT ? AS torrent_id, TF1.term_id, TF2.term_id
-                                        FROM TermFrequency TF1, TermFrequency TF2
-                                        WHERE TF1.term = ? AND TF2.term = ?"""
-
-                    self._db.executemany(add_new_terms_sql, self.new_terms.values(), commit=False)
-                    self._db.executemany(update_exist_terms_sql, self.update_terms.values(), commit=False)
-                    self._db.executemany(ins_phrase_sql, self.new_phrases, commit = False)
-                except:
-                    print_exc()
-                    print >> sys.stderr, "could not insert terms", self.new_terms.values()
+        # called by the write pipeline just before each group commit
+        with self.termLock:
+            if not (self.new_terms or self.update_terms or self.new_phrases):
+                return
 
-                self.new_terms.clear()
-                self.update_terms.clear()
-                self.new_phrases = []
+            try:
+                add_new_terms_sql = "INSERT INTO TermFrequency (term, freq) VALUES (?, ?);"
+                update_exist_terms_sql = "UPDATE OR REPLACE TermFrequency SET freq = ? WHERE term_id = ?;"
+                ins_phrase_sql = u"""INSERT OR REPLACE INTO TorrentBiTermPhrase (torrent_id, term1_id, term2_id)
+                                    SELECT ? AS torrent_id, TF1.term_id, TF2.term_id
+                                    FROM TermFrequency TF1, TermFrequency TF2
+                                    WHERE TF1.term = ? AND TF2.term = ?"""
+
+                self._db.executemany(add_new_terms_sql, self.new_terms.values(), commit=False)
+                self._db.executemany(update_exist_terms_sql, self.update_terms.values(), commit=False)
+                self._db.executemany(ins_phrase_sql, self.new_phrases, commit = False)
+            except:
+                print_exc()
+                print >> sys.stderr, "could not insert terms", self.new_terms.values()
 
-            if self.nr_bi_phrases < self.MAX_UNCOLLECTED:
-                self.updateBiPhraseCount()
+            # estimate instead of a COUNT(*) on every commit, nr_bi_phrases is only compared against MAX_UNCOLLECTED
+            self.nr_bi_phrases += len(self.new_phrases)
 
-            if self.nr_bi_phrases < 100:
-                yield 5.0
-            else:
-                yield 20.0
+            self.new_terms.clear()
+            self.update_terms.clear()
+            self.new_phrases = []
 
     def updateBiPhraseCount(self):
         count_sql = "SELECT COUNT(*) FROM TorrentBiTermPhrase"
@@ -3791,35 +4147,97 @@ class NetworkBuzzDBHandler(BasicDBHandler):
         @param torrent_name Name of the added Torrent.
         @param commit Flag to indicate whether database changes should be committed.
         """
-        if collected or self.nr_bi_phrases < self.MAX_UNCOLLECTED:
-            keywords = split_into_keywords(torrent_name)
-            terms = set(self.extractor.extractTerms(keywords))
-            phrase = self.extractor.extractBiTermPhrase(keywords)
+        self.addTorrents([(torrent_id, torrent_name, collected)])
 
-            parameters = '?,'*len(terms)
-            sql = "SELECT * FROM TermFrequency WHERE term IN ("+parameters[:-1]+")"
-            results = self._db.fetchall(sql, terms)
+    def addTorrents(self, torrents):
+        """
+        Extracts terms and bi-term phrases from multiple added Torrents, looking up the
+        terms of all Torrents in the TermFrequency table at once.
 
-            newterms = terms.copy()
-            for term_id,term,freq in results:
-                newterms.remove(term)
+        @param torrents List of (torrent_id, torrent_name, collected) tuples.
+        """
+        extracted = []
+        all_terms = set()
+        for torrent_id, torrent_name, collected in torrents:
+            if collected or self.nr_bi_phrases < self.MAX_UNCOLLECTED:
+                keywords = split_into_keywords(torrent_name)
+                terms = set(self.extractor.extractTerms(keywords))
+                phrase = self.extractor.extractBiTermPhrase(keywords)
+
+                extracted.append((torrent_id, terms, phrase))
+                all_terms.update(terms)
+
+        if not extracted:
+            return
 
-            with self.termLock:
-                for term in newterms:
-                    if term in self.new_terms:
+        existing_terms = {}
+        all_terms = list(all_terms)
+        for i in xrange(0, len(all_terms), 500):
+            terms = all_terms[i:i+500]
+            parameters = '?,'*len(terms)
+            sql = "SELECT * FROM TermFrequency WHERE term IN ("+parameters[:-1]+")"
+            for term_id, term, freq in self._db.fetchall(sql, terms):
+                existing_terms[term] = (term_id, freq)
+
+        with self.termLock:
+            for torrent_id, terms, phrase in extracted:
+                for term in terms:
+                    if term in existing_terms:
+                        term_id, freq = existing_terms[term]
+                        if term_id in self.update_terms:
+                            self.update_terms[term_id][0] += 1
+                        else:
+                            self.update_terms[term_id] = [freq+1, term_id]
+
+                    elif term in self.new_terms:
                         self.new_terms[term][1] += 1
                     else:
                         self.new_terms[term] = [term, 1]
 
-                for term_id, term, freq in results:
-                    if term_id in self.update_terms:
-                        self.update_terms[term_id][0] += 1
-                    else:
-                        self.update_terms[term_id] = [freq+1, term_id]
-
                 if phrase is not None:
                     self.new_phrases.append((torrent_id, ) + phrase)
 
+        # flushed by the group commit
+        self._db.schedule_group_commit()
+
+    def queueTorrents(self, torrents):
+        """
+        Queues multiple added Torrents for addTorrents, which processes them in batches of
+        BUZZ_QUEUE_BATCH_SIZE on the database thread.  Used when adding many Torrents at
+        once, e.g. when synchronizing a channel.
+
+        @param torrents List of (torrent_id, torrent_name, collected) tuples.
+        """
+        if not torrents:
+            return
+
+        with self.termLock:
+            self.queued_torrents.extend(torrents)
+            schedule = not self.queue_scheduled
+            self.queue_scheduled = True
+
+        if schedule:
+            register_task(None, self._processQueuedTorrents, delay = BUZZ_QUEUE_DELAY)
+
+    def _processQueuedTorrents(self):
+        with self.termLock:
+            torrents = self.queued_torrents[:BUZZ_QUEUE_BATCH_SIZE]
+            del self.queued_torrents[:BUZZ_QUEUE_BATCH_SIZE]
+
+        try:
+            self.addTorrents(torrents)
+        except:
+            print_exc()
+
+        with self.termLock:
+            schedule = self.queue_scheduled = len(self.queued_torrents) > 0
+
+        if DEBUG:
+            print >> sys.stderr, "NetworkBuzzDBHandler: extracted terms of", len(torrents), "queued torrents,", len(self.queued_torrents), "remaining"
+
+        if schedule:
+            register_task(None, self._processQueuedTorrents, delay = BUZZ_QUEUE_DELAY)
+
     def deleteTorrent(self, torrent_id, commit=True):
         """
         Updates the TorrentBiTermPhrase table to reflect the change that a Torrent
@@ -3830,6 +4248,9 @@ class NetworkBuzzDBHandler(BasicDBHandler):
         @param torrent_id Identifier of the deleted Torrent.
         @param commit Flag to indicate whether database changes should be committed.
         """
+        with self.termLock:
+            if self.queued_torrents:
+                self.queued_torrents = [torrent for torrent in self.queued_torrents if torrent[0] != torrent_id]
         self._db.delete('TorrentBiTermPhrase', commit=commit, torrent_id=torrent_id)
 
     def getBuzz(self, size= DEFAULT_SAMPLE_SIZE, with_freq=True, flat=False):
@@ -17,6 +17,7 @@ from Tribler.Core.Utilities.unicode import dunno2unicode
 import apsw
 from Tribler.Core.Utilities.utilities import get_collected_torrent_filename
 from threading import currentThread, Event, RLock, Lock
+from Queue import Queue, Empty
 import inspect
 from Tribler.Core.Swift.SwiftDef import SwiftDef
 
@@ -47,10 +48,11 @@ except ImportError:
 ##Changed from 15 to 16 changed all swift_torrent_hash that was an empty string to NULL
 ##Changed from 16 to 17 cleaning buddycast, preference, terms, and subtitles tables, removed indices
 ##Changed from 17 to 18 added swift-thumbnails/video-info metadatatypes
+##Changed from 18 to 19 added TrackerInfo table
 
 # Arno, 2012-08-01: WARNING You must also update the version number that is
 # written to the DB in the schema_sdb_v*.sql file!!!
-CURRENT_MAIN_DB_VERSION = 18
+CURRENT_MAIN_DB_VERSION = 19
 
 TEST_SQLITECACHEDB_UPGRADE = False
 CREATE_SQL_FILE = None
@@ -59,6 +61,10 @@ DB_FILE_NAME = 'tribler.sdb'
 DB_DIR_NAME = 'sqlite'    # db file path = DB_DIR_NAME/DB_FILE_NAME
 DEFAULT_BUSY_TIMEOUT = 10000
 MAX_SQL_BATCHED_TO_TRANSACTION = 1000   # don't change it unless carefully tested. A transaction with 1000 batched updates took 1.5 seconds
+GROUP_COMMIT_SIZE = 500   # commit the open transaction once this many statements are pending
+GROUP_COMMIT_INTERVAL = 0.25   # or once the oldest pending statement is this many seconds old
+GROUP_COMMIT_TASK_ID = u"sqlitecachedb-group-commit"
+READ_POOL_SIZE = 4   # number of read-only connections used for SELECTs from threads other than the DB thread, 0 disables the pool
 NULL = None
 icon_dir = None
 SHOW_ALL_EXECUTE = False
@@ -98,6 +104,149 @@ class LimitedOrderedDict(OrderedDict):
         if len(self) > self._limit:
             self.popitem(last=False)
 
+class QueryStats:
+    """
+    Per query counters, time spent waiting for a connection (or for the DB
+    thread) is kept separate from the time spent executing the query.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.queries = LimitedOrderedDict(1024)   # {sql: [count, wait_time, execute_time, pooled]}
+
+    def add_query(self, sql, wait_time, execute_time, pooled):
+        self.lock.acquire()
+        try:
+            stats = self.queries.get(sql)
+            if stats is None:
+                stats = self.queries[sql] = [0, 0.0, 0.0, 0]
+            stats[0] += 1
+            stats[1] += wait_time
+            stats[2] += execute_time
+            if pooled:
+                stats[3] += 1
+        finally:
+            self.lock.release()
+
+    def get_stats(self):
+        """
+        Returns a dictionary {sql: {'count', 'wait', 'execute', 'pooled'}}, where wait and execute are
+        the total number of seconds spent.
+        """
+        self.lock.acquire()
+        try:
+            return dict((sql, {'count':count, 'wait':wait, 'execute':execute, 'pooled':pooled}) for sql, (count, wait, execute, pooled) in self.queries.iteritems())
+        finally:
+            self.lock.release()
+
+    def reset(self):
+        self.lock.acquire()
+        try:
+            self.queries = LimitedOrderedDict(1024)
+        finally:
+            self.lock.release()
+
+class CommitStats:
+    """
+    Counters for the group commits performed by SQLiteNoCacheDB.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+    def add_commit(self, batch_size, commit_time, oldest_write_age):
+        self.lock.acquire()
+        try:
+            self.commits += 1
+            self.statements += batch_size
+            self.max_batch_size = max(self.max_batch_size, batch_size)
+            self.commit_time += commit_time
+            self.max_commit_time = max(self.max_commit_time, commit_time)
+            self.max_write_age = max(self.max_write_age, oldest_write_age)
+        finally:
+            self.lock.release()
+
+    def get_stats(self):
+        self.lock.acquire()
+        try:
+            return {'commits': self.commits,
+                    'statements': self.statements,
+                    'avg_batch_size': self.statements / float(self.commits) if self.commits else 0.0,
+                    'max_batch_size': self.max_batch_size,
+                    'avg_commit_time': self.commit_time / self.commits if self.commits else 0.0,
+                    'max_commit_time': self.max_commit_time,
+                    'max_write_age': self.max_write_age}
+        finally:
+            self.lock.release()
+
+    def reset(self):
+        self.lock.acquire()
+        try:
+            self.commits = 0
+            self.statements = 0
+            self.max_batch_size = 0
+            self.commit_time = 0.0
+            self.max_commit_time = 0.0
+            self.max_write_age = 0.0
+        finally:
+            self.lock.release()
+
+class ReadConnectionPool:
+    """
+    A pool of read-only connections to a WAL mode database.  WAL allows these readers to run
+    concurrently with the single writer on the DB thread, however they will only see committed
+    data.
+    """
+    def __init__(self, dbfile_path, busytimeout=DEFAULT_BUSY_TIMEOUT, size=READ_POOL_SIZE):
+        self.dbfile_path = dbfile_path
+        self.busytimeout = busytimeout
+        self.size = size
+
+        self.lock = Lock()
+        self.cursors = []
+        self.available = Queue()
+
+    def acquire(self):
+        try:
+            return self.available.get_nowait()
+        except Empty:
+            pass
+
+        self.lock.acquire()
+        try:
+            if len(self.cursors) < self.size:
+                con = apsw.Connection(self.dbfile_path, flags=apsw.SQLITE_OPEN_READONLY)
+                con.setbusytimeout(self.busytimeout)
+                cur = con.cursor()
+                self.cursors.append(cur)
+                return cur
+        finally:
+            self.lock.release()
+
+        return self.available.get()
+
+    def release(self, cur):
+        self.available.put(cur)
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            for cur in self.cursors:
+                try:
+                    con = cur.getconnection()
+                    cur.close()
+                    con.close()
+                except:
+                    print_exc()
+            self.cursors = []
+            self.available = Queue()
+        finally:
+            self.lock.release()
+
+    @staticmethod
+    def accepts(sql):
+        # only plain reads can be executed on a read-only connection
+        return sql.lstrip()[:6].lower() == 'select'
+
 def init(config, db_exception_handler = None):
     """ create sqlite database """
     global CREATE_SQL_FILE
@@ -2256,6 +2405,17 @@ ALTER TABLE Peer ADD COLUMN services integer DEFAULT 0;
             self.execute_write("INSERT INTO MetaDataTypes ('name') VALUES ('swift-thumbnails')")
             self.execute_write("INSERT INTO MetaDataTypes ('name') VALUES ('video-info')")
 
+        if fromver < 19:
+            self.execute_write("""CREATE TABLE IF NOT EXISTS TrackerInfo (
+              tracker          text PRIMARY KEY NOT NULL,
+              last_check       numeric DEFAULT 0,
+              last_success     numeric DEFAULT 0,
+              failures         integer DEFAULT 0,
+              rtt              numeric DEFAULT 0,
+              min_interval     integer DEFAULT 0,
+              next_check       numeric DEFAULT 0
+            );""")
+
 
     def clean_db(self, vacuum = False):
         from time import time
@@ -2316,6 +2476,11 @@ def register_task(db, *args, **kwargs):
         return fakeDispersy(*args)
     return _callback.register(*args, **kwargs)
 
+def unregister_task(db, id_):
+    global _callback
+    if _callback and _callback.is_running:
+        _callback.unregister(id_)
+
 def call_task(db, *args, **kwargs):
     global _callback
     if not _callback:
@@ -2415,6 +2580,15 @@ class SQLiteNoCacheDB(SQLiteCacheDBV5):
             raise RuntimeError, "SQLiteCacheDB is singleton"
         SQLiteCacheDBBase.__init__(self, *args, **kargs)
 
+        self.read_pool = None
+        self.read_stats = QueryStats()
+
+        self._pending_writes = 0
+        self._pending_since = None
+        self._committing = False
+        self._commit_callbacks = []
+        self.commit_stats = CommitStats()
+
         if __debug__:
             if self.__counter > 0:
                 print_stack()
@@ -2436,15 +2610,34 @@ class SQLiteNoCacheDB(SQLiteCacheDBV5):
     @forceDBThread
     def commitNow(self, vacuum = False, exiting = False):
         global _shouldCommit, _cacheCommit
+        if _cacheCommit and onDBThread():
+            # buffered writes are flushed even if nothing else was written
+            self._committing = True
+            try:
+                for callback in self._commit_callbacks:
+                    try:
+                        callback()
+                    except:
+                        print_exc()
+            finally:
+                self._committing = False
+
         if _cacheCommit and _shouldCommit and onDBThread():
             try:
                 if DEBUG: print >> sys.stderr, "SQLiteNoCacheDB.commitNow: COMMIT"
+                started = time()
                 self._execute("COMMIT;")
+                self.commit_stats.add_commit(self._pending_writes, time() - started, started - self._pending_since if self._pending_since else 0.0)
             except:
                 print >> sys.stderr, "COMMIT FAILED"
                 print_exc()
                 raise
             _shouldCommit = False
+            self._pending_writes = 0
+            if self._pending_since is not None:
+                # this commit includes the writes the group commit task was scheduled for
+                self._pending_since = None
+                unregister_task(self, GROUP_COMMIT_TASK_ID)
 
             if vacuum:
                 self._execute("VACUUM;")
@@ -2459,25 +2652,86 @@ class SQLiteNoCacheDB(SQLiteCacheDBV5):
                     raise
             else:
                 print >> sys.stderr, "SQLiteNoCacheDB.commitNow: not calling BEGIN exiting"
+                _cacheCommit = False
 
             #print_stack()
 
         elif vacuum:
             self._execute("VACUUM;")
 
+    def attach_commit_callback(self, callback):
+        """
+        Callback is called on the DB thread just before every (group) commit, allowing buffered
+        writes to be flushed in the same transaction.  Call schedule_group_commit after buffering,
+        otherwise the buffer is only flushed by the next commit.
+        """
+        assert callable(callback)
+        if callback not in self._commit_callbacks:
+            self._commit_callbacks.append(callback)
+
+    def detach_commit_callback(self, callback):
+        if callback in self._commit_callbacks:
+            self._commit_callbacks.remove(callback)
+
+    def get_commit_stats(self):
+        return self.commit_stats.get_stats()
+
+    def has_uncommitted_writes(self):
+        """
+        Returns True when the open transaction holds writes, which reads on the read pool do not see yet.
+        """
+        return self._pending_writes > 0
+
     def execute_write(self, sql, args=None, commit=True):
         global _shouldCommit, _cacheCommit
         if _cacheCommit and not _shouldCommit:
             _shouldCommit = True
 
         self._execute(sql, args)
+        self._register_writes(1)
 
     def executemany(self, sql, args, commit=True):
         global _shouldCommit, _cacheCommit
         if _cacheCommit and not _shouldCommit:
             _shouldCommit = True
 
-        return self._executemany(sql, args)
+        result = self._executemany(sql, args)
+        self._register_writes(len(args) if args else 0)
+        return result
+
+    @forceDBThread
+    def _register_writes(self, nr_statements):
+        """
+        Writes are executed directly into the transaction opened by initialBegin, this groups them
+        into a commit once GROUP_COMMIT_SIZE statements are pending or GROUP_COMMIT_INTERVAL seconds
+        after the first pending statement, whichever comes first.
+        """
+        if not _cacheCommit or nr_statements == 0:
+            return
+
+        self._pending_writes += nr_statements
+        if self._committing:
+            # writes flushed by a commit callback are part of the commit in progress
+            return
+
+        if self._pending_writes >= GROUP_COMMIT_SIZE:
+            self.commitNow()
+        else:
+            self.schedule_group_commit()
+
+    @forceDBThread
+    def schedule_group_commit(self):
+        """
+        Commits within GROUP_COMMIT_INTERVAL seconds, flushing the buffers of the commit callbacks.
+        """
+        if _cacheCommit and self._pending_since is None:
+            self._pending_since = time()
+            register_task(None, self._group_commit, delay = GROUP_COMMIT_INTERVAL, id_ = GROUP_COMMIT_TASK_ID)
+
+    def _group_commit(self):
+        self.commitNow()
+        # nothing was committed when the buffers were empty
+        self._pending_since = None
 
     def cache_transaction(self, sql, args=None):
         if DEPRECATION_DEBUG:
@@ -2501,13 +2755,93 @@ class SQLiteNoCacheDB(SQLiteCacheDBV5):
         if vacuum:
             self.commitNow(vacuum, exiting=exiting)
 
-    @forceAndReturnDBThread
+    def close(self, clean=False):
+        SQLiteCacheDBV5.close(self, clean)
+
+        if clean and self.read_pool:
+            self.read_pool.close()
+            self.read_pool = None
+
     def fetchone(self, sql, args=None):
-        return SQLiteCacheDBV5.fetchone(self, sql, args)
+        # returns NULL: if the result is null
+        # return None: if it doesn't found any match results
+        find = self._fetch(sql, args)
+        if len(find) == 0:
+            return NULL
+
+        if DEBUG and len(find) > 1:
+            print >> sys.stderr, "FetchONE resulted in many more rows than one, consider putting a LIMIT 1 in the sql statement", sql, len(find)
+
+        find = find[0]
+        if len(find) > 1:
+            return find
+        return find[0]
 
-    @forceAndReturnDBThread
     def fetchall(self, sql, args=None, retry=0):
-        return SQLiteCacheDBV5.fetchall(self, sql, args, retry)
+        return self._fetch(sql, args)
+
+    def get_read_stats(self):
+        return self.read_stats.get_stats()
+
+    def _get_read_pool(self):
+        if self.read_pool is None and READ_POOL_SIZE > 0:
+            db_path = self.class_variables['db_path']
+            if db_path and db_path.lower() != ':memory:':
+                self.lock.acquire()
+                try:
+                    if self.read_pool is None:
+                        self.read_pool = ReadConnectionPool(db_path, self.class_variables['busytimeout'] or DEFAULT_BUSY_TIMEOUT, READ_POOL_SIZE)
+                finally:
+                    self.lock.release()
+        return self.read_pool
+
+    def _fetch(self, sql, args=None):
+        """
+        Reads from the DB thread are executed on its own cursor, allowing them to see the uncommitted
+        writes of the current transaction.  Reads from any other thread use the read pool (if available)
+        instead of queueing behind the DB thread, note that these only see committed data.
+        """
+        queued = time()
+        if not onDBThread() and ReadConnectionPool.accepts(sql):
+            read_pool = self._get_read_pool()
+            if read_pool:
+                return self._fetch_on_pool(read_pool, sql, args, queued)
+
+        return self._fetch_on_dbthread(sql, args, queued)
+
+    def _fetch_on_pool(self, read_pool, sql, args, queued):
+        cur = read_pool.acquire()
+        try:
+            started = time()
+            if SHOW_ALL_EXECUTE or self.show_execute:
+                thread_name = threading.currentThread().getName()
+                print >> sys.stderr, '===', thread_name, '(read pool) ===\n', sql, '\n-----\n', args, '\n======\n'
+
+            try:
+                if args is None:
+                    find = list(cur.execute(sql))
+                else:
+                    find = list(cur.execute(sql, args))
+
+            except Exception, msg:
+                if DEBUG:
+                    print_exc()
+                    print >> sys.stderr, "cachedb: read pool execute error:", Exception, msg
+                raise msg
+        finally:
+            read_pool.release(cur)
+
+        self.read_stats.add_query(sql, started - queued, time() - started, True)
+        return find
+
+    @forceAndReturnDBThread
+    def _fetch_on_dbthread(self, sql, args, queued):
+        started = time()
+        find = self.execute_read(sql, args)
+        find = list(find) if find else []
+
+        self.read_stats.add_query(sql, started - queued, time() - started, False)
+        return find
 
     @forceAndReturnDBThread
     def _execute(self, sql, args=None):
@@ -15,6 +15,7 @@ from Tribler.Core.DownloadConfig import DownloadStartupConfig
 from Tribler.Core.APIImplementation import maketorrent
 from Tribler.Core.osutils import fix_filebasename
 from Tribler.Core.Libtorrent.LibtorrentMgr import LibtorrentMgr
+from Tribler.Core.Libtorrent.VODController import VODController
 from Tribler.Core.APIImplementation.maketorrent import torrentfilerec2savefilename, savefilenames2finaldest
 from Tribler.Core.TorrentDef import TorrentDefNoMetainfo, TorrentDef
 from Tribler.Core.exceptions import VODNoFileSelectedInMultifileTorrentException
@@ -45,11 +46,13 @@ class VODFile(object):
     def read(self, *args):
         result = self._file.read(*args)
         self._download.vod_readpos += len(result)
+        self._download.vod_readpos_changed()
         return result
 
     def seek(self, *args):
         self._file.seek(*args)
-        self._download.vod_readpos += args[0]
+        self._download.vod_readpos = self._file.tell()
+        self._download.vod_readpos_changed()
         
 
 class LibtorrentDownloadImpl(DownloadRuntimeConfig): 
@@ -88,9 +91,17 @@ class LibtorrentDownloadImpl(DownloadRuntimeConfig):
         self.vod_readpos = 0
         self.vod_pausepos = 0
         self.vod_status = ""
+        self.vod_controller = None
 
         self.lm_network_vod_event_callback = None
         self.pstate_for_restart = None
+
+        # Alert type: handler(alert, status), a handler may return the new dlstate
+        self.alert_handlers = {'metadata_received_alert': self.on_metadata_received,
+                               'file_renamed_alert': self.on_file_renamed,
+                               'torrent_checked_alert': self.on_torrent_checked,
+                               'torrent_paused_alert': self.on_torrent_paused,
+                               'piece_finished_alert': self.on_piece_finished}
         
         self.cew_scheduled = False
 
@@ -198,6 +209,7 @@ class LibtorrentDownloadImpl(DownloadRuntimeConfig):
             
     def set_vod_mode(self):
         self.vod_status = ""
+        self.vod_controller = None
         
         # Define which file to DL in VOD mode
         self.videoinfo = {'live' : self.get_def().get_live()}
@@ -232,37 +244,33 @@ class LibtorrentDownloadImpl(DownloadRuntimeConfig):
         else:
             if DEBUG:
                 print >> sys.stderr, "LibtorrentDownloadImpl: going into VOD mode", self.videoinfo
-            self.set_state_callback(self.monitor_vod, delay = 5.0)
-               
-    def monitor_vod(self, ds):
-        status = self.handle.status()
-        pieces = status.pieces if status else []
-
-        startofbuffer = 0
-        if not self.vod_status and self.tdef.is_multifile_torrent():
-            selected_files = self.get_selected_files()
-            startofbuffer = [t for t, _, f in self.filepieceranges if not selected_files or f == selected_files[0]][0]
-        else:
-            startofbuffer = int(self.vod_readpos / self.handle.get_torrent_info().piece_length())
-        endofbuffer = startofbuffer + int(self.prebuffsize / self.handle.get_torrent_info().piece_length() + 1)
-        buffer = pieces[startofbuffer:endofbuffer]
-        self.bufferprogress = float(buffer.count(True))/len(buffer) if len(buffer) > 0 else 1
 
-        if DEBUG:        
-            print >> sys.stderr, 'LibtorrentDownloadImpl: bufferprogress = %.2f' % self.bufferprogress
-        
-        if self.bufferprogress >= 1:
-            if not self.vod_status:
-                self.vod_pausepos = startofbuffer * self.handle.get_torrent_info().piece_length()
-                self.start_vod(complete = False)
-            else:
-                self.resume_vod()
+            # Instead of polling the pieces of the torrent, the controller
+            # follows the piece_finished alerts and the read position
+            torrentinfo = self.handle.get_torrent_info()
+            request = torrentinfo.map_file(self.videoinfo['index'], 0, 1)
+            fileoffset = request.piece * torrentinfo.piece_length() + request.start
+            self.vod_controller = VODController(self.handle, torrentinfo.piece_length(), fileoffset, self.videoinfo['outpath'][1], self.videoinfo['bitrate'],
+                                                self.prebuffsize, self.handle.status().pieces, self.vod_buffer_full, self.pause_vod)
+            self.ltmgr.set_vod_alerts(self, True)
+            self.vod_controller.check()
+
+    def vod_buffer_full(self):
+        if not self.vod_status:
+            self.vod_pausepos = self.vod_readpos
+            self.start_vod(complete = False)
+        else:
+            self.resume_vod()
 
-        elif self.bufferprogress <= 0.1 and self.vod_status:
-            self.pause_vod()
+    def vod_readpos_changed(self):
+        """ Called by the player thread when it read from or seeked in the VODFile """
+        controller = self.vod_controller
+        if controller and (controller.fileoffset + self.vod_readpos) / controller.piecelength != controller.start:
+            self.session.lm.rawserver.add_task(self.network_vod_readpos_changed, 0)
 
-        delay = 1.0 if self.handle and not self.handle.is_paused() else 0.0            
-        return (delay, False)
+    def network_vod_readpos_changed(self):
+        if self.vod_controller:
+            self.vod_controller.set_readpos(self.vod_readpos)
     
     def start_vod(self, complete = False):
         if not self.vod_status:
@@ -295,9 +303,13 @@ class LibtorrentDownloadImpl(DownloadRuntimeConfig):
             if DEBUG:
                 print >> sys.stderr, "LibtorrentDownloadImpl: VOD paused"
 
-    def process_alert(self, alert, alert_type):
-        if DEBUG or alert.category() in [lt.alert.category_t.error_notification, lt.alert.category_t.performance_warning]:
-            print >> sys.stderr, "LibtorrentDownloadImpl: alert %s with message %s" % (alert_type, alert)
+    def process_alerts(self, alerts):
+        """ Handles a batch of (alert, alert_type) tuples for this download,
+        fetching the status of the torrent once, and again after a handler
+        that changed the state """
+        for alert, alert_type in alerts:
+            if DEBUG or alert.category() in [lt.alert.category_t.error_notification, lt.alert.category_t.performance_warning]:
+                print >> sys.stderr, "LibtorrentDownloadImpl: alert %s with message %s" % (alert_type, alert)
 
         if self.handle and self.handle.is_valid():
             
@@ -305,35 +317,19 @@ class LibtorrentDownloadImpl(DownloadRuntimeConfig):
 
             with self.dllock:
 
-                if alert_type == 'metadata_received_alert':
-                    self.metadata = {'info': lt.bdecode(self.handle.get_torrent_info().metadata())}
-                    self.tdef = TorrentDef.load_from_dict(self.metadata)
-                    self.orig_files = [torrent_file.path for torrent_file in lt.torrent_info(self.metadata).files()]
-                    self.set_files()
-                    
-                    if self.session.lm.rtorrent_handler:
-                        self.session.lm.rtorrent_handler.save_torrent(self.tdef)
-                    elif self.session.lm.torrent_db:
-                        self.session.lm.torrent_db.addExternalTorrent(self.tdef, source = '', extra_info = {'status':'good'}, commit = True)
-                        
-                    # Checkpoint
-                    (infohash, pstate) = self.network_checkpoint()
-                    checkpoint = lambda : self.session.lm.save_download_pstate(infohash, pstate)
-                    self.session.lm.rawserver.add_task(checkpoint, 0)
-
-                if alert_type == 'file_renamed_alert':
-                    if os.path.exists(self.unwanteddir_abs) and not os.listdir(self.unwanteddir_abs) and all(self.handle.file_priorities()):
-                        os.rmdir(self.unwanteddir_abs)
-                        
-                if alert_type == 'torrent_checked_alert' and self.pause_after_next_hashcheck:
-                    self.handle.pause()
-                    self.pause_after_next_hashcheck = False
-                    self.dlstate = DLSTATUS_STOPPED
-                else:
-                    if alert_type == 'torrent_paused_alert':
-                        self.dlstate = DLSTATUS_STOPPED_ON_ERROR if status.error else DLSTATUS_STOPPED
-                    else:
-                        self.dlstate = self.dlstates[status.state] if not status.paused else DLSTATUS_STOPPED
+                # Like the status, the state follows from the last alert
+                dlstate = None
+                for alert, alert_type in alerts:
+                    handler = self.alert_handlers.get(alert_type, None)
+                    dlstate = handler(alert, status) if handler else None
+                    if dlstate is not None:
+                        # The handler may have paused the torrent, so the
+                        # state of later alerts follows from a new status
+                        status = self.handle.status()
+
+                if dlstate is None:
+                    dlstate = self.dlstates[status.state] if not status.paused else DLSTATUS_STOPPED
+                self.dlstate = dlstate
 
                 self.error = unicode(status.error) if status.error else None
                 self.length = float(status.total_wanted)
@@ -344,6 +340,43 @@ class LibtorrentDownloadImpl(DownloadRuntimeConfig):
                 self.all_time_download = status.all_time_download
                 self.finished_time = status.finished_time
                     
+    def on_metadata_received(self, alert, status):
+        self.metadata = {'info': lt.bdecode(self.handle.get_torrent_info().metadata())}
+        self.tdef = TorrentDef.load_from_dict(self.metadata)
+        self.orig_files = [torrent_file.path for torrent_file in lt.torrent_info(self.metadata).files()]
+        self.set_files()
+        
+        if self.session.lm.rtorrent_handler:
+            self.session.lm.rtorrent_handler.save_torrent(self.tdef)
+        elif self.session.lm.torrent_db:
+            self.session.lm.torrent_db.addExternalTorrent(self.tdef, source = '', extra_info = {'status':'good'}, commit = True)
+            
+        # Checkpoint
+        (infohash, pstate) = self.network_checkpoint()
+        checkpoint = lambda : self.session.lm.save_download_pstate(infohash, pstate)
+        self.session.lm.rawserver.add_task(checkpoint, 0)
+
+    def on_file_renamed(self, alert, status):
+        if os.path.exists(self.unwanteddir_abs) and not os.listdir(self.unwanteddir_abs) and all(self.handle.file_priorities()):
+            os.rmdir(self.unwanteddir_abs)
+
+    def on_torrent_checked(self, alert, status):
+        if self.vod_controller:
+            self.vod_controller.set_pieces(status.pieces)
+            self.vod_controller.check()
+
+        if self.pause_after_next_hashcheck:
+            self.handle.pause()
+            self.pause_after_next_hashcheck = False
+            return DLSTATUS_STOPPED
+
+    def on_torrent_paused(self, alert, status):
+        return DLSTATUS_STOPPED_ON_ERROR if status.error else DLSTATUS_STOPPED
+
+    def on_piece_finished(self, alert, status):
+        if self.vod_controller:
+            self.vod_controller.piece_finished(alert.piece_index)
+
     def set_files(self):
         metainfo = self.tdef.get_metainfo()
         self.set_filepieceranges(metainfo)
@@ -506,6 +539,8 @@ class LibtorrentDownloadImpl(DownloadRuntimeConfig):
     def network_calc_prebuf_frac(self):
         if self.progress * self.length >= self.prebuffsize:
             return 1.0
+        if self.vod_controller:
+            return self.vod_controller.get_buffer_progress()
         return self.bufferprogress
 
     def network_calc_prebuf_eta(self):
@@ -523,6 +558,14 @@ class LibtorrentDownloadImpl(DownloadRuntimeConfig):
         d['prebuf'] = None
         d['firstpiece'] = 0 
         d['npieces'] = ((self.length + 1023) / 1024)
+        if self.vod_controller:
+            stats = self.vod_controller.get_stats()
+            d['stall'] = stats['rebuffers']
+            d['pos'] = self.vod_readpos
+            d['prebuf'] = stats['startup_latency']
+            d['startup_latency'] = stats['startup_latency']
+            d['rebuffers'] = stats['rebuffers']
+            d['rebuffer_time'] = stats['rebuffer_time']
         return d
     
     def network_create_spew_from_peerlist(self):
@@ -667,6 +710,9 @@ class LibtorrentDownloadImpl(DownloadRuntimeConfig):
                 self.handle.resume()   
                 if self.get_mode() == DLMODE_VOD:
                     self.set_vod_mode()
+                elif self.vod_controller:
+                    self.vod_controller = None
+                    self.ltmgr.set_vod_alerts(self, False)
 
     def set_max_desired_speed(self, direct, speed):
         if DEBUG:
@@ -13,6 +13,12 @@ from Tribler.Core import NoDispersyRLock
 
 DEBUG = False
 DHTSTATE_FILENAME = "ltdht.state"
+ALERT_MASK = lt.alert.category_t.stats_notification | \
+             lt.alert.category_t.error_notification | \
+             lt.alert.category_t.status_notification | \
+             lt.alert.category_t.storage_notification | \
+             lt.alert.category_t.performance_warning
+MAX_ALERTS_PER_BATCH = 5000     # alerts handled before giving other rawserver tasks a turn
 
 class LibtorrentMgr:
     # Code to make this a singleton
@@ -33,11 +39,7 @@ class LibtorrentMgr:
         self.ltsession.add_extension(lt.create_ut_metadata_plugin)
         self.ltsession.add_extension(lt.create_ut_pex_plugin)
         self.ltsession.add_extension(lt.create_smart_ban_plugin)
-        self.ltsession.set_alert_mask(lt.alert.category_t.stats_notification |
-                                      lt.alert.category_t.error_notification |
-                                      lt.alert.category_t.status_notification |
-                                      lt.alert.category_t.storage_notification |
-                                      lt.alert.category_t.performance_warning )
+        self.ltsession.set_alert_mask(ALERT_MASK)
         self.ltsession.listen_on(self.trsession.get_listen_port(), self.trsession.get_listen_port()+10)
         self.set_upload_rate_limit(-1)
         self.set_download_rate_limit(-1)
@@ -56,6 +58,11 @@ class LibtorrentMgr:
         
         self.torlock = NoDispersyRLock()
         self.torrents = {}
+        self.vod_torrents = set()
+
+        # Alert class to alert type, such that the type does not have to be parsed from the class name each time
+        self.alert_types = dict((getattr(lt, name), name) for name in dir(lt) if name.endswith('_alert'))
+        self.alert_stats = {'alerts': 0, 'batches': 0, 'max_batch': 0, 'drain_time': 0.0, 'max_drain_time': 0.0, 'starttime': time.time()}
         self.trsession.lm.rawserver.add_task(self.process_alerts, 1)
 
     def getInstance(*args, **kw):
@@ -144,6 +151,8 @@ class LibtorrentMgr:
                 if infohash in self.torrents:
                     self.ltsession.remove_torrent(handle, int(removecontent))
                     del self.torrents[infohash]
+                    if infohash in self.vod_torrents:
+                        self.set_vod_alerts(torrentdl, False)
                     if DEBUG:
                         print >> sys.stderr, "LibtorrentMgr: remove torrent", infohash
                 elif DEBUG:
@@ -151,21 +160,78 @@ class LibtorrentMgr:
         elif DEBUG:
             print >> sys.stderr, "LibtorrentMgr: cannot remove invalid torrent"
         
+    def set_vod_alerts(self, torrentdl, enable):
+        """ Downloads in VOD mode need piece_finished alerts, which are only
+        enabled while there are such downloads as they come with one alert per
+        finished block. """
+        infohash = str(torrentdl.handle.info_hash())
+        with self.torlock:
+            if enable:
+                self.vod_torrents.add(infohash)
+            else:
+                self.vod_torrents.discard(infohash)
+            mask = ALERT_MASK | lt.alert.category_t.progress_notification if self.vod_torrents else ALERT_MASK
+        self.ltsession.set_alert_mask(mask)
+
+    def pop_alerts(self):
+        """ Returns the pending alerts, at most MAX_ALERTS_PER_BATCH of them """
+        if hasattr(self.ltsession, 'pop_alerts'):
+            return self.ltsession.pop_alerts()
+
+        alerts = []
+        alert = self.ltsession.pop_alert()
+        while alert:
+            alerts.append(alert)
+            if len(alerts) == MAX_ALERTS_PER_BATCH:
+                break
+            alert = self.ltsession.pop_alert()
+        return alerts
+
     def process_alerts(self):
         if self.ltsession:
-            alert = self.ltsession.pop_alert()
-            while alert:
+            t1 = time.time()
+            alerts = self.pop_alerts()
+
+            # Group the alerts per torrent, such that each download can handle
+            # them at once and torlock is only taken once
+            torrent_alerts = {}
+            for alert in alerts:
                 handle = getattr(alert, 'handle', None) 
                 if handle:
                     if handle.is_valid():
-                        infohash = str(handle.info_hash())
-                        with self.torlock:
-                            if infohash in self.torrents:
-                                alert_type = str(type(alert)).split("'")[1].split(".")[-1]
-                                self.torrents[infohash].process_alert(alert, alert_type)
-                            elif DEBUG:
-                                print >> sys.stderr, "LibtorrentMgr: could not find torrent", infohash
+                        alert_class = type(alert)
+                        alert_type = self.alert_types.get(alert_class, None)
+                        if alert_type is None:
+                            alert_type = self.alert_types[alert_class] = alert_class.__name__
+                        torrent_alerts.setdefault(str(handle.info_hash()), []).append((alert, alert_type))
                     elif DEBUG:
                         print >> sys.stderr, "LibtorrentMgr: alert for invalid torrent"
-                alert = self.ltsession.pop_alert()
-            self.trsession.lm.rawserver.add_task(self.process_alerts, 1)
+
+            with self.torlock:
+                torrents = [(infohash, self.torrents.get(infohash, None), torrentdl_alerts) for infohash, torrentdl_alerts in torrent_alerts.iteritems()]
+
+            for infohash, torrentdl, torrentdl_alerts in torrents:
+                if torrentdl:
+                    torrentdl.process_alerts(torrentdl_alerts)
+                elif DEBUG:
+                    print >> sys.stderr, "LibtorrentMgr: could not find torrent", infohash
+
+            drain_time = time.time() - t1
+            self.alert_stats['alerts'] += len(alerts)
+            self.alert_stats['batches'] += 1
+            self.alert_stats['max_batch'] = max(self.alert_stats['max_batch'], len(alerts))
+            self.alert_stats['drain_time'] += drain_time
+            self.alert_stats['max_drain_time'] = max(self.alert_stats['max_drain_time'], drain_time)
+
+            # A full batch probably means more alerts are waiting
+            self.trsession.lm.rawserver.add_task(self.process_alerts, 0 if len(alerts) >= MAX_ALERTS_PER_BATCH else 1)
+
+    def get_alert_stats(self):
+        """ Returns the number of alerts handled per second and how long handling a batch took """
+        stats = self.alert_stats
+        return {'alerts': stats['alerts'],
+                'alerts_per_sec': stats['alerts'] / max(time.time() - stats['starttime'], 1.0),
+                'batches': stats['batches'],
+                'max_batch': stats['max_batch'],
+                'avg_drain_time': stats['drain_time'] / stats['batches'] if stats['batches'] else 0.0,
+                'max_drain_time': stats['max_drain_time']}
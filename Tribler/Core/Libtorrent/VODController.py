@@ -0,0 +1,134 @@
+# Written by Egbert Bouman
+# see LICENSE.txt for license information
+
+import sys
+from time import time
+
+DEBUG = False
+
+DEFAULT_BITRATE = 128 * 1024    # bytes/s assumed when the torrent does not specify a bitrate
+RESUME_THRESHOLD = 1.0          # fraction of the playback window available before (re)starting playback
+PAUSE_THRESHOLD = 0.1           # fraction of the playback window available below which playback is paused
+
+
+class VODController:
+    """
+    Keeps track of the pieces available in the playback window of a VOD
+    download, i.e. the pieces holding the prebuffsize bytes following the
+    read position of the player.  The number of available pieces is updated
+    on piece_finished alerts and when the read position moves, instead of
+    copying the bitfield of the torrent on every check.
+
+    The pieces in the window get deadlines according to the bitrate of the
+    file, such that libtorrent requests them in time.
+
+    All methods are called by the network thread.
+    """
+    def __init__(self, handle, piecelength, fileoffset, filelength, bitrate, prebuffsize, pieces, playcallback, pausecallback):
+        self.handle = handle
+        self.piecelength = piecelength
+        self.fileoffset = fileoffset
+        self.firstpiece = fileoffset / piecelength
+        self.lastpiece = (fileoffset + max(filelength, 1) - 1) / piecelength
+        self.bitrate = bitrate or DEFAULT_BITRATE
+        self.windowsize = prebuffsize / piecelength + 1
+        self.playcallback = playcallback
+        self.pausecallback = pausecallback
+
+        self.deadlines = set()
+        self.start = self.firstpiece
+        self.end = min(self.start + self.windowsize, self.lastpiece + 1)
+        self.set_pieces(pieces)
+
+        self.playing = False
+        self.starttime = time()
+        self.startup_latency = None
+        self.rebuffers = 0
+        self.rebuffer_time = 0.0
+        self.pausetime = None
+
+        self.set_deadlines(self.fileoffset)
+
+    def set_pieces(self, pieces):
+        """ Sets the availability of all pieces, e.g. after a hash check """
+        # Availability of the pieces of the file, indexed by piece - firstpiece
+        self.have = bytearray(1 if piece else 0 for piece in pieces[self.firstpiece:self.lastpiece + 1])
+        self.have.extend(bytearray(self.lastpiece + 1 - self.firstpiece - len(self.have)))
+        self.available = self.count(self.start, self.end)
+        self.deadlines = set(piece for piece in self.deadlines if not self.has_piece(piece))
+
+    def count(self, start, end):
+        return self.have[start - self.firstpiece:end - self.firstpiece].count('\x01')
+
+    def has_piece(self, piece):
+        return self.have[piece - self.firstpiece] == 1
+
+    def piece_finished(self, piece):
+        if self.firstpiece <= piece <= self.lastpiece and not self.has_piece(piece):
+            self.have[piece - self.firstpiece] = 1
+            self.deadlines.discard(piece)
+            if self.start <= piece < self.end:
+                self.available += 1
+                self.check()
+
+    def set_readpos(self, readpos):
+        """ The player continues reading at readpos bytes from the start of the file """
+        pos = self.fileoffset + readpos
+        start = min(max(pos / self.piecelength, self.firstpiece), self.lastpiece)
+        if start != self.start:
+            end = min(start + self.windowsize, self.lastpiece + 1)
+            if self.start < start < self.end:
+                # Moving forward, only count the pieces entering and leaving the window
+                self.available += self.count(self.end, end) - self.count(self.start, start)
+            else:
+                # Seek, count the whole window
+                self.available = self.count(start, end)
+            self.start = start
+            self.end = end
+
+            self.set_deadlines(pos)
+            self.check()
+
+    def set_deadlines(self, pos):
+        """ Asks libtorrent to download the missing pieces in the window before
+        the player reaches them, and cancels deadlines for pieces outside it """
+        for piece in [piece for piece in self.deadlines if not self.start <= piece < self.end]:
+            self.handle.reset_piece_deadline(piece)
+            self.deadlines.remove(piece)
+
+        for piece in xrange(self.start, self.end):
+            if piece not in self.deadlines and not self.has_piece(piece):
+                deadline = int(max(0, piece * self.piecelength - pos) * 1000 / self.bitrate)
+                self.handle.set_piece_deadline(piece, deadline)
+                self.deadlines.add(piece)
+
+    def get_buffer_progress(self):
+        if self.end > self.start:
+            return float(self.available) / (self.end - self.start)
+        return 1.0
+
+    def check(self):
+        progress = self.get_buffer_progress()
+        if DEBUG:
+            print >> sys.stderr, 'VODController: bufferprogress = %.2f' % progress
+
+        if progress >= RESUME_THRESHOLD and not self.playing:
+            self.playing = True
+            if self.startup_latency is None:
+                self.startup_latency = time() - self.starttime
+            else:
+                self.rebuffer_time += time() - self.pausetime
+            self.playcallback()
+
+        elif progress <= PAUSE_THRESHOLD and self.playing:
+            self.playing = False
+            self.rebuffers += 1
+            self.pausetime = time()
+            self.pausecallback()
+
+    def get_stats(self):
+        return {'startup_latency': self.startup_latency,
+                'rebuffers': self.rebuffers,
+                'rebuffer_time': self.rebuffer_time + (time() - self.pausetime if self.rebuffers and not self.playing else 0.0),
+                'bufferprogress': self.get_buffer_progress(),
+                'deadlines': len(self.deadlines)}
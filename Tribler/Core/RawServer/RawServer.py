@@ -69,6 +69,13 @@ class RawServer:
         self.excflag = excflag
         self.lock = RLock()        
 
+        self.iterations = 0
+        self.busy_time = 0.0
+        self.max_busy_time = 0.0
+        self.nr_tasks = 0
+        self.task_lag = 0.0
+        self.max_task_lag = 0.0
+
         if sockethandler is None:
             sockethandler = SocketHandler(timeout, ipv6_enable, READSIZE)
         self.sockethandler = sockethandler
@@ -122,7 +129,19 @@ class RawServer:
         return self.sockethandler.start_connection(dns, handler, randomize)
 
     def get_stats(self):
-        return self.sockethandler.get_stats()
+        """
+        Returns the stats of the sockethandler, extended with the number of
+        loop iterations, the time spent handling tasks and events per
+        iteration and the lag between the scheduled and actual start of tasks
+        """
+        stats = self.sockethandler.get_stats()
+        stats.update({ 'iterations': self.iterations,
+                       'avg_iteration_time': self.busy_time / self.iterations if self.iterations else 0.0,
+                       'max_iteration_time': self.max_busy_time,
+                       'tasks': self.nr_tasks,
+                       'avg_task_lag': self.task_lag / self.nr_tasks if self.nr_tasks else 0.0,
+                       'max_task_lag': self.max_task_lag })
+        return stats
 
     def pop_external(self):
         self.lock.acquire()
@@ -153,6 +172,7 @@ class RawServer:
                     #if DEBUG:
                     #    print >>sys.stderr,"rawserver: do_poll",period
                     events = self.sockethandler.do_poll(period)
+                    t1 = clock()
 
                     if self.doneflag.isSet():
                         if DEBUG:
@@ -163,9 +183,14 @@ class RawServer:
                     
                     
                     while self.funcs and self.funcs[0][0] <= clock() and not self.doneflag.isSet():
-                        garbage1, func, id = self.funcs.pop(0)
+                        when, func, id = self.funcs.pop(0)
                         if id in self.tasks_to_kill:
                             pass
+
+                        lag = clock() - when
+                        self.nr_tasks += 1
+                        self.task_lag += lag
+                        self.max_task_lag = max(self.max_task_lag, lag)
                         try:
 #                            print func.func_name
                             if DEBUG:
@@ -203,6 +228,11 @@ class RawServer:
                                 
                     self.sockethandler.close_dead()
                     self.sockethandler.handle_events(events)
+
+                    busy_time = clock() - t1
+                    self.iterations += 1
+                    self.busy_time += busy_time
+                    self.max_busy_time = max(self.max_busy_time, busy_time)
                     
                 except (SystemError, MemoryError), e:
                     if DEBUG:
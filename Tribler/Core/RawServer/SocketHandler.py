@@ -4,13 +4,16 @@
 import socket
 import errno
 try:
-    from select import poll, POLLIN, POLLOUT, POLLERR, POLLHUP
-    timemult = 1000
+    # Linux
+    from epollpoll import poll, POLLIN, POLLOUT, POLLERR, POLLHUP
 except ImportError:
-    from selectpoll import poll, POLLIN, POLLOUT, POLLERR, POLLHUP
-    timemult = 1
+    try:
+        from select import poll, POLLIN, POLLOUT, POLLERR, POLLHUP
+    except ImportError:
+        from selectpoll import poll, POLLIN, POLLOUT, POLLERR, POLLHUP
 from time import sleep
 from Tribler.Core.Utilities.clock import clock
+from Tribler.Core.Utilities.bytebuffer import WriteBuffer
 import sys
 from random import shuffle, randrange
 from traceback import print_exc
@@ -25,10 +28,14 @@ DEBUG = False
 
 all = POLLIN | POLLOUT
 
+# ACCEPT_CONNECTION_ERRORCODES are accept errors caused by a single
+# connection, other pending connections can still be accepted
 if sys.platform == 'win32':
     SOCKET_BLOCK_ERRORCODE=10035    # WSAEWOULDBLOCK
+    ACCEPT_CONNECTION_ERRORCODES=(10053,)   # WSAECONNABORTED
 else:
     SOCKET_BLOCK_ERRORCODE=errno.EWOULDBLOCK
+    ACCEPT_CONNECTION_ERRORCODES=(errno.ECONNABORTED, errno.EPROTO, errno.EPERM, errno.EINTR)
 
 class InterruptSocketHandler:
     @staticmethod
@@ -47,6 +54,7 @@ class InterruptSocket:
         self.ip = "127.0.0.1"
         self.port = None
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(0)
         self.interrupt_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
         # we assume that one port in the range below is free
@@ -88,11 +96,12 @@ class SingleSocket:
         self.socket_handler = socket_handler
         self.socket = sock
         self.handler = handler
-        self.buffer = []
+        self.buffer = WriteBuffer()
         self.last_hit = clock()
         self.fileno = sock.fileno()
         self.connected = False
         self.skipped = 0
+        self.poll_events = POLLIN   # the events we are registered for, set by SocketHandler
 #        self.check = StreamCheck()
         self.myip = None
         self.myport = -1
@@ -159,7 +168,7 @@ class SingleSocket:
         self.connected = False
         sock = self.socket
         self.socket = None
-        self.buffer = []
+        self.buffer.clear()
         del self.socket_handler.single_sockets[self.fileno]
         
         try:
@@ -181,8 +190,9 @@ class SingleSocket:
         if self.socket is None:
             return
         #assert self.socket is not None
+        was_flushed = not self.buffer
         self.buffer.append(s)
-        if len(self.buffer) == 1:
+        if was_flushed:
             self.try_write()
 
     def try_write(self):
@@ -191,16 +201,15 @@ class SingleSocket:
             dead = False
             try:
                 while self.buffer:
-                    buf = self.buffer[0]
+                    buf = self.buffer.peek()
                     amount = self.socket.send(buf)
                     if amount == 0:
                         self.skipped += 1
                         break
                     self.skipped = 0
+                    self.buffer.consume(amount)
                     if amount != len(buf):
-                        self.buffer[0] = buf[amount:]
                         break
-                    del self.buffer[0]
             except socket.error, e:
                 #if DEBUG:
                 #    print_exc(file=sys.stderr)
@@ -217,21 +226,43 @@ class SingleSocket:
             if dead:
                 self.socket_handler.dead_from_write.append(self)
                 return
+        # only register for POLLOUT when the buffer becomes non-empty, and
+        # unregister when it is flushed
         if self.buffer:
-            self.socket_handler.poll.register(self.socket, all)
+            events = all
         else:
-            self.socket_handler.poll.register(self.socket, POLLIN)
+            events = POLLIN
+        if events != self.poll_events:
+            self.poll_events = events
+            self.socket_handler.poll.register(self.socket, events)
         
     def set_handler(self, handler):    # can be: NewSocketHandler, Encoder, En_Connection
         self.handler = handler
 
 
 class SocketHandler:
-    def __init__(self, timeout, ipv6_enable, readsize = 100000):
+    def __init__(self, timeout, ipv6_enable, readsize = 100000, poller = None):
+        """
+        poller can be used to override the poll object, it has to use the
+        same event constants as the default one (e.g. select.poll() or
+        epollpoll.poll(edge_triggered = False) on Linux).
+        """
         self.timeout = timeout
         self.ipv6_enable = ipv6_enable
         self.readsize = readsize
-        self.poll = poll()
+        if poller is None:
+            poller = poll()
+        self.poll = poller
+        self.poll_backend = getattr(poller, '__module__', None) or type(poller).__module__
+        # select.poll expects its timeout in milliseconds, epollpoll and selectpoll in seconds
+        self.timemult = 1000 if self.poll_backend == 'select' else 1
+        # when edge-triggered, we are only notified once for new data, hence
+        # we have to read or accept until the socket would block
+        self.edge_triggered = getattr(poller, 'edge_triggered', False)
+        self.nr_polls = 0
+        self.poll_time = 0.0
+        self.ready_fds = 0
+        self.max_ready_fds = 0
         # {socket: SingleSocket}
         self.single_sockets = {}
         self.dead_from_write = []
@@ -463,10 +494,26 @@ class SocketHandler:
                     self.poll.unregister(s)
                     del self.servers[sock]
                 else:
-                    try:
-                        newsock, addr = s.accept()
+                    while True:
+                        try:
+                            newsock, addr = s.accept()
+                        except socket.error,e:
+                            if self.edge_triggered and e[0] == SOCKET_BLOCK_ERRORCODE:
+                                # accepted all pending connections
+                                break
+                            if DEBUG:
+                                print >> sys.stderr,"SocketHandler: SocketError while accepting new connection",str(e)
+                            if self.edge_triggered and e[0] in ACCEPT_CONNECTION_ERRORCODES:
+                                continue
+                            self._sleep()
+                            if self.edge_triggered:
+                                # we are not notified again for the connections
+                                # still pending, re-arm the server socket
+                                self.poll.register(s, POLLIN)
+                            break
+
                         if DEBUG:
-                            print >> sys.stderr,"SocketHandler: Got connection from",newsock.getpeername()
+                            print >> sys.stderr,"SocketHandler: Got connection from",addr
                         if not self.btengine_said_reachable:
                             try:
                                 from Tribler.Core.NATFirewall.DialbackMsgHandler import DialbackMsgHandler
@@ -490,11 +537,9 @@ class SocketHandler:
                         else:
                             print >> sys.stderr,"SocketHandler: too many connects"
                             newsock.close()
-                        
-                    except socket.error,e:
-                        if DEBUG:
-                            print >> sys.stderr,"SocketHandler: SocketError while accepting new connection",str(e)
-                        self._sleep()
+
+                        if not self.edge_triggered:
+                            break
                 continue
 
             s = self.udp_sockets.get(sock)
@@ -533,17 +578,23 @@ class SocketHandler:
                 if (event & POLLIN):
                     try:
                         s.last_hit = clock()
-                        data = s.socket.recv(100000)
-                        if not data:
-                            if DEBUG:
-                                print >> sys.stderr,"SocketHandler: no-data closing connection",s.get_ip(),s.get_port()
-                            self._close_socket(s)
-                        else:
-                            #if DEBUG:
-                            #    print >> sys.stderr,"SocketHandler: Got data",s.get_ip(),s.get_port(),"len",len(data)
+                        while True:
+                            data = s.socket.recv(100000)
+                            if not data:
+                                if DEBUG:
+                                    print >> sys.stderr,"SocketHandler: no-data closing connection",s.get_ip(),s.get_port()
+                                self._close_socket(s)
+                                break
+                            else:
+                                #if DEBUG:
+                                #    print >> sys.stderr,"SocketHandler: Got data",s.get_ip(),s.get_port(),"len",len(data)
+
+                                # btlaunchmany: NewSocketHandler, btdownloadheadless: Encrypter.Connection
+                                s.handler.data_came_in(s, data)
 
-                            # btlaunchmany: NewSocketHandler, btdownloadheadless: Encrypter.Connection
-                            s.handler.data_came_in(s, data)
+                            # when edge-triggered, read until the socket would block
+                            if not self.edge_triggered or not s.socket:
+                                break
                     except socket.error, e:
                         if DEBUG:
                             print >> sys.stderr,"SocketHandler: Socket error",str(e)
@@ -583,7 +634,14 @@ class SocketHandler:
         s.handler.connection_lost(s)
 
     def do_poll(self, t):
-        r = self.poll.poll(t*timemult)
+        t1 = clock()
+        r = self.poll.poll(t*self.timemult)
+        self.poll_time += clock() - t1
+        self.nr_polls += 1
+        if r:
+            self.ready_fds += len(r)
+            self.max_ready_fds = max(self.max_ready_fds, len(r))
+
         if r is None:
             connects = len(self.single_sockets)
             to_close = int(connects*0.05)+1 # close 5% of sockets
@@ -599,8 +657,15 @@ class SocketHandler:
         return r     
 
     def get_stats(self):
-        return { 'interfaces': self.interfaces, 
-                 'port': self.port }
+        return { 'interfaces': getattr(self, 'interfaces', []),
+                 'poll_backend': self.poll_backend,
+                 'edge_triggered': self.edge_triggered,
+                 'registered_fds': len(self.single_sockets) + len(self.servers) + len(self.udp_sockets),
+                 'polls': self.nr_polls,
+                 'poll_time': self.poll_time,
+                 'ready_fds': self.ready_fds,
+                 'avg_ready_fds': self.ready_fds / float(self.nr_polls) if self.nr_polls else 0.0,
+                 'max_ready_fds': self.max_ready_fds }
 
 
     def shutdown(self):
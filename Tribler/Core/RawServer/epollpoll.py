@@ -0,0 +1,82 @@
+# Written by Niels Zeilemaker
+# see LICENSE.txt for license information
+#
+# epoll based poll class with the same interface as select.poll, used on Linux.
+# Sockets are registered edge-triggered by default, meaning that the users of
+# this class need to read from a socket until it would block, see
+# SocketHandler.handle_events.
+
+import sys
+import errno
+from types import IntType
+from select import epoll, EPOLLIN, EPOLLOUT, EPOLLERR, EPOLLHUP, EPOLLET
+
+POLLIN = EPOLLIN
+POLLOUT = EPOLLOUT
+POLLERR = EPOLLERR
+POLLHUP = EPOLLHUP
+
+MAX_TIMEOUT = 24 * 60 * 60     # epoll cannot wait for more than 2**31 ms
+
+DEBUG = False
+
+class poll:
+    def __init__(self, edge_triggered = True):
+        self.edge_triggered = edge_triggered
+        self.flags = EPOLLET if edge_triggered else 0
+        self.epoll = epoll()
+        self.registered = {}    # {fd: eventmask}
+
+    def register(self, f, t):
+        if type(f) != IntType:
+            f = f.fileno()
+
+        # also call into the kernel if the eventmask did not change: f may
+        # be a new socket reusing the fd of a closed one, and modify re-arms
+        # an edge-triggered socket
+        if f in self.registered:
+            try:
+                self.epoll.modify(f, t | self.flags)
+            except IOError, e:
+                # the socket was closed without being unregistered, and its
+                # fd reused
+                if e.errno != errno.ENOENT:
+                    raise
+                self.epoll.register(f, t | self.flags)
+        else:
+            try:
+                self.epoll.register(f, t | self.flags)
+            except IOError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+                self.epoll.modify(f, t | self.flags)
+        self.registered[f] = t
+
+    def unregister(self, f):
+        if type(f) != IntType:
+            f = f.fileno()
+
+        # raises a KeyError like select.poll if f is not registered
+        del self.registered[f]
+        try:
+            self.epoll.unregister(f)
+        except (IOError, ValueError):
+            # closed sockets are removed from the epoll set automatically
+            if DEBUG:
+                print >> sys.stderr, "epollpoll: unregister of closed fd", f
+
+    def poll(self, timeout = None):
+        if timeout is None or timeout < 0:
+            timeout = -1
+        else:
+            timeout = min(timeout, MAX_TIMEOUT)
+
+        try:
+            return self.epoll.poll(timeout)
+        except IOError, e:
+            if e.errno == errno.EINTR:
+                return []
+            raise
+
+    def __len__(self):
+        return len(self.registered)
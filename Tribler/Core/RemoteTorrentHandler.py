@@ -5,13 +5,14 @@
 # returned torrents for download.
 
 import sys
-import Queue
 import os
 
 from traceback import print_exc
 from random import choice
 from binascii import hexlify
 from time import sleep, time
+from heapq import heappush, heappop
+from itertools import count
 
 from Tribler.Core.simpledefs import INFOHASH_LENGTH, DLSTATUS_STOPPED_ON_ERROR,\
     NTFY_CHANNELCAST
@@ -65,6 +66,7 @@ class RemoteTorrentHandler:
         from Tribler.Utilities.TimedTaskQueue import TimedTaskQueue
         self.tqueue = TimedTaskQueue("RemoteTorrentHandler")
         self.scheduletask = self.tqueue.add_task
+        self.scheduler = RequestScheduler(self.scheduletask)
         self.torrent_db = session.open_dbhandler('torrents')
         self.channel_db = self.session.open_dbhandler(NTFY_CHANNELCAST)
 
@@ -168,11 +170,16 @@ class RemoteTorrentHandler:
             if usercallback:
                 self.callbacks.setdefault(hash, set()).add(usercallback)
 
-            #look for lowest prio requester, which already has this infohash scheduled
+            #look for a requester which already has this hash scheduled, if it has a lower priority
+            #move its candidates to the requester of this priority
             requester = None
-            for i in range(prio, prio + 1):
-                if i in requesters and requesters[i].is_being_requested(hash):
-                    requester = requesters[i]
+            candidates = set()
+            for other in requesters.values():
+                if other.is_being_requested(hash):
+                    if other.prio <= prio:
+                        requester = other
+                    else:
+                        candidates = other.remove_request(hash)
                     break
 
             #if not found, then used/create this requester
@@ -185,6 +192,8 @@ class RemoteTorrentHandler:
                 requester = requesters[prio]
 
             #make request
+            for other_candidate in candidates:
+                requester.add_request(hash, other_candidate, timeout)
             requester.add_request(hash, candidate, timeout)
 
             if DEBUG:
@@ -304,6 +313,8 @@ class RemoteTorrentHandler:
         return sdef, mfpath
 
     def notify_possible_torrent_roothash(self, roothash):
+        self.scheduletask(lambda roothash=roothash: self.scheduler.request_done(roothash))
+
         keys = self.callbacks.keys()
         for key in keys:
             if key[1] == roothash:
@@ -328,6 +339,8 @@ class RemoteTorrentHandler:
                 pass
 
     def notify_possible_thumbnail_roothash(self, roothash):
+        self.scheduletask(lambda roothash=roothash: self.scheduler.request_done(roothash))
+
         keys = self.callbacks.keys()
         for key in keys:
             if key == roothash:
@@ -336,6 +349,8 @@ class RemoteTorrentHandler:
                 print >>sys.stderr,'rtorrent: finished downloading thumbnail:', binascii.hexlify(roothash)
 
     def notify_possible_torrent_infohash(self, infohash, actualTorrent = False):
+        self.scheduletask(lambda infohash=infohash: self.scheduler.request_done(infohash))
+
         keys = self.callbacks.keys()
         for key in keys:
             if key[0] == infohash or key == infohash:
@@ -393,23 +408,166 @@ class RemoteTorrentHandler:
             return ''
         return ", ".join([qstring for qstring in [getQueueSuccess("TQueue", self.trequesters), getQueueSuccess("DQueue", self.drequesters), getQueueSuccess("MQueue", self.mrequesters)] if qstring])
 
+class RequestScheduler:
+    """
+    Schedules the requests of all requesters.  Pending requests are kept in a single heap ordered
+    by priority and deadline.  A request is made once its requester may make a new request and at
+    least one of its candidates has less than MAX_PER_CANDIDATE requests in flight.  The interval
+    between two requests of a requester shrinks if requests succeed and grows if they time out.
+    """
+    MAX_PER_CANDIDATE = 4
+    MAX_SCAN = 100
+    INFLIGHT_TIMEOUT = 45.0
+    RETRY_INTERVAL = 1.0
+
+    def __init__(self, scheduletask):
+        self.scheduletask = scheduletask
+
+        self.heap = []
+        self.counter = count()
+        self.pending = {}              # {(requester, hash): deadline}
+        self.inflight = {}             # {(requester, hash): (candidates, expires)}
+        self.candidate_inflight = {}   # {candidate: nr of requests in flight}
+        self.scheduled_at = None
+
+    def add_request(self, requester, hash, deadline):
+        key = (requester, hash)
+        if self.pending.get(key, -1) < deadline:
+            self.pending[key] = deadline
+            heappush(self.heap, (requester.prio, deadline, self.counter.next(), requester, hash))
+
+            self._schedule(max(0, requester.next_request - time()))
+
+    def remove_request(self, requester, hash):
+        self.pending.pop((requester, hash), None)
+
+    def request_done(self, hash):
+        for key in self.inflight.keys():
+            requester, requested = key
+            if requested == hash or (isinstance(requested, (tuple, frozenset)) and hash in requested):
+                self._release(key)
+                requester.interval = max(requester.REQUEST_INTERVAL / 4, requester.interval * 0.8)
+
+    def get_inflight(self, candidate):
+        return self.candidate_inflight.get(candidate, 0)
+
+    def _schedule(self, delay):
+        scheduled_at = time() + delay
+        if self.scheduled_at is None or scheduled_at < self.scheduled_at:
+            self.scheduled_at = scheduled_at
+            self.scheduletask(self._tick, t = delay)
+
+    def _release(self, key):
+        candidates, _ = self.inflight.pop(key)
+        for candidate in candidates:
+            if self.candidate_inflight[candidate] > 1:
+                self.candidate_inflight[candidate] -= 1
+            else:
+                del self.candidate_inflight[candidate]
+
+    def _tick(self):
+        now = time()
+        if self.scheduled_at is not None and now < self.scheduled_at:
+            # a later tick, an earlier one was scheduled in the mean time
+            return
+        self.scheduled_at = None
+
+        for key, (_, expires) in self.inflight.items():
+            if expires < now:
+                self._release(key)
+                requester = key[0]
+                requester.interval = min(requester.REQUEST_INTERVAL * 4, requester.interval * 1.25)
+
+        put_aside = []
+        next_tick = None
+        nr_requests = nr_scanned = 0
+        while self.heap and nr_scanned < self.MAX_SCAN:
+            entry = heappop(self.heap)
+            _, deadline, _, requester, hash = entry
+            key = (requester, hash)
+
+            #check if still needed
+            if self.pending.get(key) != deadline:
+                continue
+            if hash not in requester.sources:
+                del self.pending[key]
+                continue
+
+            if now > deadline:
+                if DEBUG:
+                    print >> sys.stderr, "rtorrent: timeout for hash", hash
+
+                del self.pending[key]
+                del requester.sources[hash]
+                continue
+
+            nr_scanned += 1
+            if requester.next_request > now:
+                put_aside.append(entry)
+                next_tick = min(next_tick or sys.maxint, requester.next_request)
+                continue
+
+            #prefer candidates which do not have too many requests in flight
+            candidates = requester.sources[hash]
+            available = [candidate for candidate in candidates if candidate is None or self.get_inflight(candidate) < self.MAX_PER_CANDIDATE]
+            if not (available and requester.can_request()):
+                put_aside.append(entry)
+                next_tick = min(next_tick or sys.maxint, now + self.RETRY_INTERVAL)
+                continue
+
+            candidates = available + [candidate for candidate in candidates if candidate not in available]
+            del self.pending[key]
+            del requester.sources[hash]
+
+            #Make sure exceptions wont crash this requesting loop
+            try:
+                madeRequest = requester.doFetch(hash, candidates)
+            except:
+                print_exc()
+                madeRequest = False
+
+            if madeRequest:
+                requester.requests_made += 1
+                requester.next_request = now + requester.interval * requester.prio
+                nr_requests += 1
+
+                if key in self.inflight:
+                    self._release(key)
+                candidates = [candidate for candidate in candidates if candidate is not None]
+                self.inflight[key] = (candidates, now + self.INFLIGHT_TIMEOUT)
+                for candidate in candidates:
+                    self.candidate_inflight[candidate] = self.candidate_inflight.get(candidate, 0) + 1
+
+        for entry in put_aside:
+            heappush(self.heap, entry)
+
+        if self.heap:
+            if nr_scanned == self.MAX_SCAN and nr_requests:
+                self._schedule(0)
+            else:
+                self._schedule(max(0, (next_tick or now + self.RETRY_INTERVAL) - now))
+
+        elif self.inflight:
+            # expire requests in flight
+            self._schedule(self.INFLIGHT_TIMEOUT)
+
 class Requester:
     REQUEST_INTERVAL = 0.5
 
-    def __init__(self, scheduletask, prio):
-        self.scheduletask = scheduletask
+    def __init__(self, remote_th, prio):
+        self.scheduletask = remote_th.scheduletask
+        self.scheduler = remote_th.scheduler
         self.prio = prio
 
-        self.queue = Queue.Queue()
         self.sources = {}
         self.canrequest = True
+        self.interval = self.REQUEST_INTERVAL
+        self.next_request = 0
 
         self.requests_made = 0
         self.requests_success = 0
 
     def add_request(self, hash, candidate, timeout = None):
-        was_empty = self.queue.empty()
-
         if hash not in self.sources:
             self.sources[hash] = set()
 
@@ -419,63 +577,19 @@ class Requester:
             timeout = timeout + time()
 
         self.sources[hash].add(candidate)
-        self.queue.put((hash, timeout))
-
-        if was_empty:
-            self.scheduletask(self.doRequest, t = self.REQUEST_INTERVAL * self.prio)
+        self.scheduler.add_request(self, hash, timeout)
 
     def is_being_requested(self, hash):
         return hash in self.sources
 
     def remove_request(self, hash):
-        del self.sources[hash]
+        self.scheduler.remove_request(self, hash)
+        return self.sources.pop(hash)
 
-    def doRequest(self):
-        try:
-            madeRequest = False
-            if isinstance(self.canrequest, bool):
-                canRequest = self.canrequest
-            else:
-                canRequest = self.canrequest()
-
-            if canRequest:
-                #request new infohash from queue
-                while True:
-                    hash, timeout = self.queue.get_nowait()
-
-                    #check if still needed
-                    if time() > timeout:
-                        if DEBUG:
-                            print >> sys.stderr, "rtorrent: timeout for hash", hash
-
-                        if hash in self.sources:
-                            del self.sources[hash]
-
-                    elif hash in self.sources:
-                        break
-
-                    self.queue.task_done()
-
-                try:
-                    candidates = list(self.sources[hash])
-                    del self.sources[hash]
-
-                    madeRequest = self.doFetch(hash, candidates)
-                    if madeRequest:
-                        self.requests_made += 1
-
-                #Make sure exceptions wont crash this requesting loop
-                except:
-                    print_exc()
-
-                self.queue.task_done()
-
-            if madeRequest or not canRequest:
-                self.scheduletask(self.doRequest, t = self.REQUEST_INTERVAL * self.prio)
-            else:
-                self.scheduletask(self.doRequest)
-        except Queue.Empty:
-            pass
+    def can_request(self):
+        if isinstance(self.canrequest, bool):
+            return self.canrequest
+        return self.canrequest()
 
     def doFetch(self, hash, candidates):
         raise NotImplementedError()
@@ -485,7 +599,7 @@ class TorrentRequester(Requester):
     SWIFT_CANCEL = 30.0
 
     def __init__(self, remote_th, magnet_requester, session, prio):
-        Requester.__init__(self, remote_th.scheduletask, prio)
+        Requester.__init__(self, remote_th, prio)
 
         self.remote_th = remote_th
         self.magnet_requester = magnet_requester
@@ -568,7 +682,9 @@ class TorrentRequester(Requester):
             if not didMagnet:
                 if DEBUG:
                     print >>sys.stderr,"rtorrent: switching to magnet for", cdef.get_name(), bin2str(infohash)
-                self.magnet_requester.add_request(infohash, None, timeout = SWIFTFAILED_TIMEOUT)
+                # called by the libtorrent/swift callback thread, the scheduler is only used by the tqueue thread
+                magnet_lambda = lambda infohash=infohash: self.magnet_requester.add_request(infohash, None, timeout = SWIFTFAILED_TIMEOUT)
+                self.scheduletask(magnet_lambda)
             return (0,False)
 
         elif ds.get_progress() == 1:
@@ -598,7 +714,7 @@ class TorrentMessageRequester(Requester):
             # Arno, 2012-07-25: Mac has just 256 fds per process, be less aggressive
             self.REQUEST_INTERVAL = 1.0
 
-        Requester.__init__(self, remote_th.scheduletask, prio)
+        Requester.__init__(self, remote_th, prio)
         self.searchcommunity = searchcommunity
         self.requests_success = -1
 
@@ -620,7 +736,7 @@ class MagnetRequester(Requester):
             #mac has severe problems with closing connections, add additional time to allow it to close connections
             self.REQUEST_INTERVAL = 15.0
 
-        Requester.__init__(self, remote_th.scheduletask, prio)
+        Requester.__init__(self, remote_th, prio)
 
         self.remote_th = remote_th
         self.requestedInfohashes = set()
@@ -681,7 +797,7 @@ class ThumbnailRequester(Requester):
     SWIFT_CANCEL = 30.0
 
     def __init__(self, remote_th, session):
-        Requester.__init__(self, remote_th.scheduletask, 0)
+        Requester.__init__(self, remote_th, 0)
 
         self.remote_th = remote_th
         self.session = session
@@ -110,6 +110,25 @@ class HitsGroup(object):
         """
         return self.prev_group and self.hits != self.prev_group.hits
 
+class GroupingContext(object):
+    """
+    A GroupingContext holds the context state of a GroupingAlgorithm for a single
+    query, together with the (infohash, name) of the hits it has been updated with
+    and the keys computed for those hits.
+    
+    The context is threaded between the GroupsLists created for a query, also when
+    a GroupsList is never finalized (e.g., when ALG_MAGIC rejects ALG_NAME), such
+    that the context state is only updated with hits that are new to it and keys
+    are only computed once per hit.  A hit that comes back with another name is
+    new to the context state.
+    """
+    __slots__ = ['state', 'names', 'keys']
+    
+    def __init__(self, algorithm):
+        self.state = algorithm.create_context_state()
+        self.names = set() # (infohash, name)
+        self.keys = {} # infohash -> (name, key), if algorithm.CACHE_KEYS
+
 class GroupsList(object):
     """
     A GroupsList represents a list of grouped hits, i.e., a list of HitsGroups, and
@@ -124,7 +143,7 @@ class GroupsList(object):
     # Certain algorithms use a datatstructure that's hard to modify. For example,
     # the size grouping algorithm uses an IntervalTree. Adding new intervals is easy,
     # but removing is not.
-    def __init__(self, query, algorithm, hits, prev_grouplist = None, max_bundles = None, two_step=False):
+    def __init__(self, query, algorithm, hits, prev_grouplist = None, max_bundles = None, two_step=False, context = None):
         """
         Constructs a GroupsList.
         
@@ -134,15 +153,20 @@ class GroupsList(object):
         @param prev_grouplist Optionally, a previous version of this GroupsList.
         @param max_bundles The maximum number of bundles to be created. Default: None (no limit).
         @param two_step Constructs the object in two steps. Default: False. See also: finalize().
+        @param context Optionally, the GroupingContext of the query. Default: the context of 
+        prev_grouplist or, if not given, a new context.
         """
         self.query = query
         self.algorithm = algorithm
         self.prev_grouplist = prev_grouplist
         
-        if prev_grouplist is not None:
-            self.context_state = prev_grouplist.context_state
-        else:
-            self.context_state = algorithm.create_context_state()
+        if context is None:
+            if prev_grouplist is not None:
+                context = prev_grouplist.context
+            else:
+                context = GroupingContext(algorithm)
+        self.context = context
+        self.context_state = context.state
         self.index = algorithm.create_index()
         self.groups = []
         self.infohashes = set()
@@ -175,7 +199,7 @@ class GroupsList(object):
     def _compute_diff(self, hits):
         """
         Private auxiliary method to compute the differences since the previous
-        GroupsList and updates the context state.
+        GroupsList and updates the context state with the hits new to it.
         
         @param hits The hits to be grouped.
         @return A tuple containing the previous representatives, the previous index 
@@ -193,11 +217,17 @@ class GroupsList(object):
             new_hits = hits
             missing_hits = False
         
-        reuse = self.prev_grouplist and not new_hits and not missing_hits
-        self.algorithm.update_context_state(new_hits, self.context_state)
+        # The context may have been updated by GroupsLists that were never finalized,
+        # and a hit known to the previous GroupsList may have been renamed
+        context_names = self.context.names
+        context_hits = [hit for hit in hits if (hit.infohash, hit.name) not in context_names]
+        context_names.update((hit.infohash, hit.name) for hit in context_hits)
+        self.algorithm.update_context_state(context_hits, self.context_state)
+        
+        reuse = self.prev_grouplist and not new_hits and not missing_hits and not context_hits
         
         if DEBUG:
-            print >>sys.stderr, '>> Bundler.py, new hits:', len(new_hits)
+            print >>sys.stderr, '>> Bundler.py, new hits:', len(new_hits), 'new to the context state:', len(context_hits)
         
         return old_representatives, old_index, reuse
     
@@ -228,6 +258,7 @@ class GroupsList(object):
         algorithm = self.algorithm
         context_state = self.context_state
         grouped_hits = self.groups
+        keys = self.context.keys if algorithm.CACHE_KEYS else None
         
         infohashes = self.infohashes
         old_representatives = self.old_representatives
@@ -264,8 +295,16 @@ class GroupsList(object):
             for hit in hits:
                 processed_hits += 1
                 
-                key = algorithm.key(hit, context_state)
                 hit_infohash = hit.infohash
+                if keys is None:
+                    key = algorithm.key(hit, context_state)
+                else:
+                    cached = keys.get(hit_infohash)
+                    if cached is not None and cached[0] == hit.name:
+                        key = cached[1]
+                    else:
+                        key = algorithm.key(hit, context_state)
+                        keys[hit_infohash] = (hit.name, key)
                             
                 # Find or create new group
                 group = None
@@ -311,6 +350,10 @@ class GroupingAlgorithm(object):
     Grouping algorithms specify to which group a hit should be added and 
     are used by the GroupsList class in order to perform the actual grouping.
     """
+    
+    # Set to True if the key of a hit only depends on its infohash and name,
+    # in which case the GroupsList caches the keys between refreshes.
+    CACHE_KEYS = False
 
     def general_description(self):
         """
@@ -463,6 +506,8 @@ class IntGrouping(SimpleExactKeyGrouping):
     same sequence of numbers.
     """
     
+    CACHE_KEYS = True
+    
     def __init__(self):
         self.re_extract_ints = re.compile('[0-9]+',re.UNICODE)
     
@@ -519,6 +564,8 @@ class LevGrouping(GroupingAlgorithm):
     (see LevenshteinTrie and LevenshteinTrie_Cached).
     """
     
+    CACHE_KEYS = True
+    
     # Parameters:
     MAX_COST = 0.50
     MAX_LEN = 10
@@ -681,9 +728,9 @@ LOG_COSTS = False
 LOG_DEPTH = False
 class LevenshteinTrie(object):
     if LOG_COSTS:
-        __slots__ = ['root', 'MAX_LEN', 'matrix', '_costs']
+        __slots__ = ['root', 'MAX_LEN', 'matrix', 'penalties', '_costs']
     else:
-        __slots__ = ['root', 'MAX_LEN', 'matrix']
+        __slots__ = ['root', 'MAX_LEN', 'matrix', 'penalties']
     
     def __init__(self, MAX_LEN = 100):
         self.root = TrieNode()
@@ -701,6 +748,9 @@ class LevenshteinTrie(object):
             matrix.append(row)
             
         self.matrix = matrix
+        
+        # penalties[row][column] == self._dynamic_penalty(max(row, column))
+        self.penalties = [[self._dynamic_penalty(max(i, j)) for j in xrange(MAX_LEN+1)] for i in xrange(MAX_LEN+1)]
     
     def add_word(self, word):
         self.root.insert(word[:self.MAX_LEN])
@@ -732,10 +782,11 @@ class LevenshteinTrie(object):
     def do_search(self, node, letter, word, row_index, results, max_cost):
         previous_row = self.matrix[row_index - 1]
         current_row = self.matrix[row_index]
+        penalties = self.penalties[row_index]
         
         columns = len(word) + 1
         for column in xrange(1, columns):
-            penalty = self._dynamic_penalty(max(row_index, column))
+            penalty = penalties[column]
             
             insert_cost = current_row[column - 1] + penalty
             delete_cost = previous_row[column] + penalty
@@ -791,20 +842,19 @@ class LevenshteinTrie_Cached(object):
         self.new_words.add(word)
     
     def update_cache(self, new_words):
-        if self.last_max_cost is None:
+        if self.last_max_cost is None or not new_words:
             return
         
-        new_words = frozenset(new_words)
-        cache_keys = frozenset(self.cache.iterkeys())
-        processed_words = set()
+        # Extend the cached searches with the new words similar to them. These are
+        # found by searching a trie holding only the new words, instead of searching 
+        # the full trie for every new word.
+        new_trie = LevenshteinTrie(MAX_LEN=self.levtrie.MAX_LEN)
         for word in new_words:
-            if word not in processed_words:
-                similar_words = set(self.search(word, self.last_max_cost))
-                similar_new_words = new_words.intersection(similar_words) 
-                for cache_key in cache_keys.intersection(similar_words):
-                    self.cache[cache_key].extend(similar_new_words)
-                
-                processed_words.update(similar_new_words)
+            new_trie.add_word(word)
+        
+        max_cost = self.last_max_cost
+        for cache_key, similar_words in self.cache.iteritems():
+            similar_words.extend(new_trie.search(cache_key, max_cost))
     
     def search(self, word, max_cost):
         if self.last_max_cost == max_cost and self.new_words and word in self.cache:
@@ -899,7 +949,8 @@ class Bundler:
     operation is to bundle a ranked list of hits according to a chosen algorithm.
     
     A Bundler instance holds on to previously created GroupsList to speed up the 
-    creation of newer GroupsLists.
+    creation of newer GroupsLists, and to the GroupingContext of each algorithm
+    for the current query such that it is only updated with new hits.
     """
     
     GROUP_TOP_N = 2000 # None = all
@@ -930,14 +981,28 @@ class Bundler:
     def clear(self):
         self.previous_query = None
         self.previous_groups = {} # bundle_mode -> GroupsList
+        self.contexts = {} # bundle_mode -> GroupingContext
+        self.timings = {} # bundle_mode -> [number of runs, total seconds]
         self.number_of_calls = 0
     
     def _benchmark_start(self):
         self._benchmark_ts = time.time()
     
-    def _benchmark_end(self):
+    def _benchmark_end(self, bundle_mode):
+        took = time.time()-self._benchmark_ts
+        timing = self.timings.setdefault(bundle_mode, [0, 0.0])
+        timing[0] += 1
+        timing[1] += took
         if DEBUG:
-            print >>sys.stderr, '>> Bundler.py, benchmark: %ss' % (time.time()-self._benchmark_ts)
+            print >>sys.stderr, '>> Bundler.py, benchmark %s: %ss' % (Bundler.PRINTABLE_ALG_CONSTANTS[bundle_mode], took)
+    
+    def _create_groupslist(self, query, bundle_mode, hits, two_step=False):
+        grouped_hits = GroupsList(query, Bundler.algorithms[bundle_mode], hits,
+                                  self.previous_groups.get(bundle_mode, None),
+                                  Bundler.MAX_BUNDLES, two_step=two_step,
+                                  context=self.contexts.get(bundle_mode, None))
+        self.contexts[bundle_mode] = grouped_hits.context
+        return grouped_hits
     
     def bundle(self, hits, bundle_mode, searchkeywords):
         """
@@ -964,6 +1029,7 @@ class Bundler:
             query = ' '.join(searchkeywords)
             if self.previous_query != query:
                 self.previous_groups = {}
+                self.contexts = {}
                 self.previous_query = query
             
             if Bundler.GROUP_TOP_N is not None:
@@ -979,9 +1045,8 @@ class Bundler:
                 selected_bundle_mode = Bundler.ALG_NAME
                 algorithm = Bundler.algorithms[selected_bundle_mode]
                 
-                grouped_hits = GroupsList(query, algorithm, hits1,
-                                          self.previous_groups.get(selected_bundle_mode, None),
-                                          Bundler.MAX_BUNDLES, two_step=True)
+                self._benchmark_start()
+                grouped_hits = self._create_groupslist(query, selected_bundle_mode, hits1, two_step=True)
                 
                 levtrie_root = grouped_hits.context_state.levtrie.root
                 levtrie_width = levtrie_root.width(level=Bundler.LEVTRIE_DEPTH)
@@ -992,9 +1057,12 @@ class Bundler:
                 
                 if levtrie_width >= Bundler.MIN_LEVTRIE_WIDTH:
                     grouped_hits.finalize()
+                    self._benchmark_end(selected_bundle_mode)
                     self.previous_groups[selected_bundle_mode] = grouped_hits
                     bundled_hits = self._convert_groupslist(grouped_hits, algorithm, hits2)
                     success = True
+                else:
+                    self._benchmark_end(selected_bundle_mode)
                     
                 # try ALG_SIZE
                 if not success:
@@ -1030,10 +1098,8 @@ class Bundler:
                 algorithm = Bundler.algorithms[bundle_mode]
                 
                 self._benchmark_start()
-                grouped_hits = GroupsList(query, algorithm, hits1,
-                                          self.previous_groups.get(bundle_mode, None),
-                                          Bundler.MAX_BUNDLES)
-                self._benchmark_end()
+                grouped_hits = self._create_groupslist(query, bundle_mode, hits1)
+                self._benchmark_end(bundle_mode)
             
                 self.previous_groups[bundle_mode] = grouped_hits
                 bundled_hits = self._convert_groupslist(grouped_hits, algorithm, hits2)
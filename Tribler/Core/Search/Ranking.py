@@ -0,0 +1,167 @@
+# Written by Niels Zeilemaker
+# see LICENSE.txt for license information
+
+import sys
+from math import sqrt
+from itertools import izip
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DEBUG = False
+
+# Features of a hit used for ranking and their weight in the score
+FEATURES = ('num_seeders', 'neg_votes', 'subscriptions')
+WEIGHTS = (0.8, -0.1, 0.1)
+
+# Sums of squares below this fraction of the largest sum of squares seen are
+# rounding errors left by removing values, i.e. the remaining values are equal
+EPSILON = 1e-9
+# Relative difference below which a normalisation is considered unchanged, as
+# removing and adding the same values does not always give the same floats
+TOLERANCE = 1e-9
+
+class RunningStat:
+    """ Mean and sample variance of a stream of values, updated per value using
+    Welford's algorithm.  Values can be removed again in the same way. """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.peak = 0.0
+
+    def add(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+        self.peak = max(self.peak, self.m2)
+
+    def remove(self, value):
+        if self.n <= 1:
+            self.__init__()
+            return
+
+        delta = value - self.mean
+        self.n -= 1
+        self.mean -= delta / self.n
+        self.m2 -= delta * (value - self.mean)
+
+    def stddev(self):
+        if self.n > 1 and self.m2 > EPSILON * self.peak:
+            return sqrt(self.m2 / (self.n - 1))
+        return 0.0
+
+class HitRanker:
+    """
+    Scores search hits on FEATURES, each normalised to zero mean and unit
+    variance over all hits, and stores the score in the last element of their
+    relevance_score.
+
+    The mean and variance of the features are updated as hits are added or
+    change, instead of being computed from all hits for every score.  When the
+    normalisation did not change since the previous call to score, only the hits
+    that were added or changed get a new score.  The scores are computed with
+    NumPy when it is available.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.stats = [RunningStat() for _ in FEATURES]
+        self.rows = {}      # infohash: row in hits and values
+        self.hits = []
+        self.values = numpy.zeros((0, len(FEATURES))) if numpy else []
+        self.dirty = set()  # rows that need a new score
+        self.normalisation = None
+
+    def get_features(self, hit):
+        return tuple(hit.get(key, 0) or 0 for key in FEATURES)
+
+    def update(self, hits):
+        """ Adds hits, or reads the features of hits added before again.  A hit
+        replaces an earlier hit with the same infohash. """
+        for hit in hits:
+            features = self.get_features(hit)
+            row = self.rows.get(hit.infohash)
+            if row is None:
+                row = self.rows[hit.infohash] = len(self.hits)
+                self.hits.append(hit)
+                if numpy:
+                    if row == len(self.values):
+                        self.values.resize((max(64, 2 * row), len(FEATURES)), refcheck = False)
+                else:
+                    self.values.append(None)
+
+            else:
+                old = tuple(self.values[row])
+                if old == features and self.hits[row] is hit:
+                    continue
+
+                self.hits[row] = hit
+                for stat, value in izip(self.stats, old):
+                    stat.remove(value)
+
+            for stat, value in izip(self.stats, features):
+                stat.add(value)
+            self.values[row] = features
+            self.dirty.add(row)
+
+    def get_normalisation(self):
+        """ Returns a (weight / stddev, mean) pair per feature, features without variance get weight 0 """
+        normalisation = []
+        for stat, weight in izip(self.stats, WEIGHTS):
+            stddev = stat.stddev()
+            if stddev > 0:
+                normalisation.append((weight / stddev, stat.mean))
+            else:
+                normalisation.append((0.0, 0.0))
+        return normalisation
+
+    def changed(self, normalisation):
+        if self.normalisation is None:
+            return True
+        for new, old in izip(normalisation, self.normalisation):
+            for a, b in izip(new, old):
+                if abs(a - b) > TOLERANCE * max(abs(a), abs(b)):
+                    return True
+        return False
+
+    def score(self):
+        """ Scores the hits that need it, returns the number of hits scored """
+        normalisation = self.get_normalisation()
+        if self.changed(normalisation):
+            rows = range(len(self.hits))
+            self.normalisation = normalisation
+        else:
+            # Score with the normalisation of the other hits
+            normalisation = self.normalisation
+            rows = sorted(self.dirty)
+        self.dirty = set()
+
+        if not rows:
+            return 0
+
+        if numpy:
+            weights = numpy.array([weight for weight, _ in normalisation])
+            means = numpy.array([mean for _, mean in normalisation])
+            if len(rows) == len(self.hits):
+                values = self.values[:len(rows)]
+            else:
+                values = self.values[rows]
+            scores = numpy.dot(values - means, weights).tolist()
+
+        else:
+            scores = [sum(weight * (value - mean) for value, (weight, mean) in izip(self.values[row], normalisation)) for row in rows]
+
+        hits = self.hits
+        for row, score in izip(rows, scores):
+            hits[row].relevance_score[-1] = score
+
+        if DEBUG:
+            print >> sys.stderr, "HitRanker: scored %d of %d hits" % (len(rows), len(hits))
+        return len(rows)
@@ -8,6 +8,8 @@ import binascii
 import urllib
 import json
 import binascii
+import socket
+from struct import Struct
 from threading import RLock
 from traceback import print_exc,print_stack
 
@@ -23,6 +25,15 @@ DONE_STATE_WORKING = 0
 DONE_STATE_EARLY_SHUTDOWN = 1
 DONE_STATE_SHUTDOWN = 2
 
+# Ask swift to use binary frames on the CMDGW connection, see FastI2I
+BINARY_CMDGW = False
+
+# Binary frames, both directions
+FRAME_TUNNEL = 1                # TUNNEL_HEADER, session, data
+FRAME_INFO = 2                  # INFO_RECORD for every download
+TUNNEL_HEADER = Struct("!4sHB") # ip, port, length of session
+INFO_RECORD = Struct("!20sBQQffIIQQ") # roothash, dlstatus, dl, total, dlspeed, ulspeed, numleech, numseeds, contentdl, contentul
+
 class SwiftProcess:
     """ Representation of an operating-system process running the C++ swift engine.
     A swift engine can participate in one or more swarms."""
@@ -105,7 +116,11 @@ class SwiftProcess:
         # Called by any thread, assume sessionlock is held
         
         if self.is_alive():
-            self.fastconn = FastI2IConnection(self.cmdport,self.i2ithread_readlinecallback,self.connection_lost)
+            if BINARY_CMDGW:
+                framecallback = self.i2ithread_framecallback
+            else:
+                framecallback = None
+            self.fastconn = FastI2IConnection(self.cmdport,self.i2ithread_readlinecallback,self.connection_lost,framecallback)
         else:
             print >>sys.stderr,"sp: start_cmd_connection: Process dead? returncode",self.popen.returncode,"pid",self.popen.pid
           
@@ -130,8 +145,7 @@ class SwiftProcess:
             if len(ic.buffer) < length:
                 return length - len(ic.buffer)
 
-            data = ic.buffer[:length]
-            ic.buffer = ic.buffer[length:]
+            data = ic.buffer.read(length)
 
             self.roothash2dl["dispersy"].i2ithread_data_came_in(session, (host, port), data)
 
@@ -187,6 +201,42 @@ class SwiftProcess:
                 d.i2ithread_info_callback(DLSTATUS_STOPPED_ON_ERROR,0.0,0,0.0,0.0,0,0,0,0)
 
 
+    def i2ithread_framecallback(self,ic,frametype,payload):
+        if self.donestate != DONE_STATE_WORKING:
+            return
+
+        if frametype == FRAME_TUNNEL:
+            ip, port, sessionlen = TUNNEL_HEADER.unpack_from(payload)
+            session = payload[TUNNEL_HEADER.size:TUNNEL_HEADER.size+sessionlen]
+            data = payload[TUNNEL_HEADER.size+sessionlen:]
+
+            self.roothash2dl["dispersy"].i2ithread_data_came_in(session, (socket.inet_ntoa(ip), port), data)
+
+        elif frametype == FRAME_INFO:
+            # one frame containing the status of all downloads
+            self.splock.acquire()
+            try:
+                roothash2dl = self.roothash2dl.copy()
+            finally:
+                self.splock.release()
+
+            for offset in xrange(0, len(payload), INFO_RECORD.size):
+                roothash,dlstatus,dl,dynasize,dlspeed,ulspeed,numleech,numseeds,contentdl,contentul = INFO_RECORD.unpack_from(payload, offset)
+                d = roothash2dl.get(roothash)
+                if d is None:
+                    if DEBUG:
+                        print >>sys.stderr,"sp: i2ithread_framecallback: unknown roothash",roothash.encode("HEX")
+                    continue
+
+                if dynasize == 0:
+                    progress = 0.0
+                else:
+                    progress = float(dl)/float(dynasize)
+                d.i2ithread_info_callback(dlstatus,progress,dynasize,dlspeed,ulspeed,numleech,numseeds,contentdl,contentul)
+
+        elif DEBUG:
+            print >>sys.stderr,"sp: i2ithread_framecallback: unknown frame",frametype
+
     #
     # Swift Mgmt interface
     #
@@ -359,6 +409,7 @@ class SwiftProcess:
                 print_exc()
         
         if self.fastconn:
+            self.fastconn.cancel_negotiation()
             self.fastconn.stop()
     
     #
@@ -408,8 +459,9 @@ class SwiftProcess:
         if DEBUG:
             print >>sys.stderr,"sp: send_tunnel:",len(data),"bytes -> %s:%d" % address
 
-        self.write("TUNNELSEND %s:%d/%s %d\r\n" % (address[0], address[1], session.encode("HEX"), len(data)))
-        self.write(data)
+        header = TUNNEL_HEADER.pack(socket.inet_aton(address[0]), address[1], len(session)) + session
+        fallback = ("TUNNELSEND %s:%d/%s %d\r\n" % (address[0], address[1], session.encode("HEX"), len(data)), data)
+        self.fastconn.write_frame(FRAME_TUNNEL, (header, data), fallback)
 
     def send_setmoreinfo(self,roothash_hex,enable):
         # assume splock is held to avoid concurrency on socket
@@ -428,8 +480,8 @@ class SwiftProcess:
             return self.popen.returncode is None
         return False
 
-    def write(self,msg):
-        self.fastconn.write(msg)
+    def write(self,*msg):
+        self.fastconn.write(*msg)
         
     def get_cmdport(self):
         return self.cmdport
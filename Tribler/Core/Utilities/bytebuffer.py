@@ -0,0 +1,99 @@
+# Written by Niels Zeilemaker
+# see LICENSE.txt for license information
+#
+# Buffers which avoid copying the pending data when it is only partially
+# sent or consumed.  Consumption is done by advancing an offset instead of
+# slicing off the consumed part.
+
+from collections import deque
+
+COALESCE_SIZE = 64 * 1024   # pending chunks smaller than this are joined into one send
+
+class WriteBuffer:
+    """
+    Queue of chunks waiting to be sent.  Large chunks are sent from a
+    memoryview at the current offset, small chunks are gathered into a single
+    send, which is the closest we can get to sendmsg in python 2.
+    """
+    def __init__(self):
+        self.chunks = deque()
+        self.offset = 0     # number of bytes of chunks[0] already sent
+        self.size = 0
+
+    def append(self, data):
+        if data:
+            self.chunks.append(data)
+            self.size += len(data)
+
+    def peek(self):
+        """ Returns the data to pass to the next send call """
+        first = self.chunks[0]
+        if len(first) - self.offset >= COALESCE_SIZE or len(self.chunks) == 1:
+            if self.offset:
+                return memoryview(first)[self.offset:]
+            return first
+
+        gathered = bytearray(memoryview(first)[self.offset:])
+        for i in xrange(1, len(self.chunks)):
+            if len(gathered) >= COALESCE_SIZE:
+                break
+            gathered.extend(self.chunks[i])
+        return gathered
+
+    def consume(self, amount):
+        """ Removes the first amount bytes, i.e. the bytes that were sent """
+        self.size -= amount
+        amount += self.offset
+        while self.chunks and amount >= len(self.chunks[0]):
+            amount -= len(self.chunks.popleft())
+        self.offset = amount
+
+    def clear(self):
+        self.chunks.clear()
+        self.offset = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+class ReadBuffer:
+    """
+    Buffer for received data which is parsed incrementally.  The consumed data
+    is only removed when new data is added and more than half of the buffer
+    was consumed.
+    """
+    def __init__(self):
+        self.data = bytearray()
+        self.offset = 0     # number of bytes of data already consumed
+
+    def feed(self, data):
+        if self.offset and self.offset * 2 >= len(self.data):
+            del self.data[:self.offset]
+            self.offset = 0
+        self.data.extend(data)
+
+    def find(self, sub):
+        """ Returns the position of sub relative to the unconsumed data, or -1 """
+        pos = self.data.find(sub, self.offset)
+        if pos == -1:
+            return -1
+        return pos - self.offset
+
+    def peek(self, length):
+        return str(self.data[self.offset:self.offset + length])
+
+    def read(self, length):
+        data = self.peek(length)
+        self.offset += len(data)
+        return data
+
+    def skip(self, length):
+        self.offset += min(length, len(self))
+
+    def unread(self, length):
+        """ Makes the last length bytes available again, only valid if feed was not called since reading them """
+        assert length <= self.offset
+        self.offset -= length
+
+    def __len__(self):
+        return len(self.data) - self.offset
@@ -29,10 +29,10 @@ from Tribler.Core.Session import Session
 from Tribler.Video.VideoPlayer import VideoPlayer
 from Tribler.Core.DecentralizedTracking.MagnetLink import MagnetLink
 
-from math import sqrt
 from __init__ import *
 from Tribler.community.allchannel.community import AllChannelCommunity
 from Tribler.Core.Search.Bundler import Bundler
+from Tribler.Core.Search.Ranking import HitRanker
 from Tribler.Main.Utility.GuiDBTuples import Torrent, ChannelTorrent, CollectedTorrent, RemoteTorrent, getValidArgs, NotCollectedTorrent, LibraryTorrent,\
     Comment, Modification, Channel, RemoteChannel, Playlist, Moderation,\
     RemoteChannelTorrent, Marking
@@ -65,6 +65,7 @@ class TorrentManager:
 
         # Contains all matches for keywords in DB, not filtered by category
         self.hits = []
+        self.hitsIndex = {}  # infohash: hit, for all hits in self.hits
         self.hitsLock = threading.Lock()
 
         # Remote results for current keywords
@@ -81,6 +82,7 @@ class TorrentManager:
 
         self.searchkeywords = []
         self.rerankingStrategy = DefaultTorrentReranker()
+        self.ranker = HitRanker()
         self.oldsearchkeywords = None
 
         self.filteredResults = 0
@@ -465,7 +467,8 @@ class TorrentManager:
 
         to_be_prefetched = {}
 
-        for i, hit in enumerate(self.hits):
+        torrentchecking = TorrentChecking.getInstance()
+        for i, hit in enumerate(self.hits[:hit_counter_limit[1]]):
             torrent_filename = self.getCollectedFilename(hit, retried = True)
             if not torrent_filename:
                 #this .torrent is not collected, decide if we want to collect it, or only collect torrentmessage
@@ -481,12 +484,10 @@ class TorrentManager:
                                 to_be_prefetched[candidate] = set()
                             to_be_prefetched[candidate].add(hit)
                         prefetch_counter[1] += 1
-                else:
-                    break
 
             else:
-                #schedule health check
-                TorrentChecking.getInstance().addTorrentToQueue(hit)
+                #schedule health check, continue after the prefetch limits are reached such that all collected hits on top are checked
+                torrentchecking.addTorrentToQueue(hit)
 
         for candidate, torrents in to_be_prefetched.iteritems():
             self.downloadTorrentmessagesFromPeer(candidate, torrents, sesscb_prefetch_done, prio = 1)
@@ -508,6 +509,8 @@ class TorrentManager:
                 self.filteredResults = 0
 
                 self.hits = []
+                self.hitsIndex = {}
+                self.ranker.clear()
                 self.remoteHits = []
                 self.gotRemoteHits = False
                 self.oldsearchkeywords = None
@@ -572,57 +575,62 @@ class TorrentManager:
 
             results = map(create_torrent, results)
         self.hits = results
+        self.hitsIndex = dict((hit.infohash, hit) for hit in results)
+        self.ranker.clear()
+        self.ranker.update(results)
 
         if DEBUG:
             print >> sys.stderr, 'TorrentSearchGridManager: _doSearchLocalDatabase took: %s of which tuple creation took %s'%(time() - begintime, time() - begintuples)
         return True
 
     def addStoredRemoteResults(self):
-        """ Called by GetHitsInCategory() to add remote results to self.hits """
+        """ Called by GetHitsInCategory() to add remote results to self.hits.
+        Returns the list of hits appended to self.hits and the set of infohashes
+        of the hits that were modified. """
         if DEBUG:
             begintime = time()
         try:
             self.remoteLock.acquire()
 
-            hitsUpdated = False
+            hitsAdded = []
             hitsModified = set()
+            hitsReplaced = set()
             for remoteItem in self.remoteHits:
                 known = False
 
-                for item in self.hits:
-                    if item.infohash == remoteItem.infohash:
-                        if item.query_candidates == None:
-                            item.query_candidates = set()
-                        item.query_candidates.update(remoteItem.query_candidates)
-
-                        if item.swift_hash == None:
-                            item.swift_hash = remoteItem.swift_hash
-                            hitsModified.add(item.infohash)
+                item = self.hitsIndex.get(remoteItem.infohash)
+                if item is not None:
+                    if item.query_candidates == None:
+                        item.query_candidates = set()
+                    item.query_candidates.update(remoteItem.query_candidates)
 
-                        if item.swift_torrent_hash == None:
-                            item.swift_torrent_hash = remoteItem.swift_torrent_hash
-                            hitsModified.add(item.infohash)
+                    if item.swift_hash == None:
+                        item.swift_hash = remoteItem.swift_hash
+                        hitsModified.add(item.infohash)
 
-                        if remoteItem.hasChannel():
-                            if isinstance(item, RemoteTorrent):
-                                self.hits.remove(item) #Replace this item with a new result with a channel
-                                break
+                    if item.swift_torrent_hash == None:
+                        item.swift_torrent_hash = remoteItem.swift_torrent_hash
+                        hitsModified.add(item.infohash)
 
-                            #Maybe update channel?
-                            if isinstance(item, RemoteChannelTorrent):
-                                this_rating = remoteItem.channel.nr_favorites - remoteItem.channel.nr_spam
+                    known = True
+                    if remoteItem.hasChannel():
+                        if isinstance(item, RemoteTorrent):
+                            #Replace this item with a new result with a channel
+                            hitsReplaced.add(id(item))
+                            known = False
 
-                                if item.hasChannel():
-                                    current_rating = item.channel.nr_favorites - item.channel.nr_spam
-                                else:
-                                    current_rating = this_rating - 1
+                        #Maybe update channel?
+                        elif isinstance(item, RemoteChannelTorrent):
+                            this_rating = remoteItem.channel.nr_favorites - remoteItem.channel.nr_spam
 
-                                if this_rating > current_rating:
-                                    item.updateChannel(remoteItem.channel)
-                                    hitsModified.add(item.infohash)
+                            if item.hasChannel():
+                                current_rating = item.channel.nr_favorites - item.channel.nr_spam
+                            else:
+                                current_rating = this_rating - 1
 
-                        known = True
-                        break
+                            if this_rating > current_rating:
+                                item.updateChannel(remoteItem.channel)
+                                hitsModified.add(item.infohash)
 
                 if not known:
                     #Niels 26-10-2012: override category if name is xxx
@@ -633,11 +641,21 @@ class TorrentManager:
                                 print >> sys.stderr, 'TorrentSearchGridManager:', remoteItem.name, "is xxx"
                             remoteItem.category_id = self.xxx_category
 
-                    self.hits.append(remoteItem)
-                    hitsUpdated = True
+                    self.hitsIndex[remoteItem.infohash] = remoteItem
+                    hitsAdded.append(remoteItem)
+
+            # Remove the replaced items in a single pass, the replacements are appended after the other hits
+            if hitsReplaced:
+                self.hits = [hit for hit in self.hits if id(hit) not in hitsReplaced]
+                hitsAdded = [hit for hit in hitsAdded if id(hit) not in hitsReplaced]
+            self.hits.extend(hitsAdded)
+
+            self.ranker.update(hitsAdded)
+            if hitsModified:
+                self.ranker.update(self.hitsIndex[infohash] for infohash in hitsModified)
 
             self.remoteHits = []
-            return hitsUpdated, hitsModified
+            return hitsAdded, hitsModified
         except:
             raise
 
@@ -720,67 +738,23 @@ class TorrentManager:
     #Rameez: The following code will call normalization functions and then
     #sort and merge the torrent results
     def rameezSort(self):
-        norm_num_seeders = self.doStatNormalization(self.hits, 'num_seeders')
-        norm_neg_votes = self.doStatNormalization(self.hits, 'neg_votes')
-        norm_subscriptions = self.doStatNormalization(self.hits, 'subscriptions')
-
-        def score_cmp(a,b):
-            info_a = a.infohash
-            info_b = b.infohash
-
-            # normScores can be small, so multiply
-            score_a = 0.8*norm_num_seeders[info_a] - 0.1 * norm_neg_votes[info_a] + 0.1 * norm_subscriptions[info_a]
-            score_b = 0.8*norm_num_seeders[info_b] - 0.1 * norm_neg_votes[info_b] + 0.1 * norm_subscriptions[info_b]
-
-            return cmp(score_a, score_b)
-
-        self.hits.sort(cmp, reverse = True)
+        self.rankHits()
+        self.hits.sort(key=lambda hit:hit.relevance_score[-1], reverse = True)
 
     def fulltextSort(self):
-        norm_num_seeders = self.doStatNormalization(self.hits, 'num_seeders')
-        norm_neg_votes = self.doStatNormalization(self.hits, 'neg_votes')
-        norm_subscriptions = self.doStatNormalization(self.hits, 'subscriptions')
-
-        for hit in self.hits:
-            score = 0.8*norm_num_seeders[hit.infohash] - 0.1 * norm_neg_votes[hit.infohash] + 0.1 * norm_subscriptions[hit.infohash]
-            hit.relevance_score[-1] = score
-
+        self.rankHits()
         self.hits.sort(key=lambda hit:hit.relevance_score, reverse = True)
 
-    def doStatNormalization(self, hits, normKey):
-        '''Center the variance on zero (this means mean == 0) and divide
-        all values by the standard deviation. This is sometimes called scaling.
-        This is done on the field normKey of hits.'''
-
-        tot = 0
-        for hit in hits:
-            tot += (hit.get(normKey, 0) or 0)
-
-        if len(hits) > 0:
-            mean = tot/len(hits)
-        else:
-            mean = 0
-
-        sum = 0
-        for hit in hits:
-            temp = (hit.get(normKey, 0) or 0) - mean
-            temp = temp * temp
-            sum += temp
-
-        if len(hits) > 1:
-            dev = sum /(len(hits)-1)
-        else:
-            dev = 0
+    def rankHits(self):
+        """ Sets the last element of the relevance_score of the hits to the
+        weighted sum of their normalised num_seeders, neg_votes and subscriptions """
+        if DEBUG:
+            begintime = time()
 
-        stdDev = sqrt(dev)
+        nr_scored = self.ranker.score()
 
-        return_dict = {}
-        for hit in hits:
-            if stdDev > 0:
-                return_dict[hit.infohash] = ((hit.get(normKey, 0) or 0) - mean)/ stdDev
-            else:
-                return_dict[hit.infohash] = 0
-        return return_dict
+        if DEBUG:
+            print >> sys.stderr, 'TorrentSearchGridManager: rankHits: scoring %d of %d hits took %s' % (nr_scored, len(self.hits), time() - begintime)
 
 class LibraryManager:
     # Code to make this a singleton
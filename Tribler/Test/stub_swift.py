@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# Written by Niels Zeilemaker
+# see LICENSE.txt for license information
+#
+# Stub of the swift process, only implementing the parts of the CMDGW
+# interface used by test_swift_cmdgw.py: TUNNELSEND is echoed as TUNNELRECV,
+# START is answered with INFO for all started downloads, and SHUTDOWN exits.
+# Set STUB_SWIFT_TEXT_ONLY to refuse the binary protocol like older swifts.
+
+import os
+import sys
+import socket
+import binascii
+from struct import Struct
+
+FRAME_HEADER = Struct("!BI")
+FRAME_TEXT = 0
+FRAME_TUNNEL = 1
+FRAME_INFO = 2
+TUNNEL_HEADER = Struct("!4sHB")
+INFO_RECORD = Struct("!20sBQQffIIQQ")
+
+class StubSwift:
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = ''
+        self.binary = False
+        self.roothashes = []
+
+    def run(self):
+        while True:
+            data = self.sock.recv(65536)
+            if not data:
+                return True
+
+            self.buffer += data
+            while True:
+                if self.binary:
+                    if len(self.buffer) < FRAME_HEADER.size:
+                        break
+                    frametype, length = FRAME_HEADER.unpack_from(self.buffer)
+                    if len(self.buffer) < FRAME_HEADER.size + length:
+                        break
+                    payload = self.buffer[FRAME_HEADER.size:FRAME_HEADER.size + length]
+                    self.buffer = self.buffer[FRAME_HEADER.size + length:]
+
+                    if frametype == FRAME_TUNNEL:
+                        self.sock.sendall(FRAME_HEADER.pack(FRAME_TUNNEL, len(payload)) + payload)
+                    elif not self.handle_command(payload):
+                        return False
+
+                else:
+                    cmd, separator, rest = self.buffer.partition("\r\n")
+                    if not separator:
+                        break
+
+                    if cmd.startswith("TUNNELSEND"):
+                        length = int(cmd.split()[2])
+                        if len(rest) < length:
+                            break
+                        self.sock.sendall("TUNNELRECV" + cmd[len("TUNNELSEND"):] + "\r\n" + rest[:length])
+                        self.buffer = rest[length:]
+                        continue
+
+                    self.buffer = rest
+                    if not self.handle_command(cmd):
+                        return False
+
+    def handle_command(self, cmd):
+        words = cmd.split()
+        if words[0] == "PROTOCOL":
+            if os.environ.get("STUB_SWIFT_TEXT_ONLY"):
+                self.sock.sendall("ERROR unknown command\r\n")
+            else:
+                self.sock.sendall("PROTOCOL BINARY\r\n")
+                self.binary = True
+
+        elif words[0] == "START":
+            self.roothashes.append(binascii.unhexlify(words[1].split("/")[-1]))
+            if self.binary:
+                records = [INFO_RECORD.pack(roothash, 4, 50, 100, 1.0, 2.0, 3, 4, 5, 6) for roothash in self.roothashes]
+                payload = "".join(records)
+                self.sock.sendall(FRAME_HEADER.pack(FRAME_INFO, len(payload)) + payload)
+            else:
+                for roothash in self.roothashes:
+                    self.sock.sendall("INFO %s 4 50/100 1.0 2.0 3 4 5 6\r\n" % binascii.hexlify(roothash))
+
+        elif words[0] == "SHUTDOWN":
+            return False
+        return True
+
+def main():
+    port = int(sys.argv[sys.argv.index("-c") + 1].split(":")[1])
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("127.0.0.1", port))
+    server.listen(1)
+
+    # serve one connection at a time until told to shutdown
+    while True:
+        sock, _ = server.accept()
+        if not StubSwift(sock).run():
+            break
+        sock.close()
+
+if __name__ == "__main__":
+    main()
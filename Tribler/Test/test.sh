@@ -12,7 +12,12 @@ export PYTHONPATH=../..:"$PYTHONPATH"
 python test_TimedTaskQueue.py
 python test_bartercast.py
 python test_buddycast2_datahandler.py
+python test_bundler.py
+python test_bytebuffer.py
+python test_fasti2i.py
 python test_cachingstream.py
+python test_channelcast_sample.py
+python test_channel_modifications.py
 python test_closedswarm.py
 python test_connect_overlay.py singtest_connect_overlay
 python test_crawler.py
@@ -27,11 +32,27 @@ python test_osutils.py
 python test_permid.py
 python test_permid_response1.py
 python test_remote_query.py
+python test_request_scheduler.py
+python test_rawserver_poll.py
+python test_ranking.py
+python test_search_hits.py
+python test_search_response_cache.py
 python test_seeding_stats.py
 python test_social_overlap.py
 python test_sqlitecachedb.py
+python test_sqlitecachedb_readpool.py
+python test_sqlitecachedb_groupcommit.py
 python test_status.py
 python test_superpeers.py 
+python test_swift_cmdgw.py
+python test_vod_controller.py
+python test_libtorrent_alerts.py
+python test_preference_index.py
+python test_batchcrypto.py
+python test_torrent_checking.py
+python test_torrent_search.py
+python test_tracker_health.py
+python test_tracker_scraper.py
 python test_url.py
 python test_url_metadata.py
 python test_ut_pex.py
@@ -1,7 +1,12 @@
 import unittest
 from time import sleep
+from threading import Event
+from functools import partial
 
-from Tribler.Utilities.TimedTaskQueue import TimedTaskQueue
+from Tribler.Utilities.TimedTaskQueue import TimedTaskQueue, HISTOGRAM_BUCKETS
+
+NR_PENDING = 10000
+NR_OPERATIONS = 250
 
 class TestTimedTaskQueue(unittest.TestCase):
 
@@ -65,6 +70,95 @@ class TestTimedTaskQueue(unittest.TestCase):
         assert self.count == 3
         self.count = 4
 
+    def test_removeTask(self):
+        self.queue = TimedTaskQueue()
+        self.count = 0
+        self.queue.add_task(self.task0a, 1, id = 'a')
+        self.queue.add_task(self.task0b, 1, id = 'b')
+        self.queue.add_task(self.task0a, 1, id = 'b')
+        self.queue.remove_task('a')
+        assert not self.queue.does_task_exist('a')
+        assert self.queue.does_task_exist('b')
+        assert self.queue.get_nr_tasks() == 1
+        sleep(2)
+        assert self.count == 1
+        assert not self.queue.does_task_exist('b')
+        assert self.queue.get_nr_tasks() == 0
+        del self.queue
+
+    def test_stats(self):
+        self.queue = TimedTaskQueue()
+        self.count = 0
+        self.queue.add_task(self.task0a, 0)
+        self.queue.add_task(self.task0b, 0)
+        self.queue.add_task(self.task_sleep, 0)
+        sleep(1)
+
+        stats = self.queue.get_stats()
+        assert stats['task0a'][0] == 1
+        assert stats['task_sleep'][0] == 1
+        assert sum(stats['task_sleep'][1]) == 1
+        assert stats['task_sleep'][2][HISTOGRAM_BUCKETS.index(1.0)] == 1
+        del self.queue
+
+    def test_stats_names(self):
+        # tasks without a stable __name__ should not create a key per task
+        class Task:
+            def __call__(self):
+                pass
+
+        self.queue = TimedTaskQueue()
+        for i in xrange(10):
+            self.queue.add_task(lambda: None, 0)
+            self.queue.add_task(partial(self.task_sleep_for, 0), 0)
+            self.queue.add_task(Task(), 0)
+        sleep(1)
+
+        stats = self.queue.get_stats()
+        self.assertEqual(sorted(stats.keys()), ['<lambda>', 'Task', 'task_sleep_for'])
+        assert all(nr_tasks == 10 for nr_tasks, _, _ in stats.itervalues())
+        del self.queue
+
+    def test_stats_exception(self):
+        self.queue = TimedTaskQueue()
+        self.queue.add_task(self.task_raise, 0)
+        sleep(1)
+
+        stats = self.queue.get_stats()
+        assert stats['task_raise'][0] == 1
+        del self.queue
+
+    def task_raise(self):
+        raise RuntimeError("task_raise")
+
+    def task_sleep_for(self, t):
+        sleep(t)
+
+    def task_sleep(self):
+        sleep(0.2)
+
+    def test_benchmark(self):
+        self.queue = TimedTaskQueue()
+        done = Event()
+
+        for i in xrange(NR_PENDING):
+            self.queue.add_task(done.set, 3600 + i % 100)
+
+        for i in xrange(NR_OPERATIONS):
+            self.queue.add_task(done.set, 3600, id = i)
+            self.queue.add_task(done.set, 3600, id = i)
+        for i in xrange(NR_OPERATIONS):
+            assert self.queue.does_task_exist(i)
+            self.queue.remove_task(i)
+            assert not self.queue.does_task_exist(i)
+        assert self.queue.get_nr_tasks() == NR_PENDING
+
+        # a task due now is executed while 10k tasks are pending
+        self.queue.add_task(done.set)
+        assert done.wait(5)
+        self.queue.shutdown()
+        del self.queue
+
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(TestTimedTaskQueue))
@@ -0,0 +1,85 @@
+# see LICENSE.txt for license information
+
+import unittest
+from random import randint
+from multiprocessing import Pool
+
+from Crypto.Util.number import bytes_to_long, long_to_bytes
+
+from Tribler.community.privatesearch.rsa import rsa_init, rsa_encrypt, rsa_decrypt, rsa_compatible
+from Tribler.community.privatesearch.pallier import pallier_init, pallier_encrypt, pallier_decrypt
+from Tribler.community.privatesearch.batchcrypto import rsa_encrypt_list, rsa_decrypt_list, pallier_encrypt_list, pallier_decrypt_list, \
+    PallierBlindingPool, PROCESS_THRESHOLD
+
+class TestBatchCrypto(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.key = rsa_init(1024)
+        cls.pkey = pallier_init(cls.key)
+        cls.pool = Pool(2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.terminate()
+
+    def test_rsa(self):
+        elements = [randint(0, i * 1000) for i in xrange(PROCESS_THRESHOLD * 2)]
+        ciphers = rsa_encrypt_list(self.key, elements)
+        assert ciphers == [rsa_encrypt(self.key, element) for element in elements]
+        assert rsa_encrypt_list(self.key, elements, self.pool) == ciphers
+
+        # decrypting uses the factorisation of our own key
+        assert rsa_decrypt_list(self.key, ciphers) == elements
+        assert rsa_decrypt_list(self.key, ciphers, self.pool) == elements
+        assert rsa_decrypt_list(self.key, ciphers[:10]) == [rsa_decrypt(self.key, cipher) for cipher in ciphers[:10]]
+
+        # short lists are not sent to the process pool
+        assert rsa_decrypt_list(self.key, ciphers[:10], self.pool) == elements[:10]
+
+    def test_rsa_compatible(self):
+        elements = [randint(0, 1000000) for _ in xrange(20)]
+        ciphers = rsa_encrypt_list(self.key, elements)
+
+        comp_key = rsa_compatible(self.key.n, self.key.n / 2)
+        twiceencrypted = rsa_encrypt_list(comp_key, ciphers)
+        assert rsa_decrypt_list(self.key, twiceencrypted) == rsa_encrypt_list(comp_key, elements)
+
+        fakeinfohash = '296069              '
+        assert long_to_bytes(rsa_decrypt_list(self.key, rsa_encrypt_list(self.key, [bytes_to_long(fakeinfohash)]))[0]) == fakeinfohash
+
+    def test_pallier(self):
+        vector = [randint(0, 1) for _ in xrange(PROCESS_THRESHOLD * 2)]
+        ciphers = pallier_encrypt_list(self.pkey, vector)
+        assert [pallier_decrypt(self.pkey, cipher) for cipher in ciphers] == vector
+        assert pallier_decrypt_list(self.pkey, ciphers) == vector
+        assert pallier_decrypt_list(self.pkey, ciphers, self.pool) == vector
+        assert pallier_decrypt_list(self.pkey, [pallier_encrypt(self.pkey, element) for element in vector[:10]]) == vector[:10]
+
+    def test_blinding_pool(self):
+        blinding_pool = PallierBlindingPool(self.pkey, 10)
+        blinding_pool.start()
+        try:
+            vector = [randint(0, 1) for _ in xrange(25)]
+            ciphers = pallier_encrypt_list(self.pkey, vector, blinding_pool)
+            assert pallier_decrypt_list(self.pkey, ciphers) == vector
+
+            # factors are never handed out twice
+            assert len(set(ciphers)) == len(ciphers)
+            assert blinding_pool.hits + blinding_pool.misses == len(vector)
+        finally:
+            blinding_pool.shutdown()
+
+        blinding_pool.join(10)
+        assert not blinding_pool.isAlive()
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestBatchCrypto))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# Written by Raynor Vliegendhart
+# see LICENSE.txt for license information
+
+import unittest
+import random
+
+from Tribler.Core.Search.Bundler import Bundler, LevGrouping, LevenshteinTrie, LevenshteinTrie_Cached
+
+WORDS = 'ubuntu linux desktop server amd64 i386 alternate netbook edition release final'.split()
+
+class FakeHit:
+    def __init__(self, i, name, length):
+        self.infohash = '%020d' % i
+        self.name = name
+        self.length = length
+        self.score = random.random()
+
+    def get(self, key, default = None):
+        return getattr(self, key, default)
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+def create_hits(nr_hits, start = 0):
+    # similar names, such that ALG_MAGIC rejects ALG_NAME
+    return [FakeHit(i, 'ubuntu %d.%02d %s %s' % (random.randint(8, 12), random.choice([4, 10]), random.choice(WORDS), random.choice(WORDS)), random.randint(600, 800) * 1048576) for i in xrange(start, start + nr_hits)]
+
+def as_infohashes(bundled_hits):
+    return [[hit.infohash for hit in item['bundle']] if isinstance(item, dict) else item.infohash for item in bundled_hits]
+
+class TestBundler(unittest.TestCase):
+
+    def test_cached_trie(self):
+        words = [' '.join(random.sample(WORDS, 2))[:LevGrouping.MAX_LEN] for _ in xrange(200)]
+        trie = LevenshteinTrie_Cached(MAX_LEN = LevGrouping.MAX_LEN)
+        for word in words[:100]:
+            trie.add_word(word)
+        trie.update_cache(words[:100])
+        for word in words[:10]:
+            trie.search(word, LevGrouping.MAX_COST)
+
+        # cached searches are extended with the similar new words
+        for word in words[100:]:
+            trie.add_word(word)
+        trie.update_cache(words[100:])
+
+        full_trie = LevenshteinTrie(MAX_LEN = LevGrouping.MAX_LEN)
+        for word in words:
+            full_trie.add_word(word)
+        for word in words[:10]:
+            self.assertEqual(set(trie.search(word, LevGrouping.MAX_COST)), set(full_trie.search(word, LevGrouping.MAX_COST)))
+
+    def test_incremental(self):
+        hits = create_hits(500)
+        bundler = Bundler()
+        for i in xrange(10):
+            hits = sorted(hits + create_hits(25, 500 + 25 * i), key = lambda hit: hit.score, reverse = True)
+            bundled_hits, selected_bundle_mode = bundler.bundle(hits, Bundler.ALG_MAGIC, ['ubuntu'])
+            self.assertNotEqual(selected_bundle_mode, Bundler.ALG_NAME)
+
+            # the same bundles as when grouping all hits from scratch
+            expected_hits, expected_bundle_mode = Bundler().bundle(hits, Bundler.ALG_MAGIC, ['ubuntu'])
+            self.assertEqual(selected_bundle_mode, expected_bundle_mode)
+            self.assertEqual(as_infohashes(bundled_hits), as_infohashes(expected_hits))
+
+        # the trie of the rejected ALG_NAME holds each hit once
+        context = bundler.contexts[Bundler.ALG_NAME]
+        self.assertEqual(context.names, set((hit.infohash, hit.name) for hit in hits))
+
+        # every algorithm that was tried is timed
+        self.assertEqual(bundler.timings[Bundler.ALG_NAME][0], 10)
+        self.assertEqual(bundler.timings[Bundler.ALG_SIZE][0], 10)
+
+        # a new query starts over
+        bundler.bundle(hits, Bundler.ALG_NAME, ['linux'])
+        self.assertNotEqual(bundler.contexts[Bundler.ALG_NAME], context)
+
+    def test_renamed(self):
+        hits = sorted(create_hits(200), key = lambda hit: hit.score, reverse = True)
+        bundler = Bundler()
+        bundler.bundle(hits, Bundler.ALG_NAME, ['ubuntu'])
+
+        # the same hits, some of them with the name of a new release
+        for i in xrange(0, len(hits), 5):
+            hit = hits[i]
+            hits[i] = FakeHit(int(hit.infohash), hit.name.replace('ubuntu', 'kubuntu 13.04 raring'), hit.length)
+            hits[i].score = hit.score
+        bundled_hits, _ = bundler.bundle(hits, Bundler.ALG_NAME, ['ubuntu'])
+
+        expected_hits, _ = Bundler().bundle(hits, Bundler.ALG_NAME, ['ubuntu'])
+        self.assertEqual(as_infohashes(bundled_hits), as_infohashes(expected_hits))
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestBundler))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+# Written by Niels Zeilemaker
+# see LICENSE.txt for license information
+
+import unittest
+import socket
+import select
+from threading import Thread
+from time import time
+
+from Tribler.Core.Utilities.bytebuffer import WriteBuffer, ReadBuffer, COALESCE_SIZE
+
+BENCHMARK_SIZE = 100 * 1024 * 1024
+BENCHMARK_CHUNK_SIZE = 10 * 1024 * 1024
+
+class ListBuffer(list):
+    """ The list of strings SingleSocket used before, to benchmark against """
+    def peek(self):
+        return self[0]
+
+    def consume(self, amount):
+        if amount == len(self[0]):
+            del self[0]
+        else:
+            self[0] = self[0][amount:]
+
+class TestByteBuffer(unittest.TestCase):
+
+    def test_write_buffer(self):
+        buffer = WriteBuffer()
+        buffer.append('a' * 10)
+        buffer.append('')
+        buffer.append('b' * 10)
+        assert len(buffer) == 20
+
+        # small chunks are gathered
+        assert memoryview(buffer.peek()).tobytes() == 'a' * 10 + 'b' * 10
+        buffer.consume(15)
+        assert len(buffer) == 5
+        assert memoryview(buffer.peek()).tobytes() == 'b' * 5
+        buffer.consume(5)
+        assert not buffer
+
+        # large chunks are sent from their offset without copying
+        large = 'c' * (COALESCE_SIZE * 2)
+        buffer.append(large)
+        buffer.append('d')
+        assert buffer.peek() is large
+        buffer.consume(COALESCE_SIZE)
+        assert isinstance(buffer.peek(), memoryview) and len(buffer.peek()) == COALESCE_SIZE
+        buffer.consume(COALESCE_SIZE)
+        assert buffer.peek() == 'd'
+
+    def test_read_buffer(self):
+        buffer = ReadBuffer()
+        buffer.feed('HELLO\r\nWOR')
+        pos = buffer.find('\r\n')
+        assert pos == 5
+        assert buffer.read(pos) == 'HELLO'
+        buffer.skip(2)
+        assert buffer.find('\r\n') == -1
+
+        buffer.feed('LD\r\n')
+        assert buffer.find('\r\n') == 5
+        assert buffer.read(5) == 'WORLD'
+        buffer.unread(5)
+        assert buffer.peek(5) == 'WORLD'
+        buffer.skip(7)
+        assert len(buffer) == 0
+
+        buffer.feed('!')
+        assert buffer.offset == 0 and len(buffer) == 1
+
+    def send(self, buffer):
+        """ Push BENCHMARK_SIZE bytes through a socket pair using the SingleSocket.try_write loop """
+        writer, reader = socket.socketpair()
+        writer.setblocking(0)
+
+        def read():
+            received = 0
+            while received < BENCHMARK_SIZE:
+                received += len(reader.recv(1024 * 1024))
+            self.received = received
+        thread = Thread(target = read)
+        thread.start()
+
+        t1 = time()
+        for _ in xrange(BENCHMARK_SIZE / BENCHMARK_CHUNK_SIZE):
+            buffer.append('x' * BENCHMARK_CHUNK_SIZE)
+
+        while buffer:
+            select.select([], [writer], [])
+            try:
+                while buffer:
+                    buf = buffer.peek()
+                    amount = writer.send(buf)
+                    buffer.consume(amount)
+                    if amount != len(buf):
+                        break
+            except socket.error:
+                pass
+
+        thread.join()
+        writer.close()
+        reader.close()
+        assert self.received == BENCHMARK_SIZE
+        return time() - t1
+
+    def test_benchmark_write(self):
+        took_list = self.send(ListBuffer())
+        took_buffer = self.send(WriteBuffer())
+        print "Sending %d MB: list %.2f seconds, buffer %.2f seconds" % (BENCHMARK_SIZE / 1024 / 1024, took_list, took_buffer)
+
+    def test_benchmark_read(self):
+        # FastI2I receiving tunnel messages of 1MB in 10KB chunks
+        message = 'TUNNELRECV 127.0.0.1:1/00 %d\r\n' % (1024 * 1024) + 'x' * (1024 * 1024)
+        data = message * 10
+        chunks = [data[i:i + 10240] for i in xrange(0, len(data), 10240)]
+
+        t1 = time()
+        buffer = ''
+        messages = 0
+        for chunk in chunks:
+            buffer = buffer + chunk
+            while True:
+                cmd, separator, rest = buffer.partition('\r\n')
+                if not separator:
+                    break
+                length = int(cmd.split()[2])
+                if len(rest) < length:
+                    break
+                buffer = rest[length:]
+                messages += 1
+        took_string = time() - t1
+        assert messages == 10
+
+        t1 = time()
+        buffer = ReadBuffer()
+        messages = 0
+        for chunk in chunks:
+            buffer.feed(chunk)
+            while True:
+                pos = buffer.find('\r\n')
+                if pos == -1:
+                    break
+                length = int(buffer.peek(pos).split()[2])
+                if len(buffer) - pos - 2 < length:
+                    break
+                buffer.skip(pos + 2)
+                assert len(buffer.read(length)) == length
+                messages += 1
+        took_buffer = time() - t1
+        assert messages == 10
+
+        print "Receiving 10 MB of tunnel messages: string %.2f seconds, buffer %.2f seconds" % (took_string, took_buffer)
+        assert took_buffer < took_string
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestByteBuffer))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
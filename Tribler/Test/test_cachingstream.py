@@ -9,16 +9,43 @@ import sys
 import os
 import tempfile
 import shutil
+import time
 from traceback import print_exc
 
 from Tribler.Video.CachingStream import SmartCachingStream
 
 
+class CountingStream:
+    """ File wrapper counting the seeks and reads done by the cache """
+    def __init__(self,f,delay=0.0):
+        self.f = f
+        self.delay = delay
+        self.nseeks = 0
+        self.nreads = 0
+
+    def seek(self,offset,whence=0):
+        self.nseeks += 1
+        self.f.seek(offset,whence)
+
+    def tell(self):
+        return self.f.tell()
+
+    def read(self,n):
+        # Like Core streams, return at most a single 32K piece per read
+        self.nreads += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return self.f.read(min(n,32768))
+
+    def close(self):
+        self.f.close()
+
+
 class TestCachingStream(unittest.TestCase):
     
-    """ Note: CachingStream currently actually reads 4x the blocksize into
-    the buffer, so the tests are slightly different than suggested, but
-    in any case all should pass.
+    """ Note: CachingStream reads whole blocks of blocksize into its cache,
+    so the tests are slightly different than suggested, but in any case
+    all should pass.
     """ 
     
     def setUp(self):
@@ -121,6 +148,80 @@ class TestCachingStream(unittest.TestCase):
         self.assert_(data1[10000:10000+20000] == data3)
 
 
+    def test_range_requests(self):
+        """ VLC pattern: GET X-, GET X+10K-, GET X+20K- with jumps back """
+        self.c.close()
+        instream = CountingStream(open(self.srcfilename,"rb"))
+        self.c = SmartCachingStream(instream,blocksize=65536,readahead=0)
+
+        src = open(self.srcfilename,"rb").read()
+        for start in [0,500000,0,2000000,500000]:
+            for i in range(0,20):
+                pos = start + i * 10240
+                self.c.seek(pos)
+                data = self.c.read(4096)
+                self.assert_(data == src[pos:pos+4096])
+
+        # Every block is read from the input stream once, jumps back are
+        # hits. 7 of the 100 reads span two blocks.
+        stats = self.c.get_stats()
+        print >>sys.stderr,"test: stats",stats
+        self.assert_(stats['misses'] == 12)
+        self.assert_(stats['hits'] == 95)
+        self.assert_(stats['stalls'] == 0)
+        self.assert_(instream.nseeks == 2)
+
+    def test_lru(self):
+        self.c.close()
+        instream = CountingStream(open(self.srcfilename,"rb"))
+        self.c = SmartCachingStream(instream,blocksize=65536,cachesize=4*65536,readahead=0)
+
+        for index in [0,1,2,3,0,4,5]:
+            self.c.seek(index*65536)
+            self.c.read(1)
+        self.assert_(self.c.blocks.keys() == [3,0,4,5])
+
+    def test_readahead(self):
+        self.c.close()
+        instream = CountingStream(open(self.srcfilename,"rb"),delay=0.04)
+        self.c = SmartCachingStream(instream,blocksize=65536,readahead=4)
+
+        # Reading a block from the input stream takes 2 x 0.04 seconds, while
+        # playing a block takes 0.1 seconds, such that the read ahead keeps up
+        src = open(self.srcfilename,"rb").read()
+        for i in range(0,64):
+            data = self.c.read(32768)
+            self.assert_(data == src[i*32768:(i+1)*32768])
+            time.sleep(0.05)
+
+        stats = self.c.get_stats()
+        print >>sys.stderr,"test: stats",stats
+        self.assert_(stats['readaheads'] > 0)
+        self.assert_(stats['hit_rate'] > 0.9)
+        self.assert_(stats['stalls'] <= 1)
+
+    def test_readahead_gives_way(self):
+        """ After a seek the reader does not wait for the readahead thread
+        to complete a block that is no longer needed """
+        self.c.close()
+        instream = CountingStream(open(self.srcfilename,"rb"),delay=0.05)
+        self.c = SmartCachingStream(instream,blocksize=8*32768,readahead=1)
+
+        # Reading a block takes 8 x 0.05 seconds, seek while the readahead
+        # thread is reading block 1
+        src = open(self.srcfilename,"rb").read()
+        self.assert_(self.c.read(1) == src[0])
+        time.sleep(0.1)
+        pos = 8*8*32768
+        self.c.seek(pos)
+        data = self.c.read(32768)
+        self.assert_(data == src[pos:pos+32768])
+
+        stats = self.c.get_stats()
+        print >>sys.stderr,"test: stats",stats
+        self.assert_(1 not in self.c.blocks)
+        self.assert_(stats['readaheads'] == 0)
+
     def cmp_files(self):
         f1 = open(self.srcfilename,"rb")
         f2 = open(self.destfilename,"rb")
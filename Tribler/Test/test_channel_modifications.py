@@ -0,0 +1,193 @@
+# see LICENSE.txt for license information
+
+import unittest
+
+from Tribler.dispersy.callback import Callback
+import Tribler.community.channel.community as channel_community
+from Tribler.community.channel.community import ChannelCommunity
+
+CHANNEL_ID = 1
+TORRENT_PACKET_ID = 10
+CHANNELTORRENT_ID = 5
+NAME = 1
+
+class Stub(object):
+    def __init__(self, **kargs):
+        self.__dict__.update(kargs)
+
+MY_MEMBER = Stub(mid = 'mid', public_key = 'public key')
+
+class FakeMessage(Stub):
+    def __init__(self, name, packet_id, global_time, **payload):
+        Stub.__init__(self, name = name, packet_id = packet_id, authentication = Stub(member = MY_MEMBER), distribution = Stub(global_time = global_time), payload = Stub(**payload))
+
+    def load_message(self):
+        return self
+
+TORRENT = FakeMessage(u"torrent", TORRENT_PACKET_ID, 1)
+
+class FakeChannelCastDB:
+    """ The ChannelMetaData and Moderations tables of a single channel """
+    def __init__(self):
+        self._db = self
+        self.modification_types = {'name': NAME, 'description': 2}
+        self.metadata = {}
+        self.moderations = {}
+        self.values = {}
+
+    def fetchone(self, sql, args):
+        if args == (TORRENT_PACKET_ID,):
+            return CHANNELTORRENT_ID
+
+    def fetchall(self, sql, args):
+        type_id, channeltorrent_id, _ = args
+        moderated = set(self.moderations.values())
+        rows = [(dispersy_id, prev_global_time) for dispersy_id, (_channeltorrent_id, _type_id, prev_global_time) in self.metadata.iteritems() if _channeltorrent_id == channeltorrent_id and _type_id == type_id and dispersy_id not in moderated]
+        rows.sort(key = lambda row: (row[1], row[0]), reverse = True)
+        return rows
+
+    def commit(self):
+        pass
+
+    def on_metadata_from_dispersy(self, message_name, channeltorrent_id, playlist_id, channel_id, dispersy_id, peer_id, mid_global_time, type_id, value, timestamp, prev_modification_id, prev_modification_global_time, update):
+        self.metadata[dispersy_id] = (channeltorrent_id, type_id, prev_modification_global_time)
+
+    def on_remove_metadata_from_dispersy(self, channel_id, dispersy_id, redo):
+        del self.metadata[dispersy_id]
+
+    def on_torrent_modification_from_dispersy(self, channeltorrent_id, modification_type, value, forward = True):
+        self.values[(channeltorrent_id, modification_type)] = value
+
+    def on_moderation(self, channel_id, dispersy_id, peer_id, by_peer_id, cause, text, timestamp, severity):
+        self.moderations[dispersy_id] = cause
+
+    def on_remove_moderation(self, channel_id, dispersy_id, redo):
+        del self.moderations[dispersy_id]
+
+class FakeChannelCommunity(ChannelCommunity):
+    """ ChannelCommunity with the messages in memory instead of in the dispersy database """
+    def __init__(self):
+        self._channel_id = CHANNEL_ID
+        self._latest_modifications = {}
+        self._channelcast_db = FakeChannelCastDB()
+        self._modification_types = self._channelcast_db.modification_types
+        self._my_member = MY_MEMBER
+        self._dispersy = self
+        self.messages = {}
+
+    def handle_missing_messages(self, messages, cache):
+        pass
+
+    def _get_message_from_dispersy_id(self, dispersy_id, messagename):
+        if dispersy_id not in self.messages:
+            raise RuntimeError("Unknown dispersy_id %d" % dispersy_id)
+        return self.messages[dispersy_id]
+
+class TestChannelModifications(unittest.TestCase):
+
+    def setUp(self):
+        self.callback = Callback()
+        self.callback.start("Dispersy") # WARNING NAME SIGNIFICANT
+
+        self.community = FakeChannelCommunity()
+        self.db = self.community._channelcast_db
+
+    def tearDown(self):
+        self.callback.stop()
+
+    def modify(self, *modifications):
+        messages = []
+        for packet_id, global_time, prev_global_time, value in modifications:
+            message = FakeMessage(u"modification", packet_id, global_time, modification_on = TORRENT, modification_type = 'name', modification_value = value, timestamp = global_time,
+                                  prev_modification_packet = None, prev_modification_id = None, prev_modification_global_time = prev_global_time)
+            self.community.messages[packet_id] = message
+            messages.append(message)
+
+        self.callback.call(self.community._disp_on_modification, (messages, ))
+        return messages
+
+    def latest(self):
+        """ Returns the value of the latest modification, and the value when determined from all modifications """
+        def get_latest():
+            cached = self.community._get_latest_modification_from_torrent_id(CHANNELTORRENT_ID, NAME)
+            determined = self.community._determine_latest_modification(self.db.fetchall(None, (NAME, CHANNELTORRENT_ID, CHANNEL_ID)))
+            return [message.payload.modification_value if message else None for message in (cached, determined)]
+        return self.callback.call(get_latest)
+
+    def value(self):
+        return self.db.values.get((CHANNELTORRENT_ID, 'name'))
+
+    def test_conflicting(self):
+        self.modify((101, 5, None, 'a'))
+        assert self.value() == 'a'
+        assert self.latest() == ['a', 'a']
+
+        self.modify((102, 7, 5, 'b'))
+        assert self.value() == 'b'
+
+        # modifies the same one as b, but b has the higher global time
+        self.modify((103, 6, 5, 'c'))
+        assert self.value() == 'b'
+        assert self.latest() == ['b', 'b']
+
+        self.modify((104, 9, 5, 'd'), (105, 8, 5, 'e'))
+        assert self.value() == 'd'
+        assert self.latest() == ['d', 'd']
+
+        # modifies d, also when the key has to be determined from the database
+        self.community._latest_modifications.clear()
+        self.modify((106, 10, 9, 'f'))
+        assert self.value() == 'f'
+        assert self.latest() == ['f', 'f']
+
+    def test_undo(self):
+        self.modify((101, 5, None, 'a'), (102, 7, 5, 'b'))
+        assert self.latest() == ['b', 'b']
+
+        b = self.community.messages[102]
+        self.callback.call(self.community._disp_undo_modification, ([(None, None, b)], ))
+        assert self.latest() == ['a', 'a']
+
+        a = self.community.messages[101]
+        self.callback.call(self.community._disp_undo_modification, ([(None, None, a)], ))
+        assert self.latest() == [None, None]
+
+    def test_moderation(self):
+        b = self.modify((101, 5, None, 'a'), (102, 7, 5, 'b'))[1]
+        assert self.latest() == ['b', 'b']
+
+        moderation = FakeMessage(u"moderation", 201, 8, causepacket = b, text = 'spam', timestamp = 8, severity = 1)
+        self.callback.call(self.community._disp_on_moderation, ([moderation], ))
+        assert self.value() == 'a'
+        assert self.latest() == ['a', 'a']
+
+        # the moderated modification is the latest again
+        self.callback.call(self.community._disp_undo_moderation, ([(None, None, moderation)], ))
+        assert self.latest() == ['b', 'b']
+
+    def test_bounded(self):
+        max_latest_modifications = channel_community.MAX_LATEST_MODIFICATIONS
+        channel_community.MAX_LATEST_MODIFICATIONS = 2
+        try:
+            def fill():
+                for type_id in xrange(5):
+                    self.community._get_latest_modification_from_torrent_id(CHANNELTORRENT_ID, type_id)
+            self.callback.call(fill)
+            assert len(self.community._latest_modifications) == 2
+        finally:
+            channel_community.MAX_LATEST_MODIFICATIONS = max_latest_modifications
+
+        # a dropped key is determined again
+        self.modify((101, 5, None, 'a'))
+        assert self.latest() == ['a', 'a']
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestChannelModifications))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+# Written by Niels Zeilemaker
+# see LICENSE.txt for license information
+
+import os
+import sys
+import unittest
+import tempfile
+import shutil
+from threading import Thread
+from time import time
+
+from Tribler.Core.CacheDB.sqlitecachedb import SQLiteCacheDB, CURRENT_MAIN_DB_VERSION, bin2str
+from Tribler.Core.CacheDB.SqliteCacheDBHandler import ChannelCastDBHandler, TorrentDBHandler, VoteCastDBHandler, PeerDBHandler, CHANNELCAST_RECENT_SIZE
+from Tribler.Category.Category import Category
+
+CREATE_SQL_FILE = os.path.join('..',"schema_sdb_v"+str(CURRENT_MAIN_DB_VERSION)+".sql")
+
+NR_CHANNELS = 100
+NR_TORRENTS = int(os.environ.get('NR_CHANNELCAST_TORRENTS', 50000))
+MY_CHANNEL = 1
+SUBSCRIPTIONS = range(2, 7)
+DOWNLOADED_FROM = 7
+
+def on_dbthread(func, *args):
+    # writes have to be performed by the 'Dispersy' thread
+    result = []
+    t = Thread(target=lambda: result.append(func(*args)), name='Dispersy')
+    t.start()
+    t.join()
+    return result[0] if result else None
+
+def infohash(i):
+    return '%020d' % i
+
+def permid(i):
+    return 'permid%d' % i
+
+class FakeRemoteTorrentHandler:
+    def notify_possible_torrent_infohash(self, infohash):
+        pass
+
+class TestChannelCastSample(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tempdir = tempfile.mkdtemp()
+        cls.db = SQLiteCacheDB.getInstance()
+        on_dbthread(cls.db.initDB, os.path.join(cls.tempdir, 'tribler.sdb'), CREATE_SQL_FILE)
+        on_dbthread(cls.populate)
+
+        cls.torrent_db = TorrentDBHandler.getInstance()
+        cls.torrent_db.register(Category.getInstance('..'), '.')
+        cls.torrent_db._rtorrent_handler = FakeRemoteTorrentHandler()
+
+    @classmethod
+    def tearDownClass(cls):
+        on_dbthread(cls.db.close, True)
+        shutil.rmtree(cls.tempdir, ignore_errors=True)
+
+    @classmethod
+    def populate(cls):
+        # channel 1 is mine, 2-6 are subscribed to and from channel 7 a torrent was downloaded
+        cls.db.executemany(u"INSERT INTO _Channels (id, dispersy_cid, peer_id, name) VALUES (?,?,?,?)", [(i, 'cid%d' % i, None if i == MY_CHANNEL else i, u'channel %d' % i) for i in xrange(1, NR_CHANNELS + 1)], commit = False)
+        cls.db.executemany(u"INSERT INTO _ChannelVotes (channel_id, voter_id, vote) VALUES (?,NULL,2)", [(i,) for i in SUBSCRIPTIONS], commit = False)
+        cls.db.executemany(u"INSERT INTO Torrent (torrent_id, infohash) VALUES (?,?)", [(i, bin2str(infohash(i))) for i in xrange(1, NR_TORRENTS + 1)], commit = False)
+        cls.db.executemany(u"INSERT INTO _ChannelTorrents (dispersy_id, torrent_id, channel_id, time_stamp) VALUES (?,?,?,?)", [(i, i, i % NR_CHANNELS + 1, (i * 7919) % NR_TORRENTS) for i in xrange(1, NR_TORRENTS + 1)], commit = False)
+        cls.db.executemany(u"INSERT INTO Peer (peer_id, permid) VALUES (?,?)", [(i, bin2str(permid(i))) for i in xrange(1, NR_CHANNELS + 1)], commit = False)
+        cls.db.execute_write(u"INSERT INTO MyPreference (torrent_id, destination_path, creation_time) VALUES (?,'',0)", (DOWNLOADED_FROM - 1,))
+
+    def setUp(self):
+        ChannelCastDBHandler.delInstance()
+        self.channelcast_db = ChannelCastDBHandler.getInstance()
+        self.channelcast_db.torrent_db = self.torrent_db
+
+    def tearDown(self):
+        ChannelCastDBHandler.delInstance()
+
+    def recent(self, channel_ids, limit):
+        sql = "SELECT infohash FROM ChannelTorrents, Torrent WHERE ChannelTorrents.torrent_id = Torrent.torrent_id AND channel_id IN (%s) AND ChannelTorrents.dispersy_id <> -1 ORDER BY time_stamp DESC LIMIT ?" % ','.join(map(str, channel_ids))
+        return [infohash.decode('base64') for infohash, in self.db.fetchall(sql, (limit, ))]
+
+    def check_torrents(self, torrents, nr_own, nr_others):
+        # the most recent torrents are exact, the others are older torrents of the same channels
+        own = torrents.pop('cid%d' % MY_CHANNEL)
+        assert set(self.recent([MY_CHANNEL], 15)) <= own and len(own) == nr_own, len(own)
+
+        others = set()
+        for channel_id in SUBSCRIPTIONS:
+            others.update(torrents.pop('cid%d' % channel_id, set()))
+        assert set(self.recent(SUBSCRIPTIONS, 15)) <= others and len(others) == nr_others, len(others)
+
+        assert torrents.pop('cid%d' % DOWNLOADED_FROM) == set(self.recent([DOWNLOADED_FROM], 5))
+        assert not torrents, torrents.keys()
+
+    def test_sample(self):
+        self.check_torrents(self.channelcast_db.getRecentAndRandomTorrents(), 25, 25)
+
+        # when the peer subscribed to my channel, my own torrents are left out
+        torrents = self.channelcast_db.getRecentAndRandomTorrents(0, 0, 25, 25, 5)
+        assert 'cid%d' % MY_CHANNEL not in torrents
+        assert sum(len(infohashes) for infohashes in torrents.itervalues()) == 55
+
+        # only the channels used for channelcast are loaded
+        assert sorted(self.channelcast_db.torrent_samples.keys()) == [MY_CHANNEL] + SUBSCRIPTIONS + [DOWNLOADED_FROM]
+        assert all(len(torrent_sample.recent) == min(CHANNELCAST_RECENT_SIZE, NR_TORRENTS / NR_CHANNELS) for torrent_sample in self.channelcast_db.torrent_samples.itervalues())
+
+    def test_incremental(self):
+        self.channelcast_db.getRecentAndRandomTorrents()
+
+        # new torrents are the most recent ones of their channel
+        new_torrents = [(channel_id, i, None, infohash(i), i, u'name', [(u'file', 1)], []) for i, channel_id in [(NR_TORRENTS + 1, MY_CHANNEL), (NR_TORRENTS + 2, SUBSCRIPTIONS[0])]]
+        on_dbthread(self.channelcast_db.on_torrents_from_dispersy, new_torrents)
+        assert self.channelcast_db.getIngestStats()['torrents'] == 2
+
+        # new torrents are indexed in bulk
+        torrent_id = self.db.fetchone(u"SELECT torrent_id FROM Torrent WHERE infohash = ?", (bin2str(infohash(NR_TORRENTS + 1)), ))
+        assert self.db.fetchone(u"SELECT name, num_files FROM Torrent WHERE torrent_id = ?", (torrent_id, )) == (u'name', 1)
+        assert self.db.fetchone(u"SELECT swarmname FROM FullTextIndex WHERE rowid = ?", (torrent_id, )) == u'name'
+        assert self.db.fetchall(u"SELECT path, length FROM TorrentFiles WHERE torrent_id = ?", (torrent_id, )) == [(u'file', 1)]
+
+        t1 = time()
+        torrents = self.channelcast_db.getRecentAndRandomTorrents()
+        took = time() - t1
+        assert infohash(NR_TORRENTS + 1) in torrents['cid%d' % MY_CHANNEL]
+        assert infohash(NR_TORRENTS + 2) in torrents['cid%d' % SUBSCRIPTIONS[0]]
+        self.check_torrents(torrents, 25, 25)
+
+        # removing a torrent reloads the sample of its channel
+        on_dbthread(self.channelcast_db.on_remove_torrent_from_dispersy, MY_CHANNEL, NR_TORRENTS + 1, False)
+        assert MY_CHANNEL not in self.channelcast_db.torrent_samples
+        assert infohash(NR_TORRENTS + 1) not in self.channelcast_db.getRecentAndRandomTorrents()['cid%d' % MY_CHANNEL]
+
+        # against the queries ordering all torrents of the channels
+        t1 = time()
+        for channel_ids in ([MY_CHANNEL], SUBSCRIPTIONS):
+            self.recent(channel_ids, 15)
+            sql = "SELECT infohash FROM ChannelTorrents, Torrent WHERE ChannelTorrents.torrent_id = Torrent.torrent_id AND channel_id IN (%s) AND ChannelTorrents.dispersy_id <> -1 ORDER BY random() LIMIT 10" % ','.join(map(str, channel_ids))
+            self.db.fetchall(sql)
+        self.recent([DOWNLOADED_FROM], 5)
+        took_sql = time() - t1
+        print >> sys.stderr, "%d channel torrents: sample %.4f seconds, ordering all torrents %.4f seconds" % (NR_TORRENTS, took, took_sql)
+
+    def test_subscribers(self):
+        votecast_db = VoteCastDBHandler.getInstance()
+        votecast_db.peer_db = PeerDBHandler.getInstance()
+        votecast_db.channelcast_db = self.channelcast_db
+        try:
+            on_dbthread(votecast_db.on_votes_from_dispersy, [(MY_CHANNEL, peer_id, None, 2, 0) for peer_id in (2, 3, 4)] + [(MY_CHANNEL, 5, None, -1, 0), (SUBSCRIPTIONS[0], 6, None, 2, 0)])
+            assert votecast_db.getMyChannelSubscribers() == set([permid(2), permid(3), permid(4)])
+
+            # votes from dispersy update the loaded subscribers
+            on_dbthread(votecast_db.on_vote_from_dispersy, MY_CHANNEL, 2, None, -1, 1)
+            on_dbthread(votecast_db.on_votes_from_dispersy, [(MY_CHANNEL, 5, None, 2, 1)])
+            assert votecast_db.my_channel_subscribers is not None
+            assert votecast_db.getMyChannelSubscribers() == set([permid(3), permid(4), permid(5)])
+
+            # removing a vote reloads them
+            on_dbthread(votecast_db.removeVote, MY_CHANNEL, 3)
+            assert votecast_db.my_channel_subscribers is None
+            assert votecast_db.getMyChannelSubscribers() == set([permid(4), permid(5)])
+        finally:
+            VoteCastDBHandler.delInstance()
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestChannelCastSample))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
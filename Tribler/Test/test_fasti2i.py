@@ -0,0 +1,102 @@
+# see LICENSE.txt for license information
+
+import unittest
+import socket
+from time import sleep
+from Queue import Queue, Empty
+
+import Tribler.Utilities.FastI2I as fasti2i
+from Tribler.Utilities.FastI2I import FastI2IConnection, FRAME_HEADER, FRAME_TEXT, PROTOCOL_REQUEST, PROTOCOL_ACK
+
+class TestFastI2I(unittest.TestCase):
+    """ The other side of the connection plays swift """
+
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.listener.settimeout(10)
+
+        self.lines = Queue()
+        self.frames = Queue()
+        self.conn = FastI2IConnection(self.listener.getsockname()[1], self.readlinecallback, self.closecallback, self.framecallback)
+        self.swift, _ = self.listener.accept()
+        self.swift.settimeout(10)
+        self.assertEqual(self.recv(len(PROTOCOL_REQUEST)), PROTOCOL_REQUEST)
+
+    def tearDown(self):
+        self.conn.close()
+        self.swift.close()
+        self.listener.close()
+
+    def recv(self, length):
+        data = ''
+        while len(data) < length:
+            data += self.swift.recv(length - len(data))
+        return data
+
+    def readlinecallback(self, conn, cmd):
+        words = cmd.split()
+        if words[0] == "TUNNELRECV":
+            # like SwiftProcess, require LENGTH bytes
+            length = int(words[1])
+            if len(conn.buffer) < length:
+                return length - len(conn.buffer)
+            cmd += " " + conn.buffer.read(length)
+        self.lines.put(cmd)
+
+    def framecallback(self, conn, frametype, payload):
+        self.frames.put((frametype, payload))
+
+    def closecallback(self, port):
+        pass
+
+    def get_line(self):
+        try:
+            return self.lines.get(timeout = 5)
+        except Empty:
+            return None
+
+    def test_binary(self):
+        self.conn.write("START a\r\n")
+        self.swift.sendall(PROTOCOL_ACK + "\r\n")
+        self.assertEqual(self.recv(FRAME_HEADER.size + 7), FRAME_HEADER.pack(FRAME_TEXT, 7) + "START a")
+
+        # the data of a text frame arrives in parts
+        self.swift.sendall(FRAME_HEADER.pack(FRAME_TEXT, 12) + "TUNNELRECV 5" + "ab")
+        sleep(0.5)
+        self.swift.sendall("cde" + FRAME_HEADER.pack(FRAME_TEXT, 6) + "INFO b" + FRAME_HEADER.pack(1, 3) + "xyz")
+        self.assertEqual(self.get_line(), "TUNNELRECV 5 abcde")
+        self.assertEqual(self.get_line(), "INFO b")
+        self.assertEqual(self.frames.get(timeout = 5), (1, "xyz"))
+
+    def test_late_ack(self):
+        timeout = fasti2i.NEGOTIATE_TIMEOUT
+        fasti2i.NEGOTIATE_TIMEOUT = 0.1
+        try:
+            self.tearDown()
+            self.setUp()
+        finally:
+            fasti2i.NEGOTIATE_TIMEOUT = timeout
+
+        # the pending write is sent as text after the timeout
+        self.conn.write("START a\r\n")
+        self.assertEqual(self.recv(9), "START a\r\n")
+
+        self.swift.sendall(PROTOCOL_ACK + "\r\n" + "INFO b\r\n")
+        self.assertEqual(self.get_line(), "INFO b")
+        assert not self.conn.binary
+
+        self.conn.write("START c\r\n")
+        self.assertEqual(self.recv(9), "START c\r\n")
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestFastI2I))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
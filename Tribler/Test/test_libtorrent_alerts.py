@@ -0,0 +1,167 @@
+# see LICENSE.txt for license information
+
+import unittest
+from time import time
+
+from Tribler.Core.simpledefs import DLSTATUS_DOWNLOADING, DLSTATUS_STOPPED
+from Tribler.Core.Libtorrent.LibtorrentMgr import LibtorrentMgr
+from Tribler.Core.Libtorrent.LibtorrentDownloadImpl import LibtorrentDownloadImpl
+
+LT_STATE_DOWNLOADING = 3
+
+class FakeAlert(object):
+    def __init__(self, handle):
+        self.handle = handle
+
+    def category(self):
+        return 0
+
+# The alert type is the name of the class, as for unknown libtorrent alerts
+class stats_alert(FakeAlert):
+    pass
+
+class torrent_checked_alert(FakeAlert):
+    pass
+
+class torrent_paused_alert(FakeAlert):
+    pass
+
+class FakeStatus:
+    def __init__(self, paused):
+        self.state = LT_STATE_DOWNLOADING
+        self.paused = paused
+        self.error = None
+        self.total_wanted = 1000
+        self.progress = 0.5
+        self.download_payload_rate = 10
+        self.upload_payload_rate = 10
+        self.all_time_upload = 0
+        self.all_time_download = 500
+        self.finished_time = 0
+        self.pieces = []
+
+class FakeHandle:
+    def __init__(self, infohash):
+        self.infohash = infohash
+        self.paused = False
+        self.nr_status = 0
+
+    def is_valid(self):
+        return True
+
+    def info_hash(self):
+        return self.infohash
+
+    def status(self):
+        self.nr_status += 1
+        return FakeStatus(self.paused)
+
+    def pause(self):
+        self.paused = True
+
+class FakeLtSession:
+    def __init__(self, alerts):
+        self.alerts = list(alerts)
+
+    def pop_alert(self):
+        return self.alerts.pop(0) if self.alerts else None
+
+class FakeRawServer:
+    def __init__(self):
+        self.tasks = []
+
+    def add_task(self, task, delay):
+        self.tasks.append(delay)
+
+class FakeSession:
+    def __init__(self):
+        self.lm = self
+        self.rawserver = FakeRawServer()
+
+class NoLock:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+class FakeLibtorrentMgr(LibtorrentMgr):
+    """ LibtorrentMgr without a libtorrent session """
+    def __init__(self, ltsession):
+        self.trsession = FakeSession()
+        self.ltsession = ltsession
+        self.torlock = NoLock()
+        self.torrents = {}
+        self.alert_types = {}
+        self.alert_stats = {'alerts': 0, 'batches': 0, 'max_batch': 0, 'drain_time': 0.0, 'max_drain_time': 0.0, 'starttime': time()}
+
+class FakeDownload:
+    def __init__(self):
+        self.batches = []
+
+    def process_alerts(self, alerts):
+        self.batches.append([alert_type for _, alert_type in alerts])
+
+class TestLibtorrentAlerts(unittest.TestCase):
+
+    def setUp(self):
+        self.ltmgr = FakeLibtorrentMgr(FakeLtSession([]))
+        LibtorrentMgr._LibtorrentMgr__single = self.ltmgr
+
+    def tearDown(self):
+        LibtorrentMgr.delInstance()
+
+    def create_download(self, infohash):
+        download = LibtorrentDownloadImpl(None, None)
+        download.handle = FakeHandle(infohash)
+        return download
+
+    def test_batches(self):
+        downloads = {'a': FakeDownload(), 'b': FakeDownload()}
+        self.ltmgr.torrents.update(downloads)
+        handles = dict((infohash, FakeHandle(infohash)) for infohash in 'abc')
+        self.ltmgr.ltsession = FakeLtSession([stats_alert(handles['a']), torrent_checked_alert(handles['b']),
+                                              torrent_paused_alert(handles['a']), stats_alert(handles['c']),
+                                              stats_alert(handles['b'])])
+        self.ltmgr.process_alerts()
+
+        # One batch per download, in the order the alerts were popped
+        assert downloads['a'].batches == [['stats_alert', 'torrent_paused_alert']]
+        assert downloads['b'].batches == [['torrent_checked_alert', 'stats_alert']]
+        stats = self.ltmgr.get_alert_stats()
+        assert stats['alerts'] == 5 and stats['batches'] == 1 and stats['max_batch'] == 5
+        assert self.ltmgr.trsession.rawserver.tasks == [1]
+
+    def test_status_once(self):
+        download = self.create_download('a')
+        download.process_alerts([(stats_alert(download.handle), 'stats_alert')] * 100)
+        assert download.handle.nr_status == 1
+        assert download.dlstate == DLSTATUS_DOWNLOADING
+
+    def test_pause_after_hashcheck(self):
+        # The torrent is paused by the torrent_checked_alert handler, the
+        # stats_alert after it in the same batch must not undo that
+        download = self.create_download('a')
+        download.pause_after_next_hashcheck = True
+        download.process_alerts([(torrent_checked_alert(download.handle), 'torrent_checked_alert'),
+                                 (stats_alert(download.handle), 'stats_alert')])
+        assert download.handle.paused
+        assert download.dlstate == DLSTATUS_STOPPED
+        assert download.curspeeds.values() == [0.0, 0.0]
+
+    def test_paused(self):
+        download = self.create_download('a')
+        download.handle.paused = True
+        download.process_alerts([(torrent_paused_alert(download.handle), 'torrent_paused_alert')])
+        assert download.dlstate == DLSTATUS_STOPPED
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestLibtorrentAlerts))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
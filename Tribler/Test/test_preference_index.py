@@ -0,0 +1,123 @@
+# Written by Niels Zeilemaker
+# see LICENSE.txt for license information
+
+import unittest
+from random import Random
+from hashlib import sha1
+from time import time
+
+import Tribler.community.privatesearch.preferenceindex as PreferenceIndexModule
+from Tribler.community.privatesearch.preferenceindex import PreferenceIndex
+
+NR_CANDIDATES = 10000
+NR_PREFERENCES = 100
+NR_TORRENTS = 50000
+NR_MATCHES = 100
+
+class FakeCandidate:
+    def __init__(self, port):
+        self.sock_addr = ('127.0.0.1', port)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+class TestPreferenceIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.original_time = PreferenceIndexModule.time
+        PreferenceIndexModule.time = self.clock
+
+        self.index = PreferenceIndex(60)
+
+    def tearDown(self):
+        PreferenceIndexModule.time = self.original_time
+
+    def match(self, preferences):
+        # sort candidates with an equal overlap on port
+        return sorted(((overlap, candidate.sock_addr[1]) for overlap, candidate in self.index.match(set(preferences))), key = lambda match: (-match[0], match[1]))
+
+    def test_match(self):
+        a, b, c = FakeCandidate(1), FakeCandidate(2), FakeCandidate(3)
+        self.index.add(a, ['1', '2', '3'])
+        self.index.add(b, ['3', '4'])
+        self.index.add(c, ['5'])
+
+        assert self.match(['2', '3', '4']) == [(2, 1), (2, 2)]
+        assert self.match(['1', '2', '4']) == [(2, 1), (1, 2)]
+        assert self.match(['1', '5']) == [(1, 1), (1, 3)]
+        assert self.match(['6']) == []
+
+        # replacing the preferences of a candidate removes the old postings
+        self.index.add(a, ['6'])
+        assert self.match(['1', '6']) == [(1, 1)]
+        assert self.index.get(a) == frozenset(['6'])
+
+    def test_expire(self):
+        a, b, c = FakeCandidate(1), FakeCandidate(2), FakeCandidate(3)
+        self.index.add(a, ['1'])
+        self.clock.now += 30
+        self.index.add(b, ['1'])
+        self.index.add(c, ['1'])
+
+        self.clock.now += 45
+        self.index.expire(lambda candidate: candidate is c)
+        assert self.match(['1']) == [(1, 2), (1, 3)]
+
+        self.clock.now += 45
+        self.index.expire(lambda candidate: candidate is c)
+        assert self.match(['1']) == [(1, 3)]
+        assert self.index.postings.keys() == ['1']
+
+        self.clock.now += 120
+        self.index.expire()
+        assert len(self.index) == 0
+        assert self.index.postings == {}
+
+    def test_benchmark(self):
+        random = Random(42)
+        torrents = [sha1(str(i)).digest() for i in xrange(NR_TORRENTS)]
+
+        cache = []
+        for i in xrange(NR_CANDIDATES):
+            candidate = FakeCandidate(i)
+            preference_set = set(random.sample(torrents, NR_PREFERENCES))
+            cache.append((self.clock.now, preference_set, candidate))
+            self.index.add(candidate, preference_set)
+
+        queries = [set(random.sample(torrents, NR_PREFERENCES)) for _ in xrange(NR_MATCHES)]
+
+        # the scan ForwardCommunity.match_preferences used to do
+        t1 = time()
+        expected = []
+        for preference_set in queries:
+            expected.append(sorted((len(other_set & preference_set), candidate.sock_addr) for _, other_set, candidate in cache if other_set & preference_set))
+        scan_took = (time() - t1) / NR_MATCHES
+
+        t1 = time()
+        results = []
+        for preference_set in queries:
+            self.index.expire()
+            results.append(self.index.match(preference_set))
+        index_took = (time() - t1) / NR_MATCHES
+
+        print "Matching against %d candidates: scan %.2f ms, index %.2f ms" % (NR_CANDIDATES, scan_took * 1000, index_took * 1000)
+
+        for result, expected_result in zip(results, expected):
+            assert sorted((overlap, candidate.sock_addr) for overlap, candidate in result) == expected_result
+            assert [overlap for overlap, _ in result] == sorted((overlap for overlap, _ in result), reverse = True)
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestPreferenceIndex))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
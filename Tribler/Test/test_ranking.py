@@ -0,0 +1,155 @@
+# Written by Niels Zeilemaker
+# see LICENSE.txt for license information
+
+import unittest
+import random
+from math import sqrt
+from time import time
+
+import Tribler.Core.Search.Ranking as RankingModule
+from Tribler.Core.Search.Ranking import RunningStat, HitRanker, FEATURES, WEIGHTS
+
+class FakeHit:
+    def __init__(self, infohash, num_seeders, neg_votes = 0, subscriptions = 0):
+        self.infohash = infohash
+        self.num_seeders = num_seeders
+        self.neg_votes = neg_votes
+        self.subscriptions = subscriptions
+        self.relevance_score = [0, None, 0, 0, 0]
+
+    def get(self, key, default = None):
+        return getattr(self, key, default)
+
+def create_hits(nr_hits, start = 0):
+    return [FakeHit('%020d' % i, random.randint(0, 500), random.randint(0, 5), random.choice([0, 0, 3])) for i in xrange(start, start + nr_hits)]
+
+def expected_scores(hits):
+    scores = dict((hit.infohash, 0.0) for hit in hits)
+    for key, weight in zip(FEATURES, WEIGHTS):
+        values = [hit.get(key) for hit in hits]
+        mean = float(sum(values)) / len(values)
+        stddev = sqrt(sum((value - mean) ** 2 for value in values) / (len(values) - 1))
+        if stddev > 0:
+            for hit, value in zip(hits, values):
+                scores[hit.infohash] += weight * (value - mean) / stddev
+    return scores
+
+class TestRanking(unittest.TestCase):
+
+    def setUp(self):
+        self.numpy = RankingModule.numpy
+
+    def tearDown(self):
+        RankingModule.numpy = self.numpy
+
+    def assert_scores(self, hits):
+        scores = expected_scores(hits)
+        for hit in hits:
+            self.assertAlmostEqual(hit.relevance_score[-1], scores[hit.infohash])
+
+    def test_running_stat(self):
+        values = [random.randint(0, 1000) for _ in xrange(1000)]
+        stat = RunningStat()
+        for value in values:
+            stat.add(value)
+        for value in values[500:]:
+            stat.remove(value)
+
+        mean = sum(values[:500]) / 500.0
+        self.assertAlmostEqual(stat.mean, mean)
+        self.assertAlmostEqual(stat.stddev(), sqrt(sum((value - mean) ** 2 for value in values[:500]) / 499))
+
+        # all values equal, no variance
+        for value in values[1:500]:
+            stat.remove(value)
+        stat.add(values[0])
+        self.assertEqual(stat.stddev(), 0.0)
+
+    def run_ranker(self):
+        ranker = HitRanker()
+        hits = create_hits(100)
+        ranker.update(hits)
+        self.assertEqual(ranker.score(), 100)
+        self.assert_scores(hits)
+
+        hits.extend(create_hits(25, 100))
+        ranker.update(hits[100:])
+        self.assertEqual(ranker.score(), 125)
+        self.assert_scores(hits)
+
+        # only the changed hit is scored if the normalisation remains the same
+        hits[0].num_seeders, hits[1].num_seeders = hits[1].num_seeders, hits[0].num_seeders
+        ranker.update(hits[:2])
+        self.assertEqual(ranker.score(), 2)
+        self.assert_scores(hits)
+
+        # a changed feature changes the normalisation
+        hits[2].num_seeders += 100
+        ranker.update(hits[2:3])
+        self.assertEqual(ranker.score(), 125)
+        self.assert_scores(hits)
+
+        # a new hit with the same infohash and features replaces the old one
+        replacement = FakeHit(hits[3].infohash, hits[3].num_seeders, hits[3].neg_votes, hits[3].subscriptions)
+        hits[3] = replacement
+        ranker.update([replacement])
+        self.assertEqual(ranker.score(), 1)
+        self.assert_scores(hits)
+
+        ranker.clear()
+        self.assertEqual(ranker.score(), 0)
+
+    def test_ranker(self):
+        self.run_ranker()
+
+    def test_ranker_without_numpy(self):
+        RankingModule.numpy = None
+        self.run_ranker()
+
+    def test_benchmark(self):
+        # 50 remote responses of 25 hits on top of 1000 local hits, against
+        # normalising all hits for every response as fulltextSort did
+        def do_stat_normalization(hits, key):
+            values = [hit.get(key, 0) or 0 for hit in hits]
+            mean = float(sum(values)) / len(values)
+            stddev = sqrt(sum((value - mean) ** 2 for value in values) / (len(values) - 1))
+            return dict((hit.infohash, (value - mean) / stddev if stddev > 0 else 0) for hit, value in zip(hits, values))
+
+        responses = [create_hits(25, 1000 + 25 * i) for i in xrange(50)]
+        local_hits = create_hits(1000)
+
+        hits = list(local_hits)
+        t1 = time()
+        for response in responses:
+            hits.extend(response)
+            norms = [do_stat_normalization(hits, key) for key in FEATURES]
+            for hit in hits:
+                hit.relevance_score[-1] = sum(weight * norm[hit.infohash] for weight, norm in zip(WEIGHTS, norms))
+        took_full = time() - t1
+
+        for with_numpy in (True, False):
+            RankingModule.numpy = self.numpy if with_numpy else None
+
+            hits = list(local_hits)
+            ranker = HitRanker()
+            ranker.update(hits)
+            t1 = time()
+            for response in responses:
+                hits.extend(response)
+                ranker.update(response)
+                ranker.score()
+            took_ranker = time() - t1
+            self.assert_scores(hits)
+
+            print "%d responses: ranker %.3f seconds (%s), normalising all hits %.3f seconds" % (len(responses), took_ranker, 'numpy' if RankingModule.numpy else 'python', took_full)
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestRanking))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
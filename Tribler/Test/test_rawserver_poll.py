@@ -0,0 +1,210 @@
+# Written by Niels Zeilemaker
+# see LICENSE.txt for license information
+
+import unittest
+import socket
+import select
+import errno
+from threading import Event, Thread
+
+from Tribler.Core.RawServer.RawServer import RawServer
+from Tribler.Core.RawServer import SocketHandler as sockethandler_module
+from Tribler.Core.RawServer.SocketHandler import SocketHandler
+from Tribler.Core.RawServer import selectpoll
+
+NR_CONNECTIONS = 5
+MESSAGE_SIZE = 256 * 1024
+
+class FakeServerSocket:
+    """ A listening socket that fails or accepts the given connections, in order """
+    def __init__(self, fd, accepts):
+        self.fd = fd
+        self.accepts = accepts
+
+    def fileno(self):
+        return self.fd
+
+    def accept(self):
+        if not self.accepts:
+            raise socket.error(errno.EWOULDBLOCK, 'would block')
+        accept = self.accepts.pop(0)
+        if isinstance(accept, socket.error):
+            raise accept
+        return accept, ('127.0.0.1', 1)
+
+class EchoHandler:
+    def external_connection_made(self, s):
+        s.set_handler(self)
+
+    def data_came_in(self, s, data):
+        s.write(data)
+
+    def connection_flushed(self, s):
+        pass
+
+    def connection_lost(self, s):
+        pass
+
+def get_pollers():
+    pollers = []
+    # the poller has to use the event constants of the SocketHandler, selectpoll does not on Linux
+    if (selectpoll.POLLIN, selectpoll.POLLOUT) == (sockethandler_module.POLLIN, sockethandler_module.POLLOUT):
+        pollers.append(('selectpoll', selectpoll.poll))
+    if hasattr(select, 'poll'):
+        pollers.append(('select.poll', select.poll))
+    try:
+        from Tribler.Core.RawServer import epollpoll
+    except ImportError:
+        pass
+    else:
+        pollers.append(('epoll edge-triggered', epollpoll.poll))
+        pollers.append(('epoll level-triggered', lambda: epollpoll.poll(edge_triggered = False)))
+    return pollers
+
+class TestRawServerPoll(unittest.TestCase):
+
+    def start_rawserver(self, poller):
+        self.doneflag = Event()
+        sockethandler = SocketHandler(300, False, poller = poller)
+        rawserver = RawServer(self.doneflag, 60, 300, ipv6_enable = False, sockethandler = sockethandler)
+        rawserver.bind(0, bind = ['127.0.0.1'], reuse = True)
+        port = sockethandler.servers.values()[0].getsockname()[1]
+
+        thread = Thread(target = rawserver.listen_forever, args = (EchoHandler(),))
+        thread.setDaemon(True)
+        thread.start()
+        return rawserver, port
+
+    def stop_rawserver(self, rawserver):
+        self.doneflag.set()
+        rawserver.add_task(lambda: None)
+
+    def echo(self, port, message):
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.settimeout(10)
+        try:
+            sock.sendall(message)
+            received = []
+            nr_received = 0
+            while nr_received < len(message):
+                data = sock.recv(65536)
+                assert data, "connection closed after %d bytes" % nr_received
+                received.append(data)
+                nr_received += len(data)
+            return ''.join(received)
+        finally:
+            sock.close()
+
+    def test_echo(self):
+        for name, poller in get_pollers():
+            rawserver, port = self.start_rawserver(poller())
+            try:
+                results = []
+                def client(i):
+                    message = chr(ord('a') + i) * MESSAGE_SIZE
+                    results.append(self.echo(port, message) == message)
+
+                threads = [Thread(target = client, args = (i,)) for i in xrange(NR_CONNECTIONS)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join(30)
+                self.assertEqual(results, [True] * NR_CONNECTIONS, name)
+
+                stats = rawserver.get_stats()
+                assert stats['polls'] > 0 and stats['max_ready_fds'] >= 1, name
+            finally:
+                self.stop_rawserver(rawserver)
+
+    def test_poll_timeout(self):
+        # while idle, the loop should wait in poll until the next task is due
+        for name, poller in get_pollers():
+            rawserver, port = self.start_rawserver(poller())
+            try:
+                self.assertEqual(self.echo(port, 'ping'), 'ping')
+
+                done = Event()
+                polls = rawserver.get_stats()['polls']
+                rawserver.add_task(done.set, 0.5)
+                assert done.wait(10), name
+
+                polls = rawserver.get_stats()['polls'] - polls
+                assert polls < 10, (name, polls)
+            finally:
+                self.stop_rawserver(rawserver)
+
+    def test_epoll_fd_reuse(self):
+        try:
+            from Tribler.Core.RawServer import epollpoll
+        except ImportError:
+            return
+
+        # a socket closed without being unregistered leaves the epoll set,
+        # its fd is registered again for a new socket with the same eventmask
+        poll = epollpoll.poll()
+        a, b = socket.socketpair()
+        fd = a.fileno()
+        poll.register(a, epollpoll.POLLIN)
+        a.close()
+        b.close()
+
+        sockets = [socket.socketpair() for _ in xrange(2)]
+        try:
+            a = [s for pair in sockets for s in pair if s.fileno() == fd][0]
+            poll.register(a, epollpoll.POLLIN)
+            [s for pair in sockets for s in pair if a in pair and s is not a][0].send('ping')
+            self.assertEqual(poll.poll(5), [(fd, epollpoll.POLLIN)])
+        finally:
+            for pair in sockets:
+                for s in pair:
+                    s.close()
+
+    def test_accept_errors(self):
+        try:
+            from Tribler.Core.RawServer import epollpoll
+        except ImportError:
+            return
+
+        sockethandler = SocketHandler(300, False, poller = epollpoll.poll())
+        sockethandler.handler = EchoHandler()
+        sleeps = []
+        sockethandler._sleep = lambda: sleeps.append(True)
+
+        pairs = [socket.socketpair() for _ in xrange(3)]
+        try:
+            listener = pairs[0][0]
+
+            # a connection that was aborted before it was accepted does not stop
+            # accepting the other pending connections
+            server = FakeServerSocket(listener.fileno(), [socket.error(errno.ECONNABORTED, 'aborted'), pairs[1][0]])
+            sockethandler.servers[server.fd] = server
+            sockethandler.poll.register(listener, sockethandler_module.POLLIN)
+            sockethandler.handle_events([(server.fd, sockethandler_module.POLLIN)])
+            assert pairs[1][0].fileno() in sockethandler.single_sockets
+            assert not sleeps
+
+            # when out of file descriptors the server socket is re-armed for the
+            # pending connections
+            server.accepts = [socket.error(errno.EMFILE, 'too many open files'), pairs[2][0]]
+            pairs[0][1].send('ping')
+            assert server.fd in [fd for fd, _ in sockethandler.poll.poll(5)]
+            assert server.fd not in [fd for fd, _ in sockethandler.poll.poll(0)]
+            sockethandler.handle_events([(server.fd, sockethandler_module.POLLIN)])
+            assert pairs[2][0].fileno() not in sockethandler.single_sockets
+            assert sleeps
+            assert server.fd in [fd for fd, _ in sockethandler.poll.poll(5)]
+        finally:
+            for pair in pairs:
+                for s in pair:
+                    s.close()
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestRawServerPoll))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# Written by Niels Zeilemaker
+# see LICENSE.txt for license information
+
+import unittest
+
+from Tribler.Core.RemoteTorrentHandler import RequestScheduler, Requester, TorrentRequester
+from Tribler.Core.simpledefs import DLSTATUS_STOPPED_ON_ERROR
+
+class FakeRemoteTorrentHandler:
+    def __init__(self):
+        self.tasks = []
+        self.scheduler = RequestScheduler(self.scheduletask)
+
+    def scheduletask(self, task, t = 0):
+        self.tasks.append(task)
+
+    def run_tasks(self):
+        tasks, self.tasks = self.tasks, []
+        for task in tasks:
+            task()
+
+class FakeRequester(Requester):
+    def __init__(self, remote_th, prio = 1):
+        Requester.__init__(self, remote_th, prio)
+        self.fetched = []
+
+    def doFetch(self, hash, candidates):
+        self.fetched.append(hash)
+        return True
+
+class FakeSession:
+    def __init__(self):
+        self.removed = []
+
+    def get_torrent_collecting_dir(self):
+        return '.'
+
+    def remove_download(self, d, removecontent = False, removestate = False, hidden = False):
+        self.removed.append(d)
+
+class FakeDef:
+    def get_name(self):
+        return 'name'
+
+class FakeDownload:
+    started_downloading = 0
+
+    def get_def(self):
+        return FakeDef()
+
+class FakeDownloadState:
+    def get_download(self):
+        return FakeDownload()
+
+    def get_progress(self):
+        return 0
+
+    def get_status(self):
+        return DLSTATUS_STOPPED_ON_ERROR
+
+class TestRequestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.remote_th = FakeRemoteTorrentHandler()
+        self.scheduler = self.remote_th.scheduler
+        self.requester = FakeRequester(self.remote_th)
+
+    def test_request(self):
+        self.requester.add_request('hash', 'candidate')
+        self.remote_th.run_tasks()
+        assert self.requester.fetched == ['hash']
+        assert not self.requester.is_being_requested('hash')
+        assert self.scheduler.pending == {}
+
+    def test_remove_and_add(self):
+        # without a timeout the deadline of both requests is the same
+        self.requester.add_request('hash', 'candidate')
+        assert self.requester.remove_request('hash') == set(['candidate'])
+        assert self.scheduler.pending == {}
+
+        self.requester.add_request('hash', 'candidate')
+        self.remote_th.run_tasks()
+        assert self.requester.fetched == ['hash']
+        assert not self.requester.is_being_requested('hash')
+        assert self.scheduler.pending == {}
+
+    def test_magnet_from_callback(self):
+        # check_progress is called by the download callback thread, it should not touch the scheduler
+        session = FakeSession()
+        requester = TorrentRequester(self.remote_th, self.requester, session, 1)
+        requester.check_progress(FakeDownloadState(), 'infohash', 'roothash', False)
+        assert not self.requester.is_being_requested('infohash')
+        assert self.scheduler.heap == []
+
+        self.remote_th.run_tasks()
+        assert len(session.removed) == 1
+        assert self.requester.is_being_requested('infohash')
+
+        self.remote_th.run_tasks()
+        assert self.requester.fetched == ['infohash']
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestRequestScheduler))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+# see LICENSE.txt for license information
+
+import unittest
+import random
+import threading
+from time import time
+
+from Tribler.Main.vwxGUI.SearchGridManager import TorrentManager
+from Tribler.Main.Utility.GuiDBTuples import RemoteTorrent, RemoteChannelTorrent, Channel
+from Tribler.Core.Search.Ranking import HitRanker
+
+NR_RESPONSES = 50
+NR_HITS = 25
+NR_INFOHASHES = 400
+
+class FakeCategory:
+    def calculateCategoryNonDict(self, *args):
+        return ['Video']
+
+class FakeTorrentManager(TorrentManager):
+    """ TorrentManager with only the state used to merge remote hits """
+    def __init__(self, hits):
+        self.hits = hits
+        self.hitsIndex = dict((hit.infohash, hit) for hit in hits)
+        self.remoteHits = []
+        self.remoteLock = threading.Lock()
+        self.ranker = HitRanker()
+        self.category = FakeCategory()
+        self.xxx_category = 0
+
+def linear_merge(hits, remoteHits):
+    """ addStoredRemoteResults as it was before hitsIndex, scanning all hits
+    for each remote hit """
+    hitsUpdated = False
+    hitsModified = set()
+    for remoteItem in remoteHits:
+        known = False
+
+        for item in hits:
+            if item.infohash == remoteItem.infohash:
+                if item.query_candidates == None:
+                    item.query_candidates = set()
+                item.query_candidates.update(remoteItem.query_candidates)
+
+                if item.swift_hash == None:
+                    item.swift_hash = remoteItem.swift_hash
+                    hitsModified.add(item.infohash)
+
+                if item.swift_torrent_hash == None:
+                    item.swift_torrent_hash = remoteItem.swift_torrent_hash
+                    hitsModified.add(item.infohash)
+
+                if remoteItem.hasChannel():
+                    if isinstance(item, RemoteTorrent):
+                        hits.remove(item)
+                        break
+
+                    if isinstance(item, RemoteChannelTorrent):
+                        this_rating = remoteItem.channel.nr_favorites - remoteItem.channel.nr_spam
+
+                        if item.hasChannel():
+                            current_rating = item.channel.nr_favorites - item.channel.nr_spam
+                        else:
+                            current_rating = this_rating - 1
+
+                        if this_rating > current_rating:
+                            item.updateChannel(remoteItem.channel)
+                            hitsModified.add(item.infohash)
+
+                known = True
+                break
+
+        if not known:
+            hits.append(remoteItem)
+            hitsUpdated = True
+    return hitsUpdated, hitsModified
+
+def create_hit(rand, candidate):
+    infohash = '%020d' % rand.randrange(NR_INFOHASHES)
+    swift_hash = rand.choice([None, 's' + infohash[1:]])
+    if rand.random() < 0.3:
+        channel = Channel(rand.randrange(10), 'cid', 'channel', '', 10, rand.randrange(20), rand.randrange(5), 0, 0, False)
+        return RemoteChannelTorrent(-1, infohash, swift_hash, None, 'name', channel = channel, query_candidates = set([candidate]))
+    return RemoteTorrent(-1, infohash, swift_hash, None, 'name', num_seeders = rand.randrange(500), query_candidates = set([candidate]))
+
+def create_responses(nr_local):
+    """ Returns new local hits and NR_RESPONSES remote responses, the same
+    ones on every call """
+    rand = random.Random(nr_local)
+    local_hits = []
+    for _ in xrange(nr_local):
+        hit = create_hit(rand, 'local')
+        if hit.infohash not in [local_hit.infohash for local_hit in local_hits]:
+            local_hits.append(hit)
+    responses = [[create_hit(rand, 'candidate%d' % response) for _ in xrange(NR_HITS)] for response in xrange(NR_RESPONSES)]
+    return local_hits, responses
+
+def describe(hits):
+    return [(hit.__class__.__name__, hit.infohash, hit.swift_hash, sorted(hit.query_candidates or []), hit.channel and hit.channel.id) for hit in hits]
+
+class TestSearchHits(unittest.TestCase):
+
+    def replay(self, nr_local):
+        local_hits, responses = create_responses(nr_local)
+        nr_hits = len(local_hits)
+        manager = FakeTorrentManager(local_hits)
+        took_index = 0.0
+        results = []
+        for response in responses:
+            manager.remoteHits = response
+            t1 = time()
+            hitsAdded, hitsModified = manager.addStoredRemoteResults()
+            took_index += time() - t1
+            results.append((bool(hitsAdded), hitsModified, describe(manager.hits)))
+
+        hits, responses = create_responses(nr_local)
+        took_scan = 0.0
+        expected = []
+        for response in responses:
+            t1 = time()
+            hitsUpdated, hitsModified = linear_merge(hits, response)
+            took_scan += time() - t1
+            expected.append((hitsUpdated, hitsModified, describe(hits)))
+
+        self.assertEqual(results, expected)
+        self.assertEqual(sorted(manager.hitsIndex), sorted(hit.infohash for hit in manager.hits))
+        print "%d responses of %d hits on %d local hits: index %.3f seconds, scan %.3f seconds" % (NR_RESPONSES, NR_HITS, nr_hits, took_index, took_scan)
+
+    def test_remote_only(self):
+        self.replay(0)
+
+    def test_local(self):
+        self.replay(200)
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestSearchHits))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
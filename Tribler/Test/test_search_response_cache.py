@@ -0,0 +1,83 @@
+# Written by Niels Zeilemaker
+# see LICENSE.txt for license information
+
+import unittest
+from struct import pack
+
+from Tribler.dispersy.encoding import encode
+from Tribler.Core.CacheDB.Notifier import Notifier
+from Tribler.Core.simpledefs import NTFY_TORRENTS, NTFY_CHANNELCAST, NTFY_INSERT, NTFY_UPDATE, NTFY_DELETE
+from Tribler.community.search.responsecache import SearchResponseCache, EncodedResults, PREFIX_LENGTH
+
+def create_results(nr_results):
+    return [('%020d' % i, u'name %d' % i, long(i * 1024), 1, [u'other'], 0L, i, 0, None, None, 'cid%d' % i if i % 2 else None) for i in xrange(nr_results)]
+
+class TestSearchResponseCache(unittest.TestCase):
+
+    def test_encode_response(self):
+        assert PREFIX_LENGTH is not None
+
+        # reusing the encoding of the results gives the same search-response as encoding it whole
+        for nr_results in (0, 1, 25):
+            results = EncodedResults(create_results(nr_results))
+            for identifier in (0, 1, 65535):
+                self.assertEqual(results.encode_response(pack('!H', identifier)), encode((pack('!H', identifier), create_results(nr_results))))
+
+    def test_cache(self):
+        cache = SearchResponseCache(max_size = 2)
+        assert cache.get([u'ubuntu']) is None
+
+        results = cache.set([u'ubuntu', u'iso'], create_results(5))
+        assert isinstance(results, EncodedResults)
+        assert cache.get([u'iso', u'ubuntu']) is results
+
+        # least recently used keywords are dropped
+        cache.set([u'debian'], [])
+        cache.get([u'iso', u'ubuntu'])
+        cache.set([u'fedora'], [])
+        assert cache.get([u'debian']) is None
+        assert cache.get([u'ubuntu', u'iso']) is results
+
+        statistics = cache.get_statistics()
+        self.assertEqual((statistics['hits'], statistics['misses'], statistics['bytes_saved']), (3, 2, 3 * len(results.encoded)))
+
+        cache.invalidate()
+        assert cache.get([u'ubuntu', u'iso']) is None
+
+        # entries expire
+        cache = SearchResponseCache(ttl = -1)
+        cache.set([u'ubuntu'], [])
+        assert cache.get([u'ubuntu']) is None
+
+    def test_observe(self):
+        notifier = Notifier.getInstance()
+        try:
+            cache = SearchResponseCache()
+            cache.observe(notifier)
+
+            # the tracker checker and votes do not clear the cache
+            results = cache.set([u'ubuntu'], create_results(5))
+            notifier.notify(NTFY_TORRENTS, NTFY_UPDATE, 'infohash')
+            notifier.notify(NTFY_CHANNELCAST, NTFY_UPDATE, 1)
+            assert cache.get([u'ubuntu']) is results
+
+            # new or removed torrents do
+            notifier.notify(NTFY_TORRENTS, NTFY_INSERT, 'infohash')
+            assert cache.get([u'ubuntu']) is None
+
+            cache.set([u'ubuntu'], create_results(5))
+            notifier.notify(NTFY_TORRENTS, NTFY_DELETE, 'infohash')
+            assert cache.get([u'ubuntu']) is None
+        finally:
+            Notifier.delInstance()
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestSearchResponseCache))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
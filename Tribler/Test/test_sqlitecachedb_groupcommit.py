@@ -0,0 +1,122 @@
+import os
+import unittest
+import tempfile
+import shutil
+from time import sleep
+
+from Tribler.dispersy.callback import Callback
+import Tribler.Core.CacheDB.sqlitecachedb as sqlitecachedb
+from Tribler.Core.CacheDB.sqlitecachedb import SQLiteCacheDB, CURRENT_MAIN_DB_VERSION, try_register, unregister
+
+CREATE_SQL_FILE = os.path.join('..',"schema_sdb_v"+str(CURRENT_MAIN_DB_VERSION)+".sql")
+
+class TestGroupCommit(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+        self.callback = Callback()
+        self.callback.start("Dispersy") # WARNING NAME SIGNIFICANT
+
+        self.db = SQLiteCacheDB.getInstance()
+        self.callback.call(self.db.initDB, (os.path.join(self.tempdir, 'tribler.sdb'), CREATE_SQL_FILE))
+        try_register(self.db, self.callback)
+        sleep(0.5)
+
+    def tearDown(self):
+        self.callback.call(self.db.commitNow, kargs={'exiting': True})
+        self.callback.call(self.db.close, (True, ))
+        unregister()
+        self.callback.stop()
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def nr_committed(self):
+        # the read pool only sees committed rows
+        return self.db.fetchone(u"SELECT COUNT(*) FROM Peer")
+
+    def test_commit_on_size(self):
+        self.db.commit_stats.reset()
+        self.db.executemany(u"INSERT INTO Peer (permid) VALUES (?)", [(u'permid%d' % i,) for i in range(sqlitecachedb.GROUP_COMMIT_SIZE)])
+
+        self.callback.call(lambda: None)
+        assert self.nr_committed() == sqlitecachedb.GROUP_COMMIT_SIZE
+        stats = self.db.get_commit_stats()
+        assert stats['commits'] == 1, stats
+        assert stats['max_batch_size'] == sqlitecachedb.GROUP_COMMIT_SIZE, stats
+
+    def test_commit_on_age(self):
+        self.db.commit_stats.reset()
+        self.db.execute_write(u"INSERT INTO Peer (permid) VALUES (?)", (u'permid',))
+        assert self.nr_committed() == 0
+
+        sleep(sqlitecachedb.GROUP_COMMIT_INTERVAL * 4)
+        assert self.nr_committed() == 1
+        stats = self.db.get_commit_stats()
+        assert stats['commits'] == 1, stats
+        assert stats['max_write_age'] >= sqlitecachedb.GROUP_COMMIT_INTERVAL, stats
+
+    def test_commit_on_size_cancels_timer(self):
+        interval = sqlitecachedb.GROUP_COMMIT_INTERVAL
+        sqlitecachedb.GROUP_COMMIT_INTERVAL = 1.0
+        try:
+            # arms the group commit timer, which should be cancelled by the commit on size
+            self.db.execute_write(u"INSERT INTO Peer (permid) VALUES (?)", (u'permid',))
+            sleep(0.5)
+            def write():
+                self.db.executemany(u"INSERT INTO Peer (permid) VALUES (?)", [(u'permid%d' % i,) for i in range(sqlitecachedb.GROUP_COMMIT_SIZE)])
+                self.db.execute_write(u"INSERT INTO Peer (permid) VALUES (?)", (u'last',))
+            self.callback.call(write)
+
+            # the first timer would have expired, the timer of the last write did not
+            sleep(0.75)
+            assert self.nr_committed() == sqlitecachedb.GROUP_COMMIT_SIZE + 1
+
+            sleep(0.75)
+            assert self.nr_committed() == sqlitecachedb.GROUP_COMMIT_SIZE + 2
+        finally:
+            sqlitecachedb.GROUP_COMMIT_INTERVAL = interval
+
+    def test_commit_callback(self):
+        flushed = []
+        def flush():
+            if not flushed:
+                flushed.append(True)
+                self.db.execute_write(u"INSERT INTO Peer (permid) VALUES (?)", (u'flushed',))
+
+        self.db.attach_commit_callback(flush)
+        try:
+            self.db.execute_write(u"INSERT INTO Peer (permid) VALUES (?)", (u'permid',))
+            sleep(sqlitecachedb.GROUP_COMMIT_INTERVAL * 4)
+        finally:
+            self.db.detach_commit_callback(flush)
+
+        assert self.nr_committed() == 2
+        assert self.db.get_commit_stats()['max_batch_size'] >= 2
+
+    def test_commit_buffered(self):
+        # buffered writes are committed without any other write
+        buffered = [(u'buffered',)]
+        def flush():
+            if buffered:
+                self.db.executemany(u"INSERT INTO Peer (permid) VALUES (?)", buffered)
+                del buffered[:]
+
+        self.db.attach_commit_callback(flush)
+        try:
+            self.db.schedule_group_commit()
+            sleep(sqlitecachedb.GROUP_COMMIT_INTERVAL * 4)
+        finally:
+            self.db.detach_commit_callback(flush)
+
+        assert self.nr_committed() == 1
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestGroupCommit))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
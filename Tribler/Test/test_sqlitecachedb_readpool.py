@@ -0,0 +1,74 @@
+import os
+import unittest
+import tempfile
+import shutil
+from threading import Thread
+
+from Tribler.Core.CacheDB.sqlitecachedb import SQLiteCacheDB, CURRENT_MAIN_DB_VERSION, ReadConnectionPool
+
+CREATE_SQL_FILE = os.path.join('..',"schema_sdb_v"+str(CURRENT_MAIN_DB_VERSION)+".sql")
+
+def on_dbthread(func, *args):
+    # writes have to be performed by the 'Dispersy' thread
+    result = []
+    t = Thread(target=lambda: result.append(func(*args)), name='Dispersy')
+    t.start()
+    t.join()
+    return result[0] if result else None
+
+class TestReadConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.db = SQLiteCacheDB.getInstance()
+        on_dbthread(self.db.initDB, os.path.join(self.tempdir, 'tribler.sdb'), CREATE_SQL_FILE)
+
+    def tearDown(self):
+        on_dbthread(self.db.close, True)
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_accepts(self):
+        assert ReadConnectionPool.accepts(u"SELECT * FROM Peer")
+        assert ReadConnectionPool.accepts(u"  select * FROM Peer")
+        assert not ReadConnectionPool.accepts(u"INSERT INTO Peer (permid) VALUES (?)")
+        assert not ReadConnectionPool.accepts(u"VACUUM")
+
+    def test_read_from_pool(self):
+        on_dbthread(self.db.execute_write, u"INSERT INTO Peer (permid) VALUES (?)", (u'permid',))
+
+        assert self.db.fetchone(u"SELECT permid FROM Peer") == u'permid'
+        assert self.db.fetchall(u"SELECT permid FROM Peer") == [(u'permid',)]
+        assert self.db.fetchone(u"SELECT permid FROM Peer WHERE permid = ?", (u'unknown',)) is None
+        assert len(self.db.read_pool.cursors) == 1
+
+        stats = self.db.get_read_stats()
+        assert stats[u"SELECT permid FROM Peer"]['count'] == 2
+        assert stats[u"SELECT permid FROM Peer"]['pooled'] == 2
+
+    def test_concurrent_readers(self):
+        on_dbthread(self.db.executemany, u"INSERT INTO Peer (permid) VALUES (?)", [(u'permid%d' % i,) for i in range(100)])
+
+        results = []
+        def reader():
+            for _ in range(10):
+                results.append(self.db.fetchone(u"SELECT COUNT(*) FROM Peer"))
+
+        threads = [Thread(target=reader) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert results == [100] * 80
+        assert len(self.db.read_pool.cursors) <= self.db.read_pool.size
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestReadConnectionPool))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# Written by Niels Zeilemaker
+# see LICENSE.txt for license information
+
+import os
+import sys
+import socket
+import tempfile
+import unittest
+from threading import Event
+from time import time, sleep
+
+import Tribler.Core.Swift.SwiftProcess as SwiftProcessModule
+from Tribler.Core.Swift.SwiftProcess import SwiftProcess
+
+NR_MESSAGES = 20000
+MESSAGE_SIZE = 1024
+ROOTHASH = '\x01' * 20
+
+class FakeProcessMgr:
+    def __init__(self):
+        self.connections_lost = 0
+
+    def connection_lost(self, port):
+        self.connections_lost += 1
+
+class FakeDispersyDownload:
+    def __init__(self, expected):
+        self.expected = expected
+        self.received = 0
+        self.done = Event()
+
+    def i2ithread_data_came_in(self, session, address, data):
+        assert session == 'sess' and address == ('127.0.0.1', 1234) and len(data) == MESSAGE_SIZE
+        self.received += 1
+        if self.received == self.expected:
+            self.done.set()
+
+class FakeDownload:
+    def __init__(self):
+        self.info = None
+        self.done = Event()
+
+    def i2ithread_info_callback(self, *args):
+        self.info = args
+        self.done.set()
+
+class TestSwiftCmdGw(unittest.TestCase):
+
+    def setUp(self):
+        self.original_binary = SwiftProcessModule.BINARY_CMDGW
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        SwiftProcessModule.BINARY_CMDGW = self.original_binary
+        os.environ.pop('STUB_SWIFT_TEXT_ONLY', None)
+
+    def start_swift(self, binary):
+        SwiftProcessModule.BINARY_CMDGW = binary
+
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.bind(('127.0.0.1', 0))
+        cmdport = s.getsockname()[1]
+        s.close()
+
+        binpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_swift.py')
+        sp = SwiftProcess(binpath, self.workdir, None, None, None, cmdport, FakeProcessMgr())
+
+        # wait until the stub is listening
+        for _ in xrange(50):
+            try:
+                socket.create_connection(('127.0.0.1', cmdport)).close()
+                break
+            except socket.error:
+                sleep(0.1)
+
+        sp.start_cmd_connection()
+
+        # in text mode, commands written before the connection is made are lost
+        for _ in xrange(50):
+            try:
+                sp.fastconn.sock.getpeername()
+                break
+            except (AttributeError, socket.error):
+                sleep(0.1)
+        return sp
+
+    def run_protocol(self, binary, expect_binary):
+        sp = self.start_swift(binary)
+        try:
+            # INFO
+            d = FakeDownload()
+            sp.roothash2dl[ROOTHASH] = d
+            sp.send_start('tswift://127.0.0.1:1/' + ROOTHASH.encode('HEX'))
+            assert d.done.wait(10)
+            assert d.info == (4, 0.5, 100, 1.0, 2.0, 3, 4, 5, 6), d.info
+            assert sp.fastconn.binary == expect_binary
+            # the reply to the negotiation stops its timer
+            assert sp.fastconn.negotiate_timer is None
+
+            # TUNNELSEND and TUNNELRECV
+            dispersy = sp.roothash2dl['dispersy'] = FakeDispersyDownload(NR_MESSAGES)
+            data = 'x' * MESSAGE_SIZE
+            t1 = time()
+            for _ in xrange(NR_MESSAGES):
+                sp.send_tunnel('sess', ('127.0.0.1', 1234), data)
+            t2 = time()
+            assert dispersy.done.wait(60), dispersy.received
+            t3 = time()
+
+            print "%s: sent %d messages/sec, received %d messages/sec" % ('binary' if expect_binary else 'text', NR_MESSAGES / (t2 - t1), NR_MESSAGES / (t3 - t1))
+        finally:
+            sp.early_shutdown()
+            sp.network_shutdown()
+
+    def test_text(self):
+        self.run_protocol(False, False)
+
+    def test_binary(self):
+        self.run_protocol(True, True)
+
+    def test_fallback(self):
+        os.environ['STUB_SWIFT_TEXT_ONLY'] = '1'
+        self.run_protocol(True, False)
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestSwiftCmdGw))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
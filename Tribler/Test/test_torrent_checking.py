@@ -0,0 +1,52 @@
+# Written by Niels Zeilemaker
+# see LICENSE.txt for license information
+
+import unittest
+from threading import Lock, Event
+from collections import deque
+
+from Tribler.TrackerChecking.TorrentChecking import TorrentChecking
+
+ANNOUNCE = 'udp://tracker:80/announce'
+
+class TestTorrentChecking(unittest.TestCase):
+
+    def setUp(self):
+        # the singleton starts the scraper and reads the database, only the bookkeeping is needed here
+        self.checker = TorrentChecking.__new__(TorrentChecking)
+        self.checker.shouldquit = False
+        self.checker.queue = deque()
+        self.checker.queueLock = Lock()
+        self.checker.checking = {}
+        self.checker.checkingLock = Lock()
+        self.checker.results = []
+        self.checker.sleepEvent = Event()
+
+    def test_piggybacked(self):
+        torrent = {'infohash': 'a'}
+        self.checker.checking['a'] = [torrent, [], {'a': (-2, -2)}, ANNOUNCE]
+
+        # b failed, c was answered, d is unknown to the tracker
+        self.checker.onScrapeResults(ANNOUNCE, {'a': (5, 1), 'b': (-1, -1), 'c': (3, 2), 'd': (-2, -2), 'e': (-3, -3)})
+
+        self.assertEqual(self.checker.results, [(None, {'c': (3, 2)}), (torrent, {'a': (5, 1)})])
+        assert not self.checker.checking
+
+    def test_checked_failure(self):
+        # the torrents we check ourselves do record a failure
+        torrent = {'infohash': 'a'}
+        self.checker.checking['a'] = [torrent, [], {'a': (-2, -2)}, ANNOUNCE]
+        self.checker.onScrapeResults(ANNOUNCE, {'a': (-1, -1), 'b': (-1, -1)})
+
+        self.assertEqual(self.checker.results, [(torrent, {'a': (-1, -1)})])
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestTorrentChecking))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+# see LICENSE.txt for license information
+
+import os
+import unittest
+import tempfile
+import shutil
+from time import sleep
+
+from Tribler.dispersy.callback import Callback
+from Tribler.Core.simpledefs import NTFY_TORRENTS, NTFY_INSERT
+from Tribler.Core.CacheDB.Notifier import Notifier
+import Tribler.Core.CacheDB.sqlitecachedb as sqlitecachedb
+from Tribler.Core.CacheDB.sqlitecachedb import SQLiteCacheDB, CURRENT_MAIN_DB_VERSION, try_register, unregister, bin2str, str2bin
+from Tribler.Core.CacheDB.SqliteCacheDBHandler import TorrentDBHandler, ChannelCastDBHandler, VoteCastDBHandler
+
+CREATE_SQL_FILE = os.path.join('..',"schema_sdb_v"+str(CURRENT_MAIN_DB_VERSION)+".sql")
+
+NR_TORRENTS = 100
+KEYS = ['T.torrent_id', 'infohash', 'swift_hash', 'swift_torrent_hash', 'T.name', 'torrent_file_name', 'length', 'category_id', 'status_id', 'num_seeders', 'num_leechers']
+NUM_SEEDERS = KEYS.index('num_seeders')
+REMOTE_KEYS = ['infohash', 'T.name', 'T.length', 'T.num_files', 'T.category_id', 'T.creation_date', 'num_seeders', 'T.num_leechers', 'swift_hash', 'swift_torrent_hash']
+MATCHES = len(KEYS) + 1 # after the channel_id
+
+class TestTorrentSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+        self.callback = Callback()
+        self.callback.start("Dispersy") # WARNING NAME SIGNIFICANT
+
+        self.db = SQLiteCacheDB.getInstance()
+        self.callback.call(self.db.initDB, (os.path.join(self.tempdir, 'tribler.sdb'), CREATE_SQL_FILE))
+        try_register(self.db, self.callback)
+        sleep(0.5)
+
+        self.callback.call(self.create_torrents)
+
+        self.notifier = Notifier.getInstance()
+        self.torrent_db = TorrentDBHandler.getInstance()
+        self.torrent_db.channelcast_db = ChannelCastDBHandler.getInstance()
+        self.torrent_db.channelcast_db.votecast_db = VoteCastDBHandler.getInstance()
+        self.torrent_db.notifier.add_observer(self.torrent_db._invalidateSearchCache, NTFY_TORRENTS, [NTFY_INSERT])
+
+    def tearDown(self):
+        TorrentDBHandler.delInstance()
+        ChannelCastDBHandler.delInstance()
+        VoteCastDBHandler.delInstance()
+        Notifier.delInstance()
+
+        self.callback.call(self.db.commitNow, kargs={'exiting': True})
+        self.callback.call(self.db.close, (True, ))
+        unregister()
+        self.callback.stop()
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def create_torrents(self):
+        """ Torrents named 'video <i> red|blue', half of them collected, and some of them in channel 1
+        or 2.  Torrents named 'red spam <i>' are only in channel 3, which I marked as spam """
+        self.db.execute_write(u"INSERT INTO _Channels (id, dispersy_cid, name, nr_favorite, nr_spam) VALUES (1, 'cid1', 'one', 5, 0)")
+        self.db.execute_write(u"INSERT INTO _Channels (id, dispersy_cid, name, nr_favorite, nr_spam) VALUES (2, 'cid2', 'two', 1, 3)")
+        self.db.execute_write(u"INSERT INTO _Channels (id, dispersy_cid, name, nr_favorite, nr_spam) VALUES (3, 'cid3', 'three', 9, 0)")
+        self.db.execute_write(u"INSERT INTO _ChannelVotes (channel_id, voter_id, vote) VALUES (3, NULL, -1)")
+        for i in xrange(NR_TORRENTS):
+            self.insert_torrent(i, i % 2 == 0)
+            if i % 5 == 0:
+                self.db.execute_write(u"INSERT INTO _ChannelTorrents (torrent_id, channel_id, name) VALUES (?, ?, ?)", (i + 1, 1 + i % 2, u"video %d" % i))
+            if i % 15 == 0:
+                self.db.execute_write(u"INSERT INTO _ChannelTorrents (torrent_id, channel_id, name) VALUES (?, ?, ?)", (i + 1, 2 - i % 2, u"video %d" % i))
+            if i % 20 == 0:
+                self.db.execute_write(u"INSERT INTO _ChannelTorrents (torrent_id, channel_id, name) VALUES (?, ?, ?)", (i + 1, 3, u"video %d" % i))
+        for i in xrange(1000, 1005):
+            self.insert_torrent(i, True, u"red spam %d" % i)
+            self.db.execute_write(u"INSERT INTO _ChannelTorrents (torrent_id, channel_id, name) VALUES (?, ?, ?)", (i + 1, 3, u"red spam %d" % i))
+        self.db.commitNow()
+
+    def insert_torrent(self, i, collected, name = None):
+        infohash = bin2str('%020d' % i)
+        name = name or u"video %d %s" % (i, u"red" if i % 4 == 0 else u"blue")
+        self.db.execute_write(u"INSERT INTO Torrent (torrent_id, infohash, name, torrent_file_name, length, creation_date, num_files, category_id, num_seeders, num_leechers) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                              (i + 1, infohash, name, u"%d.torrent" % i if collected else None, 1000 * i, 1234567890 + i, 1 + i % 4, 1, (i * 37) % NR_TORRENTS, i % 3))
+        self.db.execute_write(u"INSERT INTO FullTextIndex (rowid, swarmname, filenames, fileextensions) VALUES (?, ?, ?, ?)",
+                              (i + 1, name, name + u" avi", u"avi"))
+
+    def search(self, local = True):
+        return self.torrent_db.searchNames([u'video'], local = local, keys = KEYS)
+
+    def test_cache_hit(self):
+        results = self.search()
+        assert len(results) == NR_TORRENTS
+
+        # the cached results are equal, but not the same objects
+        cached = self.search()
+        assert cached == results
+        assert cached[0] is not results[0]
+        assert len(self.torrent_db._search_cache) == 1
+
+        # the seeders are sorted in descending order, torrents without seeders last
+        seeders = [result[NUM_SEEDERS] for result in results]
+        assert seeders == sorted(seeders, reverse = True)
+
+        remote = self.search(local = False)
+        assert len(remote) == 25
+        assert len(self.torrent_db._search_cache) == 2
+
+    def test_mutation(self):
+        results = self.search()
+        results[0][1] = 'modified'
+        results[0][MATCHES]['swarmname'].add(u'modified')
+        results.pop()
+
+        cached = self.search()
+        assert len(cached) == NR_TORRENTS
+        assert cached[0][1] != 'modified'
+        assert cached[0][MATCHES]['swarmname'] == set([u'video'])
+
+        # also the results of the search that filled the cache
+        self.torrent_db._invalidateSearchCache()
+        results = self.search()
+        results[0][MATCHES]['swarmname'].clear()
+        assert self.search()[0][MATCHES]['swarmname'] == set([u'video'])
+
+    def test_invalidation(self):
+        assert len(self.search()) == NR_TORRENTS
+
+        def write():
+            self.insert_torrent(NR_TORRENTS, True)
+            self.db.commitNow()
+        self.callback.call(write)
+        self.notifier.notify(NTFY_TORRENTS, NTFY_INSERT, '%020d' % NR_TORRENTS)
+        sleep(0.5)
+
+        assert len(self.search()) == NR_TORRENTS + 1
+
+    def test_uncommitted(self):
+        # the read pool does not see the new torrent until the commit, the result is not cached
+        interval = sqlitecachedb.GROUP_COMMIT_INTERVAL
+        sqlitecachedb.GROUP_COMMIT_INTERVAL = 5.0
+        try:
+            self.callback.call(self.insert_torrent, (NR_TORRENTS, True))
+            assert len(self.search()) == NR_TORRENTS
+            assert len(self.torrent_db._search_cache) == 0
+        finally:
+            sqlitecachedb.GROUP_COMMIT_INTERVAL = interval
+
+        self.callback.call(self.db.commitNow)
+        assert len(self.search()) == NR_TORRENTS + 1
+        assert len(self.torrent_db._search_cache) == 1
+
+    def old_search_remote(self, keywords):
+        """ The rows SearchCommunity created from searchNames before searchNamesRemote """
+        results = []
+        for dbresult in self.torrent_db.searchNames(keywords, local = False, keys = REMOTE_KEYS):
+            channel_details = dbresult[-10:]
+
+            dbresult = list(dbresult[:10])
+            dbresult[2] = long(dbresult[2])
+            dbresult[3] = int(dbresult[3])
+            dbresult[4] = [self.torrent_db.id2category[dbresult[4]],]
+            dbresult[5] = long(dbresult[5])
+            dbresult[6] = int(dbresult[6] or 0)
+            dbresult[7] = int(dbresult[7] or 0)
+            if dbresult[8]:
+                dbresult[8] = str(dbresult[8])
+            if dbresult[9]:
+                dbresult[9] = str(dbresult[9])
+
+            if channel_details[1]:
+                channel_details[1] = str(channel_details[1])
+            dbresult.append(channel_details[1])
+
+            results.append(tuple(dbresult))
+        return results
+
+    def test_search_remote(self):
+        # the top 25 of 50 collected torrents, and 25 torrents without the spam ones
+        for keywords in ([u'video'], [u'red']):
+            expected = self.old_search_remote(keywords)
+            results = self.torrent_db.searchNamesRemote(keywords, limit = 25)
+            assert len(results) == 25
+            self.assertEqual(results, expected)
+
+        # pages follow each other
+        results = self.torrent_db.searchNamesRemote([u'video'], limit = 10) + self.torrent_db.searchNamesRemote([u'video'], limit = 15, offset = 10)
+        self.assertEqual(results, self.old_search_remote([u'video']))
+
+    def test_search_remote_my_channel(self):
+        # searchNames only preferred my channel if it was merged first, searchNamesRemote always does
+        expected = self.old_search_remote([u'red'])
+        self.torrent_db.channelcast_db._channel_id = 2
+        in_my_channel = set(str2bin(infohash) for infohash, in self.db.fetchall(u"SELECT T.infohash FROM Torrent T, _ChannelTorrents C WHERE T.torrent_id = C.torrent_id AND C.channel_id = 2"))
+        expected = [result[:-1] + ('cid2',) if result[0] in in_my_channel else result for result in expected]
+
+        results = self.torrent_db.searchNamesRemote([u'red'], limit = 25)
+        assert 'cid2' in [result[-1] for result in results]
+        self.assertEqual(results, expected)
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestTorrentSearch))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
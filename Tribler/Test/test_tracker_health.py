@@ -0,0 +1,116 @@
+# Written by Niels Zeilemaker
+# see LICENSE.txt for license information
+
+import unittest
+
+import Tribler.TrackerChecking.TrackerHealth as TrackerHealthModule
+from Tribler.TrackerChecking.TrackerHealth import TrackerHealth, BACKOFF_BASE, BACKOFF_MAX
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+class TestTrackerHealth(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.original_time = TrackerHealthModule.time
+        TrackerHealthModule.time = self.clock
+
+        TrackerHealth.delInstance()
+        self.health = TrackerHealth.getInstance()
+
+    def tearDown(self):
+        TrackerHealth.delInstance()
+        TrackerHealthModule.time = self.original_time
+
+    def test_backoff(self):
+        tracker = 'udp://dead.tracker:80'
+        for failures in xrange(1, 20):
+            self.health.registerFailure(tracker)
+            assert not self.health.isAvailable(tracker)
+
+            backoff = self.health.trackers[tracker].next_check - self.clock.now
+            assert backoff == min(BACKOFF_BASE * 2 ** (failures - 1), BACKOFF_MAX), backoff
+            self.clock.now += backoff
+            assert self.health.isAvailable(tracker)
+
+        self.health.registerSuccess(tracker, 0.1)
+        assert self.health.isAvailable(tracker)
+        assert self.health.trackers[tracker].failures == 0
+
+    def test_interval(self):
+        tracker = 'http://busy.tracker/announce'
+        self.health.registerSuccess(tracker, 0.5, 900)
+        assert not self.health.isAvailable(tracker)
+
+        self.clock.now += 900
+        assert self.health.isAvailable(tracker)
+
+        self.health.registerInterval(tracker, 1800)
+        self.clock.now += 900
+        assert not self.health.isAvailable(tracker)
+
+    def test_sort(self):
+        self.health.registerSuccess('http://fast/announce', 0.1)
+        self.health.registerSuccess('udp://slow:80', 2.0)
+        self.health.registerSuccess('udp://fast:80', 0.1)
+        self.health.registerFailure('udp://dead:80')
+
+        trackers = ['udp://dead:80', 'http://fast/announce', 'udp://slow:80', 'udp://unknown:80', 'udp://fast:80']
+        assert self.health.sortTrackers(trackers) == ['udp://unknown:80', 'udp://fast:80', 'udp://slow:80', 'http://fast/announce']
+
+    def test_persist(self):
+        self.health.registerSuccess('udp://fast:80', 0.1)
+        self.health.registerFailure('udp://dead:80')
+        rows = self.health.getDirty()
+        assert len(rows) == 2
+        assert self.health.getDirty() == []
+
+        TrackerHealth.delInstance()
+        health = TrackerHealth.getInstance()
+        health.load(rows)
+        assert not health.isAvailable('udp://dead:80')
+        assert health.trackers['udp://fast:80'].rtt == 0.1
+
+    def test_wasted_scrapes(self):
+        # half of the trackers are dead, scrape every tracker every minute for a day
+        trackers = ['udp://tracker%d:80' % i for i in xrange(20)]
+        dead = set(trackers[::2])
+
+        def simulate(use_health):
+            for _ in xrange(24 * 60):
+                for tracker in trackers:
+                    if use_health and not self.health.isAvailable(tracker):
+                        continue
+
+                    if tracker in dead:
+                        self.health.registerFailure(tracker)
+                    else:
+                        self.health.registerSuccess(tracker, 0.1)
+                self.clock.now += 60
+            return self.health.getStats()
+
+        before = simulate(False)
+        TrackerHealth.delInstance()
+        self.health = TrackerHealth.getInstance()
+        after = simulate(True)
+
+        print "Without backoff: %d scrapes, %.1f%% wasted" % (before['scrapes'], before['wasted_fraction'] * 100)
+        print "With backoff: %d scrapes, %.1f%% wasted" % (after['scrapes'], after['wasted_fraction'] * 100)
+        assert before['wasted_fraction'] == 0.5
+        assert after['wasted_fraction'] < 0.01
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestTrackerHealth))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
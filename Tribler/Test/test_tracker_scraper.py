@@ -0,0 +1,237 @@
+# Written by Niels Zeilemaker
+# see LICENSE.txt for license information
+
+import unittest
+import socket
+from struct import pack, unpack_from
+from threading import Thread, Event, Lock
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from urlparse import urlparse, parse_qs
+from time import time, sleep
+
+from Tribler.Core.Utilities.bencode import bencode
+from Tribler.TrackerChecking.TrackerScraper import TrackerScraper, UDP_MAX_INFOHASHES
+from Tribler.TrackerChecking.TrackerHealth import TrackerHealth
+
+NR_INFOHASHES = 2000
+
+def create_infohashes(nr):
+    return [pack('!I', i) * 5 for i in xrange(nr)]
+
+def status(infohash):
+    nr, = unpack_from('!I', infohash)
+    return nr % 100, nr % 7
+
+class FakeUDPTracker(Thread):
+    def __init__(self, drop_first = 0, drop_scrapes = False):
+        Thread.__init__(self)
+        self.setDaemon(True)
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.settimeout(0.1)
+        self.port = self.socket.getsockname()[1]
+
+        self.drop_first = drop_first
+        self.drop_scrapes = drop_scrapes
+        self.connects = self.scrapes = 0
+        self.shouldquit = False
+        self.start()
+
+    def run(self):
+        while not self.shouldquit:
+            try:
+                data, address = self.socket.recvfrom(8192)
+            except socket.timeout:
+                continue
+
+            if self.drop_first:
+                self.drop_first -= 1
+                continue
+
+            connection_id, action, transaction_id = unpack_from('!qii', data)
+            if action == 0:
+                self.connects += 1
+                self.socket.sendto(pack('!iiq', 0, transaction_id, 42), address)
+            elif action == 2:
+                assert connection_id == 42
+                self.scrapes += 1
+                if self.drop_scrapes:
+                    continue
+
+                response = [pack('!ii', 2, transaction_id)]
+                for i in xrange(16, len(data), 20):
+                    seeders, leechers = status(data[i:i + 20])
+                    response.append(pack('!iii', seeders, 0, leechers))
+                self.socket.sendto(''.join(response), address)
+
+    def stop(self):
+        self.shouldquit = True
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class FakeHTTPTracker(Thread):
+    def __init__(self):
+        Thread.__init__(self)
+        self.setDaemon(True)
+
+        self.lock = Lock()
+        self.running = self.max_running = self.requests = 0
+
+        tracker = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with tracker.lock:
+                    tracker.requests += 1
+                    tracker.running += 1
+                    tracker.max_running = max(tracker.max_running, tracker.running)
+
+                sleep(0.05)
+                files = {}
+                for infohash in parse_qs(urlparse(self.path).query)['info_hash']:
+                    seeders, leechers = status(infohash)
+                    files[infohash] = {'complete': seeders, 'incomplete': leechers, 'downloaded': 0}
+                response = bencode({'files': files})
+
+                with tracker.lock:
+                    tracker.running -= 1
+
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.port = self.server.server_address[1]
+        self.start()
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+
+class TestTrackerScraper(unittest.TestCase):
+
+    def setUp(self):
+        self.results = {}
+        self.lock = Lock()
+        self.done = Event()
+        self.expected = 0
+
+        self.scraper = TrackerScraper(self.on_results, udp_timeout = 0.2)
+        self.scraper.start()
+
+    def tearDown(self):
+        self.scraper.shutdown()
+
+    def on_results(self, announce, results):
+        with self.lock:
+            self.results.update(results)
+            if len(self.results) >= self.expected:
+                self.done.set()
+
+    def scrape(self, announce, infohashes, per_request = 1):
+        self.expected = len(infohashes)
+
+        start = time()
+        for i in xrange(0, len(infohashes), per_request):
+            self.scraper.scrape(announce, infohashes[i:i + per_request])
+        self.done.wait(30)
+        return time() - start
+
+    def test_udp(self):
+        tracker = FakeUDPTracker()
+        try:
+            infohashes = create_infohashes(NR_INFOHASHES)
+            took = self.scrape('udp://127.0.0.1:%d/announce' % tracker.port, infohashes)
+            print "UDP: scraped %d infohashes in %.2f seconds" % (len(infohashes), took)
+
+            assert len(self.results) == len(infohashes)
+            assert all(self.results[infohash] == status(infohash) for infohash in infohashes)
+
+            # one connect, infohashes are batched
+            assert tracker.connects == 1, tracker.connects
+            assert tracker.scrapes <= len(infohashes) / (UDP_MAX_INFOHASHES / 2), tracker.scrapes
+        finally:
+            tracker.stop()
+
+    def test_udp_retransmit(self):
+        tracker = FakeUDPTracker(drop_first = 2)
+        try:
+            infohashes = create_infohashes(10)
+            self.scrape('udp://127.0.0.1:%d/announce' % tracker.port, infohashes, 10)
+
+            assert all(self.results[infohash] == status(infohash) for infohash in infohashes)
+            assert self.scraper.get_stats()['udp_retransmits'] >= 2
+        finally:
+            tracker.stop()
+
+    def test_udp_timeout(self):
+        tracker = FakeUDPTracker(drop_first = 100)
+        try:
+            infohashes = create_infohashes(10)
+            self.scrape('udp://127.0.0.1:%d/announce' % tracker.port, infohashes, 10)
+
+            assert all(self.results[infohash] == (-1, -1) for infohash in infohashes)
+            assert self.scraper.get_stats()['udp_timeouts'] == 1
+        finally:
+            tracker.stop()
+
+    def test_udp_failure_once(self):
+        TrackerHealth.delInstance()
+        tracker = FakeUDPTracker(drop_scrapes = True)
+        try:
+            announce = 'udp://127.0.0.1:%d/announce' % tracker.port
+            infohashes = create_infohashes(UDP_MAX_INFOHASHES * 3)
+            self.scrape(announce, infohashes, len(infohashes))
+
+            assert all(self.results[infohash] == (-1, -1) for infohash in infohashes)
+            assert self.scraper.get_stats()['udp_timeouts'] == 3
+
+            # all batches failed in the same round
+            self.assertEqual(TrackerHealth.getInstance().trackers[announce].failures, 1)
+
+            # the next round is registered again
+            self.results = {}
+            self.done.clear()
+            self.scrape(announce, infohashes[:10], 10)
+            self.assertEqual(TrackerHealth.getInstance().trackers[announce].failures, 2)
+        finally:
+            tracker.stop()
+            TrackerHealth.delInstance()
+
+    def test_http_bad_url(self):
+        # getUrl can not quote a non-ascii unicode infohash, the infohash is still reported
+        infohashes = [u'\xe9' * 20]
+        self.scrape('http://127.0.0.1:1/announce', infohashes)
+        self.assertEqual(self.results, {infohashes[0]: (-1, -1)})
+
+    def test_http(self):
+        tracker = FakeHTTPTracker()
+        try:
+            infohashes = create_infohashes(NR_INFOHASHES / 4)
+            took = self.scrape('http://127.0.0.1:%d/announce' % tracker.port, infohashes, 5)
+            print "HTTP: scraped %d infohashes in %.2f seconds using %d requests" % (len(infohashes), took, tracker.requests)
+
+            assert len(self.results) == len(infohashes)
+            assert all(self.results[infohash] == status(infohash) for infohash in infohashes)
+            assert tracker.max_running <= self.scraper.http_per_tracker, tracker.max_running
+        finally:
+            tracker.stop()
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestTrackerScraper))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
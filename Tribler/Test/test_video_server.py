@@ -9,7 +9,7 @@ import time
 import socket
 from traceback import print_exc,print_stack
 
-from Tribler.Video.VideoServer import VideoHTTPServer
+from Tribler.Video.VideoServer import VideoHTTPServer,NR_WORKERS
 
 
 DEBUG=False
@@ -56,14 +56,19 @@ class TestVideoHTTPServer(unittest.TestCase):
         self.range_test(self.sourcesize-100,None,self.sourcesize)
         self.range_test(None,100,self.sourcesize)
         self.range_test(115,214,self.sourcesize,setset=True)
+        self.keepalive_test()
+        self.keepalive_test(filename=self.sourcefn)
+        self.idle_connections_test()
 
     #
     # Internal
     #
-    def register_file_stream(self):
+    def register_file_stream(self,filename=None):
         stream = open(self.sourcefn,"rb")
 
         streaminfo = { 'mimetype': 'video/x-ms-wmv', 'stream': stream, 'length': self.sourcesize }
+        if filename is not None:
+            streaminfo['filename'] = filename
         
         self.serv.set_inputstream(streaminfo,"/stream")
 
@@ -94,7 +99,8 @@ class TestVideoHTTPServer(unittest.TestCase):
         head += "Range: bytes="
         head += self.create_range_str(firstbyte,lastbyte)
         if setset:
-            # Make into set of byte ranges, VideoHTTPServer should refuse.
+            # Make into set of byte ranges, VideoHTTPServer should send
+            # them as multipart/byteranges.
             head += ",0-99"
         head += "\r\n"
         
@@ -139,7 +145,8 @@ class TestVideoHTTPServer(unittest.TestCase):
                     self.assert_(line.find("206") != -1) # Partial content
                 else:
                     self.assert_(line.startswith("HTTP/1."))
-                    self.assert_(line.find("416") != -1) # Requested Range Not Satisfiable
+                    self.assert_(line.find("206") != -1) # Partial content
+                    self.multipart_test(s,[(expfirstbyte,explastbyte),(0,99)])
                     return
 
             elif line.startswith("Content-Range:"):
@@ -181,6 +188,100 @@ class TestVideoHTTPServer(unittest.TestCase):
                 print >> sys.stderr,"test: Timeout, video server didn't respond with requested bytes, possibly bug in Python impl of HTTP"
                 print_exc()
 
+    def multipart_test(self,s,ranges):
+        # The status line was read by range_test
+        headers = self.read_headers(s,status=False)
+        self.assert_(headers['Content-Type'].startswith("multipart/byteranges; boundary="))
+        boundary = headers['Content-Type'].split("boundary=")[1]
+
+        body = self.recvall(s,int(headers['Content-Length']))
+        parts = body.split("\r\n--"+boundary)
+        self.assertEqual(parts[0],"")
+        self.assertEqual(parts[-1],"--\r\n")
+
+        expdata = open(self.sourcefn,"rb").read()
+        self.assertEqual(len(parts),len(ranges)+2)
+        for (firstbyte,lastbyte), part in zip(ranges,parts[1:-1]):
+            partheader, data = part.split("\r\n\r\n",1)
+            self.assert_("Content-Type: video/x-ms-wmv" in partheader)
+            self.assert_("Content-Range: bytes %d-%d/%d" % (firstbyte,lastbyte,self.sourcesize) in partheader)
+            self.assertEqual(data,expdata[firstbyte:lastbyte+1])
+
+    def keepalive_test(self,filename=None):
+        """ Send multiple requests over one persistent connection """
+        print >>sys.stderr,"test: keepalive_test:",filename
+        self.register_file_stream(filename)
+        expdata = open(self.sourcefn,"rb").read()
+
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.connect(('127.0.0.1', self.port))
+        s.settimeout(10.0)
+        for firstbyte, lastbyte in [(0,9999),(50000,None),(1000,1999)]:
+            head = self.get_std_header()
+            head += "Range: bytes="+self.create_range_str(firstbyte,lastbyte)+"\r\n"
+            head += "\r\n"
+            s.send(head)
+
+            headers = self.read_headers(s)
+            self.assertEqual(headers['Connection'],"Keep-Alive")
+            if lastbyte is None:
+                lastbyte = self.sourcesize-1
+            data = self.recvall(s,int(headers['Content-Length']))
+            self.assertEqual(data,expdata[firstbyte:lastbyte+1])
+        s.close()
+
+        stats = self.serv.get_stream_stats("/stream")
+        print >>sys.stderr,"test: stats",stats
+        self.assertEqual(stats['requests'],3)
+        self.assertEqual(stats['bytes'],10000+self.sourcesize-50000+1000)
+        self.assert_(stats['ttfb'] is not None)
+
+    def idle_connections_test(self):
+        """ Idle persistent connections do not keep other requests waiting """
+        print >>sys.stderr,"test: idle_connections_test"
+        self.register_file_stream()
+
+        idle = []
+        for i in range(NR_WORKERS+1):
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.connect(('127.0.0.1', self.port))
+            s.settimeout(10.0)
+            s.send(self.get_std_header()+"Range: bytes=0-99\r\n\r\n")
+            headers = self.read_headers(s)
+            self.recvall(s,int(headers['Content-Length']))
+            idle.append(s)
+
+        # Served well before the idle connections time out
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.connect(('127.0.0.1', self.port))
+        s.settimeout(5.0)
+        s.send(self.get_std_header()+"Range: bytes=0-99\r\n\r\n")
+        headers = self.read_headers(s)
+        self.assertEqual(headers['Content-Length'],"100")
+        s.close()
+        for s in idle:
+            s.close()
+
+    def read_headers(self,s,status=True):
+        if status:
+            line = self.readline(s)
+            self.assert_(line.find("206") != -1)
+        headers = {}
+        while True:
+            line = self.readline(s)
+            if line == "\r\n":
+                return headers
+            key, value = line.strip().split(": ",1)
+            headers[key] = value
+
+    def recvall(self,s,size):
+        data = ''
+        while len(data) < size:
+            chunk = s.recv(size-len(data))
+            self.assert_(len(chunk) > 0)
+            data += chunk
+        return data
+
     def readline(self,s):
         line = ''
         while True:
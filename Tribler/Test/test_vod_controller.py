@@ -0,0 +1,136 @@
+# Written by Egbert Bouman
+# see LICENSE.txt for license information
+
+import unittest
+import random
+from time import time
+
+from Tribler.Core.Libtorrent.VODController import VODController
+
+PIECE_LENGTH = 256 * 1024
+NR_PIECES = 400
+
+class FakeHandle:
+    def __init__(self):
+        self.deadlines = {}
+
+    def set_piece_deadline(self, piece, deadline):
+        self.deadlines[piece] = deadline
+
+    def reset_piece_deadline(self, piece):
+        self.deadlines.pop(piece, None)
+
+    def piece_finished(self, piece):
+        # libtorrent drops the deadline of a piece once it is downloaded
+        self.deadlines.pop(piece, None)
+
+class TestVODController(unittest.TestCase):
+
+    def setUp(self):
+        self.handle = FakeHandle()
+        self.events = []
+
+    def create_controller(self, pieces, fileoffset = 0, filelength = NR_PIECES * PIECE_LENGTH, bitrate = PIECE_LENGTH):
+        controller = VODController(self.handle, PIECE_LENGTH, fileoffset, filelength, bitrate, 10 * PIECE_LENGTH, pieces,
+                                   lambda: self.events.append('play'), lambda: self.events.append('pause'))
+        controller.check()
+        return controller
+
+    def assert_window(self, controller, pieces):
+        assert controller.available == pieces[controller.start:controller.end].count(True), (controller.start, controller.available)
+
+    def test_startup(self):
+        controller = self.create_controller([False] * NR_PIECES)
+        assert controller.end - controller.start == 11
+        assert self.events == []
+
+        # deadlines at the bitrate of one piece per second
+        assert sorted(self.handle.deadlines.items()) == [(piece, piece * 1000) for piece in range(11)]
+
+        for piece in range(11):
+            controller.piece_finished(piece)
+        assert self.events == ['play']
+        assert controller.get_stats()['startup_latency'] is not None
+        assert controller.deadlines == set()
+
+    def test_rebuffer(self):
+        pieces = [True] * 20 + [False] * (NR_PIECES - 20)
+        controller = self.create_controller(pieces)
+        assert self.events == ['play']
+
+        # move to the end of what is available
+        controller.set_readpos(19 * PIECE_LENGTH)
+        assert self.events == ['play', 'pause']
+        assert controller.get_stats()['rebuffers'] == 1
+        assert set(self.handle.deadlines) == set(range(20, 30))
+
+        for piece in range(20, 30):
+            controller.piece_finished(piece)
+        assert self.events == ['play', 'pause', 'play']
+
+    def test_incremental(self):
+        pieces = [random.random() < 0.7 for _ in range(NR_PIECES)]
+        controller = self.create_controller(list(pieces))
+
+        readpos = 0
+        for _ in range(1000):
+            action = random.random()
+            if action < 0.5:
+                piece = random.randrange(NR_PIECES)
+                pieces[piece] = True
+                self.handle.piece_finished(piece)
+                controller.piece_finished(piece)
+            elif action < 0.9:
+                readpos = min(readpos + random.randrange(2 * PIECE_LENGTH), NR_PIECES * PIECE_LENGTH - 1)
+                controller.set_readpos(readpos)
+            else:
+                readpos = random.randrange(NR_PIECES * PIECE_LENGTH)
+                controller.set_readpos(readpos)
+            self.assert_window(controller, pieces)
+
+            # only the missing pieces in the window have deadlines
+            assert set(self.handle.deadlines) == set(piece for piece in range(controller.start, controller.end) if not pieces[piece])
+
+    def test_multifile(self):
+        # the file starts halfway piece 100 and is 50 pieces long
+        pieces = [True] * 100 + [False] * (NR_PIECES - 100)
+        controller = self.create_controller(pieces, fileoffset = 100 * PIECE_LENGTH + 1000, filelength = 50 * PIECE_LENGTH)
+        assert controller.start == 100 and controller.lastpiece == 150
+        assert set(self.handle.deadlines) == set(range(100, 111))
+
+        controller.set_readpos(45 * PIECE_LENGTH)
+        assert controller.start == 145 and controller.end == 151
+
+    def test_benchmark(self):
+        # piece_finished alerts and read position updates for a 5000 piece torrent,
+        # against copying and slicing the bitfield as the old monitor_vod did
+        nr_pieces = 5000
+        pieces = [False] * nr_pieces
+        controller = self.create_controller(list(pieces), filelength = nr_pieces * PIECE_LENGTH)
+
+        t1 = time()
+        for piece in xrange(nr_pieces):
+            pieces[piece] = True
+            controller.piece_finished(piece)
+            controller.set_readpos(piece * PIECE_LENGTH)
+        took_controller = time() - t1
+
+        t1 = time()
+        for piece in xrange(nr_pieces):
+            bitfield = list(pieces)
+            buffer = bitfield[piece:piece + 11]
+            float(buffer.count(True)) / len(buffer)
+        took_bitfield = time() - t1
+
+        print "%d pieces: controller %.3f seconds, copying the bitfield %.3f seconds" % (nr_pieces, took_controller, took_bitfield)
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestVODController))
+    return suite
+
+def main():
+    unittest.main(defaultTest='test_suite')
+
+if __name__ == '__main__':
+    main()
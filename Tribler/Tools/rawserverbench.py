@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+# Written by Niels Zeilemaker
+# see LICENSE.txt for license information
+#
+# Compares the poll backends of the RawServer by echoing a number of
+# concurrent connections, usage: rawserverbench.py [connections] [message size]
+
+import sys
+import socket
+import select
+from threading import Event, Thread
+from time import time
+
+from Tribler.Core.RawServer.RawServer import RawServer
+from Tribler.Core.RawServer.SocketHandler import SocketHandler
+
+class EchoHandler:
+    def external_connection_made(self, s):
+        s.set_handler(self)
+
+    def data_came_in(self, s, data):
+        s.write(data)
+
+    def connection_flushed(self, s):
+        pass
+
+    def connection_lost(self, s):
+        pass
+
+def start_rawserver(doneflag, poller):
+    sockethandler = SocketHandler(300, False, poller = poller)
+    rawserver = RawServer(doneflag, 60, 300, ipv6_enable = False, sockethandler = sockethandler)
+    rawserver.bind(0, bind = ['127.0.0.1'], reuse = True)
+    port = sockethandler.servers.values()[0].getsockname()[1]
+
+    thread = Thread(target = rawserver.listen_forever, args = (EchoHandler(),))
+    thread.setDaemon(True)
+    thread.start()
+    return rawserver, port
+
+def echo(port, nr_connections, message_size):
+    received = []
+    def client():
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall('x' * message_size)
+        nr_received = 0
+        while nr_received < message_size:
+            data = sock.recv(65536)
+            if not data:
+                break
+            nr_received += len(data)
+        sock.close()
+        received.append(nr_received)
+
+    threads = [Thread(target = client) for _ in xrange(nr_connections)]
+    t1 = time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time() - t1, received.count(message_size)
+
+def run_backend(name, poller, nr_connections, message_size):
+    doneflag = Event()
+    rawserver, port = start_rawserver(doneflag, poller)
+    try:
+        took, nr_echoed = echo(port, nr_connections, message_size)
+    finally:
+        doneflag.set()
+        rawserver.add_task(lambda: None)
+
+    stats = rawserver.get_stats()
+    print "%s: echoed %d/%d x %d bytes in %.2f seconds, %d iterations, %.1f ready fds per poll, %.4f avg task lag" % (name, nr_echoed, nr_connections, message_size, took, stats['iterations'], stats['avg_ready_fds'], stats['avg_task_lag'])
+
+if __name__ == '__main__':
+    nr_connections = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    message_size = int(sys.argv[2]) if len(sys.argv) > 2 else 512 * 1024
+
+    if hasattr(select, 'poll'):
+        run_backend('select.poll', select.poll(), nr_connections, message_size)
+
+    try:
+        from Tribler.Core.RawServer.epollpoll import poll
+    except ImportError:
+        print "epoll not available"
+    else:
+        run_backend('epoll edge-triggered', poll(), nr_connections, message_size)
+        run_backend('epoll level-triggered', poll(edge_triggered = False), nr_connections, message_size)
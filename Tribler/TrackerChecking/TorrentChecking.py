@@ -22,7 +22,6 @@
 
 import sys
 import threading
-from Queue import Queue
 from threading import Thread, Lock, currentThread
 from random import sample
 from time import time
@@ -36,7 +35,9 @@ except ImportError,e:
     prctlimported = False
 
 from Tribler.Core.Utilities.bencode import bdecode
-from Tribler.TrackerChecking.TrackerChecking import multiTrackerChecking
+from Tribler.TrackerChecking.TrackerChecking import getTrackers
+from Tribler.TrackerChecking.TrackerScraper import TrackerScraper, UDP_MAX_INFOHASHES, HTTP_MAX_INFOHASHES
+from Tribler.TrackerChecking.TrackerHealth import TrackerHealth
 
 from Tribler.Core.CacheDB.CacheDBHandler import TorrentDBHandler
 from Tribler.Core.DecentralizedTracking.mainlineDHTChecker import mainlineDHTChecker
@@ -46,6 +47,8 @@ from traceback import print_exc
 from Tribler.Core.CacheDB.sqlitecachedb import forceDBThread
 
 QUEUE_SIZE_LIMIT = 250
+MAX_CHECKING = 100      # number of torrents being scraped concurrently
+UPDATE_BATCH_SIZE = 50  # number of results written to the database at once
 DEBUG = False
 
 class TorrentChecking(Thread):
@@ -72,11 +75,20 @@ class TorrentChecking(Thread):
         self.queueset = set()
         self.queueLock = Lock()
         
-        self.announceQueue = Queue()
+        self.checking = {} # {infohash: [torrent, remaining trackers, announce_dict, current tracker]}
+        self.checkingLock = Lock()
+        self.results = []
+        self.lastSelect = 0
+        
+        self.scraper = TrackerScraper(self.onScrapeResults)
+        self.scraper.start()
         
         self.mldhtchecker = mainlineDHTChecker.getInstance()
         self.torrentdb = TorrentDBHandler.getInstance()
         
+        self.health = TrackerHealth.getInstance()
+        self.health.load(self.torrentdb.getTrackerInfos())
+        
         self.sleepEvent = threading.Event()
         self.torrent_collection_dir = Session.get_instance().get_torrent_collecting_dir()
                 
@@ -98,12 +110,12 @@ class TorrentChecking(Thread):
     def shutdown(self):
         self.shouldquit = True
         self.sleepEvent.set()
-        self.announceQueue.put(None)
+        self.scraper.shutdown()
         
     #add a torrent to the queue, this will schedule a call to update the status etc. for this torrent
     #if the queue is currently full, it will not!
     def addToQueue(self, infohash):
-        if infohash not in self.queueset and len(self.queueset) < QUEUE_SIZE_LIMIT:
+        if infohash not in self.queueset and infohash not in self.checking and len(self.queueset) < QUEUE_SIZE_LIMIT:
             torrent = self.torrentdb.selectTorrentToCheck(infohash=infohash)
             if not torrent:
                 return False
@@ -116,7 +128,8 @@ class TorrentChecking(Thread):
                 return False
             
             with self.queueLock:
-                self.queue.append(torrent)
+                # the user is looking at this torrent, check it before the search results
+                self.queue.appendleft(torrent)
                 self.queueset.add(infohash)
             
             self.sleepEvent.set()
@@ -126,7 +139,7 @@ class TorrentChecking(Thread):
     #add a torrent to the queue, this will schedule a call to update the status etc. for this torrent
     #if the queue is currently full, it will not!
     def addTorrentToQueue(self, torrent):
-        if torrent._torrent_id != -1 and torrent.infohash not in self.queueset and len(self.queueset) < QUEUE_SIZE_LIMIT:
+        if torrent._torrent_id != -1 and torrent.infohash not in self.queueset and torrent.infohash not in self.checking and len(self.queueset) < QUEUE_SIZE_LIMIT:
             
             #convert torrent gui-dbtuple to internal format
             res = {'torrent_id':torrent._torrent_id, 
@@ -143,6 +156,7 @@ class TorrentChecking(Thread):
                 res['trackers'] = torrent.trackers
         
             with self.queueLock:
+                # search results, checked before the torrents selected from the database
                 self.queue.append(res)
                 self.queueset.add(torrent.infohash)
         
@@ -152,74 +166,58 @@ class TorrentChecking(Thread):
         return False
             
     def run(self):
-        """ Gets one torrent from good or unknown list and checks it """
+        """ Starts checking queued torrents, or one torrent from the database per interval, and writes the results """
         
         if prctlimported:
             prctl.set_name("Tribler"+currentThread().getName())
         
-        #request new infohash from queue, start database
         while not self.shouldquit:
             start = time()
             self.sleepEvent.clear()
             try:
-                torrent = None
-                try:
-                    self.queueLock.acquire()
-                    while True:
+                torrents = []
+                with self.queueLock:
+                    while self.queue and len(self.checking) + len(torrents) < MAX_CHECKING:
                         torrent = self.queue.popleft()
                         self.queueset.discard(torrent['infohash'])
+                        torrents.append(torrent)
+                        
                         if DEBUG:
                             print >> sys.stderr, "TorrentChecking: get value from QUEUE:", torrent
-                        break
-                except:
-                    pass
-                finally:
-                    self.queueLock.release()
-                    
-                if torrent:
+                
+                for torrent in torrents:
                     self.dbDoCheck(torrent)
-                else:
-                    self.dbSelectTorrentToCheck(self.dbDoCheck)
                     
-                torrent = self.announceQueue.get()
-                if torrent:
-                    if DEBUG:
-                        print >> sys.stderr, "TorrentChecking: tracker checking", torrent["info"].get("announce", ""), torrent["info"].get("announce-list", "")
-    
-                    trackerStart = time()
-                    multi_announce_dict = multiTrackerChecking(torrent, self.getInfoHashesForTracker)
-                    if DEBUG:
-                        print >> sys.stderr, "TorrentChecking: tracker checking took ", time() - trackerStart, torrent["info"].get("announce", "") ,torrent["info"].get("announce-list", "")
+                if not torrents and len(self.checking) < MAX_CHECKING and start - self.lastSelect >= self.interval:
+                    self.lastSelect = start
                     
-                    if not self.shouldquit:
-                        # Modify last_check time such that the torrents in queue will be skipped if present in this multi-announce
-                        with self.queueLock:
-                            for tor in self.queue:
-                                if tor['infohash'] in multi_announce_dict:
-                                    tor['last_check'] = time()
-        
-                        # Update torrent with new status
-                        self.dbUpdateTorrents(torrent, multi_announce_dict)
+                    # scrape as many torrents as possible of the healthy tracker which was not checked for the longest time
+                    tracker = self.health.selectTracker()
+                    if tracker:
+                        self.scrapeTracker(tracker)
+                    self.dbSelectTorrentToCheck(self.dbDoCheck)
                     
-                self.announceQueue.task_done()
+                self.flushResults()
+                self.dbStoreTrackerHealth()
             
             except: #make sure we do not crash while True loop
                 print_exc()
             
-            # schedule sleep time, only if we do not have any infohashes scheduled
-            if len(self.queue) == 0 and not self.shouldquit:
+            # schedule sleep time, only if we cannot start checking the torrents in queue
+            if not (self.queue and len(self.checking) < MAX_CHECKING) and not self.shouldquit:
                 diff = time() - start
                 remaining = int(self.interval - diff)
                 if remaining > 0:
                     if DEBUG:
-                        print >> sys.stderr, "TorrentChecking: going to sleep for", remaining
+                        print >> sys.stderr, "TorrentChecking: going to sleep for", remaining, self.getStats()
                     self.sleepEvent.wait(remaining)
     
     @forceDBThread
     def dbDoCheck(self, torrent):
         diff = time() - (torrent['last_check'] or 0)
         if diff < 1800:
-            self.announceQueue.put(None)
+            if DEBUG:
+                print >> sys.stderr, "TorrentChecking: checking too soon:", torrent
             
         elif torrent['ignored_times'] > 0:
             #ignoring this torrent
@@ -228,17 +226,133 @@ class TorrentChecking(Thread):
             
             kw = { 'ignored_times': torrent['ignored_times'] - 1 }
             self.torrentdb.updateTorrent(torrent['infohash'], **kw)
-            self.announceQueue.put(None)
             
         else:
             # read the torrent from disk / use other sources to specify trackers
             torrent = self.readTrackers(torrent)
             if self.hasTrackers(torrent):
-                self.announceQueue.put(torrent)
+                self.startChecking(torrent)
+                
+            else:
+                self.dbUpdateTorrents([(torrent, {torrent['infohash']:(-2, -2)})])
                 
+    def startChecking(self, torrent):
+        infohash = torrent['infohash']
+        trackers = getTrackers(torrent)
+        if not trackers:
+            # all trackers are backed off, do not waste a scrape
+            self.addResult(torrent, {infohash: (-1, -1)})
+            return
+        
+        with self.checkingLock:
+            if infohash in self.checking:
+                return
+            self.checking[infohash] = [torrent, trackers, {infohash: (-2, -2)}, None]
+            
+        if DEBUG:
+            print >> sys.stderr, "TorrentChecking: tracker checking", torrent["info"].get("announce", ""), torrent["info"].get("announce-list", "")
+        self.scrapeNextTracker(infohash)
+        
+    def scrapeNextTracker(self, infohash):
+        with self.checkingLock:
+            item = self.checking[infohash]
+            announce = item[3] = item[1].pop(0) if item[1] else None
+        
+        if announce:
+            if announce.startswith('udp'):
+                max_infohashes = UDP_MAX_INFOHASHES
             else:
-                self.dbUpdateTorrents(torrent, {torrent['infohash']:(-2, -2)})
-                self.announceQueue.put(None)
+                max_infohashes = HTTP_MAX_INFOHASHES
+            self.scraper.scrape(announce, [infohash] + self.getInfoHashesForTracker(announce, max_infohashes - 1))
+        else:
+            self.finishChecking(infohash)
+            
+    def scrapeTracker(self, tracker):
+        if tracker.startswith('udp'):
+            max_infohashes = UDP_MAX_INFOHASHES
+        else:
+            max_infohashes = HTTP_MAX_INFOHASHES
+        
+        infohashes = self.getInfoHashesForTracker(tracker, max_infohashes)
+        if infohashes:
+            self.scraper.scrape(tracker, infohashes)
+        else:
+            self.health.touch(tracker)
+            
+    def onScrapeResults(self, announce, announce_dict):
+        # called by the scraper, merges the results of the torrents we are checking and continues with
+        # the next tracker if this one did not report any seeders
+        next_tracker = []
+        finished = []
+        others = {}
+        with self.checkingLock:
+            for key, values in announce_dict.iteritems():
+                item = self.checking.get(key)
+                if item and item[3] == announce:
+                    cur_values = item[2][key]
+                    item[2][key] = (max(values[0], cur_values[0]), max(values[1], cur_values[1]))
+                    
+                    if item[2][key][0] > 0 or not item[1]:
+                        finished.append(key)
+                    else:
+                        next_tracker.append(key)
+                elif values[0] >= 0 and values[1] >= 0:
+                    # piggybacked torrents are only updated by real answers of the tracker, a failed
+                    # scrape or a missing infohash should not overwrite their status
+                    others[key] = values
+                
+        if others:
+            self.addResult(None, others)
+        for key in next_tracker:
+            self.scrapeNextTracker(key)
+        for key in finished:
+            self.finishChecking(key)
+            
+    def finishChecking(self, infohash):
+        with self.checkingLock:
+            torrent, _, announce_dict, _ = self.checking.pop(infohash)
+            
+        if not self.shouldquit:
+            self.addResult(torrent, announce_dict)
+            
+        # a checking slot became available
+        if self.queue:
+            self.sleepEvent.set()
+        
+    def addResult(self, torrent, announce_dict):
+        # Modify last_check time such that the torrents in queue will be skipped if present in this multi-announce
+        with self.queueLock:
+            for tor in self.queue:
+                if tor['infohash'] in announce_dict:
+                    tor['last_check'] = time()
+        
+        with self.checkingLock:
+            self.results.append((torrent, announce_dict))
+            flush = len(self.results) >= UPDATE_BATCH_SIZE
+            
+        if flush:
+            self.flushResults()
+            
+    def flushResults(self):
+        with self.checkingLock:
+            results = self.results
+            self.results = []
+            
+        if results:
+            self.dbUpdateTorrents(results)
+    
+    @forceDBThread
+    def dbStoreTrackerHealth(self):
+        tracker_infos = self.health.getDirty()
+        if tracker_infos:
+            self.torrentdb.updateTrackerInfos(tracker_infos)
+            
+    def getStats(self):
+        stats = self.scraper.get_stats()
+        stats.update(self.health.getStats())
+        stats['checking'] = len(self.checking)
+        stats['queue'] = len(self.queue)
+        return stats
     
     def readTorrent(self, torrent):
         try:
@@ -341,7 +455,13 @@ class TorrentChecking(Thread):
         return torrent
     
     @forceDBThread
-    def dbUpdateTorrents(self, torrent, announce_dict):
+    def dbUpdateTorrents(self, results):
+        for torrent, announce_dict in results:
+            self._updateTorrent(torrent, announce_dict)
+            
+    def _updateTorrent(self, torrent, announce_dict):
+        # torrent is None if we did not check these torrents ourselves, but got their status because
+        # they were included in a multiscrape
         for key, values in announce_dict.iteritems():
             seeders, leechers = values
             seeders = max(-2, seeders)
@@ -355,7 +475,7 @@ class TorrentChecking(Thread):
                 
             retried_times = 0
             ignored_times = 0
-            if key == torrent['infohash']:
+            if torrent and key == torrent['infohash']:
                 if status == "unknown":
                     if torrent["retried_times"] > self.retryThreshold:    # set to dead
                         status = "dead"
@@ -374,11 +494,11 @@ class TorrentChecking(Thread):
             if DEBUG:
                 print >> sys.stderr, "TorrentChecking: new status:", curkw
             
-            if key == torrent['infohash']:
+            if torrent and key == torrent['infohash']:
                 if status == 'dead':
                     self.mldhtchecker.lookup(torrent['infohash'])
                     
-    def getInfoHashesForTracker(self, tracker):
+    def getInfoHashesForTracker(self, tracker, max_infohashes = 10):
         isLocked = False
         try:
             tracker = unicode(tracker)
@@ -399,15 +519,15 @@ class TorrentChecking(Thread):
             if DEBUG:
                 print >> sys.stderr, "TorrentChecking: Found %d additional infohashes for tracker %s in QUEUE"%(len(infohashes), tracker)
             
-            if len(infohashes) < 10:
+            if len(infohashes) < max_infohashes:
                 max_last_check = int(time()) - 4*60*60
-                t_infohashes = self.torrentdb.getTorrentsFromTracker(tracker, max_last_check, 10 - len(infohashes))
+                t_infohashes = self.torrentdb.getTorrentsFromTracker(tracker, max_last_check, max_infohashes - len(infohashes))
                 if t_infohashes:
                     infohashes.extend(t_infohashes)
                 
             if DEBUG:
                 print >> sys.stderr, "TorrentChecking: Returning %d additional infohashes for tracker %s"%(len(infohashes), tracker)
-            return infohashes
+            return infohashes[:max_infohashes]
         
         except UnicodeDecodeError:
             if isLocked:
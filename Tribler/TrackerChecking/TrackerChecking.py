@@ -5,7 +5,7 @@
 import sys
 from Tribler.Core.Utilities.bencode import bdecode
 from urlparse import urlparse
-from random import shuffle, randint, choice
+from random import shuffle, randint
 from struct import *
 
 import urllib
@@ -15,10 +15,11 @@ from time import time
 from traceback import print_exc
 from binascii import unhexlify
 
+from Tribler.TrackerChecking.TrackerHealth import TrackerHealth
+
 HTTP_TIMEOUT = 30 # seconds
 
 DEBUG = False
-ioErrors = {}
 
 def trackerChecking(torrent):
     single_no_thread(torrent)
@@ -30,7 +31,26 @@ def single_no_thread(torrent, multiscrapeCallback = None):
     multi_announce_dict = {}
     multi_announce_dict[torrent['infohash']] = (-2, -2)
 
-    #determine trackers
+    for announce in getTrackers(torrent):
+        announce_dict = singleTrackerStatus(torrent, announce, multiscrapeCallback)
+
+        for key, values in announce_dict.iteritems():
+            #merge results
+            if key in multi_announce_dict:
+                cur_values = list(multi_announce_dict[key])
+                cur_values[0] = max(values[0], cur_values[0])
+                cur_values[1] = max(values[1], cur_values[1])
+                multi_announce_dict[key] = cur_values
+            else:
+                multi_announce_dict[key] = values
+
+        (seeder, _) = multi_announce_dict[torrent["infohash"]]
+        if seeder > 0:
+            break
+
+    return multi_announce_dict
+
+def getTrackers(torrent):
     trackers = []
     if (torrent["info"].get("announce-list", "")==""):  # no announce-list
         trackers.append(torrent["info"]["announce"])
@@ -44,33 +64,14 @@ def single_no_thread(torrent, multiscrapeCallback = None):
                 trackers.append(announces[0])
 
             else:                                       # length > 1
-                aindex = torrent["info"]["announce-list"].index(announces)
                 shuffle(announces)
 
                 # Arno: protect against DoS torrents with many trackers in announce list.
                 trackers.extend(announces[:10])
 
-
-    trackers = [(-ioErrors.get(tracker, 0), tracker) for tracker in trackers if tracker.startswith('http') or tracker.startswith('udp')]
-    trackers.sort(reverse = True) #sorting reverse will prefer udp over http trackers
-    for _, announce in trackers:
-        announce_dict = singleTrackerStatus(torrent, announce, multiscrapeCallback)
-
-        for key, values in announce_dict.iteritems():
-            #merge results
-            if key in multi_announce_dict:
-                cur_values = list(multi_announce_dict[key])
-                cur_values[0] = max(values[0], cur_values[0])
-                cur_values[1] = max(values[1], cur_values[1])
-                multi_announce_dict[key] = cur_values
-            else:
-                multi_announce_dict[key] = values
-
-        (seeder, _) = multi_announce_dict[torrent["infohash"]]
-        if seeder > 0:
-            break
-
-    return multi_announce_dict
+    # trackers which are backed off are skipped
+    trackers = [tracker for tracker in trackers if tracker.startswith('http') or tracker.startswith('udp')]
+    return TrackerHealth.getInstance().sortTrackers(trackers)
 
 def singleTrackerStatus(torrent, announce, multiscrapeCallback):
     # return (-1, -1) means the status of torrent is unknown
@@ -163,6 +164,7 @@ def getStatus(announce, url, info_hash, info_hashes):
         try:
             if response_dict.has_key("flags"): # may be interval problem
                 if response_dict["flags"].has_key("min_request_interval"):
+                    registerInterval(announce, response_dict["flags"]["min_request_interval"])
                     return {info_hash: (-3 ,-3)}
         except:
             pass
@@ -235,14 +237,16 @@ def registerIOError(announce):
     if DEBUG:
         print >>sys.stderr,"TrackerChecking: No repsonse for", announce
 
-    ioErrors[announce] = ioErrors.get(announce, 0) + 1
-    if len(ioErrors) > 100:
-        key = choice(ioErrors.keys())
-        del ioErrors[key]
+    TrackerHealth.getInstance().registerFailure(announce)
+
+def registerSuccess(announce, rtt = None, min_interval = None):
+    TrackerHealth.getInstance().registerSuccess(announce, rtt, min_interval)
+
+def registerInterval(announce, min_interval):
+    if DEBUG:
+        print >>sys.stderr,"TrackerChecking: Scraping too often", announce, min_interval
 
-def registerSuccess(announce):
-    if announce in ioErrors:
-        ioErrors[announce] = max(ioErrors[announce] - 1, 0)
+    TrackerHealth.getInstance().registerInterval(announce, min_interval)
 
 if __name__ == '__main__':
     infohash = unhexlify('174E3CDD9610E79849304FCB9A835CDC6851B6F0')
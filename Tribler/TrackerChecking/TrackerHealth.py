@@ -0,0 +1,155 @@
+# Written by Niels Zeilemaker
+# see LICENSE.txt for license information
+#
+# Keeps track of the health of the trackers we scrape.  Trackers which do not respond are backed off
+# exponentially, trackers which tell us to scrape less often are not scraped before their
+# min_request_interval expired.  The state is persisted in the TrackerInfo table.
+
+import sys
+from threading import Lock
+from time import time
+
+BACKOFF_BASE = 5 * 60           # seconds a tracker is skipped after its first failure, doubled for every next failure
+BACKOFF_MAX = 24 * 60 * 60
+RTT_ALPHA = 0.25                # weight of a new rtt sample in the moving average
+
+DEBUG = False
+
+class TrackerInfo:
+    def __init__(self, tracker, last_check = 0, last_success = 0, failures = 0, rtt = 0, min_interval = 0, next_check = 0):
+        self.tracker = tracker
+        self.last_check = last_check
+        self.last_success = last_success
+        self.failures = failures
+        self.rtt = rtt
+        self.min_interval = min_interval
+        self.next_check = next_check
+
+    def to_row(self):
+        return (self.tracker, self.last_check, self.last_success, self.failures, self.rtt, self.min_interval, self.next_check)
+
+class TrackerHealth:
+    __single = None
+
+    def __init__(self):
+        if TrackerHealth.__single:
+            raise RuntimeError, "TrackerHealth is singleton"
+        TrackerHealth.__single = self
+
+        self.lock = Lock()
+        self.trackers = {}   # {tracker: TrackerInfo}
+        self.dirty = set()
+
+        self.started = time()
+        self.scrapes = 0
+        self.wasted = 0
+
+    def getInstance(*args, **kw):
+        if TrackerHealth.__single is None:
+            TrackerHealth(*args, **kw)
+        return TrackerHealth.__single
+    getInstance = staticmethod(getInstance)
+
+    def delInstance():
+        TrackerHealth.__single = None
+    delInstance = staticmethod(delInstance)
+
+    def load(self, rows):
+        with self.lock:
+            for row in rows:
+                if row[0] not in self.trackers:
+                    self.trackers[row[0]] = TrackerInfo(*row)
+
+    def getDirty(self):
+        """ Returns the rows which changed since the last call, to be stored using updateTrackerInfos """
+        with self.lock:
+            rows = [self.trackers[tracker].to_row() for tracker in self.dirty]
+            self.dirty.clear()
+        return rows
+
+    def _get(self, tracker):
+        info = self.trackers.get(tracker)
+        if not info:
+            info = self.trackers[tracker] = TrackerInfo(tracker)
+        self.dirty.add(tracker)
+        return info
+
+    def registerSuccess(self, tracker, rtt = None, min_interval = None):
+        now = time()
+        with self.lock:
+            info = self._get(tracker)
+            info.last_check = info.last_success = now
+            info.failures = 0
+            if rtt is not None:
+                info.rtt = rtt if not info.rtt else (1 - RTT_ALPHA) * info.rtt + RTT_ALPHA * rtt
+            if min_interval is not None:
+                info.min_interval = min_interval
+            info.next_check = now + info.min_interval
+
+            self.scrapes += 1
+
+    def registerFailure(self, tracker):
+        now = time()
+        with self.lock:
+            info = self._get(tracker)
+            info.last_check = now
+            info.failures += 1
+            info.next_check = now + min(BACKOFF_BASE * 2 ** (info.failures - 1), BACKOFF_MAX)
+
+            self.scrapes += 1
+            self.wasted += 1
+
+        if DEBUG:
+            print >> sys.stderr, "TrackerHealth: backing off", tracker, "for", info.next_check - now
+
+    def registerInterval(self, tracker, min_interval):
+        """ The tracker refused our scrape as we did not respect its min_request_interval """
+        now = time()
+        with self.lock:
+            info = self._get(tracker)
+            info.last_check = now
+            info.min_interval = min_interval
+            info.next_check = now + min_interval
+
+            self.scrapes += 1
+            self.wasted += 1
+
+    def isAvailable(self, tracker, now = None):
+        info = self.trackers.get(tracker)
+        return not info or info.next_check <= (now or time())
+
+    def sortTrackers(self, trackers):
+        """
+        Returns the available trackers, the most reliable first.  UDP trackers are preferred over
+        HTTP trackers as they are cheaper to scrape.
+        """
+        now = time()
+        def key(tracker):
+            info = self.trackers.get(tracker)
+            if info:
+                return (info.failures, not tracker.startswith('udp'), info.rtt)
+            return (0, not tracker.startswith('udp'), 0)
+        return sorted((tracker for tracker in trackers if self.isAvailable(tracker, now)), key = key)
+
+    def selectTracker(self):
+        """ Returns the available tracker which responded last time and was not checked for the longest time """
+        now = time()
+        with self.lock:
+            infos = [info for info in self.trackers.itervalues() if info.failures == 0 and info.next_check <= now]
+        if infos:
+            return min(infos, key = lambda info: info.last_check).tracker
+
+    def touch(self, tracker):
+        """ We decided not to scrape this tracker, i.e. none of its torrents need to be checked """
+        with self.lock:
+            self._get(tracker).last_check = time()
+
+    def getStats(self):
+        with self.lock:
+            now = time()
+            return {'trackers': len(self.trackers),
+                    'backed_off': sum(1 for info in self.trackers.itervalues() if info.failures and info.next_check > now),
+                    'scrapes': self.scrapes,
+                    'scrapes_per_second': self.scrapes / max(now - self.started, 1.0),
+                    'wasted': self.wasted,
+                    'wasted_fraction': self.wasted / float(self.scrapes) if self.scrapes else 0.0}
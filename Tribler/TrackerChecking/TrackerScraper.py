@@ -0,0 +1,442 @@
+# Written by Niels Zeilemaker
+# see LICENSE.txt for license information
+#
+# Non-blocking tracker scraper.
+#
+# All UDP trackers are multiplexed on a single socket (BEP 15).  Connection ids are cached per
+# tracker address, infohashes are batched into scrapes of at most 74 infohashes and lost packets
+# are retransmitted with an exponential backoff.
+#
+# HTTP trackers and DNS lookups are handled by a small pool of worker threads, at most
+# HTTP_PER_TRACKER scrapes are running concurrently for one tracker host.
+
+import sys
+import socket
+from select import select
+from struct import pack, unpack_from
+from random import randint
+from threading import Thread, Lock
+from Queue import Queue
+from collections import deque
+from urlparse import urlparse
+from time import time
+from traceback import print_exc
+
+from Tribler.Core.Utilities.bencode import bdecode
+import Tribler.Core.Utilities.timeouturlopen as timeouturlopen
+from Tribler.TrackerChecking.TrackerChecking import getUrl, registerIOError, registerSuccess, registerInterval, HTTP_TIMEOUT
+
+UDP_TIMEOUT = 5.0               # seconds before the first retransmit, doubled for every retry
+UDP_RETRIES = 2
+UDP_CONNECTION_LIFETIME = 60.0  # a connection id may be used for one minute
+UDP_MAX_INFOHASHES = 74
+HTTP_MAX_INFOHASHES = 50
+HTTP_WORKERS = 8
+HTTP_PER_TRACKER = 2
+DNS_LIFETIME = 30 * 60
+
+UDP_CONNECT_ID = 0x41727101980
+ACTION_CONNECT = 0
+ACTION_SCRAPE = 2
+ACTION_ERROR = 3
+
+DEBUG = False
+
+class Tracker:
+    def __init__(self, announce):
+        self.announce = announce
+        self.host = urlparse(announce).netloc
+
+        self.pending = deque()
+        self.pendingset = set()
+
+        # a scrape round lasts until all infohashes of the tracker are scraped, a failure is
+        # registered once per round
+        self.running = 0
+        self.failed = False
+
+        # udp only
+        self.address = None
+        self.resolved_at = 0
+        self.resolving = False
+        self.resolve_failed = False
+        self.connecting = False
+
+    def add(self, infohashes):
+        for infohash in infohashes:
+            if infohash not in self.pendingset:
+                self.pending.append(infohash)
+                self.pendingset.add(infohash)
+
+    def pop(self, max_infohashes):
+        infohashes = []
+        while self.pending and len(infohashes) < max_infohashes:
+            infohash = self.pending.popleft()
+            self.pendingset.discard(infohash)
+            infohashes.append(infohash)
+        return infohashes
+
+class Transaction:
+    def __init__(self, tracker, action, infohashes, packet):
+        self.tracker = tracker
+        self.action = action
+        self.infohashes = infohashes
+        self.packet = packet
+        self.address = tracker.address
+        self.attempt = 0
+        self.deadline = 0
+        self.sent = 0
+
+class TrackerScraper(Thread):
+    """
+    Scrapes UDP and HTTP trackers without blocking the caller.  Results are reported by calling
+    callback(announce, {infohash: (seeders, leechers)}) from the scraper or one of its worker
+    threads.  As in TrackerChecking, (-1, -1) means the status is unknown, (-2, -2) that the
+    tracker does not know the torrent and (-3, -3) that we are scraping too often.
+    """
+
+    def __init__(self, callback, port = 0, udp_timeout = UDP_TIMEOUT, udp_retries = UDP_RETRIES, http_workers = HTTP_WORKERS, http_per_tracker = HTTP_PER_TRACKER):
+        Thread.__init__(self)
+        self.setName('TrackerScraper' + self.getName())
+        self.setDaemon(True)
+
+        self.callback = callback
+        self.udp_timeout = udp_timeout
+        self.udp_retries = udp_retries
+        self.http_per_tracker = http_per_tracker
+        self.shouldquit = False
+
+        self.lock = Lock()
+        self.incoming = []
+
+        self.trackers = {}      # {announce: Tracker}
+        self.active = set()     # trackers with pending infohashes
+        self.connections = {}   # {address: (connection_id, expires)}
+        self.transactions = {}  # {transaction_id: Transaction}
+        self.http_running = {}  # {host: nr_running}
+
+        self.stats = dict.fromkeys(['scrapes', 'infohashes', 'failed', 'udp_sent', 'udp_retransmits', 'udp_timeouts', 'udp_connects', 'udp_connection_reuses', 'http_requests', 'dns_lookups'], 0)
+
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_socket.bind(('', port))
+        self.udp_socket.setblocking(0)
+        self.port = self.udp_socket.getsockname()[1]
+
+        self.jobs = Queue()
+        self.workers = []
+        for _ in xrange(http_workers):
+            worker = Thread(target = self._worker, name = self.getName() + 'Worker')
+            worker.setDaemon(True)
+            worker.start()
+            self.workers.append(worker)
+
+    def scrape(self, announce, infohashes):
+        """
+        Schedule a scrape of infohashes at tracker announce, can be called from any thread.
+        Infohashes already pending for this tracker are scraped only once.
+        """
+        with self.lock:
+            self.incoming.append((announce, list(infohashes)))
+        self._wakeup()
+
+    def shutdown(self):
+        self.shouldquit = True
+        for _ in self.workers:
+            self.jobs.put(None)
+        self._wakeup()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['pending'] = sum(len(tracker.pending) for tracker in list(self.active))
+            stats['transactions'] = len(self.transactions)
+            stats['http_running'] = sum(self.http_running.itervalues())
+        return stats
+
+    def run(self):
+        while not self.shouldquit:
+            try:
+                readable, _, _ = select([self.udp_socket], [], [], self._process_timeouts())
+                if readable:
+                    self._read_udp()
+
+                self._process_incoming()
+                self._process_trackers()
+            except:
+                print_exc()
+
+        self.udp_socket.close()
+
+    def _wakeup(self):
+        # an empty datagram to ourselves interrupts the select
+        try:
+            self.udp_socket.sendto('', ('127.0.0.1', self.port))
+        except socket.error:
+            pass
+
+    def _process_incoming(self):
+        with self.lock:
+            incoming = self.incoming
+            self.incoming = []
+
+        for announce, infohashes in incoming:
+            if announce.startswith('udp') or announce.startswith('http'):
+                tracker = self.trackers.get(announce)
+                if not tracker:
+                    tracker = self.trackers[announce] = Tracker(announce)
+
+                with self.lock:
+                    idle = not (tracker.pending or tracker.running or tracker.resolving)
+                if idle:
+                    tracker.failed = False
+                tracker.add(infohashes)
+                self.active.add(tracker)
+            else:
+                self._deliver(announce, infohashes, {}, (-1, -1))
+
+    def _process_trackers(self):
+        now = time()
+        for tracker in list(self.active):
+            if tracker.announce.startswith('udp'):
+                self._process_udp_tracker(tracker, now)
+            else:
+                self._process_http_tracker(tracker)
+
+            if not tracker.pending:
+                self.active.discard(tracker)
+
+    def _process_udp_tracker(self, tracker, now):
+        if tracker.resolving:
+            return
+
+        if tracker.resolve_failed:
+            tracker.resolve_failed = False
+            self._register_failure(tracker)
+            self._deliver(tracker.announce, tracker.pop(len(tracker.pending)), {}, (-1, -1))
+            return
+
+        if not tracker.address or tracker.resolved_at + DNS_LIFETIME < now:
+            tracker.resolving = True
+            self.jobs.put((self._resolve, (tracker,)))
+            return
+
+        connection = self.connections.get(tracker.address)
+        if connection and connection[1] > now:
+            while tracker.pending:
+                infohashes = tracker.pop(UDP_MAX_INFOHASHES)
+                transaction_id = self._new_transaction_id()
+
+                data = [connection[0], ACTION_SCRAPE, transaction_id]
+                data.extend(infohashes)
+                packet = pack('!qii' + '20s' * len(infohashes), *data)
+
+                self._send_transaction(transaction_id, Transaction(tracker, ACTION_SCRAPE, infohashes, packet))
+                self.stats['udp_connection_reuses'] += 1
+
+        elif not tracker.connecting:
+            tracker.connecting = True
+            transaction_id = self._new_transaction_id()
+            packet = pack('!qii', UDP_CONNECT_ID, ACTION_CONNECT, transaction_id)
+            self._send_transaction(transaction_id, Transaction(tracker, ACTION_CONNECT, [], packet))
+            self.stats['udp_connects'] += 1
+
+    def _new_transaction_id(self):
+        while True:
+            transaction_id = randint(0, 2 ** 31 - 1)
+            if transaction_id not in self.transactions:
+                return transaction_id
+
+    def _send_transaction(self, transaction_id, transaction):
+        if not transaction.attempt:
+            transaction.tracker.running += 1
+        transaction.sent = time()
+        transaction.deadline = transaction.sent + self.udp_timeout * 2 ** transaction.attempt
+        self.transactions[transaction_id] = transaction
+
+        try:
+            self.udp_socket.sendto(transaction.packet, transaction.address)
+            self.stats['udp_sent'] += 1
+        except socket.error:
+            # retransmitted or failed by _process_timeouts
+            if DEBUG:
+                print_exc()
+
+    def _process_timeouts(self):
+        """
+        Retransmits or fails expired transactions, returns the number of seconds until the next
+        deadline.
+        """
+        now = time()
+        timeout = 1.0
+        for transaction_id, transaction in self.transactions.items():
+            if transaction.deadline <= now:
+                del self.transactions[transaction_id]
+
+                if transaction.attempt < self.udp_retries:
+                    transaction.attempt += 1
+                    self.stats['udp_retransmits'] += 1
+                    self._send_transaction(transaction_id, transaction)
+                else:
+                    self.stats['udp_timeouts'] += 1
+                    transaction.tracker.running -= 1
+                    self._fail_transaction(transaction)
+                    continue
+
+            timeout = min(timeout, transaction.deadline - now)
+        return max(0, timeout)
+
+    def _fail_transaction(self, transaction):
+        tracker = transaction.tracker
+        self._register_failure(tracker)
+
+        if transaction.action == ACTION_CONNECT:
+            tracker.connecting = False
+            infohashes = tracker.pop(len(tracker.pending))
+        else:
+            infohashes = transaction.infohashes
+
+        if DEBUG:
+            print >> sys.stderr, "TrackerScraper: no response from", tracker.announce
+        self._deliver(tracker.announce, infohashes, {}, (-1, -1))
+
+    def _read_udp(self):
+        while True:
+            try:
+                data, address = self.udp_socket.recvfrom(8192)
+            except socket.error:
+                break
+
+            if len(data) < 8:
+                continue
+
+            action, transaction_id = unpack_from('!ii', data)
+            transaction = self.transactions.get(transaction_id)
+            if not transaction or transaction.address != address:
+                continue
+            del self.transactions[transaction_id]
+
+            tracker = transaction.tracker
+            tracker.running -= 1
+            if action == ACTION_CONNECT and transaction.action == ACTION_CONNECT and len(data) >= 16:
+                connection_id, = unpack_from('!q', data, 8)
+                self.connections[tracker.address] = (connection_id, time() + UDP_CONNECTION_LIFETIME)
+                tracker.connecting = False
+
+            elif action == ACTION_SCRAPE and transaction.action == ACTION_SCRAPE and len(data) >= 8 + 12 * len(transaction.infohashes):
+                results = {}
+                for i, infohash in enumerate(transaction.infohashes):
+                    seeders, _, leechers = unpack_from('!iii', data, 8 + 12 * i)
+                    results[infohash] = (seeders, leechers)
+
+                registerSuccess(tracker.announce, time() - transaction.sent)
+                self._deliver(tracker.announce, transaction.infohashes, results, (-1, -1))
+
+            else:
+                if DEBUG:
+                    print >> sys.stderr, "TrackerScraper: error from", tracker.announce, repr(data[8:]) if action == ACTION_ERROR else action
+
+                # the connection id might have expired, reconnect before the next scrape
+                self.connections.pop(tracker.address, None)
+                self._fail_transaction(transaction)
+
+    def _process_http_tracker(self, tracker):
+        while tracker.pending and self.http_running.get(tracker.host, 0) < self.http_per_tracker:
+            with self.lock:
+                self.http_running[tracker.host] = self.http_running.get(tracker.host, 0) + 1
+                tracker.running += 1
+            self.jobs.put((self._http_scrape, (tracker, tracker.pop(HTTP_MAX_INFOHASHES))))
+
+    def _worker(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+
+            func, args = job
+            try:
+                func(*args)
+            except:
+                print_exc()
+
+    def _resolve(self, tracker):
+        try:
+            host, port = getUrl(tracker.announce, [])
+            tracker.address = (socket.gethostbyname(host), port)
+            tracker.resolved_at = time()
+        except:
+            tracker.resolve_failed = True
+            if DEBUG:
+                print_exc()
+
+        with self.lock:
+            self.stats['dns_lookups'] += 1
+        tracker.resolving = False
+        self._wakeup()
+
+    def _http_scrape(self, tracker, infohashes):
+        announce = tracker.announce
+        results = {}
+        default = (-1, -1)
+        try:
+            response_dict = None
+            start = time()
+            try:
+                url = getUrl(announce, infohashes)
+                if DEBUG:
+                    print >> sys.stderr, "TrackerScraper: Checking", url
+
+                response = timeouturlopen.urlOpenTimeout(url, timeout = HTTP_TIMEOUT).read()
+                response_dict = bdecode(response)
+                for infohash, status in response_dict["files"].iteritems():
+                    results[infohash] = (max(0, status["complete"]), max(0, status["incomplete"]))
+
+                # infohashes not in the response are unknown to the tracker
+                default = (-2, -2)
+                registerSuccess(announce, time() - start, response_dict.get("flags", {}).get("min_request_interval"))
+
+            except IOError:
+                self._register_failure(tracker)
+
+            except KeyError:
+                if isinstance(response_dict, dict) and "min_request_interval" in response_dict.get("flags", {}):
+                    registerInterval(announce, response_dict["flags"]["min_request_interval"])
+                    default = (-3, -3)
+
+            except:
+                self._register_failure(tracker)
+                if DEBUG:
+                    print_exc()
+
+        finally:
+            with self.lock:
+                self.stats['http_requests'] += 1
+                self.http_running[tracker.host] -= 1
+                tracker.running -= 1
+            self._wakeup()
+
+            # the infohashes are being checked, always report them
+            self._deliver(announce, infohashes, results, default)
+
+    def _register_failure(self, tracker):
+        # the other requests of this round failed due to the same outage, registering each of them
+        # would multiply the backoff
+        with self.lock:
+            failed, tracker.failed = tracker.failed, True
+        if not failed:
+            registerIOError(tracker.announce)
+
+    def _deliver(self, announce, infohashes, results, default):
+        for infohash in infohashes:
+            if infohash not in results:
+                results[infohash] = default
+
+        with self.lock:
+            self.stats['scrapes'] += 1
+            self.stats['infohashes'] += len(infohashes)
+            if default == (-1, -1) and not any(value != default for value in results.itervalues()):
+                self.stats['failed'] += 1
+
+        try:
+            self.callback(announce, results)
+        except:
+            print_exc()
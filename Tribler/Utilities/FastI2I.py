@@ -4,9 +4,14 @@
 # Simpler way of communicating with a separate process running swift via
 # its CMDGW interface
 #
+# By default the CMDGW interface uses \r\n terminated text commands.  When a
+# framecallback is given, we ask the other side to switch to length-prefixed
+# binary frames.  If it does not acknowledge this, we continue using text.
+#
 
 import sys
-from threading import Thread,Lock,currentThread
+from threading import Thread,Lock,Timer,currentThread
+from struct import Struct
 import socket
 from traceback import print_exc
 try:
@@ -16,12 +21,20 @@ except ImportError,e:
     prctlimported = False
 
 from Tribler.dispersy.decorator import attach_profiler
+from Tribler.Core.Utilities.bytebuffer import ReadBuffer, COALESCE_SIZE
 
 DEBUG = False
 
+FRAME_HEADER = Struct("!BI")    # frametype, length of payload
+FRAME_TEXT = 0                  # a text command, without \r\n
+
+PROTOCOL_REQUEST = "PROTOCOL BINARY\r\n"
+PROTOCOL_ACK = "PROTOCOL BINARY"
+NEGOTIATE_TIMEOUT = 5.0
+
 class FastI2IConnection(Thread):
     
-    def __init__(self,port,readlinecallback,closecallback):
+    def __init__(self,port,readlinecallback,closecallback,framecallback=None):
         Thread.__init__(self)
         self.setName("FastI2I"+self.getName())
         self.setDaemon(True)
@@ -29,10 +42,16 @@ class FastI2IConnection(Thread):
         self.port = port
         self.readlinecallback = readlinecallback
         self.closecallback = closecallback
+        self.framecallback = framecallback
+        
+        self.binary = False
+        # writes are held back until the protocol is negotiated
+        self.pending = [] if framecallback else None
+        self.negotiate_timer = None
         
         self.sock = None
         # Socket only every read by self
-        self.buffer = ''
+        self.buffer = ReadBuffer()
         # write lock on socket
         self.lock = Lock() 
 
@@ -47,6 +66,16 @@ class FastI2IConnection(Thread):
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.connect(("127.0.0.1",self.port))
+            if self.framecallback:
+                self.lock.acquire()
+                try:
+                    self.sock.sendall(PROTOCOL_REQUEST)
+                    self.negotiate_timer = Timer(NEGOTIATE_TIMEOUT, self.protocol_negotiated, (False,))
+                    self.negotiate_timer.setDaemon(True)
+                    self.negotiate_timer.start()
+                finally:
+                    self.lock.release()
+                
             while True:
                 data = self.sock.recv(10240)
                 if len(data) == 0:
@@ -55,6 +84,8 @@ class FastI2IConnection(Thread):
         except:
             print_exc()
             self.close()
+        
+        self.cancel_negotiation()
             
     def stop(self):
         try:
@@ -80,35 +111,132 @@ class FastI2IConnection(Thread):
         if DEBUG:
             print >>sys.stderr,"fasti2i: data_came_in",`data`,len(data)
 
-        if len(self.buffer) == 0:
-            self.buffer = data
+        self.buffer.feed(data)
+        if self.binary:
+            self.read_frames()
         else:
-            self.buffer = self.buffer + data
-        self.read_lines()
+            self.read_lines()
         
     def read_lines(self):
         while True:
-            cmd, separator, self.buffer = self.buffer.partition("\r\n")
-            if separator:
-                if self.readlinecallback(self, cmd):
-                    # 01/05/12 Boudewijn: when a positive value is returned we immediately return to
-                    # allow more bytes to be pushed into the buffer
-                    self.buffer = "".join((cmd, separator, self.buffer))
+            pos = self.buffer.find("\r\n")
+            if pos == -1:
+                break
 
-            else:
-                self.buffer = cmd
+            cmd = self.buffer.read(pos)
+            self.buffer.skip(2)
+            
+            if cmd == PROTOCOL_ACK and self.framecallback:
+                # an ACK arriving after the negotiation timed out is ignored,
+                # we continue using text
+                if self.protocol_negotiated(True):
+                    self.read_frames()
+                    break
+                continue
+            
+            if self.pending is not None and cmd.startswith("ERROR"):
+                # the only command we did not get a reply to is PROTOCOL_REQUEST
+                self.protocol_negotiated(False)
+                continue
+            
+            if self.readlinecallback(self, cmd):
+                # 01/05/12 Boudewijn: when a positive value is returned we immediately return to
+                # allow more bytes to be pushed into the buffer
+                self.buffer.unread(pos + 2)
+                break
+    
+    def read_frames(self):
+        while len(self.buffer) >= FRAME_HEADER.size:
+            frametype, length = FRAME_HEADER.unpack(self.buffer.peek(FRAME_HEADER.size))
+            if len(self.buffer) < FRAME_HEADER.size + length:
                 break
+            
+            self.buffer.skip(FRAME_HEADER.size)
+            payload = self.buffer.read(length)
+            if frametype == FRAME_TEXT:
+                if self.readlinecallback(self, payload):
+                    # like read_lines, return to allow more bytes to be pushed
+                    # into the buffer
+                    self.buffer.unread(FRAME_HEADER.size + length)
+                    break
+            else:
+                self.framecallback(self, frametype, payload)
     
-    def write(self,data):
-        """ Called by any thread """
+    def protocol_negotiated(self, binary):
+        """ 
+        Called by this thread or the negotiation timer, sends the writes that
+        were held back.  Returns False if the protocol was negotiated before.
+        """
         self.lock.acquire()
         try:
+            if self.pending is None:
+                return False
+            
+            self._cancel_timer()
+            if DEBUG:
+                print >>sys.stderr,"fasti2i: using binary protocol",binary
+            
+            self.binary = binary
+            pending = self.pending
+            self.pending = None
             if self.sock is not None:
-                self.sock.send(data)
+                for frametype, data, fallback in pending:
+                    self._send(frametype, data, fallback)
+            return True
+        finally:
+            self.lock.release()
+    
+    def cancel_negotiation(self):
+        """ Called by any thread, stops the negotiation timer when the connection is closed """
+        self.lock.acquire()
+        try:
+            self._cancel_timer()
+        finally:
+            self.lock.release()
+    
+    def _cancel_timer(self):
+        # Called with lock held
+        if self.negotiate_timer is not None:
+            self.negotiate_timer.cancel()
+            self.negotiate_timer = None
+    
+    def write(self,*data):
+        """ Called by any thread, all parts of data are written without being interleaved with other writes """
+        self.write_frame(FRAME_TEXT, data)
+    
+    def write_frame(self, frametype, data, fallback = None):
+        """ 
+        Called by any thread, writes a frame consisting of the parts in data.  If
+        the other side does not support binary frames, the text command parts in
+        fallback are written instead.
+        """
+        self.lock.acquire()
+        try:
+            if self.pending is not None:
+                self.pending.append((frametype, data, fallback))
+            elif self.sock is not None:
+                self._send(frametype, data, fallback)
         finally:
             self.lock.release()            
     
+    def _send(self, frametype, data, fallback):
+        # Called with lock held
+        if self.binary:
+            if frametype == FRAME_TEXT:
+                # a text write can contain multiple commands
+                data = [FRAME_HEADER.pack(FRAME_TEXT, len(line)) + line for line in "".join(data).split("\r\n") if line]
+            else:
+                data = (FRAME_HEADER.pack(frametype, sum(len(part) for part in data)),) + tuple(data)
+        elif frametype != FRAME_TEXT:
+            data = fallback
+        
+        if len(data) > 1 and sum(len(part) for part in data) <= COALESCE_SIZE:
+            data = ("".join(data),)
+        for part in data:
+            self.sock.sendall(part)
+    
     def close(self):
+        self.cancel_negotiation()
         if self.sock is not None:
             self.sock.close()
             self.closecallback(self.port)
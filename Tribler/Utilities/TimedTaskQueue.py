@@ -6,11 +6,17 @@
 # that you still need to delegate the actual updating of the GUI to the
 # MainThread via the wx.CallAfter mechanism.
 #
+# Tasks are kept in a heap, tasks removed by id are only marked as cancelled
+# and dropped when they reach the top of the heap.
+#
 import sys
 
 from threading import Thread,Condition, RLock, currentThread
 from traceback import print_exc,print_stack,format_stack
 from time import time
+from heapq import heappush, heappop, heapify
+from bisect import bisect_left
+from functools import partial
 try:
     prctlimported = True
     import prctl
@@ -19,6 +25,9 @@ except ImportError,e:
 
 DEBUG = False
 
+# upper bounds (in seconds) of the buckets of the lag (scheduled vs actual start) and duration histograms
+HISTOGRAM_BUCKETS = (0.001, 0.01, 0.1, 1.0, 10.0, float('inf'))
+
 class TimedTaskQueue:
 
     __single = None
@@ -27,8 +36,11 @@ class TimedTaskQueue:
         self.inDEBUG = inDEBUG
 
         self.cond = Condition(RLock())
-        self.queue = []
+        self.queue = [] # heap of [when, count, task, id, cancelled]
+        self.ids = {}   # {id: [entry]}
+        self.nr_cancelled = 0
         self.count = 0.0 # serves to keep task that were scheduled at the same time in FIFO order
+        self.stats = {}  # {task name: [nr of tasks, lag histogram, duration histogram]}
         self.thread = Thread(target = self.run)
         self.thread.setDaemon(isDaemon)
         self.thread.setName( nameprefix+self.thread.getName() )
@@ -59,21 +71,82 @@ class TimedTaskQueue:
         if __debug__:
             self.callstack[self.count] = format_stack()
 
+        entry = [when,self.count,task,id,False]
         if id != None:  # remove all redundant tasks
-            self.queue = filter(lambda item:item[3]!=id, self.queue)
-        self.queue.append((when,self.count,task,id))
+            self._cancel(id)
+            self.ids[id] = [entry]
+        heappush(self.queue, entry)
         self.count += 1.0
         self.cond.notify()
         self.cond.release()
 
     def remove_task(self, id):
         self.cond.acquire()
-        self.queue = filter(lambda item:item[3]!=id, self.queue)
+        self._cancel(id)
         self.cond.notify()
         self.cond.release()
 
     def does_task_exist(self, id):
-        return any(item[3]==id for item in self.queue)
+        return id in self.ids
+
+    def _cancel(self, id):
+        """ Called with lock held, marks all tasks with this id as cancelled """
+        entries = self.ids.pop(id, None)
+        if entries:
+            for entry in entries:
+                entry[4] = True
+                if __debug__:
+                    self.callstack.pop(entry[1], None)
+            self.nr_cancelled += len(entries)
+
+            # if most of the heap consists of cancelled tasks, rebuild it
+            if self.nr_cancelled > 100 and self.nr_cancelled > len(self.queue) / 2:
+                self.queue = [entry for entry in self.queue if not entry[4]]
+                heapify(self.queue)
+                self.nr_cancelled = 0
+
+    def _pop(self):
+        """ Called with lock held, removes cancelled tasks from the top of the heap """
+        entry = heappop(self.queue)
+        if entry[4]:
+            self.nr_cancelled -= 1
+        elif entry[3] != None:
+            entries = self.ids[entry[3]]
+            entries.remove(entry)
+            if not entries:
+                del self.ids[entry[3]]
+        return entry
+
+    def get_nr_tasks(self):
+        return len(self.queue) - self.nr_cancelled
+
+    def get_stats(self):
+        """
+        Returns {task name: (nr of tasks, lag histogram, duration histogram)}, the histograms are lists
+        containing the number of tasks per bucket in HISTOGRAM_BUCKETS.
+        """
+        self.cond.acquire()
+        try:
+            return dict((name, (stats[0], stats[1][:], stats[2][:])) for name, stats in self.stats.iteritems())
+        finally:
+            self.cond.release()
+
+    def _get_task_name(self, task):
+        # str(task) contains the address of the object, creating a new key for every task
+        if isinstance(task, partial):
+            task = task.func
+        return getattr(task, "__name__", None) or task.__class__.__name__
+
+    def _add_stats(self, task, lag, duration):
+        name = self._get_task_name(task)
+        self.cond.acquire()
+        stats = self.stats.get(name)
+        if not stats:
+            stats = self.stats[name] = [0, [0] * len(HISTOGRAM_BUCKETS), [0] * len(HISTOGRAM_BUCKETS)]
+        stats[0] += 1
+        stats[1][bisect_left(HISTOGRAM_BUCKETS, lag)] += 1
+        stats[2][bisect_left(HISTOGRAM_BUCKETS, duration)] += 1
+        self.cond.release()
 
     def run(self):
         """ Run by server thread """
@@ -83,22 +156,17 @@ class TimedTaskQueue:
 
         while True:
             task = None
-            timeout = None
-            flag = False
             self.cond.acquire()
             while True:
-                while len(self.queue) == 0 or flag:
-                    flag = False
-                    if timeout is None:
-                        # Wait until something is queued
-                        self.cond.wait()
-                    else:
-                        # Wait till first event is due
-                        self.cond.wait(timeout)
-                # A new event was added or an event is due
-                self.queue.sort()
+                while self.queue and self.queue[0][4]:
+                    self._pop()
 
-                (when,count,task,id) = self.queue[0]
+                if len(self.queue) == 0:
+                    # Wait until something is queued
+                    self.cond.wait()
+                    continue
+
+                (when,count,task,id,_) = self.queue[0]
                 if DEBUG:
                     print >>sys.stderr,"ttqueue: EVENT IN QUEUE",when,task
                 now = time()
@@ -106,13 +174,12 @@ class TimedTaskQueue:
                     # Event not due, wait some more
                     if DEBUG:
                         print >>sys.stderr,"ttqueue: EVENT NOT TILL",when-now
-                    timeout = when-now
-                    flag = True
+                    self.cond.wait(when-now)
                 else:
                     # Event due, execute
                     if DEBUG:
                         print >>sys.stderr,"ttqueue: EVENT DUE"
-                    self.queue.pop(0)
+                    self._pop()
                     if __debug__:
                         assert count in self.callstack
                         stack = self.callstack.pop(count)
@@ -125,23 +192,24 @@ class TimedTaskQueue:
                 if task == 'stop':
                     break
                 elif task == 'quit':
-                    if len(self.queue) == 0:
+                    self.cond.acquire()
+                    whens = [entry[0] for entry in self.queue if not entry[4]]
+                    self.cond.release()
+                    if len(whens) == 0:
                         break
                     else:
-                        (when,count,task,id) = self.queue[-1]
-                        t = when-time()+0.001
+                        t = max(whens)-time()+0.001
                         self.add_task('quit',t)
                 else:
-                    if self.inDEBUG:
-                        t1 = time()
-
-                    task()
-
-                    if self.inDEBUG:
+                    t1 = time()
+                    try:
+                        task()
+                    finally:
                         took = time() - t1
-                        if took > 0.2:
-                            debug_call_name = task.__name__ if hasattr(task, "__name__") else str(task)
-                            print >> sys.stderr,"ttqueue: EVENT TOOK", took, debug_call_name
+                        self._add_stats(task, t1 - when, took)
+                    if self.inDEBUG and took > 0.2:
+                        debug_call_name = task.__name__ if hasattr(task, "__name__") else str(task)
+                        print >> sys.stderr,"ttqueue: EVENT TOOK", took, debug_call_name
             except:
                 print_exc()
                 if __debug__:
@@ -3,107 +3,306 @@
 #
 
 
+import os
 import sys
+from threading import Condition, Lock, Thread
+from time import time
+from collections import OrderedDict
 
 DEBUG = False
 
+DEFAULT_BLOCKSIZE = 256 * 1024          # size of the blocks in the cache, reads on the input stream are aligned to these
+DEFAULT_CACHESIZE = 32 * 1024 * 1024    # maximum number of bytes kept in the cache
+DEFAULT_READAHEAD = 4                   # number of blocks after the playback position to read in the background
+STALL_THRESHOLD = 0.1                   # a read on the input stream taking longer than this (in seconds) is a stall
+
 class SmartCachingStream:
     """ Class that adds buffering to a seekable stream, such that reads after
     seeks that stay in the bounds of the buffer are handled from the buffer,
     instead of doing seeks and reads on the underlying stream.
-    
+
+    The buffer is a LRU cache of blocks aligned to blocksize, such that the
+    range requests of VLC (GET X-, GET X+10K-, ...) do not discard data that
+    is read again shortly after.  A background thread reads the blocks just
+    after the current position, such that sequential playback does not have
+    to wait for the input stream.
+
     Currently specifically tuned to input streams as returned by Core.
     """
-    def __init__(self,inputstream,blocksize=1024*1024):
+    def __init__(self,inputstream,blocksize=DEFAULT_BLOCKSIZE,cachesize=DEFAULT_CACHESIZE,readahead=DEFAULT_READAHEAD):
         print >>sys.stderr,"CachingStream: __init__"
         self.instream = inputstream
-        self.inblocksize = blocksize 
+        self.inblocksize = blocksize
         self.inpos = 0
-        
-        self.buffer = None
-        self.bufstart = None
-        self.bufend = None
+        self.inlock = Lock()  # serialises seeks and reads on the input stream
+        self.waiting = 0  # number of readers waiting for inlock, the readahead thread gives way to them
+
+        self.maxblocks = max(readahead + 2, cachesize / blocksize)
+        self.blocks = OrderedDict()  # block index: data, least recently used first
+        self.lastblock = None  # index of the last block of the stream, once known
         self.bufpos = 0
+        self.cond = Condition()  # protects blocks, bufpos and the statistics
+
+        self.hits = 0
+        self.misses = 0
+        self.stalls = 0
+        self.stalltime = 0.0
+        self.readaheads = 0
+
+        self.closed = False
+        self.readahead = readahead
+        if readahead:
+            thread = Thread(target=self.readahead_thread, name="CachingStream")
+            thread.setDaemon(True)
+            thread.start()
 
     def read(self,nwant=None):
         if DEBUG:
             print >>sys.stderr,"read: ",nwant
-            print >>sys.stderr,"bufpos",self.bufpos,"inpos",self.inpos,"bufs",self.bufstart,"bufe",self.bufend
-        
-        if self.buffer is None:
-            self.read_new(nwant)
-            
-            return self.read_buf(nwant)
+            print >>sys.stderr,"bufpos",self.bufpos,"inpos",self.inpos,"blocks",self.blocks.keys()
+
+        parts = self.read_buf(nwant)
+        if len(parts) == 1:
+            ret = parts[0].tobytes()
         else:
-            if self.bufstart <= self.bufpos and self.bufpos < self.bufend:
-                # Reading from current buffer:
-                return self.read_buf(nwant)
-            else:
-                # Current buffer inadequate
-                assert self.bufpos == self.inpos
-                self.read_new(nwant)
-            
-                return self.read_buf(nwant)
-        
-        
-    def seek(self,offset,whence=0):
-        if DEBUG:
-            print >>sys.stderr,"seek: ",offset
-        if self.buffer is not None:
-            if self.bufstart <= offset and offset < self.bufend:
-                # Seeking within current buffer
-                self.bufpos = offset
-                return
-            else:
-                # No, get rid off buffer
-                self.buffer = None
-                self.bufstart = None
-                self.bufend = None
-                
-        self.instream.seek(offset,whence)
-        self.inpos = offset
-        self.bufpos = offset
-        
-        
-    def read_new(self,nwant):
-        if DEBUG:
-            print >>sys.stderr,"read_new: ",nwant
-        avail = self.inblocksize
-        
-        # Core specific: we only return a single piece on each read, so
-        # to make the buffer larger we just read 4 times.
-        #
-        buffer1 = self.instream.read(avail)
-        if DEBUG:
-            print >>sys.stderr,"read_new: 1got",len(buffer1)
-        buffer2 = self.instream.read(avail)
-        if DEBUG:
-            print >>sys.stderr,"read_new: 2got",len(buffer2)
-        buffer3 = self.instream.read(avail)
-        if DEBUG:
-            print >>sys.stderr,"read_new: 3got",len(buffer3)
-        buffer4 = self.instream.read(avail)
-        if DEBUG:
-            print >>sys.stderr,"read_new: 4got",len(buffer4)
+            buffer = bytearray()
+            for part in parts:
+                buffer += part
+            ret = str(buffer)
 
-        self.buffer = buffer1 + buffer2 + buffer3 + buffer4
+        self.cond.acquire()
+        try:
+            self.bufpos += len(ret)
+            self.cond.notify()
+        finally:
+            self.cond.release()
+        return ret
+
+    def seek(self,offset,whence=os.SEEK_SET):
         if DEBUG:
-            print >>sys.stderr,"read_new: got",len(self.buffer)
-        self.bufstart =  self.inpos
-        self.inpos += len(self.buffer)
-        self.bufend = self.inpos
-        
+            print >>sys.stderr,"seek: ",offset,whence
+
+        if whence == os.SEEK_CUR:
+            offset += self.bufpos
+        elif whence == os.SEEK_END:
+            self.inlock.acquire()
+            try:
+                self.instream.seek(offset,whence)
+                self.inpos = offset = self.instream.tell()
+            finally:
+                self.inlock.release()
+
+        # The input stream is only seeked when a block is not in the cache
+        self.cond.acquire()
+        try:
+            self.bufpos = offset
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+    def tell(self):
+        return self.bufpos
+
+    def close(self):
+        self.cond.acquire()
+        try:
+            self.closed = True
+            self.blocks.clear()
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+        self.inlock.acquire()
+        try:
+            self.instream.close()
+        finally:
+            self.inlock.release()
+
+    def get_stats(self):
+        """ Returns the hit rate and stall counters of the cache """
+        self.cond.acquire()
+        try:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+                    'stalls': self.stalls,
+                    'stall_time': self.stalltime,
+                    'readaheads': self.readaheads,
+                    'cached': sum(len(block) for block in self.blocks.itervalues())}
+        finally:
+            self.cond.release()
 
     def read_buf(self,nwant):
+        """ Returns a list of memoryviews on the cached blocks holding the
+        nwant bytes at the current position, or the remainder of the current
+        block if nwant is None.
+        """
         if DEBUG:
             print >>sys.stderr,"read_buf: ",nwant
-        ngot = min(nwant,self.bufend-self.bufpos)
-        bufoff = self.bufpos-self.bufstart
-        ret = self.buffer[bufoff:bufoff+ngot]
-        # TODO: opt if buffer == pos+nwant
-        self.bufpos += ngot
+        index, bufoff = divmod(self.bufpos, self.inblocksize)
+        block = self.get_block(index)
+        if nwant is None:
+            nwant = len(block) - bufoff
+
+        parts = [memoryview(block)[bufoff:bufoff + nwant]]
+        ngot = len(parts[0])
+        while ngot < nwant and len(block) == self.inblocksize:
+            index += 1
+            block = self.get_block(index)
+            if not block:
+                break
+            parts.append(memoryview(block)[:nwant - ngot])
+            ngot += len(parts[-1])
+
         if DEBUG:
-            print >>sys.stderr,"read_buf: ngot",ngot,"returned",len(ret)
-        return ret
-            
+            print >>sys.stderr,"read_buf: ngot",ngot
+        return parts
+
+    def get_block(self,index):
+        self.cond.acquire()
+        try:
+            block = self.blocks.get(index)
+            if block is not None:
+                # Move to the most recently used end
+                del self.blocks[index]
+                self.blocks[index] = block
+                self.hits += 1
+                return block
+            self.misses += 1
+        finally:
+            self.cond.release()
+
+        t1 = time()
+        self.cond.acquire()
+        self.waiting += 1
+        self.cond.release()
+        try:
+            block = self.read_new(index)
+        finally:
+            self.cond.acquire()
+            self.waiting -= 1
+            self.cond.notify()
+            self.cond.release()
+        took = time() - t1
+        if took >= STALL_THRESHOLD:
+            self.cond.acquire()
+            try:
+                self.stalls += 1
+                self.stalltime += took
+            finally:
+                self.cond.release()
+
+            if DEBUG:
+                print >>sys.stderr,"CachingStream: stalled %.2f seconds reading block %d" % (took, index)
+        return block
+
+    def read_new(self,index,readahead=False):
+        """ Reads block index from the input stream and adds it to the cache.
 
+        A read for the readahead thread is abandoned between two reads on the
+        input stream as soon as a reader is waiting, or the block is no
+        longer ahead of the current position, and then returns None.
+        """
+        if DEBUG:
+            print >>sys.stderr,"read_new: ",index,readahead
+
+        self.inlock.acquire()
+        try:
+            # The readahead thread may have read the block while we were waiting
+            self.cond.acquire()
+            try:
+                block = self.blocks.get(index)
+                if block is not None or self.closed:
+                    return block or ''
+                if readahead and not self.want_readahead(index):
+                    return None
+            finally:
+                self.cond.release()
+
+            offset = index * self.inblocksize
+            if self.inpos != offset:
+                self.instream.seek(offset)
+                self.inpos = offset
+
+            # Core specific: we only return a single piece on each read, so
+            # keep reading until the block is complete or at EOF.
+            data = []
+            ngot = 0
+            while ngot < self.inblocksize:
+                if readahead and ngot and not self.want_readahead(index):
+                    if DEBUG:
+                        print >>sys.stderr,"read_new: readahead of",index,"gives way"
+                    return None
+                buffer = self.instream.read(self.inblocksize - ngot)
+                if not buffer:
+                    break
+                data.append(buffer)
+                ngot += len(buffer)
+                self.inpos += len(buffer)
+            block = data[0] if len(data) == 1 else ''.join(data)
+            if DEBUG:
+                print >>sys.stderr,"read_new: got",len(block)
+        finally:
+            self.inlock.release()
+
+        self.cond.acquire()
+        try:
+            if len(block) < self.inblocksize:
+                self.lastblock = index
+            if not self.closed:
+                self.blocks[index] = block
+                while len(self.blocks) > self.maxblocks:
+                    self.blocks.popitem(last=False)
+        finally:
+            self.cond.release()
+        return block
+
+    def want_readahead(self,index):
+        """ Returns whether the readahead thread should (continue to) read block index """
+        first = self.bufpos / self.inblocksize
+        return not self.waiting and not self.closed and first <= index <= first + self.readahead
+
+    def get_readahead_block(self):
+        """ Returns the first block after the current position that is not in the cache, or None """
+        first = self.bufpos / self.inblocksize
+        for index in xrange(first, first + self.readahead + 1):
+            if self.lastblock is not None and index > self.lastblock:
+                break
+            if index not in self.blocks:
+                return index
+
+    def readahead_thread(self):
+        while True:
+            self.cond.acquire()
+            try:
+                while not self.closed:
+                    index = self.get_readahead_block()
+                    if index is not None and not self.waiting:
+                        break
+                    self.cond.wait()
+                if self.closed:
+                    return
+            finally:
+                self.cond.release()
+
+            try:
+                block = self.read_new(index,readahead=True)
+            except:
+                # Leave the error to the reader, which will retry the block itself
+                if DEBUG:
+                    from traceback import print_exc
+                    print_exc()
+                self.cond.acquire()
+                try:
+                    self.cond.wait(1.0)
+                finally:
+                    self.cond.release()
+            else:
+                if block is None:
+                    continue
+                self.cond.acquire()
+                try:
+                    self.readaheads += 1
+                finally:
+                    self.cond.release()
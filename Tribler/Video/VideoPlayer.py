@@ -49,6 +49,7 @@ class VideoPlayer:
         self.videohttpserv = None
         # Must create the instance here, such that it won't get garbage collected
         self.videorawserv = VideoRawVLCServer.getInstance()
+        self.cachestream = None
 
         self.resume_by_system = 1
         self.user_download_choice = None
@@ -115,6 +116,9 @@ class VideoPlayer:
         if DEBUG:
             print >>sys.stderr,"videoplay: Playing file from disk",dest
 
+        # Not a cached stream, don't report the stats of the previous one
+        self.cachestream = None
+
         (prefix,ext) = os.path.splitext(dest)
         [mimetype,cmd] = self.get_video_player(ext,dest)
 
@@ -132,14 +136,17 @@ class VideoPlayer:
             print >>sys.stderr,"videoplay: Playing file with Unicode filename via HTTP"
 
         (prefix,ext) = os.path.splitext(dest)
-        videourl = self.create_url(self.videohttpserv,'/'+os.path.basename(prefix+ext))
+        upath = '/'+os.path.basename(prefix+ext)
+        videourl = self.create_url(self.videohttpserv,upath)
         [mimetype,cmd] = self.get_video_player(ext,videourl)
 
+        self.cachestream = None
         stream = open(dest,"rb")
         stats = os.stat(dest)
         length = stats.st_size
-        streaminfo = {'mimetype':mimetype,'stream':stream,'length':length}
-        self.videohttpserv.set_inputstream(streaminfo)
+        # The file is complete, so the HTTP server can send it from disk
+        streaminfo = {'mimetype':mimetype,'stream':stream,'length':length,'filename':dest}
+        self.videohttpserv.set_inputstream(streaminfo,urllib.quote(unicode2str(upath)))
 
         self.launch_video_player(cmd)
 
@@ -534,6 +541,7 @@ class VideoPlayer:
             else:
                 if d.get_def().get_live():
                     cachestream = stream
+                    self.cachestream = None
                     blocksize = d.get_def().get_piece_length()
                 else:
                     if d.get_def().get_def_type() == "swift":
@@ -541,24 +549,25 @@ class VideoPlayer:
                     else:
                         piecelen = d.get_def().get_piece_length()
 
-                    if piecelen > 2 ** 17:
-                        # Arno, 2010-01-21:
-                        # Workaround for streams with really large piece
-                        # sizes. For some content/containers, VLC can do
-                        # GET X-, GET X+10K-, GET X+20K HTTP requests
-                        # and we would answer these by putting megabytes
-                        # into the stream buffer, of which only 10K would be
-                        # used. This kills performance. Hence I add a caching
-                        # stream that tries to resolve answers from its internal
-                        # buffer, before reading the engine's stream.
-                        # This works, but only if the HTTP server doesn't
-                        # read too aggressively, i.e., uses small blocksize.
-                        #
-                        cachestream = SmartCachingStream(stream)
+                    # Arno, 2010-01-21:
+                    # For some content/containers, VLC can do
+                    # GET X-, GET X+10K-, GET X+20K HTTP requests
+                    # and we would answer these by putting megabytes
+                    # into the stream buffer, of which only 10K would be
+                    # used. This kills performance. Hence I add a caching
+                    # stream that tries to resolve answers from its internal
+                    # buffer, before reading the engine's stream.
+                    # This works, but only if the HTTP server doesn't
+                    # read too aggressively, i.e., uses small blocksize.
+                    #
+                    # The stream is shared by the HTTP server and the raw
+                    # VLC interface, so both read from the same cache.
+                    cachestream = SmartCachingStream(stream)
+                    self.cachestream = cachestream
 
+                    if piecelen > 2 ** 17:
                         blocksize = max(32768,piecelen/8)
                     else:
-                        cachestream = stream
                         blocksize = piecelen
 
                 if d.get_def().get_live() and is_ogg(d.get_def().get_name_as_unicode()):
@@ -602,6 +611,8 @@ class VideoPlayer:
                 self.play_stream(streaminfo)
 
         elif event == VODEVENT_PAUSE:
+            if DEBUG:
+                print >>sys.stderr,"videoplay: gui_vod_event: stream cache",self.get_stream_stats()
             if self.videoframe is not None:
                 self.videoframe.get_videopanel().Pause()
             self.set_player_status("Buffering...")
@@ -765,6 +776,12 @@ class VideoPlayer:
     def get_vod_download(self):
         return self.vod_download
 
+    def get_stream_stats(self):
+        """ Returns the hit rate and stall counters of the cache of the
+        stream being played, or None when not playing a cached stream """
+        if self.cachestream is not None:
+            return self.cachestream.get_stats()
+
     #
     # Set information about video playback progress that is displayed
     # to the user.
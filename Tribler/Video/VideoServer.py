@@ -5,9 +5,11 @@
 import sys
 import time
 import socket
+import random
 import BaseHTTPServer
+from Queue import Queue
 from SocketServer import ThreadingMixIn
-from threading import RLock,Thread,currentThread
+from threading import Lock,RLock,Thread,currentThread
 from traceback import print_exc,print_stack
 import string
 from cStringIO import StringIO
@@ -15,6 +17,12 @@ from cStringIO import StringIO
 import os
 import Tribler.Core.osutils
 
+try:
+    # pysendfile, os.sendfile is only available from python 3.3
+    from sendfile import sendfile
+except ImportError:
+    sendfile = getattr(os,'sendfile',None)
+
 # NOTE: DEBUG is set dynamically depending from DEBUGWEBUI and DEBUGCONTENT
 DEBUG = False
 DEBUGCONTENT = False
@@ -22,12 +30,58 @@ DEBUGWEBUI = False
 DEBUGLOCK = False
 DEBUGBASESERV = False
 
+NR_WORKERS = 16             # number of threads serving requests while idle
+KEEPALIVE_TIMEOUT = 15      # seconds an idle persistent connection is kept open
+SENDFILE_BLOCKSIZE = 1024*1024
+
 def bytestr2int(b):
     if b == "":
         return None
     else:
         return int(b)
 
+def parse_ranges(header,length):
+    """ Parses the value of a Range header into a list of (firstbyte,lastbyte)
+    tuples. Returns None when the header is invalid or none of the ranges can
+    be satisfied.
+    """
+    try:
+        unit, rangeset = header.split('=',1)
+    except ValueError:
+        return None
+    if unit.strip() != "bytes":
+        return None
+
+    ranges = []
+    for spec in rangeset.split(','):
+        try:
+            firstbytestr, lastbytestr = spec.strip().split('-')
+            firstbyte = bytestr2int(firstbytestr)
+            lastbyte = bytestr2int(lastbytestr)
+        except ValueError:
+            return None
+
+        if firstbyte is None and lastbyte is None:
+            # - Invalid input
+            return None
+        elif firstbyte is None:
+            # "-100" = last 100 bytes
+            if lastbyte == 0:
+                continue
+            firstbyte = max(0,length - lastbyte)
+            lastbyte = length - 1
+        else:
+            # "100-" : byte 100 and further, a lastbyte beyond the
+            # entity is cut off
+            if lastbyte is None or lastbyte >= length:
+                lastbyte = length - 1
+            if firstbyte >= length:
+                continue
+            if firstbyte > lastbyte:
+                return None
+        ranges.append((firstbyte,lastbyte))
+    return ranges or None
+
 
 class AbstractPathMapper:
 
@@ -41,7 +95,64 @@ class AbstractPathMapper:
         return streaminfo
 
 
-class VideoHTTPServer(ThreadingMixIn,BaseHTTPServer.HTTPServer):
+class ThreadPoolMixIn:
+    """ Mix-in class to handle each request using a pool of worker threads,
+    instead of starting a new thread per request as ThreadingMixIn does.
+
+    A worker serves a connection until it is closed, so a persistent
+    connection waiting for its next request holds a worker. When all workers
+    are busy an extra worker is started, such that the webUI and NSSA
+    requests are not queued behind idle connections. Extra workers stop once
+    more than nr_workers are running and idle.
+    """
+    nr_workers = NR_WORKERS
+
+    def start_workers(self):
+        self.requestqueue = Queue()
+        self.workerlock = Lock()
+        self.nr_running = 0
+        self.nr_idle = self.nr_workers  # workers that will take a request from the queue
+        for i in range(self.nr_workers):
+            self.start_worker()
+
+    def start_worker(self):
+        """ Called with workerlock held, or before serving """
+        self.nr_running += 1
+        thread = Thread(target=self.process_request_worker,name="VideoHTTPServerWorker-%d" % self.nr_running)
+        thread.setDaemon(True)
+        thread.start()
+
+    def process_request_worker(self):
+        while True:
+            request, client_address = self.requestqueue.get()
+            try:
+                self.finish_request(request,client_address)
+            except:
+                self.handle_error(request,client_address)
+            self.shutdown_request(request)
+
+            self.workerlock.acquire()
+            try:
+                if self.nr_running > self.nr_workers:
+                    self.nr_running -= 1
+                    return
+                self.nr_idle += 1
+            finally:
+                self.workerlock.release()
+
+    def process_request(self,request,client_address):
+        self.workerlock.acquire()
+        try:
+            if self.nr_idle:
+                self.nr_idle -= 1
+            else:
+                self.start_worker()
+        finally:
+            self.workerlock.release()
+        self.requestqueue.put((request,client_address))
+
+
+class VideoHTTPServer(ThreadPoolMixIn,BaseHTTPServer.HTTPServer):
 #class VideoHTTPServer(BaseHTTPServer.HTTPServer):
     """
     Arno: not using ThreadingMixIn makes it a single-threaded server.
@@ -58,6 +169,9 @@ class VideoHTTPServer(ThreadingMixIn,BaseHTTPServer.HTTPServer):
     2009-12-05: I now made it Multi-threaded to also handle the NSSA search
     API requests. The concurrency issue on the p2p streams is handled by
     adding a lock per stream.
+
+    Requests are handled by a pool of at least NR_WORKERS threads, HTTP/1.1
+    connections are kept alive for KEEPALIVE_TIMEOUT seconds.
     """
     __single = None
 
@@ -80,6 +194,8 @@ class VideoHTTPServer(ThreadingMixIn,BaseHTTPServer.HTTPServer):
         self.errorcallback = None
         self.statuscallback = None
 
+        self.start_workers()
+
     def getInstance(*args, **kw):
         if VideoHTTPServer.__single is None:
             VideoHTTPServer(*args, **kw)
@@ -102,6 +218,8 @@ class VideoHTTPServer(ThreadingMixIn,BaseHTTPServer.HTTPServer):
             print >>sys.stderr,"vs: set_input: lock",urlpath,currentThread().getName()
         self.lock.acquire()
         streaminfo['lock'] = RLock()
+        streaminfo['statslock'] = Lock()  # the stream lock is held while sending
+        streaminfo['stats'] = {'requests':0,'bytes':0,'time':0.0,'ttfb':None,'ttfb_total':0.0}
         self.urlpath2streaminfo[urlpath] = streaminfo
         if DEBUGLOCK:
             print >>sys.stderr,"vs: set_input: unlock",urlpath,currentThread().getName()
@@ -173,6 +291,28 @@ class VideoHTTPServer(ThreadingMixIn,BaseHTTPServer.HTTPServer):
             streaminfo['lock'].release()
 
 
+    def get_stream_stats(self,urlpath):
+        """ Returns the number of requests, bytes/sec while sending and the
+        last and average time-to-first-byte for the stream, or None """
+        self.lock.acquire()
+        try:
+            streaminfo = self.urlpath2streaminfo.get(urlpath,None)
+        finally:
+            self.lock.release()
+        if streaminfo is None or 'stats' not in streaminfo:
+            return None
+
+        streaminfo['statslock'].acquire()
+        try:
+            stats = streaminfo['stats']
+            return {'requests': stats['requests'],
+                    'bytes': stats['bytes'],
+                    'bytes_per_sec': stats['bytes'] / stats['time'] if stats['time'] else 0.0,
+                    'ttfb': stats['ttfb'],
+                    'avg_ttfb': stats['ttfb_total'] / stats['requests'] if stats['requests'] else None}
+        finally:
+            streaminfo['statslock'].release()
+
     def get_port(self):
         return self.port
 
@@ -207,14 +347,24 @@ class SimpleServer(BaseHTTPServer.BaseHTTPRequestHandler):
     def log_message(self, format, *args):
         pass
 
+    def handle_one_request(self):
+        # Close persistent connections that stay idle, but do not time out
+        # while sending to a player that paused reading
+        self.connection.settimeout(KEEPALIVE_TIMEOUT)
+        BaseHTTPServer.BaseHTTPRequestHandler.handle_one_request(self)
+
     def do_GET(self):
         """
         Handle HTTP GET request. See remark about VLC's use of HTTP GET RANGE
         requests above.
 
-        Called by a separate thread for each request.
+        Called by one of the worker threads for each request.
         """
         global DEBUG
+        self.connection.settimeout(None)
+        self.starttime = time.time()
+        self.ttfb = None
+        self.nbytes = 0
         try:
             if self.path.startswith("/webUI"):
                 DEBUG = DEBUGWEBUI
@@ -237,6 +387,9 @@ class SimpleServer(BaseHTTPServer.BaseHTTPRequestHandler):
             # Ric: modified to create a persistent connection in case it's requested (HTML5)
             if self.request_version == 'HTTP/1.1':
                 self.protocol_version = 'HTTP/1.1'
+                # parse_request only keeps the connection open when
+                # protocol_version was HTTP/1.1 already
+                self.close_connection = int(self.headers.get('Connection',"").lower() == 'close')
 
             try:
                 if streaminfo is None or ('statuscode' in streaminfo and streaminfo['statuscode'] != 200):
@@ -249,6 +402,7 @@ class SimpleServer(BaseHTTPServer.BaseHTTPRequestHandler):
                     self.send_response(streaminfo['statuscode'])
                     if streaminfo['statuscode'] == 301:
                         self.send_header("Location", streaminfo['statusmsg'])
+                        self.send_header("Content-Length", 0)
                         self.end_headers()
                     else:
                         self.send_header("Content-Type","text/plain")
@@ -272,6 +426,8 @@ class SimpleServer(BaseHTTPServer.BaseHTTPRequestHandler):
                         svc = streaminfo['svc']
                     else:
                         svc = False
+                    # Complete content on disk can be sent without reading the stream
+                    filename = streaminfo.get('filename',None)
 
 
                 #mimetype = 'application/x-mms-framed'
@@ -286,67 +442,41 @@ class SimpleServer(BaseHTTPServer.BaseHTTPRequestHandler):
                     lastbyte = length-1
                 else:
                     lastbyte = None # to avoid print error below
+                ranges = None
 
                 range = self.headers.getheader('range')
                 if self.RANGE_REQUESTS_ENABLED and length and range:
                     # Handle RANGE query
-                    bad = False
-                    type, seek = string.split(range,'=')
-                    if seek.find(",") != -1:
-                        # - Range header contains set, not supported at the moment
-                        bad = True
-                    else:
-                        firstbytestr, lastbytestr = string.split(seek,'-')
-                        firstbyte = bytestr2int(firstbytestr)
-                        lastbyte = bytestr2int(lastbytestr)
-
-                        if length is None:
-                            # - No length (live)
-                            bad = True
-                        elif firstbyte is None and lastbyte is None:
-                            # - Invalid input
-                            bad = True
-                        elif firstbyte >= length:
-                            bad = True
-                        elif lastbyte >= length:
-                            if firstbyte is None:
-                                """ If the entity is shorter than the specified
-                                suffix-length, the entire entity-body is used.
-                                """
-                                lastbyte = length-1
-                            else:
-                                bad = True
-
-                    if bad:
+                    ranges = parse_ranges(range,length)
+                    if ranges is None:
                         # Send 416 - Requested Range not satisfiable and exit
                         self.send_response(416)
-                        if length is None:
-                            crheader = "bytes */*"
-                        else:
-                            crheader = "bytes */"+str(length)
+                        crheader = "bytes */"+str(length)
                         self.send_header("Content-Range",crheader)
+                        self.send_header("Content-Length",0)
                         self.end_headers()
 
                         return
 
-                    if firstbyte is not None and lastbyte is None:
-                        # "100-" : byte 100 and further
-                        nbytes2send = length - firstbyte
-                        lastbyte = length - 1
-                    elif firstbyte is None and lastbyte is not None:
-                        # "-100" = last 100 bytes
-                        nbytes2send = lastbyte
-                        firstbyte = length - lastbyte
-                        lastbyte = length - 1
-
-                    else:
+                    if len(ranges) == 1:
+                        firstbyte, lastbyte = ranges[0]
                         nbytes2send = lastbyte+1 - firstbyte
 
-                    # Arno, 2010-01-08: Fixed bug, now return /length
-                    crheader = "bytes "+str(firstbyte)+"-"+str(lastbyte)+"/"+str(length)
+                        # Arno, 2010-01-08: Fixed bug, now return /length
+                        crheader = "bytes "+str(firstbyte)+"-"+str(lastbyte)+"/"+str(length)
 
-                    self.send_response(206)
-                    self.send_header("Content-Range",crheader)
+                        self.send_response(206)
+                        self.send_header("Content-Range",crheader)
+                    else:
+                        # Set of ranges, send as multipart/byteranges:
+                        # http://tools.ietf.org/html/rfc2616#section-19.2
+                        boundary = "%x" % random.getrandbits(64)
+                        partheaders = ["\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n" % (boundary,mimetype,first,last,length) for first, last in ranges]
+                        trailer = "\r\n--%s--\r\n" % boundary
+                        nbytes2send = sum(last+1-first for first, last in ranges)
+
+                        self.send_response(206)
+                        mimetype = "multipart/byteranges; boundary="+boundary
                 else:
                     # Normal GET request
                     nbytes2send = length
@@ -354,11 +484,12 @@ class SimpleServer(BaseHTTPServer.BaseHTTPRequestHandler):
 
 
                 if DEBUG:
-                    print >>sys.stderr,"videoserv: do_GET: final range",firstbyte,lastbyte,nbytes2send,currentThread().getName()
+                    print >>sys.stderr,"videoserv: do_GET: final range",ranges or (firstbyte,lastbyte),nbytes2send,currentThread().getName()
 
 
-                # 4. Seek in stream to desired offset, unless svc
-                if not svc:
+                # 4. Seek in stream to desired offset, unless svc or
+                # serving a complete file from disk
+                if not svc and not filename:
                     try:
                         stream.seek(firstbyte)
                     except:
@@ -369,10 +500,9 @@ class SimpleServer(BaseHTTPServer.BaseHTTPRequestHandler):
                         print_exc()
 
                 # For persistent connections keep the socket alive!
-                if self.request_version == 'HTTP/1.1':
+                if self.request_version == 'HTTP/1.1' and not self.close_connection:
                     self.send_header("Connection", "Keep-Alive")
-                    # test.. to be adjusted depending on the request
-                    self.send_header("Keep-Alive", "timeout=15, max=100")
+                    self.send_header("Keep-Alive", "timeout=%d, max=100" % KEEPALIVE_TIMEOUT)
 
                 # 5. Send headers
                 self.send_header("Content-Type", mimetype)
@@ -385,7 +515,9 @@ class SimpleServer(BaseHTTPServer.BaseHTTPRequestHandler):
                     estduration = float(length) / float(bitrate)
                     self.send_header("X-Content-Duration", estduration)
 
-                if length is not None:
+                if ranges is not None and len(ranges) > 1:
+                    self.send_header("Content-Length", nbytes2send + sum(map(len,partheaders)) + len(trailer))
+                elif length is not None:
                     self.send_header("Content-Length", nbytes2send)
                 else:
                     self.send_header("Transfer-Encoding", "chunked")
@@ -397,46 +529,35 @@ class SimpleServer(BaseHTTPServer.BaseHTTPRequestHandler):
                     data = stream.read()
 
                     if len(data) > 0:
-                        self.wfile.write(data)
+                        self.write_body(data)
                     elif len(data) == 0:
                         if DEBUG:
                             print >>sys.stderr,"videoserv: svc: stream.read() no data"
                 else:
                     # 6. Send body (completely, a Range: or an infinite stream in chunked encoding
-                    done = False
-                    while True:
-                        data = stream.read(blocksize)
-                        if len(data) == 0:
-                            done = True
-
-                        #print >>sys.stderr,"videoserv: HTTP: read",len(data),"bytes",currentThread().getName()
-
-                        if length is None:
-                            # If length unknown, use chunked encoding
-                            # http://www.ietf.org/rfc/rfc2616.txt, $3.6.1
-                            self.wfile.write("%x\r\n" % (len(data)))
-                        if len(data) > 0:
-                            # Limit output to what was asked on range queries:
-                            if length is not None and nbyteswritten+len(data) > nbytes2send:
-                                endlen = nbytes2send-nbyteswritten
-                                if endlen != 0:
-                                    self.wfile.write(data[:endlen])
-                                done = True
-                                nbyteswritten += endlen
+                    if filename:
+                        # Complete file on disk, let the kernel copy it
+                        f = open(filename,"rb")
+                        try:
+                            if ranges is not None and len(ranges) > 1:
+                                for (first, last), partheader in zip(ranges,partheaders):
+                                    self.write_body(partheader)
+                                    nbyteswritten += self.send_file(f,first,last+1-first)
+                                self.write_body(trailer)
                             else:
-                                self.wfile.write(data)
-                                nbyteswritten += len(data)
+                                nbyteswritten = self.send_file(f,firstbyte,nbytes2send)
+                        finally:
+                            f.close()
 
-                            #print >>sys.stderr,"videoserv: HTTP: wrote total",nbyteswritten
+                    elif ranges is not None and len(ranges) > 1:
+                        for (first, last), partheader in zip(ranges,partheaders):
+                            self.write_body(partheader)
+                            stream.seek(first)
+                            nbyteswritten += self.send_stream(stream,last+1-first,blocksize)
+                        self.write_body(trailer)
 
-                        if length is None:
-                            # If length unknown, use chunked encoding
-                            self.wfile.write("\r\n")
-
-                        if done:
-                            if DEBUG:
-                                print >>sys.stderr,"videoserv: do_GET: stream reached EOF or range query's send limit",currentThread().getName()
-                            break
+                    else:
+                        nbyteswritten = self.send_stream(stream,nbytes2send,blocksize)
 
                     if nbyteswritten != nbytes2send:
                         print >>sys.stderr,"videoserv: do_GET: Sent wrong amount, wanted",nbytes2send,"got",nbyteswritten,currentThread().getName()
@@ -448,6 +569,17 @@ class SimpleServer(BaseHTTPServer.BaseHTTPRequestHandler):
                             self.server.statuscallback("Done")
 
             finally:
+                if 'stats' in streaminfo and self.ttfb is not None:
+                    streaminfo['statslock'].acquire()
+                    try:
+                        stats = streaminfo['stats']
+                        stats['requests'] += 1
+                        stats['bytes'] += self.nbytes
+                        stats['time'] += time.time() - self.starttime - self.ttfb
+                        stats['ttfb'] = self.ttfb
+                        stats['ttfb_total'] += self.ttfb
+                    finally:
+                        streaminfo['statslock'].release()
                 self.server.release_inputstream(self.path)
 
         except socket.error,e2:
@@ -463,6 +595,80 @@ class SimpleServer(BaseHTTPServer.BaseHTTPRequestHandler):
 
 
 
+    def write_body(self,data):
+        if self.ttfb is None:
+            self.ttfb = time.time() - self.starttime
+        self.wfile.write(data)
+        self.nbytes += len(data)
+
+    def send_stream(self,stream,nbytes2send,blocksize):
+        """ Sends nbytes2send bytes read from stream, or the stream until EOF
+        in chunked encoding when nbytes2send is None. Returns the number of
+        bytes sent.
+        """
+        nbyteswritten = 0
+        done = False
+        while True:
+            data = stream.read(blocksize)
+            if len(data) == 0:
+                done = True
+
+            #print >>sys.stderr,"videoserv: HTTP: read",len(data),"bytes",currentThread().getName()
+
+            if nbytes2send is None:
+                # If length unknown, use chunked encoding
+                # http://www.ietf.org/rfc/rfc2616.txt, $3.6.1
+                self.write_body("%x\r\n" % (len(data)))
+            if len(data) > 0:
+                # Limit output to what was asked on range queries:
+                if nbytes2send is not None and nbyteswritten+len(data) >= nbytes2send:
+                    endlen = nbytes2send-nbyteswritten
+                    if endlen != 0:
+                        self.write_body(data[:endlen])
+                    done = True
+                    nbyteswritten += endlen
+                else:
+                    self.write_body(data)
+                    nbyteswritten += len(data)
+
+                #print >>sys.stderr,"videoserv: HTTP: wrote total",nbyteswritten
+
+            if nbytes2send is None:
+                # If length unknown, use chunked encoding
+                self.write_body("\r\n")
+
+            if done:
+                if DEBUG:
+                    print >>sys.stderr,"videoserv: do_GET: stream reached EOF or range query's send limit",currentThread().getName()
+                break
+        return nbyteswritten
+
+    def send_file(self,f,offset,nbytes):
+        """ Sends nbytes bytes from offset of file f, using sendfile when
+        available. Returns the number of bytes sent.
+        """
+        if self.ttfb is None:
+            self.ttfb = time.time() - self.starttime
+        self.wfile.flush()
+
+        nbyteswritten = 0
+        if sendfile is not None:
+            while nbyteswritten < nbytes:
+                sent = sendfile(self.connection.fileno(),f.fileno(),offset+nbyteswritten,min(nbytes-nbyteswritten,SENDFILE_BLOCKSIZE))
+                if sent == 0:
+                    break
+                nbyteswritten += sent
+        else:
+            f.seek(offset)
+            while nbyteswritten < nbytes:
+                data = f.read(min(nbytes-nbyteswritten,SENDFILE_BLOCKSIZE))
+                if not data:
+                    break
+                self.connection.sendall(data)
+                nbyteswritten += len(data)
+        self.nbytes += nbyteswritten
+        return nbyteswritten
+
     def error(self,e,url):
         if self.server.errorcallback is not None:
             self.server.errorcallback(e,url)
@@ -138,6 +138,7 @@ class AllChannelCommunity(Community):
 
                 favoriteTorrents = None
                 normalTorrents = None
+                subscribers = None
 
                 #cleanup blocklist
                 for candidate in self._blocklist.keys():
@@ -156,18 +157,12 @@ class AllChannelCommunity(Community):
                     didFavorite = False
                     #only check if we actually have a channel
                     if mychannel_id:
-                        peer_ids = set()
-                        for member in candidate.get_members(self):
-                            key = member.public_key
-                            peer_ids.add(self._peer_db.addOrGetPeerID(key))
+                        if subscribers is None:
+                            subscribers = self._votecast_db.getMyChannelSubscribers()
 
                         #see if all members on this address are subscribed to my channel
-                        didFavorite = len(peer_ids) > 0
-                        for peer_id in peer_ids:
-                            vote = self._votecast_db.getVoteForMyChannel(peer_id)
-                            if vote != 2:
-                                didFavorite = False
-                                break
+                        members = list(candidate.get_members(self))
+                        didFavorite = len(members) > 0 and all(member.public_key in subscribers for member in members)
 
                     #Modify type of message depending on if all peers have marked my channels as their favorite
                     if didFavorite:
@@ -191,12 +186,12 @@ class AllChannelCommunity(Community):
 
                         if DEBUG:
                             nr_torrents = sum(len(torrent) for torrent in torrents.values())
-                            print >> sys.stderr, "AllChannelCommunity: sending channelcast message containing",nr_torrents,"torrents to",candidate.sock_addr,"didFavorite",didFavorite
+                            print >> sys.stderr, "AllChannelCommunity: sending channelcast message containing",nr_torrents,"torrents to",candidate.sock_addr,"didFavorite",didFavorite,"composed in %.4f seconds" % (time() - now)
 
                         if __debug__:
                             if not self.integrate_with_tribler:
                                 nr_torrents = sum(len(torrent) for torrent in torrents.values())
-                                log("dispersy.log", "Sending channelcast message containing %d torrents to %s didFavorite %s"%(nr_torrents,candidate.sock_addr,didFavorite))
+                                log("dispersy.log", "Sending channelcast message containing %d torrents to %s didFavorite %s composed in %.4f seconds"%(nr_torrents,candidate.sock_addr,didFavorite,time() - now))
 
                         #we're done
                         break
@@ -676,6 +671,10 @@ class VoteCastDBStub():
             return 2
         return 0
 
+    def getMyChannelSubscribers(self):
+        sql = u"SELECT DISTINCT member.public_key FROM sync JOIN member ON sync.member = member.id JOIN community ON community.id = sync.community JOIN meta_message ON sync.meta_message = meta_message.id WHERE community.classification = 'AllChannelCommunity' AND meta_message.name = 'votecast'"
+        return set(str(public_key) for public_key, in self._dispersy.database.execute(sql))
+
     def get_latest_vote_dispersy_id(self, channel_id, voter_id):
         return
 
@@ -31,6 +31,8 @@ if __debug__:
     from Tribler.dispersy.dprint import dprint
     from Tribler.dispersy.tool.lencoder import log
 
+MAX_LATEST_MODIFICATIONS = 10000    # entries dropped from _latest_modifications are determined again when needed
+
 class MissingChannelCache(MissingSomethingCache):
     @staticmethod
     def properties_to_identifier(community):
@@ -115,6 +117,10 @@ class ChannelCommunity(Community):
         self.integrate_with_tribler = integrate_with_tribler
 
         self._channel_id = None
+        # (message name, id, type_id): (prev_global_time, global_time, dispersy_id) of the latest
+        # modification or None, loaded on first use and kept up to date as modifications come in.
+        # at most MAX_LATEST_MODIFICATIONS keys are kept
+        self._latest_modifications = {}
         super(ChannelCommunity, self).__init__(master)
 
         if self.integrate_with_tribler:
@@ -736,20 +742,17 @@ class ChannelCommunity(Community):
             if message_name ==  u"torrent":
                 channeltorrent_id = channeltorrentDict[modifying_dispersy_id]
 
-                latest = self._get_latest_modification_from_torrent_id(channeltorrent_id, modification_type_id)
-                if not latest or latest.packet_id == dispersy_id:
+                if self._update_latest_modification((message_name, channeltorrent_id, modification_type_id), message):
                     self._channelcast_db.on_torrent_modification_from_dispersy(channeltorrent_id, modification_type, modification_value, False)
 
             elif message_name == u"playlist":
                 playlist_id = playlistDict[modifying_dispersy_id]
 
-                latest = self._get_latest_modification_from_playlist_id(playlist_id, modification_type_id)
-                if not latest or latest.packet_id == dispersy_id:
+                if self._update_latest_modification((message_name, playlist_id, modification_type_id), message):
                     self._channelcast_db.on_playlist_modification_from_dispersy(playlist_id, modification_type, modification_value, False)
 
             elif message_name == u"channel":
-                latest = self._get_latest_modification_from_channel_id(modification_type_id)
-                if not latest or latest.packet_id == dispersy_id:
+                if self._update_latest_modification((message_name, self._channel_id, modification_type_id), message):
                     self._channelcast_db.on_channel_modification_from_dispersy(self._channel_id, modification_type, modification_value, False)
 
 
@@ -781,6 +784,8 @@ class ChannelCommunity(Community):
             elif message_name == u"playlist":
                 playlist_id = self._get_playlist_id_from_message(modifying_dispersy_id)
             self._channelcast_db.on_remove_metadata_from_dispersy(self._channel_id, dispersy_id, redo)
+            # an undone modification can be the latest of any chain, determine them again when needed
+            self._latest_modifications.clear()
 
             if message_name ==  u"torrent":
                 latest = self._get_latest_modification_from_torrent_id(channeltorrent_id, modification_type_id)
@@ -1013,6 +1018,8 @@ class ChannelCommunity(Community):
                     updateTorrent = True
 
             self._channelcast_db.on_moderation(self._channel_id, dispersy_id, peer_id, by_peer_id, cause, message.payload.text, message.payload.timestamp, message.payload.severity)
+            # moderated modifications are ignored, determine the latest modifications again when needed
+            self._latest_modifications.clear()
 
             if updateTorrent:
                 latest = self._get_latest_modification_from_torrent_id(channeltorrent_id, modification_type_id)
@@ -1027,6 +1034,7 @@ class ChannelCommunity(Community):
         for _, _, packet in descriptors:
             dispersy_id = packet.packet_id
             self._channelcast_db.on_remove_moderation(self._channel_id, dispersy_id, redo)
+            self._latest_modifications.clear()
 
     #check or receive torrent_mark messages
     @forceDispersyThread
@@ -1146,24 +1154,74 @@ class ChannelCommunity(Community):
         assert isinstance(type_id, (int, long)), "type_id type is '%s'"%type(type_id)
 
         # 1. get the dispersy identifier from the channel_id
-        dispersy_ids = self._channelcast_db._db.fetchall(u"SELECT dispersy_id, prev_global_time FROM ChannelMetaData WHERE type_id = ? AND channel_id = ? AND id NOT IN (SELECT metadata_id FROM MetaDataTorrent) AND id NOT IN (SELECT metadata_id FROM MetaDataPlaylist) AND dispersy_id not in (SELECT cause FROM Moderations WHERE channel_id = ?) ORDER BY prev_global_time DESC", (type_id, self._channel_id, self._channel_id))
-        return self._determine_latest_modification(dispersy_ids)
+        sql = u"SELECT dispersy_id, prev_global_time FROM ChannelMetaData WHERE type_id = ? AND channel_id = ? AND id NOT IN (SELECT metadata_id FROM MetaDataTorrent) AND id NOT IN (SELECT metadata_id FROM MetaDataPlaylist) AND dispersy_id not in (SELECT cause FROM Moderations WHERE channel_id = ?) ORDER BY prev_global_time DESC"
+        return self._get_latest_modification((u"channel", self._channel_id, type_id), sql, (type_id, self._channel_id, self._channel_id))
 
     def _get_latest_modification_from_torrent_id(self, channeltorrent_id, type_id):
         assert isinstance(channeltorrent_id, (int, long)), "channeltorrent_id type is '%s'"%type(channeltorrent_id)
         assert isinstance(type_id, (int, long)), "type_id type is '%s'"%type(type_id)
 
         # 1. get the dispersy identifier from the channel_id
-        dispersy_ids = self._channelcast_db._db.fetchall(u"SELECT dispersy_id, prev_global_time FROM ChannelMetaData, MetaDataTorrent WHERE ChannelMetaData.id = MetaDataTorrent.metadata_id AND type_id = ? AND channeltorrent_id = ? AND dispersy_id not in (SELECT cause FROM Moderations WHERE channel_id = ?) ORDER BY prev_global_time DESC", (type_id, channeltorrent_id, self._channel_id))
-        return self._determine_latest_modification(dispersy_ids)
+        sql = u"SELECT dispersy_id, prev_global_time FROM ChannelMetaData, MetaDataTorrent WHERE ChannelMetaData.id = MetaDataTorrent.metadata_id AND type_id = ? AND channeltorrent_id = ? AND dispersy_id not in (SELECT cause FROM Moderations WHERE channel_id = ?) ORDER BY prev_global_time DESC"
+        return self._get_latest_modification((u"torrent", channeltorrent_id, type_id), sql, (type_id, channeltorrent_id, self._channel_id))
 
     def _get_latest_modification_from_playlist_id(self, playlist_id, type_id):
         assert isinstance(playlist_id, (int, long)), "playlist_id type is '%s'"%type(playlist_id)
         assert isinstance(type_id, (int, long)), "type_id type is '%s'"%type(type_id)
 
         # 1. get the dispersy identifier from the channel_id
-        dispersy_ids = self._channelcast_db._db.fetchall(u"SELECT dispersy_id, prev_global_time FROM ChannelMetaData, MetaDataPlaylist WHERE ChannelMetaData.id = MetaDataPlaylist.metadata_id AND type_id = ? AND playlist_id = ? AND dispersy_id not in (SELECT cause FROM Moderations WHERE channel_id = ?) ORDER BY prev_global_time DESC", (type_id, playlist_id, self._channel_id))
-        return self._determine_latest_modification(dispersy_ids)
+        sql = u"SELECT dispersy_id, prev_global_time FROM ChannelMetaData, MetaDataPlaylist WHERE ChannelMetaData.id = MetaDataPlaylist.metadata_id AND type_id = ? AND playlist_id = ? AND dispersy_id not in (SELECT cause FROM Moderations WHERE channel_id = ?) ORDER BY prev_global_time DESC"
+        return self._get_latest_modification((u"playlist", playlist_id, type_id), sql, (type_id, playlist_id, self._channel_id))
+
+    @forceAndReturnDispersyThread
+    def _get_latest_modification(self, key, sql, args):
+        # 2. use the latest modification determined before, if it can still be loaded
+        if key in self._latest_modifications:
+            latest = self._latest_modifications[key]
+            if latest is None:
+                return None
+
+            try:
+                message = self._get_message_from_dispersy_id(latest[2], 'modification')
+                if message:
+                    return message.load_message()
+            except RuntimeError:
+                pass
+
+        # 3. determine the latest modification from all modifications
+        message = self._determine_latest_modification(self._channelcast_db._db.fetchall(sql, args))
+        self._set_latest_modification(key, message)
+        return message
+
+    def _set_latest_modification(self, key, message):
+        if key not in self._latest_modifications and len(self._latest_modifications) >= MAX_LATEST_MODIFICATIONS:
+            self._latest_modifications.popitem()
+
+        if message:
+            self._latest_modifications[key] = (message.payload.prev_modification_global_time, message.distribution.global_time, message.packet_id)
+        else:
+            self._latest_modifications[key] = None
+
+    def _update_latest_modification(self, key, message):
+        """
+        Called for a modification stored in the database, returns True if it is the latest
+        modification for key
+        """
+        if key in self._latest_modifications:
+            latest = self._latest_modifications[key]
+            if latest is None or (message.payload.prev_modification_global_time, message.distribution.global_time) > latest[:2]:
+                self._set_latest_modification(key, message)
+                return True
+            return latest[2] == message.packet_id
+
+        message_name, object_id, type_id = key
+        if message_name == u"torrent":
+            latest = self._get_latest_modification_from_torrent_id(object_id, type_id)
+        elif message_name == u"playlist":
+            latest = self._get_latest_modification_from_playlist_id(object_id, type_id)
+        else:
+            latest = self._get_latest_modification_from_channel_id(type_id)
+        return not latest or latest.packet_id == message.packet_id
 
     @forceAndReturnDispersyThread
     def _determine_latest_modification(self, list):
@@ -1189,17 +1247,8 @@ class ChannelCommunity(Community):
             # 2. see if we have a conflict
             if len(conflicting_messages) > 1:
 
-                # 3. solve conflict using mid to sort on
-                def cleverSort(message_a, message_b):
-                    public_key_a = message_a.authentication.member.public_key
-                    public_key_b = message_a.authentication.member.public_key
-
-                    if public_key_a == public_key_b:
-                        return cmp(message_b.distribution.global_time, message_a.distribution.global_time)
-
-                    return cmp(public_key_a, public_key_b)
-
-                conflicting_messages.sort(cleverSort)
+                # 3. solve conflict using the global time, the most recent modification wins
+                conflicting_messages.sort(key = lambda message: message.distribution.global_time, reverse = True)
 
             if len(conflicting_messages) > 0:
                 # 4. return first message
@@ -0,0 +1,205 @@
+from Crypto.Random.random import StrongRandom
+from Crypto.Util.number import GCD, bytes_to_long, long_to_bytes, inverse
+
+from gmpy import mpz
+
+from collections import deque, namedtuple
+from threading import Thread, Event
+from random import randint
+from time import time
+
+from Tribler.community.privatesearch.rsa import rsa_init, rsa_encrypt, rsa_decrypt, rsa_compatible, hash_element
+from Tribler.community.privatesearch.pallier import pallier_init, pallier_encrypt, pallier_decrypt
+
+# Batched versions of the rsa and pallier functions, encrypting or decrypting a complete preference
+# list/vector in one call.  Optionally, the lists are split into chunks and handed to a
+# multiprocessing.Pool.
+
+CRTKey = namedtuple('CRTKey', ['p', 'q', 'dp', 'dq', 'qinv'])
+
+BLINDING_POOL_SIZE = 500        # number of pallier blinding factors kept ready
+PROCESS_THRESHOLD = 100         # lists shorter than this are not worth sending to a process pool
+PROCESS_CHUNK_SIZE = 50
+
+_crt_keys = {}
+
+def rsa_crt(key):
+    """
+    Returns the chinese remainder theorem parameters of this key, or None if we do not know its
+    factorisation (i.e. it is not our own key).
+    """
+    if key.p is None or key.q is None or key.d is None:
+        return None
+
+    crt = _crt_keys.get(key.n)
+    if not crt:
+        p, q, d = mpz(key.p), mpz(key.q), mpz(key.d)
+        crt = _crt_keys[key.n] = CRTKey(p, q, d % (p - 1), d % (q - 1), mpz(inverse(long(q), long(p))))
+    return crt
+
+def _rsa_chunk(args):
+    (modulus, exponent), elements = args
+    modulus = mpz(modulus)
+    exponent = mpz(exponent)
+    return [long(pow(mpz(element), exponent, modulus)) for element in elements]
+
+def _rsa_crt_chunk(args):
+    (p, q, dp, dq, qinv), ciphers = args
+    p, q, dp, dq, qinv = mpz(p), mpz(q), mpz(dp), mpz(dq), mpz(qinv)
+
+    elements = []
+    for cipher in ciphers:
+        _cipher = mpz(cipher)
+        m1 = pow(_cipher % p, dp, p)
+        m2 = pow(_cipher % q, dq, q)
+        h = (qinv * (m1 - m2)) % p
+        elements.append(long(m2 + h * q))
+    return elements
+
+def _pallier_decrypt_chunk(args):
+    (n, n2, lambda_, d), ciphers = args
+    n, n2, lambda_, d = mpz(n), mpz(n2), mpz(lambda_), mpz(d)
+    return [long((((pow(mpz(cipher), lambda_, n2) - 1) / n) * d) % n) for cipher in ciphers]
+
+def _map(pool, func, key, elements):
+    if pool and len(elements) >= PROCESS_THRESHOLD:
+        # mpz cannot be pickled, send longs to the other processes
+        key = tuple(long(value) for value in key)
+        chunks = [(key, elements[i:i + PROCESS_CHUNK_SIZE]) for i in xrange(0, len(elements), PROCESS_CHUNK_SIZE)]
+        return [element for chunk in pool.map(func, chunks) for element in chunk]
+    return func((key, elements))
+
+def rsa_encrypt_list(key, elements, pool = None):
+    assert all(isinstance(element, (long, int)) for element in elements)
+    return _map(pool, _rsa_chunk, (key.n, key.e), elements)
+
+def rsa_decrypt_list(key, ciphers, pool = None):
+    assert all(isinstance(cipher, long) for cipher in ciphers)
+
+    crt = rsa_crt(key)
+    if crt:
+        return _map(pool, _rsa_crt_chunk, crt, ciphers)
+    return _map(pool, _rsa_chunk, (key.n, key.d), ciphers)
+
+def pallier_blinding_factor(n, n2, random):
+    _n = long(n)
+    while True:
+        r = random.randint(1, _n)
+        if GCD(r, _n) == 1: break
+    return pow(mpz(r), n, n2)
+
+class PallierBlindingPool(Thread):
+    """
+    Creating the blinding factor r^n mod n^2 is the expensive part of a pallier encryption, but it
+    does not depend on the element encrypted.  This thread keeps a pool of them ready.
+    """
+
+    def __init__(self, key, size = BLINDING_POOL_SIZE):
+        Thread.__init__(self, name = "PallierBlindingPool")
+        self.setDaemon(True)
+
+        self.n = key.n
+        self.n2 = key.n2
+        self.size = size
+
+        self.random = StrongRandom()
+        self.factors = deque()
+        self.needed = Event()
+        self.needed.set()
+        self.shouldquit = False
+
+        self.hits = self.misses = 0
+
+    def run(self):
+        while not self.shouldquit:
+            self.needed.wait()
+            self.needed.clear()
+
+            while len(self.factors) < self.size and not self.shouldquit:
+                self.factors.append(pallier_blinding_factor(self.n, self.n2, self.random))
+
+    def get(self, nr):
+        factors = []
+        for _ in xrange(nr):
+            try:
+                factors.append(self.factors.popleft())
+                self.hits += 1
+            except IndexError:
+                factors.append(pallier_blinding_factor(self.n, self.n2, self.random))
+                self.misses += 1
+
+        if len(self.factors) < self.size / 2:
+            self.needed.set()
+        return factors
+
+    def shutdown(self):
+        self.shouldquit = True
+        self.needed.set()
+
+def pallier_encrypt_list(key, elements, blinding_pool = None):
+    assert all(element in [0, 1] for element in elements), elements
+
+    if blinding_pool:
+        factors = blinding_pool.get(len(elements))
+    else:
+        random = StrongRandom()
+        factors = [pallier_blinding_factor(key.n, key.n2, random) for _ in elements]
+
+    #key_g < n2, so no need for modulo if element is 0
+    return [long((key.g * factor) % key.n2) if element else long(factor) for element, factor in zip(elements, factors)]
+
+def pallier_decrypt_list(key, ciphers, pool = None):
+    return _map(pool, _pallier_decrypt_chunk, (key.n, key.n2, key.lambda_, key.d), ciphers)
+
+if __name__ == "__main__":
+    from multiprocessing import Pool
+
+    key = rsa_init(1024)
+    pool = Pool(2)
+
+    #check if the batched functions match the single element ones
+    random_list = [randint(0, i * 1000) for i in xrange(PROCESS_THRESHOLD * 2)]
+    encrypted_values = rsa_encrypt_list(key, random_list)
+    assert encrypted_values == [rsa_encrypt(key, value) for value in random_list]
+    assert rsa_encrypt_list(key, random_list, pool) == encrypted_values
+    assert rsa_decrypt_list(key, encrypted_values) == random_list
+    assert rsa_decrypt_list(key, encrypted_values, pool) == random_list
+
+    comp_key = rsa_compatible(key.n, key.n / 2)
+    twiceencrypted = rsa_encrypt_list(comp_key, encrypted_values)
+    assert rsa_decrypt_list(key, twiceencrypted) == rsa_encrypt_list(comp_key, random_list)
+
+    fakeinfohash = '296069              '
+    assert long_to_bytes(rsa_decrypt_list(key, rsa_encrypt_list(key, [bytes_to_long(fakeinfohash)]))[0]) == fakeinfohash
+
+    pkey = pallier_init(key)
+    blinding_pool = PallierBlindingPool(pkey, 100)
+    blinding_pool.start()
+
+    random_vector = [randint(0, 1) for _ in xrange(PROCESS_THRESHOLD * 2)]
+    encrypted_vector = pallier_encrypt_list(pkey, random_vector, blinding_pool)
+    assert [pallier_decrypt(pkey, cipher) for cipher in encrypted_vector] == random_vector
+    assert pallier_decrypt_list(pkey, encrypted_vector) == random_vector
+    assert pallier_decrypt_list(pkey, encrypted_vector, pool) == random_vector
+
+    #performance
+    t1 = time()
+    for value in random_list:
+        rsa_decrypt(key, rsa_encrypt(key, value))
+    t2 = time()
+    rsa_decrypt_list(key, rsa_encrypt_list(key, random_list))
+    t3 = time()
+    rsa_decrypt_list(key, rsa_encrypt_list(key, random_list, pool), pool)
+    print "RSA: single", t2 - t1, "batched", t3 - t2, "process pool", time() - t3
+
+    t1 = time()
+    for value in random_vector:
+        pallier_encrypt(pkey, value)
+    t2 = time()
+    pallier_encrypt_list(pkey, random_vector)
+    t3 = time()
+    pallier_encrypt_list(pkey, random_vector, blinding_pool)
+    print "Pallier: single", t2 - t1, "batched", t3 - t2, "blinding pool", time() - t3, "(%d hits, %d misses)" % (blinding_pool.hits, blinding_pool.misses)
+
+    blinding_pool.shutdown()
+    pool.close()
@@ -29,10 +29,13 @@ from Tribler.dispersy.bloomfilter import BloomFilter
 from Tribler.dispersy.tool.lencoder import log
 from Tribler.community.privatesearch.conversion import PSearchConversion,\
     HSearchConversion
+from Tribler.community.search.responsecache import SearchResponseCache
+from Tribler.community.privatesearch.preferenceindex import PreferenceIndex
 from Tribler.dispersy.script import assert_
 
-from Tribler.community.privatesearch.pallier import pallier_add, pallier_init, pallier_encrypt, pallier_decrypt
-from Tribler.community.privatesearch.rsa import rsa_init, rsa_encrypt, rsa_decrypt, rsa_compatible, hash_element
+from Tribler.community.privatesearch.pallier import pallier_add, pallier_init
+from Tribler.community.privatesearch.rsa import rsa_init, rsa_compatible, hash_element
+from Tribler.community.privatesearch.batchcrypto import rsa_encrypt_list, rsa_decrypt_list, pallier_encrypt_list, pallier_decrypt_list, PallierBlindingPool
 
 if __debug__:
     from Tribler.dispersy.dprint import dprint
@@ -42,6 +45,7 @@ DEBUG_VERBOSE = False
 TTL = 4
 NEIGHBORS = 5
 ENCRYPTION = True
+CRYPTO_PROCESSES = 0    # if > 0, large preference lists are encrypted/decrypted using a pool of processes
 PING_INTERVAL = CANDIDATE_WALK_LIFETIME - 5.0
 
 class SearchCommunity(Community):
@@ -107,17 +111,29 @@ class SearchCommunity(Community):
         self.create_time_encryption = 0.0
         self.create_time_decryption = 0.0
         self.receive_time_encryption = 0.0
+        self.search_time_encryption = 0.0
+
+        if self.encryption and CRYPTO_PROCESSES:
+            from multiprocessing import Pool
+            self.crypto_pool = Pool(CRYPTO_PROCESSES)
+        else:
+            self.crypto_pool = None
+
+        self.search_cache = SearchResponseCache(encoded = False)
 
         if self.integrate_with_tribler:
             from Tribler.Core.CacheDB.SqliteCacheDBHandler import ChannelCastDBHandler, TorrentDBHandler, MyPreferenceDBHandler
             from Tribler.Core.CacheDB.Notifier import Notifier
             from Tribler.Core.RemoteTorrentHandler import RemoteTorrentHandler
+            from Tribler.Core.simpledefs import NTFY_TORRENTS, NTFY_CHANNELCAST, NTFY_INSERT, NTFY_UPDATE, NTFY_DELETE, NTFY_CREATE, NTFY_MODIFIED
 
             # tribler channelcast database
             self._channelcast_db = ChannelCastDBHandler.getInstance()
             self._torrent_db = TorrentDBHandler.getInstance()
             self._mypref_db = MyPreferenceDBHandler.getInstance()
             self._notifier = Notifier.getInstance()
+            self._notifier.add_observer(self.search_cache.invalidate, NTFY_TORRENTS, [NTFY_INSERT, NTFY_UPDATE, NTFY_DELETE])
+            self._notifier.add_observer(self.search_cache.invalidate, NTFY_CHANNELCAST, [NTFY_INSERT, NTFY_UPDATE, NTFY_DELETE, NTFY_CREATE, NTFY_MODIFIED])
 
             # torrent collecting
             self._rtorrent_handler = RemoteTorrentHandler.getInstance()
@@ -130,6 +146,13 @@ class SearchCommunity(Community):
             self._notifier = None
             self._rtorrent_handler = None
 
+    def unload_community(self):
+        Community.unload_community(self)
+
+        if self.crypto_pool:
+            self.crypto_pool.terminate()
+            self.crypto_pool = None
+
     def fast_walker(self):
         for cycle in xrange(10):
             if cycle < 2:
@@ -265,7 +288,7 @@ class SearchCommunity(Community):
                 myPreferences = [bytes_to_long(infohash) for infohash in myPreferences]
                 if self.encryption:
                     t1 = time()
-                    myPreferences = [rsa_encrypt(self.key, infohash) for infohash in myPreferences]
+                    myPreferences = rsa_encrypt_list(self.key, myPreferences, self.crypto_pool)
                     self.create_time_encryption += time() - t1
 
                 self.my_vector_cache = [str_myPreferences, myPreferences]
@@ -332,8 +355,8 @@ class SearchCommunity(Community):
                 compatible_key = rsa_compatible(his_n, fake_phi)
 
                 #4. encrypt hislist and mylist + hash mylist
-                hisList = [rsa_encrypt(compatible_key, infohash) for infohash in message.payload.preference_list]
-                myList = [hash_element(rsa_encrypt(compatible_key, infohash)) for infohash in myPreferences]
+                hisList = rsa_encrypt_list(compatible_key, message.payload.preference_list, self.crypto_pool)
+                myList = [hash_element(cipher) for cipher in rsa_encrypt_list(compatible_key, myPreferences, self.crypto_pool)]
 
                 self.receive_time_encryption += time() - t1
             else:
@@ -374,7 +397,7 @@ class SearchCommunity(Community):
     def compute_rsa_overlap(self, preference_list, his_preference_list):
         if self.encryption:
             t1 = time()
-            myList = [hash_element(rsa_decrypt(self.key, infohash)) for infohash in preference_list]
+            myList = [hash_element(element) for element in rsa_decrypt_list(self.key, preference_list, self.crypto_pool)]
 
             self.create_time_decryption += time() - t1
         else:
@@ -382,11 +405,8 @@ class SearchCommunity(Community):
 
         assert all(len(infohash) == 20 for infohash in myList)
 
-        overlap = 0
-        for pref in myList:
-            if pref in his_preference_list:
-                overlap += 1
-        return overlap
+        his_preference_set = set(his_preference_list)
+        return sum(1 for pref in myList if pref in his_preference_set)
 
     class SearchRequest(Cache):
         timeout_delay = 30.0
@@ -531,37 +551,26 @@ class SearchCommunity(Community):
                 self._create_search_response(message.payload.identifier, [], message.candidate)
 
     def _get_results(self, keywords, bloomfilter, local):
+        if local:
+            dbresults = self._torrent_db.searchNamesRemote(keywords, limit = 250, local = True)
+        else:
+            # the unfiltered results are cached, requesters only differ in the bloomfilter they send
+            dbresults = self.search_cache.get(keywords)
+            if dbresults is None:
+                dbresults = self.search_cache.set(keywords, self._torrent_db.searchNamesRemote(keywords, limit = 250))
+
         results = []
-        dbresults = self._torrent_db.searchNames(keywords, local = local, keys = ['infohash', 'T.name', 'T.length', 'T.num_files', 'T.category_id', 'T.creation_date', 'T.num_seeders', 'T.num_leechers', 'swift_hash', 'swift_torrent_hash'])
-        if len(dbresults) > 0:
-            for dbresult in dbresults:
-                if not (bloomfilter and dbresult[0] in bloomfilter):
-                    channel_details = dbresult[-10:]
-
-                    dbresult = list(dbresult[:10])
-                    dbresult[1] = unicode(dbresult[1]) + (u"_bf" if bloomfilter else u"_nobf")
-                    dbresult[2] = long(dbresult[2])
-                    dbresult[3] = int(dbresult[3])
-                    dbresult[4] = [self._torrent_db.id2category[dbresult[4]],]
-                    dbresult[5] = long(dbresult[5])
-                    dbresult[6] = int(dbresult[6] or 0)
-                    dbresult[7] = int(dbresult[7] or 0)
-                    if dbresult[8]:
-                        dbresult[8] = str(dbresult[8])
-                    if dbresult[9]:
-                        dbresult[9] = str(dbresult[9])
-
-                    if channel_details[1]:
-                        channel_details[1] = str(channel_details[1])
-                    dbresult.append(channel_details[1])
-
-                    results.append(tuple(dbresult))
-
-                    if bloomfilter:
-                        bloomfilter.add(dbresult[0])
-
-                    if len(results) == 25:
-                        break
+        for dbresult in dbresults:
+            if not (bloomfilter and dbresult[0] in bloomfilter):
+                dbresult = list(dbresult)
+                dbresult[1] = unicode(dbresult[1]) + (u"_bf" if bloomfilter else u"_nobf")
+                results.append(tuple(dbresult))
+
+                if bloomfilter:
+                    bloomfilter.add(dbresult[0])
+
+                if len(results) == 25:
+                    break
         return results
 
     def _create_search_response(self, identifier, results, candidate):
@@ -866,6 +875,8 @@ class ForwardCommunity(SearchCommunity):
     def __init__(self, master, integrate_with_tribler = True, ttl = TTL, neighbors = NEIGHBORS, encryption = ENCRYPTION, max_prefs = None, log_searches = False):
         SearchCommunity.__init__(self, master, integrate_with_tribler, ttl, neighbors, encryption, max_prefs, log_searches)
 
+        self.preference_index = PreferenceIndex(CANDIDATE_WALK_LIFETIME)
+
         def get_overlap(self):
             if self.community.encryption:
                 t1 = time()
@@ -919,26 +930,25 @@ class ForwardCommunity(SearchCommunity):
             if DEBUG:
                 print >> sys.stderr, "SearchCommunity: sending one message too", message.candidate
 
+    def on_intro_request(self, messages):
+        # index the preferences of the requesting candidates before dispersy asks whom to introduce them to
+        for message in messages:
+            if message.payload.preference_list and not isinstance(self._dispersy.get_candidate(message.candidate.sock_addr), BootstrapCandidate):
+                self.add_preferences(message.candidate, message.payload.preference_list)
+
+        SearchCommunity.on_intro_request(self, messages)
+
+    def add_preferences(self, candidate, preference_set):
+        self.preference_index.expire(self.is_taste_buddy)
+        self.preference_index.add(candidate, preference_set)
+
     def get_preferences(self, candidate):
-        for time, preferenceset, pref_candidate in self.preference_cache:
-            if pref_candidate.sock_addr == candidate.sock_addr:
-                return preferenceset
+        return self.preference_index.get(candidate)
 
     def match_preferences(self, preference_set):
         #cleanup of invalid candidates
-        timeout = time() - CANDIDATE_WALK_LIFETIME
-        for i in range(len(self.preference_cache), 0, -1):
-            if self.preference_cache[i-1][0] < timeout and not self.is_taste_buddy(self.preference_cache[i-1][2]):
-                del self.preference_cache[i-1]
-
-        matches = []
-        for _, other_preference_set, candidate in self.preference_cache:
-            overlap = len(other_preference_set & preference_set)
-            if overlap > 0:
-                matches.append((overlap, candidate))
-
-        matches.sort(reverse = True)
-        return [candidate for _,candidate in matches]
+        self.preference_index.expire(self.is_taste_buddy)
+        return [candidate for _, candidate in self.preference_index.match(preference_set)]
 
     def dispersy_yield_introduce_candidates(self, candidate = None):
         if candidate:
@@ -1119,6 +1129,19 @@ class PSearchCommunity(ForwardCommunity):
         self.key = pallier_init(self.key)
         self.my_vector_cache = [None, None]
 
+        if self.encryption:
+            self.blinding_pool = PallierBlindingPool(self.key)
+            self.blinding_pool.start()
+        else:
+            self.blinding_pool = None
+
+    def unload_community(self):
+        ForwardCommunity.unload_community(self)
+
+        if self.blinding_pool:
+            self.blinding_pool.shutdown()
+            self.blinding_pool = None
+
     def initiate_meta_messages(self):
         messages = ForwardCommunity.initiate_meta_messages(self)
         messages.append(Message(self, u"sum-request", MemberAuthentication(encoding="sha1"), PublicResolution(), DirectDistribution(), CandidateDestination(), EncryptedVectorPayload(), self._dispersy._generic_timeline_check, self.on_sum_request))
@@ -1154,11 +1177,7 @@ class PSearchCommunity(ForwardCommunity):
             if self.encryption:
 
                 t1 = time()
-                encrypted_vector = []
-                for element in my_vector:
-                    cipher = pallier_encrypt(self.key, element)
-                    encrypted_vector.append(cipher)
-
+                encrypted_vector = pallier_encrypt_list(self.key, my_vector, self.blinding_pool)
                 self.create_time_encryption += time() - t1
             else:
                 encrypted_vector = my_vector
@@ -1420,8 +1439,9 @@ class PSearchCommunity(ForwardCommunity):
             if self.encryption:
                 t1 = time()
 
-                _sums = [[pallier_decrypt(self.key, _sum), time(), candidate_mid, message.candidate] for candidate_mid, _sum in message.payload.sums]
-                _sum = pallier_decrypt(self.key, message.payload._sum)
+                decrypted = pallier_decrypt_list(self.key, [message.payload._sum] + [_sum for _, _sum in message.payload.sums], self.crypto_pool)
+                _sum = decrypted[0]
+                _sums = [[decrypted_sum, time(), candidate_mid, message.candidate] for decrypted_sum, (candidate_mid, _) in zip(decrypted[1:], message.payload.sums)]
 
                 self.create_time_decryption += time() - t1
             else:
@@ -1468,7 +1488,7 @@ class HSearchCommunity(ForwardCommunity):
             myPreferences = [bytes_to_long(infohash) for infohash in myPreferences]
             if self.encryption:
                 t1 = time()
-                myPreferences = [rsa_encrypt(self.key, infohash) for infohash in myPreferences]
+                myPreferences = rsa_encrypt_list(self.key, myPreferences, self.crypto_pool)
                 self.create_time_encryption += time() - t1
 
             self.my_vector_cache = [str_myPreferences, myPreferences]
@@ -1506,6 +1526,8 @@ class HSearchCommunity(ForwardCommunity):
             if DEBUG_VERBOSE:
                 print >> sys.stderr, long(time()), "HSearchCommunity: got msimi request from", message.candidate
 
+            self.add_preferences(message.candidate, message.payload.preference_list)
+
             #get candidates to forward requests to, excluding the requesting peer
             candidates = self.get_connections(10, message.candidate)
 
@@ -1650,6 +1672,16 @@ class Das4DBStub():
                 results.append((infohash, unicode(self._dispersy._lan_address), 1L, 1, 1, 0L, 0, 0, None, None, None, None, '', '', 0, 0, 0, 0, 0, False))
         return results
 
+    def searchNamesRemote(self, keywords, limit = 25, offset = 0, local = True):
+        my_preferences = set(self.getMyPrefListInfohash(local = local)) | self.myMegaSet
+
+        results = []
+        for keyword in keywords:
+            infohash = str(keyword)
+            if infohash in my_preferences:
+                results.append((infohash, unicode(self._dispersy._lan_address), 1L, 1, [u'other'], 0L, 0, 0, None, None, None))
+        return results[offset:offset + limit]
+
     def on_search_response(self, results):
         for result in results:
             if result[0] not in self.myMegaSet:
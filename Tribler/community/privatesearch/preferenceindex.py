@@ -0,0 +1,81 @@
+#Written by Niels Zeilemaker
+from time import time
+
+try:
+    # python 2.7 only...
+    from collections import OrderedDict
+except ImportError:
+    from Tribler.dispersy.python27_ordereddict import OrderedDict
+
+class PreferenceIndex:
+    """
+    Inverted index from a (hashed) preference to the candidates which have it, allowing the overlap
+    of a preference set with all cached candidates to be computed by only touching the candidates
+    which share at least one preference.  Candidates expire lifetime seconds after they were added.
+    """
+
+    def __init__(self, lifetime):
+        self.lifetime = lifetime
+        self.postings = {}                  # {preference: set(sock_addr)}
+        self.candidates = OrderedDict()     # {sock_addr: (timestamp, preference_set, candidate)}, oldest first
+
+    def add(self, candidate, preference_set, timestamp = None):
+        self.remove(candidate.sock_addr)
+
+        preference_set = frozenset(preference_set)
+        self.candidates[candidate.sock_addr] = (timestamp or time(), preference_set, candidate)
+        for preference in preference_set:
+            self.postings.setdefault(preference, set()).add(candidate.sock_addr)
+
+    def remove(self, sock_addr):
+        item = self.candidates.pop(sock_addr, None)
+        if item:
+            for preference in item[1]:
+                posting = self.postings[preference]
+                posting.discard(sock_addr)
+                if not posting:
+                    del self.postings[preference]
+
+    def get(self, candidate):
+        item = self.candidates.get(candidate.sock_addr)
+        if item:
+            return item[1]
+
+    def expire(self, keep = None):
+        """
+        Removes the candidates which were added more than lifetime seconds ago, unless keep(candidate)
+        returns True in which case they are kept for another lifetime.
+        """
+        now = time()
+        timeout = now - self.lifetime
+        kept = []
+        while self.candidates:
+            sock_addr, item = next(self.candidates.iteritems())
+            if item[0] >= timeout:
+                break
+
+            if keep and keep(item[2]):
+                del self.candidates[sock_addr]
+                kept.append((sock_addr, (now, item[1], item[2])))
+            else:
+                self.remove(sock_addr)
+
+        for sock_addr, item in kept:
+            self.candidates[sock_addr] = item
+
+    def match(self, preference_set):
+        """
+        Returns [(overlap, candidate)] for all candidates which have at least one preference in
+        common with preference_set, the largest overlap first.
+        """
+        overlap = {}
+        for preference in preference_set:
+            for sock_addr in self.postings.get(preference, ()):
+                overlap[sock_addr] = overlap.get(sock_addr, 0) + 1
+
+        matches = [(count, self.candidates[sock_addr][2]) for sock_addr, count in overlap.iteritems()]
+        matches.sort(key = lambda match: match[0], reverse = True)
+        return matches
+
+    def __len__(self):
+        return len(self.candidates)
@@ -17,6 +17,7 @@ from Tribler.dispersy.message import Message
 from Tribler.dispersy.resolution import PublicResolution
 
 from Tribler.community.search.conversion import SearchConversion
+from Tribler.community.search.responsecache import SearchResponseCache
 from Tribler.community.search.payload import SearchRequestPayload,\
     SearchResponsePayload, TorrentRequestPayload, TorrentCollectRequestPayload,\
     TorrentCollectResponsePayload, TasteIntroPayload
@@ -74,6 +75,7 @@ class SearchCommunity(Community):
 
         self.integrate_with_tribler = integrate_with_tribler
         self.taste_buddies = []
+        self.search_cache = SearchResponseCache()
         #To always connect to a peer uncomment/modify the following line
         #self.taste_buddies.append([1, time(), Candidate(("127.0.0.1", 1234), False))
 
@@ -87,6 +89,9 @@ class SearchCommunity(Community):
             self._mypref_db = MyPreferenceDBHandler.getInstance()
             self._notifier = Notifier.getInstance()
 
+            # search results are cached until new torrents are indexed
+            self.search_cache.observe(self._notifier)
+
             # torrent collecting
             self._rtorrent_handler = RemoteTorrentHandler.getInstance()
         else:
@@ -310,30 +315,10 @@ class SearchCommunity(Community):
             if DEBUG:
                 print >> sys.stderr, "SearchCommunity: got search request for",keywords
 
-            results = []
-            dbresults = self._torrent_db.searchNames(keywords, local = False, keys = ['infohash', 'T.name', 'T.length', 'T.num_files', 'T.category_id', 'T.creation_date', 'T.num_seeders', 'T.num_leechers', 'swift_hash', 'swift_torrent_hash'])
-            if len(dbresults) > 0:
-                for dbresult in dbresults:
-                    channel_details = dbresult[-10:]
-
-                    dbresult = list(dbresult[:10])
-                    dbresult[2] = long(dbresult[2])
-                    dbresult[3] = int(dbresult[3])
-                    dbresult[4] = [self._torrent_db.id2category[dbresult[4]],]
-                    dbresult[5] = long(dbresult[5])
-                    dbresult[6] = int(dbresult[6] or 0)
-                    dbresult[7] = int(dbresult[7] or 0)
-                    if dbresult[8]:
-                        dbresult[8] = str(dbresult[8])
-                    if dbresult[9]:
-                        dbresult[9] = str(dbresult[9])
-
-                    if channel_details[1]:
-                        channel_details[1] = str(channel_details[1])
-                    dbresult.append(channel_details[1])
-
-                    results.append(tuple(dbresult))
-            elif DEBUG:
+            results = self.search_cache.get(keywords)
+            if results is None:
+                results = self.search_cache.set(keywords, self._torrent_db.searchNamesRemote(keywords, limit = 25))
+            if DEBUG and not results:
                 print >> sys.stderr, "SearchCommunity: no results"
 
             self._create_search_response(message.payload.identifier, results, message.candidate)
@@ -10,6 +10,7 @@ from Tribler.dispersy.bloomfilter import BloomFilter
 from Tribler.Core.Swift.SwiftDef import SwiftDef
 import zlib
 from Tribler.community.search.payload import TasteIntroPayload
+from Tribler.community.search.responsecache import EncodedResults
 
 class SearchConversion(BinaryConversion):
     def __init__(self, community):
@@ -129,7 +130,12 @@ class SearchConversion(BinaryConversion):
         return offset, placeholder.meta.payload.implement(identifier, keywords, bloom_filter)
 
     def _encode_search_response(self, message):
-        packet = pack('!H', message.payload.identifier), message.payload.results
+        results = message.payload.results
+        if isinstance(results, EncodedResults):
+            # results from the SearchResponseCache carry their encoding
+            return results.encode_response(pack('!H', message.payload.identifier)),
+
+        packet = pack('!H', message.payload.identifier), results
         return encode(packet),
 
     def _decode_search_response(self, placeholder, offset, data):
@@ -0,0 +1,145 @@
+#Written by Niels Zeilemaker
+from time import time
+from struct import pack
+from threading import Lock
+
+try:
+    # python 2.7 only...
+    from collections import OrderedDict
+except ImportError:
+    from Tribler.dispersy.python27_ordereddict import OrderedDict
+
+from Tribler.dispersy.encoding import encode
+from Tribler.Core.simpledefs import NTFY_TORRENTS, NTFY_CHANNELCAST, NTFY_INSERT, NTFY_DELETE, NTFY_CREATE, NTFY_MODIFIED
+
+def _get_prefix_length():
+    """
+    Returns the number of leading bytes of encode(results) which encode((identifier, results)) does
+    not repeat, i.e. the latter ends with encode(results) without that prefix.  This is derived from,
+    and checked against, the output of encode.  Returns None if the encoding is not composed that way.
+    """
+    identifier = pack('!H', 1)
+    results = [('\x00' * 20, u'name', 1L, 1, [u'other'], 0L, 0, 0, None, None, 'cid')]
+    empty = encode([])
+    empty_response = encode((identifier, []))
+    encoded = encode(results)
+    response = encode((identifier, results))
+    for length in xrange(len(empty) + 1):
+        if empty_response.endswith(empty[length:]) and empty_response[:len(empty_response) - len(empty) + length] + encoded[length:] == response:
+            return length
+    return None
+
+PREFIX_LENGTH = _get_prefix_length()
+EMPTY_LENGTH = len(encode([]))
+
+class EncodedResults(list):
+    """
+    A list of search results which also carries its encoding, allowing the conversion to reuse it
+    when creating a search-response for another candidate.
+    """
+    def __init__(self, results):
+        list.__init__(self, results)
+        self.encoded = encode(results)
+
+    def encode_response(self, identifier):
+        """
+        Returns encode((identifier, results)), reusing the encoding of the results.
+        """
+        if PREFIX_LENGTH is None:
+            return encode((identifier, list(self)))
+
+        prefix = encode((identifier, []))
+        return prefix[:len(prefix) - EMPTY_LENGTH + PREFIX_LENGTH] + self.encoded[PREFIX_LENGTH:]
+
+class SearchResponseCache:
+    """
+    LRU cache of search results keyed on the set of keywords, entries expire after ttl seconds or
+    when invalidate is called (i.e. when new torrents are indexed).  The hit rate and the number of
+    bytes which did not have to be encoded again are counted per minute.
+    """
+
+    def __init__(self, max_size = 250, ttl = 60.0, encoded = True):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.encoded = encoded
+
+        self.lock = Lock()
+        self.cache = OrderedDict() # {keywords: (timestamp, results)}
+
+        self.hits = self.misses = self.bytes_saved = 0
+        self.minute = int(time() / 60)
+        self.minute_hits = self.minute_misses = self.minute_bytes_saved = 0
+        self.last_minute = (0, 0, 0)
+
+    def get(self, keywords):
+        key = frozenset(keywords)
+        with self.lock:
+            self._roll_minute()
+
+            item = self.cache.pop(key, None)
+            if item and item[0] + self.ttl > time():
+                # reinsert as most recently used
+                self.cache[key] = item
+                results = item[1]
+
+                bytes_saved = len(results.encoded) if self.encoded else 0
+                self.hits += 1
+                self.minute_hits += 1
+                self.bytes_saved += bytes_saved
+                self.minute_bytes_saved += bytes_saved
+                return results
+
+            self.misses += 1
+            self.minute_misses += 1
+
+    def set(self, keywords, results):
+        if self.encoded:
+            results = EncodedResults(results)
+
+        with self.lock:
+            self.cache[frozenset(keywords)] = (time(), results)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last = False)
+        return results
+
+    def observe(self, notifier):
+        """
+        Invalidates the cache when torrents are indexed or removed, or channels are created or
+        modified.  Updates are ignored: the tracker checker updates the seeders and leechers of
+        torrents continuously, and votes update channels.  Entries still expire after ttl seconds.
+        """
+        notifier.add_observer(self.invalidate, NTFY_TORRENTS, [NTFY_INSERT, NTFY_DELETE])
+        notifier.add_observer(self.invalidate, NTFY_CHANNELCAST, [NTFY_INSERT, NTFY_DELETE, NTFY_CREATE, NTFY_MODIFIED])
+
+    def invalidate(self, *args):
+        with self.lock:
+            self.cache.clear()
+
+    def get_statistics(self):
+        """
+        Returns the totals and the hits, misses, hit rate and bytes saved of the last complete minute.
+        """
+        with self.lock:
+            self._roll_minute()
+
+            hits, misses, bytes_saved = self.last_minute
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'bytes_saved': self.bytes_saved,
+                    'size': len(self.cache),
+                    'hits_per_minute': hits,
+                    'misses_per_minute': misses,
+                    'hit_rate_per_minute': hits / float(hits + misses) if hits + misses else 0.0,
+                    'bytes_saved_per_minute': bytes_saved}
+
+    def _roll_minute(self):
+        minute = int(time() / 60)
+        if minute != self.minute:
+            if minute == self.minute + 1:
+                self.last_minute = (self.minute_hits, self.minute_misses, self.minute_bytes_saved)
+            else:
+                # no lookups during the last complete minute
+                self.last_minute = (0, 0, 0)
+
+            self.minute = minute
+            self.minute_hits = self.minute_misses = self.minute_bytes_saved = 0
@@ -185,6 +185,16 @@ CREATE UNIQUE INDEX torrent_tracker_idx
 
 CREATE INDEX torrent_tracker_last_idx ON TorrentTracker (tracker, last_check );
 
+CREATE TABLE TrackerInfo (
+  tracker          text PRIMARY KEY NOT NULL,
+  last_check       numeric DEFAULT 0,
+  last_success     numeric DEFAULT 0,
+  failures         integer DEFAULT 0,
+  rtt              numeric DEFAULT 0,
+  min_interval     integer DEFAULT 0,
+  next_check       numeric DEFAULT 0
+);
+
 ----------------------------------------
 
 CREATE VIEW Friend AS SELECT * FROM Peer WHERE friend=1;
@@ -477,7 +487,7 @@ INSERT INTO TorrentStatus VALUES (2, 'dead', NULL);
 INSERT INTO TorrentSource VALUES (0, '', 'Unknown');
 INSERT INTO TorrentSource VALUES (1, 'BC', 'Received from other user');
 
-INSERT INTO MyInfo VALUES ('version', 18);
+INSERT INTO MyInfo VALUES ('version', 19);
 
 INSERT INTO MetaDataTypes ('name') VALUES ('name');
 INSERT INTO MetaDataTypes ('name') VALUES ('description');